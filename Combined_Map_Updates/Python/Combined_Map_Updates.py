@@ -43,10 +43,22 @@
 
 # 4. REINSERTING THE NE EVIDENCE BASE INTO THE COMBINED MAP
 
+# PLEASE NOTE: Sections 1 - 4 are also declared as pipeline stages within Combined_Map_Stages.py. Running the update
+#              through the pipeline caches the outputs of every stage, so a failed run resumes from the last stage
+#              which completed rather than from the top of this script.
+#
+# PLEASE NOTE: This script is run section by section within the ArcGIS Python Console and cannot be imported. All its
+#              functions are held within the combined_map package alongside this script (see combined_map\__init__.py),
+#              and each stage can be run on its own with: python -m combined_map update_config.json <stage>
+
 ########################################################################################################################
 
 # Initial setup and setting of arcpy workspace
 
+# Stop here if this script is imported rather than run - import from the combined_map package instead
+if __name__ != '__main__':
+    raise ImportError('Combined_Map_Updates.py runs the update when executed - import the combined_map package instead')
+
 # Import all Python libraries required within ArcPy - IMPORT ALL FOR USE WITHIN ArcGIS
 import arcpy
 from arcpy import env
@@ -58,6 +70,13 @@ import os
 import pandas as pd
 import ast
 
+# Import the combined_map package stored alongside this script - add the folder containing it to the Python path
+import sys
+sys.path.append(r"Insert the full directory path to the Combined_Map_Updates\Python folder here")
+from combined_map.Combined_Map_Functions import add_fields, eunisToAllLevel3, listUniqueValues, remove_my_nan, \
+    list_set, confidence_check, MESH_confidence_check, habitat_classifier, decision_tree
+from combined_map.Geometry_QA import read_layer_geometries, check_geometries, write_repaired_geometries, find_overlaps
+
 ########################################################################################################################
 
 #                                    1. UPDATING THE COMBINED MAP WITH UKSeaMap                                        #
@@ -93,19 +112,7 @@ newlist = arcpy.ListFeatureClasses()
 ##########################
 
 
-add_fields = [
-     ("GUI", "TEXT", "#", "#", 8),
-     ("POLYGON", "LONG", 8, "#", "#"),
-     ("ORIG_HAB", "TEXT", "#", "#", 254),
-     ("ORIG_CLASS", "TEXT", "#", "#", 254),
-     ("HAB_TYPE", "TEXT", "#", "#", 20),
-     ("VERSION", "TEXT", "#", "#", 50),
-     ("DET_MTHD", "TEXT", "#", "#", 254),
-     ("DET_NAME", "TEXT", "#", "#", 254),
-     ("DET_DATE", "DATE", "#", "#", "#"),
-     ("TRAN_COM", "TEXT", "#", "#", 254),
-     ("T_RELATE", "TEXT", "#", "#", 1),
-     ("VAL_COMM", "TEXT", "#", "#", 254)]
+#   add_fields is defined within Combined_Map_Functions.py
 
 for fc in newlist:
     # Add all fields
@@ -136,7 +143,7 @@ arcpy.AddField_management("Insert target feature here", "Insert field name here"
 #  	     This can be done manually if you want just by selecting by EUNIS values and batch-filling with the relevant
 #  	     level 3 value. Alternatively, this can be automated using the body of code below developed by G. Duncan (2016).
 
-# Use formula "eunisToAllLevel3(!HAB_TYPE!)" in field calculator (Python of course) with the below as the code block.
+# Use formula "eunisToAllLevel3(!HAB_TYPE!)" in field calculator (Python of course) with the code block below.
 # Warning: This will only pull out TRUE eunis habitats from the input field.
 #          Therefore, any places where the input is a non-eunis value (e.g.
 #          "deep sea coarse sediment" or "deep sea seabed") will have to be
@@ -145,58 +152,41 @@ arcpy.AddField_management("Insert target feature here", "Insert field name here"
 # POST-SCRIPT-RUN - check for all "Void" values in the output field to test if
 #                  they can be manually attributed a level 3 or 2 habitat.
 
-# Suggest keeping at False to standardise the concatenation, but can change to True to use the function below.
-# If set "y", uses the first matching concatenator in original hab_type field
-useConcatenateBool = False
-# What to use as concatenator if you're not getting it from the original field (i.e. above is set to False) or if
-# nothing matches in original.
-concatenatorDefault = '+'
-# Are L2 habitats to be removed from the output? True/False
-removeL2Bool = True
-# Are there any habitats that would be caught by the above that should be retained (e.g. deep sea "A6")
-keepList = ['A6']
-# Should the output list be alphabetised for standardisation? True/False
-sortListBool = True
-
-
-eunisPattern = re.compile(r'(\b(?:[ABCJ](?:[0-9](?:\.[0-9]*)?))|\b[ABCJ]\b)')
-concatenatePattern = re.compile(r'([\\/+\&]|or)')
-
-
-# Tries to use the (first instance of a) habitat concatenator to output into the final result.
-# If no matches found, defaults to "+"
-# Potential matches are "\" "/" "+" and "&"
-def collectConcatenator(searchString):
-    concatenateMatches = re.search(concatenatePattern, searchString)
-    if concatenateMatches:
-        return concatenateMatches.group(0)
-    else:
-        return '+'
-
-
-def eunisToAllLevel3(eunisFull):
-    if useConcatenateBool:
-        concatenator = collectConcatenator(eunisFull)
-    else:
-        concatenator = concatenatorDefault
-    eunisMatches = re.findall(eunisPattern, eunisFull)
-    habFirstFour = set([x[:4] for x in eunisMatches])
-    if removeL2Bool:
-        habFirstFour = [x for x in habFirstFour if ((len(x) > 3) or x in keepList)]
-    if sortListBool:
-        habFirstFour = sorted(habFirstFour)
-    if len(habFirstFour) == 0:
-        return 'Void'
-    else:
-        return concatenator.join(habFirstFour)
-
-
-#        Set the Field Calculator to use Python rather than VB, Paste the contents of the above into the 'Codeblock'
-#        section, and then call the function in the main Field Calculator window with HAB_TYPE field as the input value
+# The settings for eunisToAllLevel3() (useConcatenateBool, concatenatorDefault, removeL2Bool, keepList and sortListBool)
+# are defined alongside the function within Combined_Map_Functions.py
+
+
+#        Set the Field Calculator to use Python rather than VB, and paste the following into the 'Codeblock' section
+#        (eunisToAllLevel3() classifies codes against the EUNIS registry of the combined_map package, so the function
+#        is imported from the package rather than pasted on its own):
+#            import sys
+#            sys.path.append(r"Insert the full directory path to the Combined_Map_Updates\Python folder here")
+#            from combined_map.Combined_Map_Functions import eunisToAllLevel3
+#        then call the function in the main Field Calculator window with HAB_TYPE field as the input value
 #        e.g. eunisToAllLevel3(!HAB_TYPE!)
 
 # 1.1.5. Check the data for any geometry errors and overlaps.
 
+##########################
+# [THIS SECTION READS DATA WITH ARCPY, BUT THE CHECKS MUST BE EXECUTED FROM A STANDARD PYTHON 3 CONSOLE / IDE]
+##########################
+
+#        Read the GUI and geometry of every polygon within the layer
+Layer_Geometries = read_layer_geometries("Insert target feature here", ['GUI'])
+
+#        Validate all geometries and repair any which are invalid. This runs across all available processors - the
+#        process pool cannot start from within the ArcGIS Python window, so use check_geometries(..., workers=1) there.
+Layer_Geometries = check_geometries(Layer_Geometries)
+
+#        Review the geometries which were invalid, then write the repaired geometries back into the layer
+print(Layer_Geometries.loc[~Layer_Geometries['Valid'], ['OID', 'GUI', 'Validity_Reason']])
+write_repaired_geometries("Insert target feature here", Layer_Geometries)
+
+#        Find all overlapping polygons within the layer and summarise the overlap and sliver areas for each GUI.
+#        Overlaps are found with an STR-tree self-join, so only polygons with intersecting bounding boxes are compared.
+Overlap_Pairs, Overlap_Report = find_overlaps(Layer_Geometries)
+print(Overlap_Report)
+
 ########################################################################################################################
 
 # 1.2. Inserting UKSeaMap from the combined map
@@ -301,17 +291,7 @@ arcpy.env.workspace = r"J:\GISprojects\Marine\HabitatMapping\Combined_Map_Update
 
 #        Define listUniqueValues() function
 #        Function title: listUniqueValues()
-def listUniqueValues(inLayer, inField, lineString=False):
-    import arcpy
-    uniqueSet = set([])
-    with arcpy.da.SearchCursor(inLayer, inField) as cursor:
-        for row in cursor:
-            uniqueSet.add(row[0])
-    if lineString:
-        output = "\n".join([str(x) for x in uniqueSet])
-        return output
-    else:
-        return (list(uniqueSet))
+#        listUniqueValues() is defined within Combined_Map_Functions.py
 
 
 # 3.1.2. Execute listUniqueValues() function on the combined map layer and GUI field within the layer attributes. This
@@ -389,6 +369,13 @@ for gdb, datasets, features in arcpy.da.Walk(arcpy.env.workspace):
             # For all features within target location, copy and write to the outputGDB
             arcpy.CopyFeatures_management(feature, os.path.join(outputGDB, "Polyline_" + feature))
 
+#        Alternatively, copy the feature classes concurrently with copy_feature_classes() (see Reference_Reader.py) -
+#        run from a standard Python 3 console, as the worker processes cannot start from within the ArcGIS Python window
+from combined_map.Reference_Reader import list_feature_classes, copy_feature_classes, format_statistics
+copied, copy_statistics = copy_feature_classes(list_feature_classes("Insert combined map gdb here"), outputGDB,
+                                               workers=4, prefix="Polyline_")
+print(format_statistics(copy_statistics))
+
 # 3.2.4. Dissolve all newly merged map features by GUI and save within the working geodatabase as 'new_maps_dissolved'
 arcpy.Dissolve_management("Insert filepath to input gdb and feature here", "Insert output file path here \\new_maps_dissolved", "GUI", "#", "MULTI_PART", "DISSOLVE_LINES")
 
@@ -454,15 +441,7 @@ Intersected_Maps.columns = ['CombinedMap_GUI', 'NewMap_GUI']
 # 3.3.2. Formatting data - removing unwanted 'nan' values
 
 #        Define remove_my_nan() function to remove all unwanted not a number values within the targeted column
-def remove_my_nan(df, column):
-    """
-    Function Title: remove_my_nan()
-    Define function to remove all nan values from the HAB_TYPE column of the aggregated DataFrame
-    """
-    habitat = df[column]
-    # Return data as clean habitat if the string value of the habitat is not a 'nan' value
-    clean_habitat = [habitat for habitat in habitat if str(habitat) != 'nan']
-    return clean_habitat
+#        remove_my_nan() is defined within Combined_Map_Functions.py
 
 
 #        Remove any 'nan' (not a number) values from the Intersected_Maps DataFrame
@@ -471,13 +450,7 @@ Intersected_Maps['NewMap_GUI'] = Intersected_Maps.apply(lambda df: remove_my_nan
 
 # 3.3.3. Removing duplicate data entries within GUI fields
 #        Define list_set() function to convert values within new maps lists into list type
-def list_set(x):
-    """
-    Function Title: list_set()
-    Define function to return a list of a set of the original list (basically remove duplicates and return as new
-    list)
-    """
-    return list(set(x))
+#        list_set() is defined within Combined_Map_Functions.py
 
 
 #        Apply the list_set() function on the list of all new GUIs
@@ -511,33 +484,11 @@ ThreeStep_GUI_Confidence = UK_Meta_Confidence[['GUI', 'NewTotal', 'Overall score
 
 
 #        Define confidence_check() function to check if the data are missing 3-step confidence scores
-def confidence_check(df):
-    """
-    Function title: confidence_check()
-    Define function to check if a 3-step confidence score has been completed for each GUI within the
-    attribute table
-    """
-    data = df['NewTotal']
-    # Perform check calculate if a MESH score is present or lacking
-    if data >= 0:
-        return '3-Step confidence present'
-    else:
-        return 'Requires 3-Step confidence'
+#        confidence_check() is defined within Combined_Map_Functions.py
 
 
 #        Define MESH_confidence_check() function to check if the data are missing MESH confidence scores
-def MESH_confidence_check(df):
-    """
-    Function title: confidence_check()
-    Define function to check if a 3-step confidence score has been completed for each GUI within the
-    attribute table
-    """
-    data = df['Overall score']
-    # Perform check calculate if a MESH score is present or lacking
-    if data >= 0:
-        return 'MESH confidence present'
-    else:
-        return 'Requires MESH confidence'
+#        MESH_confidence_check() is defined within Combined_Map_Functions.py
 
 
 # 3.4.2. Metadata Check 1 - Are there any missing 3-step confidence scores?
@@ -721,27 +672,7 @@ Aggregated_Attributes['HAB_TYPE'] = Aggregated_Attributes.apply(lambda df: remov
 # 3.5.2. Classify habitats based on EUNIS Codes present within data
 #        Define habitat_classifier() function to categorise HAB_TYPE data into intertidal, subtidal or mixed based on
 #        EUNIS values
-def habitat_classifier(df):
-    """
-     Function Title: habitat_classifier()
-     Define function to classify data into intertidal, mixed or sub-tidal values based on EUNIS codes present
-     """
-    # Define values to search by
-    intertidal = ['A1', 'A2', 'B3']
-    subtidal = ['A3', 'A4', 'A5', 'A6']
-    # Pull out all unique habitat codes within target subset
-    habitat = df['HAB_TYPE']
-
-    # Run conditional statements
-    if any([x in y for x in intertidal for y in habitat]):
-        if any([x in y for x in subtidal for y in habitat]):
-            return 'Mixed habitat'
-        else:
-            return 'Intertidal'
-    elif any([x in y for x in subtidal for y in habitat]):
-        return 'Sub-tidal'
-    else:
-        return 'Error'
+#        habitat_classifier() is defined within Combined_Map_Functions.py
 
 
 #        Apply habitat classifier to Aggregated_Attributes DataFrame to indicate the habitat type based on the EUNIS
@@ -893,137 +824,7 @@ Comparison_DF['Existing_MESH_Score'].fillna(0, inplace=True)
 
 # Define decision_tree() function
 # Function Title: decision_tree()
-def decision_tree(df):
-    """Create evaluation mechanism to complete step-wise JNCC decision tree analysis"""
-    # Return the new GUI if the new map is intertidal only
-    if df['New_Habitat_Classification'] == 'Intertidal':
-        return df['NewGUI']
-
-    # Run analysis if the new map comprises mixed habitats
-    elif df['New_Habitat_Classification'] == 'Mixed habitat':
-
-        # Return the existing GUI if the existing map is intertidal and the new map is mixed or sub-tidal
-        if df['Existing_Habitat_Classification'] == 'Intertidal':
-            return df['ExistingGUI']
-
-        # Run further analyses if the new map comprises mixed habitats and the existing map is sub-tidal
-        # (neither are prioritised)
-        elif df['Existing_Habitat_Classification'] == 'Sub-tidal':
-
-            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
-            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
-                return df['NewGUI']
-
-            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
-            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
-                return df['ExistingGUI']
-
-            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
-            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
-                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
-
-                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
-                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
-                    return df['NewGUI']
-
-                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
-                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
-                    return df['ExistingGUI']
-
-                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
-                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
-                    return 'Requires expert judgement'
-
-        # Run further analyses if the new map comprises mixed habitats and the existing map is also mixed
-        # (neither are prioritised)
-        elif df['Existing_Habitat_Classification'] == 'Mixed habitat':
-
-            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
-            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
-                return df['NewGUI']
-
-            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
-            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
-                return df['ExistingGUI']
-
-            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
-            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
-                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
-
-                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
-                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
-                    return df['NewGUI']
-
-                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
-                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
-                    return df['ExistingGUI']
-
-                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
-                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
-                    return 'Requires expert judgement'
-
-    # Run analysis if the new map comprises sub-tidal habitats
-    elif df['New_Habitat_Classification'] == 'Sub-tidal':
-
-        # Return the existing GUI if the existing map is intertidal and the new map is mixed or sub-tidal
-        if df['Existing_Habitat_Classification'] == 'Intertidal':
-            return df['ExistingGUI']
-
-        # Run further analyses if the new map comprises mixed habitats and the existing map is sub-tidal
-        # (neither are prioritised)
-        elif df['Existing_Habitat_Classification'] == 'Sub-tidal':
-
-            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
-            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
-                return df['NewGUI']
-
-            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
-            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
-                return df['ExistingGUI']
-
-            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
-            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
-                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
-
-                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
-                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
-                    return df['NewGUI']
-
-                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
-                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
-                    return df['ExistingGUI']
-
-                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
-                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
-                    return 'Requires expert judgement'
-
-        # Run further analyses if the new map comprises sub-tidal habitats and the existing map is also mixed
-        # (neither are prioritised)
-        elif df['Existing_Habitat_Classification'] == 'Mixed habitat':
-
-            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
-            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
-                return df['NewGUI']
-
-            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
-            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
-                return df['ExistingGUI']
-
-            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
-            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
-                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
-
-                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
-                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
-                    return df['NewGUI']
-
-                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
-                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
-                    return df['ExistingGUI']
-
-                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
-                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
-                    return 'Requires expert judgement'
+#        decision_tree() is defined within Combined_Map_Functions.py
 
 
 # 3.7.3. Executing the decision tree
@@ -1031,9 +832,20 @@ def decision_tree(df):
 # Run decision tree analysis on the combined Comparison_DF
 Comparison_DF['Comparison_Result'] = Comparison_DF.apply(lambda df: decision_tree(df), axis=1)
 
+#    Alternatively, reuse the decisions and expert judgements recorded during previous updates (see Decision_Store.py),
+#    so that only new or changed intersections are run through the decision tree and require expert judgement
+# from combined_map.Decision_Store import DecisionStore
+# with DecisionStore(r'Insert the full directory path to the decision store here\Combined_Map_Decisions.sqlite') as store:
+#     Comparison_DF = store.decide(Comparison_DF, lambda new: new.apply(lambda df: decision_tree(df), axis=1))
+
 # 3.7.4. Analysing decision results
 
 # Output the comparison table as a csv
+#    Alternatively, write this and the other outputs to the network drive in the background (see Output_Writer.py),
+#    as Parquet and .csv files, and wait for them (writer.close()) before they are needed within ArcGIS
+# from combined_map.Output_Writer import OutputWriter
+# writer = OutputWriter(r'Insert the full directory path to the output folder here', formats=['parquet', 'csv'])
+# writer.write('NewCombinedMap_ComparisonOutput', Comparison_DF)
 Comparison_DF.to_csv(r'J:\GISprojects\Marine\HabitatMapping\Combined_Map_Updates_LM\NewCombinedMap_ComparisonOutput\NewCombinedMap_ComparisonOutput.csv', sep=',')
 
 #    Perform QC check to identify if any data have been flagged as requiring expert judgement
@@ -0,0 +1,363 @@
+########################################################################################################################
+
+# Title: Benchmarks
+
+# Script description:    End-to-end benchmark of the combined map update on synthetic data (Synthetic_Data.py), run at
+#                        several scales (1x, 10x and 100x by default). Every stage of the update is timed with the
+#                        Tracer from Instrumentation.py and its throughput (input rows / features per second) recorded.
+#
+#                        The ArcPy geometry stages are represented by their open-source equivalents within Overlay.py,
+#                        so the benchmark runs on any machine with Pandas and Shapely installed:
+#                            python -m combined_map.Benchmarks --scales 1 10 100 --output benchmark.json
+#
+#                        The new survey maps are written as one GeoParquet file each and read back concurrently with
+#                        Reference_Reader.py, as the new maps are read from the EUNIS reference geodatabase.
+#
+#                        Add --workers N to run the geometry checks and the Erase, Dissolve and Intersect overlays
+#                        within N worker processes (sharing the layers as GeometryBuffers), and the reads of the new
+#                        maps on N threads (4 by default).
+#
+#                        Add --grid-size 1e-7 to run the overlays with a fixed-precision model (see Overlay.py); the
+#                        part and vertex counts of every overlay are listed in the summary either way.
+#
+#                        Add --generalise to select the UKSeaMap polygons which intersect the combined map (Section
+#                        1.2.2.) using a generalised UKSeaMap (see Generalised_Layer.py).
+#
+#                        Add --lazy to also time the Polars version of Sections 3.3. - 3.8. (Lazy_Decisions.py).
+#
+#                        Add --tile-size 2 to also time the update run tile by tile on a grid of 2 degree tiles
+#                        (Tiled_Update.py), within --workers N local worker processes.
+#
+#                        Compare the output of two benchmark runs to find regressions with:
+#                            python -m combined_map.Benchmarks --compare baseline.json benchmark.json
+
+########################################################################################################################
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import shapely
+
+from .Change_Detection import detect_changes
+from .Combined_Map_Stages import build_control_frames, load_confidence_metadata, run_metadata_checks, \
+    build_new_decision_attributes, build_existing_decision_attributes, build_comparison, attach_overlap_areas, \
+    run_decision_tree
+from .Generalised_Layer import GeneralisedLayer
+from .GeoParquet import read_geoparquet, write_geoparquet
+from .Geometry_QA import check_geometries, find_overlaps
+from .Instrumentation import Tracer, count_geometry, set_tracer, summary_table, trace
+from .Measures import add_area_field, measure_layer
+from .Overlay import append_layer, dissolve_layer, erase_layer, intersect_layers, merge_layers, select_by_location
+from .Reference_Reader import list_feature_classes, read_feature_classes
+from .Synthetic_Data import generate_update_inputs, write_update_inputs
+
+
+def _count_vertices(record, inputs, output):
+    """Record the polygon parts and vertices of the inputs and output of an overlay (outside its timed section)"""
+    counts = [count_geometry(x) for x in inputs]
+    record.parts_in, record.vertices_in = sum(x[0] for x in counts), sum(x[1] for x in counts)
+    record.parts_out, record.vertices_out = count_geometry(output)
+
+
+def run_update(data, paths, workers=None, lazy=False, grid_size=None, generalise=False, tile_size=None):
+    """
+    Function Title: run_update()
+    Define function to run every stage of the combined map update on generated inputs, tracing each stage. grid_size
+    runs the overlays with a fixed-precision model (see Overlay.py), and generalise selects the UKSeaMap polygons
+    intersecting the combined map using a generalised UKSeaMap (see Generalised_Layer.py). tile_size also runs the
+    update tile by tile (see Tiled_Update.py).
+    """
+    ne_sources = ['NE_Ev_2', 'NE_Evid']
+
+    # Section 1.1.5. - Geometry checks
+    with trace('check_geometries', rows_in=len(data['combined_map'])) as record:
+        checked = check_geometries(data['combined_map'], workers=workers)
+        record.rows_out = int((~checked['Valid']).sum())
+    with trace('find_overlaps', rows_in=len(checked)) as record:
+        record.rows_out = len(find_overlaps(checked)[0])
+
+    # Section 1.2. - Inserting UKSeaMap into the combined map
+    with trace('Select', rows_in=len(data['combined_map'])) as record:
+        combined_extract = data['combined_map'].loc[data['combined_map']['GUI'] != 'UKSM16']
+        record.rows_out = len(combined_extract)
+    generalised = None
+    if generalise:
+        with trace('generalise_uksm', rows_in=len(data['uksm'])) as record:
+            generalised = GeneralisedLayer.build(data['uksm'])
+            record.rows_out = len(generalised)
+    with trace('SelectLayerByLocation', rows_in=len(data['uksm'])) as record:
+        intersecting = select_by_location(data['uksm'], combined_extract, generalised)
+        uksm_intersecting, uksm_notintersecting = data['uksm'].loc[intersecting], data['uksm'].loc[~intersecting]
+        record.rows_out = len(uksm_intersecting)
+    with trace('Erase', rows_in=len(uksm_intersecting) + len(combined_extract)) as record:
+        uksm_erased = erase_layer(uksm_intersecting, combined_extract, workers=workers, grid_size=grid_size)
+        record.rows_out = len(uksm_erased)
+    _count_vertices(record, [uksm_intersecting, combined_extract], uksm_erased)
+    with trace('Merge', rows_in=len(uksm_erased) + len(uksm_notintersecting)) as record:
+        uksm_erased = merge_layers([uksm_erased, uksm_notintersecting])
+        record.rows_out = len(uksm_erased)
+    with trace('Append', rows_in=len(uksm_erased)) as record:
+        combined_insert = append_layer(uksm_erased, combined_extract)
+        record.rows_out = len(combined_insert)
+
+    # Section 2. - Removing the NE Evidence Base
+    with trace('Select', rows_in=len(combined_insert)) as record:
+        ne_evidence = combined_insert.loc[combined_insert['Source'].isin(ne_sources)]
+        no_ne = combined_insert.loc[~combined_insert['Source'].isin(ne_sources)]
+        no_evidbase = no_ne.loc[no_ne['Source'] != 'UKSM18']
+        record.rows_out = len(no_evidbase)
+
+    # Section 3.1. - 3.2. - Identifying, merging, dissolving and intersecting the new maps
+    with trace('listUniqueValues', rows_in=len(no_evidbase)) as record:
+        combined_set = set(no_evidbase['GUI'].unique())
+        new_map_guis = sorted(set(data['new_maps']['GUI'].unique()) - combined_set)
+        record.rows_out = len(new_map_guis)
+    reference_folder = os.path.join(os.path.dirname(paths['new_maps']), 'Reference_maps')
+    os.makedirs(reference_folder)
+    for gui, new_map in data['new_maps'].groupby('GUI', sort=False):
+        write_geoparquet(new_map, os.path.join(reference_folder, '%s.parquet' % gui))
+    with trace('read_feature_classes', rows_in=len(data['new_maps'])) as record:
+        reference_maps, _ = read_feature_classes(list_feature_classes(reference_folder), fields=None,
+                                                 workers=workers or 4)
+        record.rows_out = sum(len(x) for x in reference_maps.values())
+    with trace('Merge', rows_in=len(data['new_maps'])) as record:
+        # The new maps are merged as read back by read_feature_classes(), in the order of their GUIs within new_maps
+        merged = merge_layers([reference_maps[x] for x in data['new_maps']['GUI'].unique()])
+        record.rows_out = len(merged)
+    with trace('Dissolve', rows_in=len(merged)) as record:
+        dissolved = dissolve_layer(merged, 'GUI', workers=workers, grid_size=grid_size)
+        record.rows_out = len(dissolved)
+    _count_vertices(record, [merged], dissolved)
+    with trace('Intersect', rows_in=len(no_evidbase) + len(dissolved)) as record:
+        intersect = intersect_layers(no_evidbase, dissolved, workers=workers, grid_size=grid_size)
+        record.rows_out = len(intersect)
+    _count_vertices(record, [no_evidbase, dissolved], intersect)
+
+    # Sections 3.3. - 3.7. - Metadata checks and decision tree analysis
+    with trace('overlap_areas', rows_in=len(intersect)) as record:
+        Intersection_Attributes = intersect.drop(columns=['WKB'])
+        Intersection_Attributes['Overlap_Area_km2'] = measure_layer(intersect, workers)[0]
+        record.rows_out = len(Intersection_Attributes)
+    with trace('control_frames', rows_in=len(Intersection_Attributes)) as record:
+        Intersected_Maps, Control_DF = build_control_frames(Intersection_Attributes)
+        record.rows_out = len(Control_DF)
+    with trace('confidence_metadata', inputs=[paths['confidence'], paths['gui_tracking']], count=True) as record:
+        ThreeStep_GUI_Confidence, GUI_Tracking = load_confidence_metadata(paths['confidence'], paths['gui_tracking'])
+        record.rows_out = len(ThreeStep_GUI_Confidence)
+    with trace('metadata_checks', rows_in=len(Control_DF)) as record:
+        record.rows_out = sum(len(x) for x in run_metadata_checks(Control_DF, ThreeStep_GUI_Confidence,
+                                                                  GUI_Tracking).values())
+    with trace('new_map_attributes', rows_in=len(data['merged_attributes'])) as record:
+        New_Decision_Attributes = build_new_decision_attributes(data['merged_attributes'], ThreeStep_GUI_Confidence)
+        record.rows_out = len(New_Decision_Attributes)
+    with trace('existing_map_attributes', rows_in=len(Intersection_Attributes)) as record:
+        Combined_Decision_Attributes = build_existing_decision_attributes(Intersection_Attributes, Intersected_Maps,
+                                                                          ThreeStep_GUI_Confidence)
+        record.rows_out = len(Combined_Decision_Attributes)
+    with trace('comparison', rows_in=len(Control_DF)) as record:
+        Comparison_DF = build_comparison(Control_DF, New_Decision_Attributes, Combined_Decision_Attributes)
+        Comparison_DF = attach_overlap_areas(Comparison_DF, Intersection_Attributes)
+        record.rows_out = len(Comparison_DF)
+    with trace('decision', rows_in=len(Comparison_DF)) as record:
+        Comparison_DF, Requires_Judgement, Join_Results = run_decision_tree(Comparison_DF)
+        record.rows_out = len(Join_Results)
+    if lazy:
+        from .Lazy_Decisions import run_lazy_decisions
+        Intersection_Attributes.to_csv(paths['intersection_attributes'], sep=',', index=False)
+        with trace('lazy_decisions', rows_in=len(Intersection_Attributes)) as record:
+            record.rows_out = len(run_lazy_decisions(paths['intersection_attributes'], paths['merged_attributes'],
+                                                     paths['confidence'], paths['gui_tracking'])['Join_Results'])
+
+    # Section 3.8. - 3.9. - Erasing the losing areas and overwriting the combined map
+    results = dict(((x.NewGUI, x.ExistingGUI), x.Comparison_Result) for x in Join_Results.itertuples())
+    won = [results.get((new, existing)) == new for new, existing in zip(intersect['GUI_1'], intersect['GUI'])]
+    losing = intersect.loc[[not x for x in won]]
+    with trace('Erase', rows_in=len(merged) + len(losing)) as record:
+        new_maps_win = erase_layer(merged, losing, workers=workers, grid_size=grid_size)
+        record.rows_out = len(new_maps_win)
+    _count_vertices(record, [merged, losing], new_maps_win)
+    with trace('Erase', rows_in=len(no_ne) + len(new_maps_win)) as record:
+        placeholder = erase_layer(no_ne, new_maps_win, workers=workers, grid_size=grid_size)
+        record.rows_out = len(placeholder)
+    _count_vertices(record, [no_ne, new_maps_win], placeholder)
+    with trace('Append', rows_in=len(new_maps_win)) as record:
+        updated = append_layer(new_maps_win, placeholder)
+        record.rows_out = len(updated)
+
+    # Section 4. - Reinserting the NE Evidence Base
+    with trace('Erase', rows_in=len(updated) + len(ne_evidence)) as record:
+        erased = erase_layer(updated, ne_evidence, workers=workers, grid_size=grid_size)
+        record.rows_out = len(erased)
+    _count_vertices(record, [updated, ne_evidence], erased)
+    updated = erased
+    with trace('Append', rows_in=len(ne_evidence)) as record:
+        updated = append_layer(ne_evidence, updated)
+        record.rows_out = len(updated)
+
+    with trace('calculate_area_field', rows_in=len(updated)) as record:
+        updated = add_area_field(updated, 'AreaKm2', workers)
+        record.rows_out = len(updated)
+
+    # Comparison of the updated combined map with the previous version
+    with trace('change_detection', rows_in=len(data['combined_map']) + len(updated)) as record:
+        record.rows_out = len(detect_changes(data['combined_map'], updated, workers=workers)['changes'])
+
+    # The same update run tile by tile
+    if tile_size:
+        from .Tiled_Update import tiled_update, compare_updates
+        with trace('tiled_update', rows_in=len(data['combined_map'])) as record:
+            tiled, _, _ = tiled_update(dict((x, data[x]) for x in ['combined_map', 'uksm', 'new_maps']),
+                                       dict((x, paths[x]) for x in ['merged_attributes', 'confidence', 'gui_tracking']),
+                                       os.path.join(os.path.dirname(paths['combined_map']), 'Tiled_update'),
+                                       tile_size, workers=workers, grid_size=grid_size)
+            record.rows_out = len(tiled)
+        # The tiled update must give the same features and areas as the update run as one job
+        differences = compare_updates(updated, tiled, grid_size=grid_size)
+        if not differences.empty:
+            raise ValueError('The tiled update (%d features) differs from the update run as one job (%d features):\n%s'
+                             % (len(tiled), len(updated), differences.to_string()))
+
+    # Export of the updated combined map to GeoParquet, and a read of a tenth of its extent
+    parquet_path = os.path.join(os.path.dirname(paths['combined_map']), 'Combined_Map.parquet')
+    with trace('write_geoparquet', rows_in=len(updated)) as record:
+        write_geoparquet(updated, parquet_path)
+        record.rows_out = len(updated)
+    with trace('read_geoparquet', rows_in=len(updated)) as record:
+        xmin, ymin, xmax, ymax = shapely.total_bounds(shapely.from_wkb(updated['WKB'].values))
+        record.rows_out = len(read_geoparquet(parquet_path, bbox=(xmin, ymin, xmin + (xmax - xmin) / 10,
+                                                                  ymin + (ymax - ymin) / 10)))
+    return updated
+
+
+def throughput(records):
+    """
+    Function Title: throughput()
+    Define function to total the wall time and rows of each stage and calculate its throughput (rows per second)
+    """
+    totals = {}
+    for record in records:
+        if record.get('parent') is not None:
+            continue
+        total = totals.setdefault(record['name'], {'wall_seconds': 0.0, 'rows_in': 0, 'peak_rss_bytes': 0})
+        total['wall_seconds'] += record['wall_seconds'] or 0.0
+        total['rows_in'] += record['rows_in'] or 0
+        total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record['peak_rss_bytes'] or 0)
+    for total in totals.values():
+        total['rows_per_second'] = total['rows_in'] / total['wall_seconds'] if total['wall_seconds'] > 0 else None
+    return totals
+
+
+def run_benchmarks(scales=(1, 10, 100), seed=0, workers=None, lazy=False, grid_size=None, generalise=False,
+                   tile_size=None):
+    """
+    Function Title: run_benchmarks()
+    Define function to generate synthetic inputs and run the update at every scale. Returns the benchmark results.
+    """
+    results = {'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(),
+               'python': sys.version.split()[0], 'seed': seed, 'grid_size': grid_size, 'scales': {}}
+    for scale in scales:
+        print('Generating synthetic inputs at %sx scale ...' % scale)
+        start = time.perf_counter()
+        data = generate_update_inputs(scale=scale, seed=seed)
+        folder = tempfile.mkdtemp(prefix='combined_map_benchmark_')
+        try:
+            paths = write_update_inputs(data, folder)
+            print('Generated %d combined map features in %.1f s' % (len(data['combined_map']),
+                                                                      time.perf_counter() - start))
+            tracer = set_tracer(Tracer())
+            try:
+                updated = run_update(data, paths, workers=workers, lazy=lazy, grid_size=grid_size,
+                                     generalise=generalise, tile_size=tile_size)
+            finally:
+                set_tracer(None)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+        records = [x.as_dict() for x in tracer.records]
+        print(summary_table(records))
+        parts, vertices = count_geometry(updated)
+        print('Updated combined map: %d features, %d parts, %d vertices' % (len(updated), parts, vertices))
+        results['scales'][str(scale)] = {'features': len(data['combined_map']), 'stages': records,
+                                         'throughput': throughput(records),
+                                         'updated_map': {'features': len(updated), 'parts': parts,
+                                                         'vertices': vertices}}
+    return results
+
+
+def throughput_table(results):
+    """
+    Function Title: throughput_table()
+    Define function to format the throughput of every stage at every scale as a text table
+    """
+    scales = list(results['scales'])
+    stages = []
+    for scale in scales:
+        stages += [x for x in results['scales'][scale]['throughput'] if x not in stages]
+    lines = ['%-26s' % 'Stage (rows/s)' + ''.join('%14s' % (scale + 'x') for scale in scales)]
+    for stage in stages:
+        values = [results['scales'][scale]['throughput'].get(stage, {}).get('rows_per_second') for scale in scales]
+        lines.append('%-26s' % stage + ''.join('%14s' % ('-' if x is None else '%.0f' % x) for x in values))
+    return '\n'.join(lines)
+
+
+def compare_benchmarks(baseline, current, threshold=0.2):
+    """
+    Function Title: compare_benchmarks()
+    Define function to compare the throughput of every stage at every scale between two benchmark results. Returns a
+    list of (scale, stage, baseline, current, change) for stages which have slowed by more than threshold (20 %).
+    """
+    regressions = []
+    for scale, result in current['scales'].items():
+        if scale not in baseline['scales']:
+            continue
+        for stage, total in result['throughput'].items():
+            old = baseline['scales'][scale]['throughput'].get(stage, {}).get('rows_per_second')
+            new = total.get('rows_per_second')
+            if old and new and (old - new) / old > threshold:
+                regressions.append((scale, stage, old, new, (new - old) / old))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the combined map update on synthetic data')
+    parser.add_argument('--scales', nargs='*', type=float, default=[1, 10, 100])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for the geometry checks and '
+                                                                           'overlays')
+    parser.add_argument('--grid-size', type=float, default=None,
+                        help='Run the overlays with a fixed-precision model on a grid of this size (e.g. 1e-7)')
+    parser.add_argument('--generalise', action='store_true',
+                        help='Select the UKSeaMap polygons intersecting the combined map using a generalised UKSeaMap')
+    parser.add_argument('--lazy', action='store_true', help='Also time the Polars version of Sections 3.3. - 3.8.')
+    parser.add_argument('--tile-size', type=float, default=None,
+                        help='Also time the update run tile by tile on a grid of tiles of this size (in degrees)')
+    parser.add_argument('--output', help='JSON file to write the benchmark results to')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='Compare two benchmark result files instead of running the benchmark')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline_results = json.load(f)
+        with open(args.compare[1]) as f:
+            current_results = json.load(f)
+        found = compare_benchmarks(baseline_results, current_results)
+        for scale_name, stage_name, old_rate, new_rate, change in found:
+            print('%sx %s: %.0f -> %.0f rows/s (%+.0f %%)' % (scale_name, stage_name, old_rate, new_rate, change * 100))
+        if not found:
+            print('No regressions found')
+        sys.exit(1 if found else 0)
+
+    benchmark_results = run_benchmarks([int(x) if x == int(x) else x for x in args.scales], args.seed, args.workers,
+                                       args.lazy, args.grid_size, args.generalise, args.tile_size)
+    print(throughput_table(benchmark_results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+        print('Benchmark results written to %s' % os.path.abspath(args.output))
@@ -0,0 +1,182 @@
+########################################################################################################################
+
+# Title: Change Detection
+
+# Script description:    Comparison of two versions of the combined map (e.g. before and after an update), reporting
+#                        which GUIs and EUNIS level 3 habitats gained or lost area, how much intertidal and sub-tidal
+#                        coverage moved, and the areas which changed as a layer.
+#
+#                        Polygon differences are only calculated where they are needed:
+#                            - every feature is hashed (geometry, GUI and EUNIS level 3 habitat), and the hashes and
+#                              areas are summarised by GUI - GUIs with the same summary in both versions are unchanged;
+#                            - within changed GUIs, features found unchanged within the other version are skipped;
+#                            - the remaining removed and added features are overlaid with the STR-tree based tools
+#                              within Overlay.py, giving the areas which were reassigned (to another GUI or habitat),
+#                              lost (no longer mapped) or gained (newly mapped).
+#
+#                        Areas are calculated in km2 on the WGS 1984 ellipsoid (see Measures.py), from layers in
+#                        WGS 1984 longitude / latitude.
+#
+#                        Compare two GeoParquet exports of the combined map (see GeoParquet.py) with:
+#                            python -m combined_map.Change_Detection Combined_Map_v1.parquet Combined_Map_v2.parquet
+#                        or set 'previous_version' within the update configuration (see Combined_Map_Stages.py).
+
+########################################################################################################################
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from .EUNIS_Registry import get_registry
+from .Measures import measure_geometries, measure_layer
+from .Overlay import erase_layer, intersect_layers
+
+#   Field holding the EUNIS level 3 habitats of the combined map
+L3_FIELD = 'E_L3_LON'
+
+
+def area_km2(geometries):
+    """
+    Function Title: area_km2()
+    Define function to calculate the area (km2) of longitude / latitude geometries on the WGS 1984 ellipsoid (see
+    Measures.py)
+    """
+    return measure_geometries(geometries)[0]
+
+
+def habitat_zone(l3_habitats):
+    """
+    Function Title: habitat_zone()
+    Define function to classify EUNIS level 3 habitats as intertidal, sub-tidal or mixed, as within
+    habitat_classifier() (looking up the zone of every EUNIS code within the EUNIS registry)
+    """
+    l3_habitats = pd.Series(l3_habitats).fillna('').astype(str)
+    registry = get_registry()
+    zones = [registry.zones(x) for x in l3_habitats]
+    intertidal = np.array(['Intertidal' in x for x in zones], dtype=bool)
+    subtidal = np.array(['Sub-tidal' in x for x in zones], dtype=bool)
+    return pd.Series(np.select([intertidal & subtidal, intertidal, subtidal], ['Mixed habitat', 'Intertidal',
+                                                                             'Sub-tidal'], 'Other'),
+                     index=l3_habitats.index)
+
+
+def _prepare(layer, key, l3_field):
+    """Return the key, habitat and geometry of every feature with its hash and area"""
+    Prepared = layer[[key, l3_field, 'WKB']].reset_index(drop=True)
+    Prepared['Hash'] = pd.util.hash_pandas_object(Prepared, index=False).values
+    Prepared['Area_km2'] = measure_layer(Prepared)[0]
+    return Prepared
+
+
+def summarise(Prepared, key):
+    """
+    Function Title: summarise()
+    Define function to summarise the features of a prepared layer by key - the number of features, their area and the
+    sum of their hashes (which does not depend on the order of the features)
+    """
+    return Prepared.groupby(key, dropna=False).agg(Features=('Hash', 'size'), Area_km2=('Area_km2', 'sum'),
+                                                   Fingerprint=('Hash', lambda x: int(np.sum(x.values))))
+
+
+def detect_changes(Old, New, key='GUI', l3_field=L3_FIELD, workers=None):
+    """
+    Function Title: detect_changes()
+    Define function to compare two versions of the combined map (DataFrames with 'WKB', GUI and EUNIS level 3 habitat
+    columns). Returns a dictionary holding:
+        summary    - the change table: the area (km2) of every changed GUI, EUNIS level 3 habitat and habitat zone
+                     within each version, with the area lost to and gained from other values
+        changes    - the change layer: the areas reassigned, lost or gained, with their GUI and habitat within the old
+                     ('From_') and new ('To_') versions
+        statistics - the number of features compared and overlaid
+    """
+    Old_Features = _prepare(Old, key, l3_field)
+    New_Features = _prepare(New, key, l3_field)
+
+    # GUIs with the same number of features, area and fingerprint within both versions are unchanged
+    Summaries = summarise(Old_Features, key).join(summarise(New_Features, key), how='outer', lsuffix='_Old',
+                                                  rsuffix='_New')
+    changed = Summaries.index[(Summaries['Fingerprint_Old'] != Summaries['Fingerprint_New']) |
+                              (Summaries['Features_Old'] != Summaries['Features_New'])]
+
+    # Features of changed GUIs which are not found (with the same geometry and habitat) within the other version
+    removed = Old_Features[key].isin(changed) & ~Old_Features['Hash'].isin(New_Features['Hash'])
+    added = New_Features[key].isin(changed) & ~New_Features['Hash'].isin(Old_Features['Hash'])
+    Removed = Old_Features.loc[removed, [key, l3_field, 'WKB']].reset_index(drop=True)
+    Added = New_Features.loc[added, [key, l3_field, 'WKB']].reset_index(drop=True)
+
+    # Areas which changed GUI or habitat, areas no longer covered by the new version and areas newly covered
+    Reassigned = intersect_layers(Removed, Added, workers=workers)
+    Reassigned = Reassigned.loc[(Reassigned[key].fillna('') != Reassigned[key + '_1'].fillna('')) |
+                                (Reassigned[l3_field].fillna('') != Reassigned[l3_field + '_1'].fillna(''))]
+    Lost = erase_layer(Removed, New, workers=workers)
+    Gained = erase_layer(Added, Old, workers=workers)
+    Change_Layer = pd.concat([
+        pd.DataFrame({'Change': 'Reassigned', 'From_GUI': Reassigned[key].values,
+                      'From_L3': Reassigned[l3_field].values, 'To_GUI': Reassigned[key + '_1'].values,
+                      'To_L3': Reassigned[l3_field + '_1'].values, 'WKB': Reassigned['WKB'].values}),
+        pd.DataFrame({'Change': 'Lost', 'From_GUI': Lost[key].values, 'From_L3': Lost[l3_field].values,
+                      'WKB': Lost['WKB'].values}),
+        pd.DataFrame({'Change': 'Gained', 'To_GUI': Gained[key].values, 'To_L3': Gained[l3_field].values,
+                      'WKB': Gained['WKB'].values})], ignore_index=True)
+    Change_Layer['From_Zone'] = habitat_zone(Change_Layer['From_L3']).where(Change_Layer['Change'] != 'Gained')
+    Change_Layer['To_Zone'] = habitat_zone(Change_Layer['To_L3']).where(Change_Layer['Change'] != 'Lost')
+    Change_Layer['Area_km2'] = measure_layer(Change_Layer)[0]
+    Change_Layer = Change_Layer[['Change', 'From_GUI', 'To_GUI', 'From_L3', 'To_L3', 'From_Zone', 'To_Zone',
+                                 'Area_km2', 'WKB']]
+
+    Old_Features['Zone'] = habitat_zone(Old_Features[l3_field]).values
+    New_Features['Zone'] = habitat_zone(New_Features[l3_field]).values
+    summary = []
+    for name, field, change_field in [('GUI', key, 'GUI'), ('EUNIS_L3', l3_field, 'L3'), ('Zone', 'Zone', 'Zone')]:
+        Areas = pd.DataFrame({'Old_Area_km2': Old_Features.groupby(field)['Area_km2'].sum(),
+                              'New_Area_km2': New_Features.groupby(field)['Area_km2'].sum()}).fillna(0.0)
+        moved = Change_Layer['From_' + change_field].fillna('') != Change_Layer['To_' + change_field].fillna('')
+        Areas['Lost_km2'] = Change_Layer.loc[moved].groupby('From_' + change_field)['Area_km2'].sum()
+        Areas['Gained_km2'] = Change_Layer.loc[moved].groupby('To_' + change_field)['Area_km2'].sum()
+        Areas[['Lost_km2', 'Gained_km2']] = Areas[['Lost_km2', 'Gained_km2']].fillna(0.0)
+        Areas['Change_km2'] = Areas['New_Area_km2'] - Areas['Old_Area_km2']
+        keep = (Areas['Lost_km2'] > 0) | (Areas['Gained_km2'] > 0)
+        if field == key:
+            keep |= Areas.index.isin(changed)
+        Areas = Areas.loc[keep]
+        summary.append(Areas.rename_axis('Value').reset_index().assign(Summary=name))
+    Change_Summary = pd.concat(summary, ignore_index=True)[['Summary', 'Value', 'Old_Area_km2', 'New_Area_km2',
+                                                            'Change_km2', 'Lost_km2', 'Gained_km2']]
+
+    statistics = {'old_features': len(Old_Features), 'new_features': len(New_Features), 'guis': len(Summaries),
+                  'changed_guis': len(changed), 'removed_features': len(Removed), 'added_features': len(Added),
+                  'change_features': len(Change_Layer)}
+    return {'summary': Change_Summary, 'changes': Change_Layer, 'statistics': statistics}
+
+
+def write_changes(result, summary_path, changes_path):
+    """
+    Function Title: write_changes()
+    Define function to write the change table (.csv) and change layer (GeoParquet) from detect_changes()
+    """
+    from .GeoParquet import write_geoparquet
+    result['summary'].to_csv(summary_path, sep=',', index=False)
+    write_geoparquet(result['changes'], changes_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two versions of the combined map')
+    parser.add_argument('old', help='GeoParquet export of the earlier version')
+    parser.add_argument('new', help='GeoParquet export of the later version')
+    parser.add_argument('--out-dir', default='.', help='Folder to write Change_Summary.csv and Changes.parquet to')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for the overlays')
+    args = parser.parse_args()
+
+    from .GeoParquet import read_geoparquet
+    change_result = detect_changes(read_geoparquet(args.old, columns=['GUI', L3_FIELD]),
+                                   read_geoparquet(args.new, columns=['GUI', L3_FIELD]), workers=args.workers)
+    print(change_result['statistics'])
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(change_result['summary'].loc[change_result['summary']['Summary'] != 'GUI'])
+    if not os.path.isdir(args.out_dir):
+        os.makedirs(args.out_dir)
+    write_changes(change_result, os.path.join(args.out_dir, 'Change_Summary.csv'),
+                  os.path.join(args.out_dir, 'Changes.parquet'))
+    print('Change table and layer written to %s' % args.out_dir)
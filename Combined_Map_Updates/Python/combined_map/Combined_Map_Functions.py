@@ -0,0 +1,304 @@
+########################################################################################################################
+
+# Title: Combined Map Functions
+
+# Script description:    Functions and settings used throughout Combined_Map_Updates.py. These are held within their own
+#                        module so that they can be imported by the pipeline stages (Combined_Map_Stages.py) and by any
+#                        Python console / IDE without running the ArcGIS sections of the main script.
+
+########################################################################################################################
+
+import re
+
+from .EUNIS_Registry import eunisTokenPattern, get_registry
+
+#   Translated Habitat DEF mandatory fields (Section 1.1.2.) - field name, type, precision, scale and length
+add_fields = [
+     ("GUI", "TEXT", "#", "#", 8),
+     ("POLYGON", "LONG", 8, "#", "#"),
+     ("ORIG_HAB", "TEXT", "#", "#", 254),
+     ("ORIG_CLASS", "TEXT", "#", "#", 254),
+     ("HAB_TYPE", "TEXT", "#", "#", 20),
+     ("VERSION", "TEXT", "#", "#", 50),
+     ("DET_MTHD", "TEXT", "#", "#", 254),
+     ("DET_NAME", "TEXT", "#", "#", 254),
+     ("DET_DATE", "DATE", "#", "#", "#"),
+     ("TRAN_COM", "TEXT", "#", "#", 254),
+     ("T_RELATE", "TEXT", "#", "#", 1),
+     ("VAL_COMM", "TEXT", "#", "#", 254)]
+
+
+# EUNIS level 3 settings and functions (Section 1.1.4.) - developed by G. Duncan (2016)
+#   EUNIS codes are looked up within the EUNIS registry (EUNIS_Registry.py). To use within the ArcGIS Field Calculator,
+#   add the Combined_Map_Updates\Python folder to sys.path within the 'Codeblock' section and import eunisToAllLevel3
+#   from combined_map.Combined_Map_Functions
+
+# Suggest keeping at False to standardise the concatenation, but can change to True to use the function below.
+# If set "y", uses the first matching concatenator in original hab_type field
+useConcatenateBool = False
+# What to use as concatenator if you're not getting it from the original field (i.e. above is set to False) or if
+# nothing matches in original.
+concatenatorDefault = '+'
+# Are L2 habitats to be removed from the output? True/False
+removeL2Bool = True
+# Are there any habitats that would be caught by the above that should be retained (e.g. deep sea "A6")
+keepList = ['A6']
+# Should the output list be alphabetised for standardisation? True/False
+sortListBool = True
+
+
+eunisPattern = eunisTokenPattern
+concatenatePattern = re.compile(r'([\\/+\&]|or)')
+
+
+# Tries to use the (first instance of a) habitat concatenator to output into the final result.
+# If no matches found, defaults to "+"
+# Potential matches are "\" "/" "+" and "&"
+def collectConcatenator(searchString):
+    concatenateMatches = re.search(concatenatePattern, searchString)
+    if concatenateMatches:
+        return concatenateMatches.group(0)
+    else:
+        return '+'
+
+
+def eunisToAllLevel3(eunisFull):
+    if useConcatenateBool:
+        concatenator = collectConcatenator(eunisFull)
+    else:
+        concatenator = concatenatorDefault
+    registry = get_registry()
+    habFirstFour = set([registry.level3(x) for x in registry.tokenise(eunisFull)])
+    if removeL2Bool:
+        habFirstFour = [x for x in habFirstFour if ((registry.level(x) >= 3) or x in keepList)]
+    if sortListBool:
+        habFirstFour = sorted(habFirstFour)
+    if len(habFirstFour) == 0:
+        return 'Void'
+    else:
+        return concatenator.join(habFirstFour)
+
+
+# Identifying new maps to add (Section 3.1.) - developed by G. Duncan (2017)
+def listUniqueValues(inLayer, inField, lineString=False):
+    import arcpy
+    uniqueSet = set([])
+    with arcpy.da.SearchCursor(inLayer, inField) as cursor:
+        for row in cursor:
+            uniqueSet.add(row[0])
+    if lineString:
+        output = "\n".join([str(x) for x in uniqueSet])
+        return output
+    else:
+        return (list(uniqueSet))
+
+
+def remove_my_nan(df, column):
+    """
+    Function Title: remove_my_nan()
+    Define function to remove all nan values from the HAB_TYPE column of the aggregated DataFrame
+    """
+    habitat = df[column]
+    # Return data as clean habitat if the string value of the habitat is not a 'nan' value
+    clean_habitat = [habitat for habitat in habitat if str(habitat) != 'nan']
+    return clean_habitat
+
+
+def list_set(x):
+    """
+    Function Title: list_set()
+    Define function to return a list of a set of the original list (basically remove duplicates and return as new
+    list)
+    """
+    return list(set(x))
+
+
+def confidence_check(df):
+    """
+    Function title: confidence_check()
+    Define function to check if a 3-step confidence score has been completed for each GUI within the
+    attribute table
+    """
+    data = df['NewTotal']
+    # Perform check calculate if a MESH score is present or lacking
+    if data >= 0:
+        return '3-Step confidence present'
+    else:
+        return 'Requires 3-Step confidence'
+
+
+def MESH_confidence_check(df):
+    """
+    Function title: confidence_check()
+    Define function to check if a 3-step confidence score has been completed for each GUI within the
+    attribute table
+    """
+    data = df['Overall score']
+    # Perform check calculate if a MESH score is present or lacking
+    if data >= 0:
+        return 'MESH confidence present'
+    else:
+        return 'Requires MESH confidence'
+
+
+def habitat_classifier(df):
+    """
+     Function Title: habitat_classifier()
+     Define function to classify data into intertidal, mixed or sub-tidal values based on EUNIS codes present
+     """
+    # Pull out all unique habitat codes within target subset
+    habitat = df['HAB_TYPE']
+    # Look up the zone (intertidal A1 / A2 / B3 or sub-tidal A3 - A6) of every EUNIS code within the habitats
+    registry = get_registry()
+    zones = set()
+    for y in habitat:
+        zones |= registry.zones(y)
+
+    # Run conditional statements
+    if 'Intertidal' in zones:
+        if 'Sub-tidal' in zones:
+            return 'Mixed habitat'
+        else:
+            return 'Intertidal'
+    elif 'Sub-tidal' in zones:
+        return 'Sub-tidal'
+    else:
+        return 'Error'
+
+
+# Version of the decision tree rules (decision_tree() and habitat_classifier()). Increase this whenever the rules change
+# so that decisions recorded within the decision store (Decision_Store.py) under earlier rules are not reused.
+DECISION_TREE_VERSION = 1
+
+
+def decision_tree(df):
+    """Create evaluation mechanism to complete step-wise JNCC decision tree analysis"""
+    # Return the new GUI if the new map is intertidal only
+    if df['New_Habitat_Classification'] == 'Intertidal':
+        return df['NewGUI']
+
+    # Run analysis if the new map comprises mixed habitats
+    elif df['New_Habitat_Classification'] == 'Mixed habitat':
+
+        # Return the existing GUI if the existing map is intertidal and the new map is mixed or sub-tidal
+        if df['Existing_Habitat_Classification'] == 'Intertidal':
+            return df['ExistingGUI']
+
+        # Run further analyses if the new map comprises mixed habitats and the existing map is sub-tidal
+        # (neither are prioritised)
+        elif df['Existing_Habitat_Classification'] == 'Sub-tidal':
+
+            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
+            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
+                return df['NewGUI']
+
+            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
+            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
+                return df['ExistingGUI']
+
+            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
+            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
+                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
+
+                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
+                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
+                    return df['NewGUI']
+
+                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
+                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
+                    return df['ExistingGUI']
+
+                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
+                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
+                    return 'Requires expert judgement'
+
+        # Run further analyses if the new map comprises mixed habitats and the existing map is also mixed
+        # (neither are prioritised)
+        elif df['Existing_Habitat_Classification'] == 'Mixed habitat':
+
+            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
+            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
+                return df['NewGUI']
+
+            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
+            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
+                return df['ExistingGUI']
+
+            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
+            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
+                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
+
+                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
+                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
+                    return df['NewGUI']
+
+                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
+                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
+                    return df['ExistingGUI']
+
+                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
+                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
+                    return 'Requires expert judgement'
+
+    # Run analysis if the new map comprises sub-tidal habitats
+    elif df['New_Habitat_Classification'] == 'Sub-tidal':
+
+        # Return the existing GUI if the existing map is intertidal and the new map is mixed or sub-tidal
+        if df['Existing_Habitat_Classification'] == 'Intertidal':
+            return df['ExistingGUI']
+
+        # Run further analyses if the new map comprises mixed habitats and the existing map is sub-tidal
+        # (neither are prioritised)
+        elif df['Existing_Habitat_Classification'] == 'Sub-tidal':
+
+            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
+            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
+                return df['NewGUI']
+
+            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
+            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
+                return df['ExistingGUI']
+
+            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
+            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
+                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
+
+                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
+                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
+                    return df['NewGUI']
+
+                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
+                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
+                    return df['ExistingGUI']
+
+                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
+                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
+                    return 'Requires expert judgement'
+
+        # Run further analyses if the new map comprises sub-tidal habitats and the existing map is also mixed
+        # (neither are prioritised)
+        elif df['Existing_Habitat_Classification'] == 'Mixed habitat':
+
+            # Return the new GUI if the new map has a greater 3 step confidence score than the existing map
+            if df['New_3_Step_Confidence_Score'] > df['Existing_3_Step_Confidence_Score']:
+                return df['NewGUI']
+
+            # Return the existing GUI if the existing map has a greater 3 step confidence score than the new map
+            elif df['New_3_Step_Confidence_Score'] < df['Existing_3_Step_Confidence_Score']:
+                return df['ExistingGUI']
+
+            # Run further analyses if both maps have equal 3 step confidence scores (neither is prioritised)
+            elif df['New_3_Step_Confidence_Score'] == df['Existing_3_Step_Confidence_Score']:
+                # Compare data sources from two data sets - NOT CURRENTLY POSSIBLE / MISSING DATA?
+
+                # Return the new GUI if the new map has a greater MESH confidence score than the existing map
+                if df['New_MESH_Score'] > df['Existing_MESH_Score']:
+                    return df['NewGUI']
+
+                # Return the existing GUI if the existing map has a greater MESH confidence score than the new map
+                elif df['New_MESH_Score'] < df['Existing_MESH_Score']:
+                    return df['ExistingGUI']
+
+                # If neither MESH confidence score takes priority, then flag the map as requiring expert judgement
+                elif df['New_MESH_Score'] == df['Existing_MESH_Score']:
+                    return 'Requires expert judgement'
@@ -0,0 +1,966 @@
+########################################################################################################################
+
+# Title: Combined Map Stages
+
+# Script description:    Sections 1 - 4 of Combined_Map_Updates.py declared as pipeline stages (see Pipeline.py) with
+#                        explicit inputs and outputs, in place of the placeholder file paths and dated intermediate
+#                        outputs used within the console version of the update.
+#
+#                        The ArcPy stages import arcpy when they run and hold the 'arcpy' lock, so only one
+#                        geoprocessing stage runs at a time. The Pandas stages (Sections 3.3. - 3.8.) run alongside
+#                        them wherever their inputs allow, e.g. the confidence metadata is loaded while the geometry
+#                        is being prepared.
+#
+#                        Run the full update, or a single stage, with the command line within __main__.py:
+#                            python -m combined_map update_config.json [stage ...]
+#                        where update_config.json holds the inputs listed within build_pipeline(). Re-running the same
+#                        command after a failure resumes from the last stage which completed.
+
+########################################################################################################################
+
+import json
+import os
+
+import pandas as pd
+
+from . import Combined_Map_Functions
+from .Combined_Map_Functions import add_fields, eunisToAllLevel3, listUniqueValues, remove_my_nan, list_set, \
+    confidence_check, habitat_classifier, decision_tree, collectConcatenator, DECISION_TREE_VERSION
+from .EUNIS_Registry import EUNIS_CODES_PATH
+from .Instrumentation import trace, Tracer
+from .Output_Writer import OutputWriter, publish
+from .Pipeline import Pipeline, Stage, StageOutput
+
+
+########################################################################################################################
+
+#                                   DATAFRAME FUNCTIONS (SECTIONS 3.3. - 3.8.)                                         #
+
+########################################################################################################################
+
+def read_table(path, sheet_name=None):
+    """
+    Function Title: read_table()
+    Define function to read a .csv or Excel spreadsheet into a Pandas DataFrame depending on the file extension
+    """
+    if path.lower().endswith('.csv'):
+        return pd.read_csv(path, low_memory=False)
+    return pd.read_excel(path, sheet_name)
+
+
+def build_control_frames(Intersection_Attributes):
+    """
+    Function Title: build_control_frames()
+    Section 3.3. - Group the intersected data by existing map and create the control DataFrame of all unique
+    intersections between new and existing maps
+    """
+    # 3.3.1. Group the attributes by existing maps within the Combined Map and all intersections with new data
+    Intersected_Maps = pd.DataFrame(Intersection_Attributes.groupby(['GUI'])['GUI_1'].apply(list))
+    Intersected_Maps = Intersected_Maps.reset_index(inplace=False)
+    Intersected_Maps.columns = ['CombinedMap_GUI', 'NewMap_GUI']
+
+    # 3.3.2. Remove any 'nan' (not a number) values from the Intersected_Maps DataFrame
+    Intersected_Maps['NewMap_GUI'] = Intersected_Maps.apply(lambda df: remove_my_nan(df, 'NewMap_GUI'), axis=1)
+
+    # 3.3.3. Remove duplicate GUIs and create the control DataFrame
+    Intersected_Maps['NewMap_GUI'] = Intersected_Maps['NewMap_GUI'].apply(list_set)
+    Control_DF = Intersection_Attributes[['GUI_1', 'GUI']].drop_duplicates(['GUI_1', 'GUI'], inplace=False)
+    Control_DF.columns = ['NewGUI', 'ExistingGUI']
+    return Intersected_Maps, Control_DF
+
+
+def load_confidence_metadata(confidence_path, tracking_path):
+    """
+    Function Title: load_confidence_metadata()
+    Section 3.4.1. - Load the 3-step and MESH confidence scores from the UK_METADATA_&_CONFIDENCE_2012_HOCI_additions
+    spreadsheet, along with the dataset titles from the GUI tracking document
+    """
+    UK_Meta_Confidence = read_table(confidence_path, 'Confidence scores')
+    ThreeStep_GUI_Confidence = UK_Meta_Confidence[['GUI', 'NewTotal', 'Overall score']].copy()
+    ThreeStep_GUI_Confidence['Confidence_check'] = ThreeStep_GUI_Confidence.apply(lambda df: confidence_check(df),
+                                                                                  axis=1)
+    GUI_Tracking = read_table(tracking_path, 'Sheet1')[['Globally unique ID', 'Dataset Title']]
+    return ThreeStep_GUI_Confidence, GUI_Tracking
+
+
+def run_metadata_checks(Control_DF, ThreeStep_GUI_Confidence, GUI_Tracking):
+    """
+    Function Title: run_metadata_checks()
+    Sections 3.4.2. - 3.4.5. - Run metadata checks 1 - 4 and return a dictionary of the data flagged by each check
+    """
+    # METADATA CHECK 1 - Are there any missing 3-step confidence scores? (excluding maps intersecting UKSeaMap)
+    with trace('metadata_check_1', rows_in=len(Control_DF)) as record:
+        Non_UKSM_Intersections = Control_DF.loc[~Control_DF['ExistingGUI'].isin(['UKSM'])]
+        Unique_Not_UKSM = list(Non_UKSM_Intersections['NewGUI'].unique())
+        JNCC_Missing_Confidence = ThreeStep_GUI_Confidence.loc[ThreeStep_GUI_Confidence['GUI'].isin(Unique_Not_UKSM)]
+        JNCC_Missing_Confidence = pd.merge(JNCC_Missing_Confidence, GUI_Tracking, left_on='GUI',
+                                           right_on='Globally unique ID', how='left')
+        JNCC_Missing_Confidence = JNCC_Missing_Confidence.drop(['Globally unique ID'], axis=1)
+        JNCC_Missing_Confidence_Output = JNCC_Missing_Confidence.loc[
+            JNCC_Missing_Confidence['Confidence_check'].isin(['Requires 3-Step confidence'])]
+        record.rows_out = len(JNCC_Missing_Confidence_Output)
+
+    # METADATA CHECK 2 - Have values been erroneously assigned a 3-step confidence score of 0?
+    with trace('metadata_check_2', rows_in=len(JNCC_Missing_Confidence)) as record:
+        Zero_Confidence = JNCC_Missing_Confidence.loc[JNCC_Missing_Confidence['NewTotal'] == 0]
+        record.rows_out = len(Zero_Confidence)
+
+    # METADATA CHECK 3 - Are intersected maps missing from the UK_METADATA_&_CONFIDENCE_2012_HOCI_additions document?
+    with trace('metadata_check_3', rows_in=len(Control_DF)) as record:
+        UK_Meta_Conf_2012HOCI_Missing_GUI = Control_DF.loc[
+            ~Control_DF['ExistingGUI'].isin(ThreeStep_GUI_Confidence['GUI'])]
+        UK_Meta_Conf_2012HOCI_Missing_GUI_Unique = pd.DataFrame(
+            UK_Meta_Conf_2012HOCI_Missing_GUI['ExistingGUI'].unique(), columns=['MissingGUI'])
+        record.rows_out = len(UK_Meta_Conf_2012HOCI_Missing_GUI_Unique)
+
+    # METADATA CHECK 4 - Have any MESH confidence scores been recorded as 0?
+    with trace('metadata_check_4', rows_in=len(JNCC_Missing_Confidence)) as record:
+        Zero_MESH_Confidence = JNCC_Missing_Confidence.loc[JNCC_Missing_Confidence['Overall score'] == 0]
+        record.rows_out = len(Zero_MESH_Confidence)
+
+    return {'JNCC_Missing_Confidence_output': JNCC_Missing_Confidence_Output,
+            'GUI_Zero_Confidence': Zero_Confidence,
+            'NotIn_UKMetaConf2012': UK_Meta_Conf_2012HOCI_Missing_GUI_Unique,
+            'Zero_MESH_Confidence': Zero_MESH_Confidence}
+
+
+def build_new_decision_attributes(Merged_Attributes, ThreeStep_GUI_Confidence):
+    """
+    Function Title: build_new_decision_attributes()
+    Section 3.5. - Classify the habitats of each new survey map and attach its confidence scores and MCZ source
+    """
+    # 3.5.1. Aggregate all habitat data by GUI, removing any 'nan' values
+    Merged_Attributes = Merged_Attributes.copy()
+    Merged_Attributes['HAB_TYPE'] = Merged_Attributes['HAB_TYPE'].astype(str)
+    Aggregated_Attributes = pd.DataFrame(Merged_Attributes.groupby(['GUI'])['HAB_TYPE'].apply(list))
+    Aggregated_Attributes = Aggregated_Attributes.reset_index(inplace=False)
+    Aggregated_Attributes.columns = ['GUI', 'HAB_TYPE']
+    Aggregated_Attributes['HAB_TYPE'] = Aggregated_Attributes.apply(lambda df: remove_my_nan(df, 'HAB_TYPE'), axis=1)
+
+    # 3.5.2. Classify habitats based on EUNIS Codes present within data
+    with trace('habitat_classifier', rows_in=len(Merged_Attributes)) as record:
+        Aggregated_Attributes['Habitat_Classification'] = Aggregated_Attributes.apply(lambda df: habitat_classifier(df),
+                                                                                      axis=1)
+        record.rows_out = len(Aggregated_Attributes)
+    Agg_Merge = Aggregated_Attributes[['GUI', 'Habitat_Classification']]
+
+    # 3.5.3. Completing confidence checks on new map data
+    New_Decision_Attributes = pd.merge(Agg_Merge, ThreeStep_GUI_Confidence, on='GUI', how='left')
+    New_Decision_Attributes['Confidence_check'] = New_Decision_Attributes.apply(lambda df: confidence_check(df), axis=1)
+    New_Decision_Attributes.columns = ['GUI', 'Habitat_Classification', '3_Step_Confidence_Score', 'Overall score',
+                                       'Confidence_check']
+
+    # 3.5.4. Combining data sets - source and new decision DF
+    Merge_MCZ = Merged_Attributes[['GUI', 'MCZ_Source']]
+    New_Decision_Attributes = pd.merge(New_Decision_Attributes, Merge_MCZ, on='GUI', how='left')
+    return New_Decision_Attributes.drop_duplicates(subset=['GUI'], inplace=False)
+
+
+def build_existing_decision_attributes(Intersection_Attributes, Intersected_Maps, ThreeStep_GUI_Confidence):
+    """
+    Function Title: build_existing_decision_attributes()
+    Section 3.6. - Classify the habitats of each existing map which is intersected by a new survey map and attach its
+    confidence scores and MCZ source
+    """
+    # 3.6.1. Pull out all combined map GUIs which have an intersecting reference map and aggregate their habitats
+    Combined_GUI = pd.DataFrame(Intersected_Maps['CombinedMap_GUI'])
+    Combined_Attributes = Intersection_Attributes.loc[
+        Intersection_Attributes['GUI'].isin(Combined_GUI['CombinedMap_GUI'])]
+    Combined_Aggregated_Attributes = pd.DataFrame(Combined_Attributes.groupby(['GUI'])['HAB_TYPE'].apply(list))
+    Combined_Aggregated_Attributes = Combined_Aggregated_Attributes.reset_index(inplace=False)
+    Combined_Aggregated_Attributes.columns = ['GUI', 'HAB_TYPE']
+    Combined_Aggregated_Attributes['HAB_TYPE'] = Combined_Aggregated_Attributes.apply(
+        lambda df: remove_my_nan(df, 'HAB_TYPE'), axis=1)
+
+    # 3.6.2. Classifying habitat data based on EUNIS Codes present
+    with trace('habitat_classifier', rows_in=len(Combined_Attributes)) as record:
+        Combined_Aggregated_Attributes['Habitat_Classification'] = \
+            Combined_Aggregated_Attributes.apply(lambda df: habitat_classifier(df), axis=1)
+        record.rows_out = len(Combined_Aggregated_Attributes)
+    Comb_Agg_Merge = Combined_Aggregated_Attributes[['GUI', 'Habitat_Classification']]
+    Combined_Decision_Attributes = pd.merge(Comb_Agg_Merge, ThreeStep_GUI_Confidence, on='GUI', how='left')
+
+    # 3.6.3. Completing confidence checks on the intersected maps
+    Combined_Decision_Attributes['Confidence_check'] = \
+        Combined_Decision_Attributes.apply(lambda df: confidence_check(df), axis=1)
+    Combined_Decision_Attributes.columns = ['GUI', 'Habitat_Classification', '3_Step_Confidence_Score',
+                                            'Overall score', 'Confidence_check']
+
+    # 3.6.4. Combining data sets - source and main decision DF
+    Combined_MCZ = Combined_Attributes[['GUI', 'MCZ_Original_survey']]
+    Combined_Decision_Attributes = pd.merge(Combined_Decision_Attributes, Combined_MCZ, on='GUI', how='left')
+    return Combined_Decision_Attributes.drop_duplicates(subset=['GUI'], inplace=False)
+
+
+def build_comparison(Control_DF, New_Decision_Attributes, Combined_Decision_Attributes):
+    """
+    Function Title: build_comparison()
+    Section 3.7.1. - Create the comparison data set of new and existing map attributes for every intersection
+    """
+    Comparison_DF = Control_DF.copy()
+    Comparison_DF.columns = ['NewGUI', 'ExistingGUI']
+
+    Comparison_DF = pd.merge(Comparison_DF, New_Decision_Attributes, left_on='NewGUI', right_on='GUI')
+    Comparison_DF.columns = ['NewGUI', 'ExistingGUI', 'GUI', 'New_Habitat_Classification',
+                             'New_3_Step_Confidence_Score', 'New_MESH_Score', 'New_Confidence_check', 'New_MCZ_Source']
+
+    Comparison_DF = pd.merge(Comparison_DF, Combined_Decision_Attributes, left_on='ExistingGUI', right_on='GUI')
+    Comparison_DF.columns = [
+        'NewGUI', 'ExistingGUI', 'GUI_x', 'New_Habitat_Classification', 'New_3_Step_Confidence_Score',
+        'New_MESH_Score', 'New_Confidence_check', 'New_MCZ_Source', 'GUI_y', 'Existing_Habitat_Classification',
+        'Existing_3_Step_Confidence_Score', 'Existing_MESH_Score', 'Existing_Confidence_check',
+        'Existing_MCZ_Original_survey']
+
+    Comparison_DF = Comparison_DF[[
+        'NewGUI', 'ExistingGUI', 'New_Habitat_Classification', 'Existing_Habitat_Classification',
+        'New_3_Step_Confidence_Score', 'Existing_3_Step_Confidence_Score', 'New_MESH_Score', 'Existing_MESH_Score',
+        'New_MCZ_Source', 'Existing_MCZ_Original_survey']].copy()
+
+    # Replace 'NaN' values with 0 to allow for decision tree analysis to complete accurately
+    for column in ['New_3_Step_Confidence_Score', 'Existing_3_Step_Confidence_Score', 'New_MESH_Score',
+                   'Existing_MESH_Score']:
+        Comparison_DF[column] = Comparison_DF[column].fillna(0)
+    return Comparison_DF
+
+
+def overlap_areas(Intersection_Attributes, area_field='Overlap_Area_km2'):
+    """
+    Function Title: overlap_areas()
+    Define function to total the area (km2) of the intersection between every new and existing map, from the areas
+    exported alongside the intersection attributes (see export_attributes())
+    """
+    Overlap_Areas = Intersection_Attributes.groupby(['GUI_1', 'GUI'], as_index=False)[area_field].sum()
+    Overlap_Areas.columns = ['NewGUI', 'ExistingGUI', 'Overlap_Area_km2']
+    return Overlap_Areas
+
+
+def attach_overlap_areas(Comparison_DF, Intersection_Attributes, area_field='Overlap_Area_km2'):
+    """
+    Function Title: attach_overlap_areas()
+    Define function to add the area (km2) of the intersection between the new and existing map to every row of
+    Comparison_DF, so the intersections which require expert judgement can be reviewed largest first. Comparison_DF is
+    returned unchanged if no areas were exported with the intersection attributes.
+    """
+    if area_field not in Intersection_Attributes.columns:
+        return Comparison_DF
+    Overlap_Areas = overlap_areas(Intersection_Attributes, area_field)
+    return pd.merge(Comparison_DF.drop(columns=['Overlap_Area_km2'], errors='ignore'), Overlap_Areas,
+                    on=['NewGUI', 'ExistingGUI'], how='left').set_axis(Comparison_DF.index)
+
+
+def run_decision_tree(Comparison_DF, store=None):
+    """
+    Function Title: run_decision_tree()
+    Sections 3.7.3. - 3.8. - Run the decision tree on every intersection, returning the comparison results, the
+    intersections which require expert judgement and the join results. If a DecisionStore (see Decision_Store.py) is
+    given, intersections recorded during earlier updates reuse their recorded result or expert judgement, and only new
+    or changed intersections are run through the decision tree.
+    """
+    Comparison_DF = Comparison_DF.copy()
+    with trace('decision_tree', rows_in=len(Comparison_DF)) as record:
+        if store is None:
+            Comparison_DF['Comparison_Result'] = Comparison_DF.apply(lambda df: decision_tree(df), axis=1)
+        else:
+            Comparison_DF = store.decide(Comparison_DF, lambda new: new.apply(lambda df: decision_tree(df), axis=1))
+        record.rows_out = len(Comparison_DF)
+    return split_decisions(Comparison_DF)
+
+
+def split_decisions(Comparison_DF):
+    """
+    Function Title: split_decisions()
+    Define function to pull out the intersections requiring expert judgement and the join results from the decision
+    tree results
+    """
+    Requires_Judgement = Comparison_DF.loc[Comparison_DF['Comparison_Result'].isin(['Requires expert judgement'])]
+    if 'Overlap_Area_km2' in Requires_Judgement.columns:
+        # Review the largest overlaps first (see attach_overlap_areas())
+        Requires_Judgement = Requires_Judgement.sort_values('Overlap_Area_km2', ascending=False, kind='stable')
+    Join_Results = Comparison_DF[['NewGUI', 'ExistingGUI', 'Comparison_Result']]
+    return Comparison_DF, Requires_Judgement, Join_Results
+
+
+########################################################################################################################
+
+#                                              ARCPY HELPER FUNCTIONS                                                  #
+
+########################################################################################################################
+
+def _create_gdb(path):
+    """
+    Function Title: _create_gdb()
+    Define function to create the file geodatabase which will contain an output feature class
+    """
+    import arcpy
+    gdb = os.path.dirname(path)
+    if not arcpy.Exists(gdb):
+        arcpy.CreateFileGDB_management(os.path.dirname(gdb), os.path.basename(gdb))
+    return gdb
+
+
+def export_attributes(in_table, out_csv, area_field=None, workers=None):
+    """
+    Function Title: export_attributes()
+    Define function to export the attribute table of a feature class to a .csv file (replaces TableToExcel and the
+    manual conversion to .csv in Section 3.2.6.). If area_field is given, the area (km2) of every feature is added
+    within it (see Measures.py), read within the same pass over the feature class. Returns the exported attributes.
+    """
+    import arcpy
+    fields = [field.name for field in arcpy.ListFields(in_table) if field.type not in ['Geometry', 'Blob', 'Raster']]
+    geometry = ['SHAPE@WKB'] if area_field else []
+    with arcpy.da.SearchCursor(in_table, fields + geometry) as cursor:
+        Attributes = pd.DataFrame.from_records(list(cursor), columns=fields + geometry)
+    if area_field:
+        from .Measures import measure_layer
+        # Geometries are returned as a bytearray, or None if the feature has a null geometry
+        wkbs = [bytes(x) if x is not None else None for x in Attributes.pop('SHAPE@WKB')]
+        Attributes[area_field] = measure_layer(pd.DataFrame({'WKB': wkbs}), workers)[0]
+    Attributes.to_csv(out_csv, sep=',', index=False)
+    return Attributes
+
+
+########################################################################################################################
+
+#                                                  PIPELINE STAGES                                                     #
+
+########################################################################################################################
+
+class _XYPrecision(object):
+    """Set the XY resolution and tolerance used by the ArcPy overlay tools within a with block, if given (e.g.
+    '0.0000001 Degrees'). Outputs are snapped to the resolution grid, and vertices within the tolerance of each other
+    are clustered together. arcpy.env is shared by every stage run within the process, so the previous values are
+    restored on leaving the block."""
+
+    def __init__(self, params):
+        self.params = params
+        self._previous = None
+
+    def __enter__(self):
+        import arcpy
+        self._previous = (arcpy.env.XYResolution, arcpy.env.XYTolerance)
+        if self.params.get('xy_resolution'):
+            arcpy.env.XYResolution = self.params['xy_resolution']
+        if self.params.get('xy_tolerance'):
+            arcpy.env.XYTolerance = self.params['xy_tolerance']
+        return self
+
+    def __exit__(self, *args):
+        import arcpy
+        arcpy.env.XYResolution, arcpy.env.XYTolerance = self._previous
+
+
+# Section 1.1. - Readying UKSeaMap
+def stage_ready_uksm(inputs, outputs, params):
+    """Copy UKSeaMap, add the Translated Habitat DEF fields (1.1.2.) and complete the EUNIS level 3 field (1.1.3. -
+    1.1.4.)"""
+    import arcpy
+    _create_gdb(outputs['uksm'])
+    arcpy.CopyFeatures_management(inputs['uksm'], outputs['uksm'])
+
+    field_name_list = [field.name for field in arcpy.ListFields(outputs['uksm'])]
+    for fieldToAdd in add_fields:
+        if fieldToAdd[0] not in field_name_list:
+            arcpy.AddField_management(outputs['uksm'], *fieldToAdd)
+    if params['l3_field'] not in field_name_list:
+        arcpy.AddField_management(outputs['uksm'], params['l3_field'], "TEXT", "", "", params['l3_field_length'])
+
+    with arcpy.da.UpdateCursor(outputs['uksm'], ['HAB_TYPE', params['l3_field']]) as cursor:
+        for row in cursor:
+            cursor.updateRow([row[0], eunisToAllLevel3(row[0] or '')])
+
+
+# Generalised UKSeaMap used to select the UKSeaMap polygons which intersect the combined map (see Generalised_Layer.py)
+def stage_generalise_uksm(inputs, outputs, params):
+    from .Generalised_Layer import GeneralisedLayer
+    from .Geometry_QA import read_layer_geometries
+    with trace('generalise_uksm', inputs=[inputs['uksm']], count=True) as record:
+        generalised = GeneralisedLayer.build(read_layer_geometries(inputs['uksm'], []), params['tolerances'])
+        generalised.save(outputs['generalised'])
+        record.rows_out = len(generalised)
+
+
+def _split_by_generalised(uksm, generalised_path, selecting, out_intersecting, out_notintersecting):
+    """Copy the UKSeaMap polygons which intersect / do not intersect selecting, testing the generalised UKSeaMap
+    first and full detail geometry only where it cannot settle the test"""
+    import arcpy
+    import shapely
+    from .Generalised_Layer import GeneralisedLayer
+    from .Geometry_QA import read_layer_geometries
+    generalised = GeneralisedLayer.load(generalised_path)
+    Selecting = read_layer_geometries(selecting, [])
+    with trace('SelectLayerByLocation', rows_in=len(generalised)) as record:
+        intersecting = generalised.select(shapely.from_wkb(Selecting['WKB'].values))
+        record.rows_out = int(intersecting.sum())
+    print('Intersection tests settled at each level of detail: %s' % generalised.statistics)
+
+    oid_field = arcpy.Describe(uksm).OIDFieldName
+    oids = ', '.join(str(x) for x in generalised.oids[intersecting]) or '-1'
+    for out_path, where in [(out_intersecting, '%s IN (%s)'), (out_notintersecting, '%s NOT IN (%s)')]:
+        arcpy.MakeFeatureLayer_management(uksm, 'uksm_layer', where % (oid_field, oids))
+        arcpy.CopyFeatures_management('uksm_layer', out_path)
+        arcpy.Delete_management('uksm_layer')
+
+
+# Section 1.2. - Inserting UKSeaMap into the combined map
+def stage_insert_uksm(inputs, outputs, params):
+    """Replace the UKSeaMap data within the combined map with the readied UKSeaMap (1.2.1. - 1.2.4.)"""
+    import arcpy
+    gdb = _create_gdb(outputs['combined_map'])
+    with _XYPrecision(params):
+
+        def work(name):
+            return os.path.join(gdb, name)
+
+        # 1.2.1. Export all data within the combined map which is not UKSeaMap as Combined_extract
+        arcpy.Select_analysis(inputs['combined_map'], work('Combined_extract'),
+                              "GUI IS NULL OR GUI <> '%s'" % params['uksm_gui'])
+
+        # 1.2.2. Split UKSeaMap into the polygons which intersect with Combined_extract and those which do not, and
+        #        erase the intersecting polygons by Combined_extract
+        if 'uksm_generalised' in inputs:
+            _split_by_generalised(inputs['uksm'], inputs['uksm_generalised'], work('Combined_extract'),
+                                  work('UKSM_intersecting'), work('UKSM_notintersecting'))
+        else:
+            arcpy.MakeFeatureLayer_management(inputs['uksm'], 'uksm_layer')
+            arcpy.SelectLayerByLocation_management('uksm_layer', 'INTERSECT', work('Combined_extract'))
+            arcpy.CopyFeatures_management('uksm_layer', work('UKSM_intersecting'))
+            arcpy.SelectLayerByLocation_management('uksm_layer', 'INTERSECT', work('Combined_extract'), '',
+                                                   'NEW_SELECTION', 'INVERT')
+            arcpy.CopyFeatures_management('uksm_layer', work('UKSM_notintersecting'))
+            arcpy.Delete_management('uksm_layer')
+        with trace('Erase', inputs=[work('UKSM_intersecting'), work('Combined_extract')], outputs=[work('UKSM_erased')],
+                   count=True, geometry=True):
+            arcpy.Erase_analysis(work('UKSM_intersecting'), work('Combined_extract'), work('UKSM_erased'), "#")
+
+        # 1.2.3. Merge the erased and non-intersecting UKSeaMap polygons and erase any landward data
+        with trace('Merge', inputs=[work('UKSM_erased'), work('UKSM_notintersecting')],
+                   outputs=[work('UKSM_erased_intersecting_merge')], count=True):
+            arcpy.Merge_management([work('UKSM_erased'), work('UKSM_notintersecting')],
+                                   work('UKSM_erased_intersecting_merge'))
+        arcpy.Project_management(inputs['mhw_land'], work('mhw_land_wgs84'), arcpy.SpatialReference(4326),
+                                 params['land_transformation'])
+        with trace('Erase', inputs=[work('UKSM_erased_intersecting_merge'), work('mhw_land_wgs84')],
+                   outputs=[work('UKSM_merge_land_erase')], count=True, geometry=True):
+            arcpy.Erase_analysis(work('UKSM_erased_intersecting_merge'), work('mhw_land_wgs84'),
+                                 work('UKSM_merge_land_erase'), "#")
+
+        # 1.2.4. Append UKSeaMap into a copy of Combined_extract
+        arcpy.CopyFeatures_management(work('Combined_extract'), outputs['combined_map'])
+        with trace('Append', inputs=[work('UKSM_merge_land_erase')], outputs=[outputs['combined_map']], count=True):
+            arcpy.Append_management(work('UKSM_merge_land_erase'), outputs['combined_map'], "NO_TEST")
+
+
+# Section 2.1. - Removing NE_Ev_2 and NE_Evid data
+def stage_remove_ne_evidence(inputs, outputs, params):
+    """Split the combined map into the NE Evidence Base, the map without the NE Evidence Base (used in Section 3.9.) and
+    the map without the NE Evidence Base or UKSeaMap (used to identify and intersect new survey maps)"""
+    import arcpy
+    _create_gdb(outputs['no_evidbase'])
+    ne_sources = ', '.join("'%s'" % x for x in params['ne_sources'])
+    excluded = ', '.join("'%s'" % x for x in params['ne_sources'] + [params['uksm_source']])
+
+    # NULL values within the Source field are kept, as with the 'SWITCH_SELECTION' method in Section 2.1.1.
+    arcpy.Select_analysis(inputs['combined_map'], outputs['no_evidbase'],
+                          "Source IS NULL OR Source NOT IN (%s)" % excluded)
+    arcpy.Select_analysis(inputs['combined_map'], outputs['no_ne'], "Source IS NULL OR Source NOT IN (%s)" % ne_sources)
+    arcpy.Select_analysis(inputs['combined_map'], outputs['ne_evidence'], "Source IN (%s)" % ne_sources)
+
+
+# Section 3.1. - Identifying new maps to add
+def stage_identify_new_maps(inputs, outputs, params):
+    """List the EUNIS reference maps which are not yet within the combined map (3.1.2. - 3.1.7.)"""
+    import arcpy
+    if params['new_maps']:
+        # Use the reviewed list of new maps where one has been given
+        new_maps = sorted(params['new_maps'])
+    else:
+        with trace('listUniqueValues', inputs=[inputs['combined_map']], count=True) as record:
+            combined_set = set(listUniqueValues(inputs['combined_map'], "GUI"))
+            record.rows_out = len(combined_set)
+        arcpy.env.workspace = inputs['reference_gdb']
+        reference_set = set(arcpy.ListFeatureClasses(feature_dataset=params['feature_dataset']))
+        new_maps = sorted(reference_set - combined_set - set(params['exclude_maps']))
+
+    # 3.1.7. Review new maps which are yet to be included within the combined map
+    print(new_maps)
+    with open(outputs['new_maps'], 'w') as f:
+        json.dump(new_maps, f, indent=2)
+
+
+# Section 3.2.2. - 3.2.4. - Merging and dissolving the new maps
+def stage_merge_new_maps(inputs, outputs, params):
+    """Merge all new maps from the EUNIS reference geodatabase and dissolve them by GUI"""
+    import arcpy
+    _create_gdb(outputs['merged'])
+    with _XYPrecision(params):
+        with open(inputs['new_maps']) as f:
+            new_maps = json.load(f)
+        new_map_paths = [os.path.join(inputs['reference_gdb'], params['feature_dataset'], x) for x in new_maps]
+        if params.get('copy_workers'):
+            # Copy the new maps out of the (network) reference geodatabase concurrently, so Merge reads local copies
+            from .Reference_Reader import copy_feature_classes, format_statistics
+            with trace('CopyFeatures', inputs=new_map_paths, rows_in=len(new_map_paths)) as record:
+                copied, statistics = copy_feature_classes(new_map_paths, os.path.dirname(outputs['merged']),
+                                                          workers=params['copy_workers'], prefix='Reference_')
+                record.rows_out = statistics['features']
+            print(format_statistics(statistics))
+            new_map_paths = [copied[x] for x in new_maps]
+        with trace('Merge', inputs=new_map_paths, outputs=[outputs['merged']], count=True):
+            arcpy.Merge_management(new_map_paths, outputs['merged'])
+        with trace('Dissolve', inputs=[outputs['merged']], outputs=[outputs['dissolved']], count=True,
+                   geometry=True):
+            arcpy.Dissolve_management(outputs['merged'], outputs['dissolved'], "GUI", "#", "MULTI_PART",
+                                      "DISSOLVE_LINES")
+        export_attributes(outputs['merged'], outputs['merged_attributes'])
+
+
+# Section 3.2.5. - 3.2.6. - Intersecting the new maps with the combined map
+def stage_intersect_new_maps(inputs, outputs, params):
+    """Intersect the dissolved new maps with the combined map and export the attributes of the intersection"""
+    import arcpy
+    _create_gdb(outputs['intersect'])
+    with _XYPrecision(params):
+        # The combined map is the first input so that its GUI is held within 'GUI' and the new map GUI within 'GUI_1',
+        # as expected by Sections 3.3. - 3.6.
+        with trace('Intersect', inputs=[inputs['combined_map'], inputs['dissolved']], outputs=[outputs['intersect']],
+                   count=True, geometry=True):
+            arcpy.Intersect_analysis([inputs['combined_map'], inputs['dissolved']], outputs['intersect'], "ALL", "",
+                                     "INPUT")
+        # The area of every intersection is exported alongside its attributes, to rank the decisions in Section 3.7.4.
+        Attributes = export_attributes(outputs['intersect'], outputs['intersection_attributes'],
+                                       area_field='Overlap_Area_km2', workers=params.get('measure_workers'))
+        publish('Intersection_Attributes', Attributes, index=False)
+
+
+# Section 3.3. - Creating a control data frame
+def stage_control_frames(inputs, outputs, params):
+    Intersected_Maps, Control_DF = build_control_frames(pd.read_csv(inputs['intersection_attributes'],
+                                                                    low_memory=False))
+    Intersected_Maps.to_pickle(outputs['intersected_maps'])
+    Control_DF.to_pickle(outputs['control_df'])
+
+
+# Section 3.4.1. - Importing confidence metadata
+def stage_confidence_metadata(inputs, outputs, params):
+    ThreeStep_GUI_Confidence, GUI_Tracking = load_confidence_metadata(inputs['confidence'], inputs['gui_tracking'])
+    ThreeStep_GUI_Confidence.to_pickle(outputs['three_step'])
+    GUI_Tracking.to_pickle(outputs['gui_tracking'])
+
+
+# Sections 3.4.2. - 3.4.5. - Metadata checks
+def stage_metadata_checks(inputs, outputs, params):
+    checks = run_metadata_checks(pd.read_pickle(inputs['control_df']), pd.read_pickle(inputs['three_step']),
+                                 pd.read_pickle(inputs['gui_tracking']))
+    for name, df in checks.items():
+        # Every check is written out so that the stage can be checkpointed - an empty file means no erroneous data
+        if df.empty is False:
+            print(df)
+        else:
+            print('%s: No erroneous data present' % name)
+        df.to_csv(outputs[name], sep=',')
+        publish(name, df)
+
+
+# Section 3.5. - Creating metadata for all new survey maps
+def stage_new_map_attributes(inputs, outputs, params):
+    New_Decision_Attributes = build_new_decision_attributes(
+        pd.read_csv(inputs['merged_attributes'], low_memory=False), pd.read_pickle(inputs['three_step']))
+    New_Decision_Attributes.to_pickle(outputs['new_decision_attributes'])
+
+
+# Section 3.6. - Creating metadata for the intersected existing maps
+def stage_existing_map_attributes(inputs, outputs, params):
+    Combined_Decision_Attributes = build_existing_decision_attributes(
+        pd.read_csv(inputs['intersection_attributes'], low_memory=False), pd.read_pickle(inputs['intersected_maps']),
+        pd.read_pickle(inputs['three_step']))
+    Combined_Decision_Attributes.to_pickle(outputs['existing_decision_attributes'])
+
+
+def _open_store(params):
+    """Open the decision store (see Decision_Store.py) if one is used by the update"""
+    if params.get('decision_store') is None:
+        return None
+    from .Decision_Store import DecisionStore
+    return DecisionStore(params['decision_store'])
+
+
+# Sections 3.7. - 3.8. - Decision tree analysis
+def stage_decision_tree(inputs, outputs, params):
+    Comparison_DF = build_comparison(pd.read_pickle(inputs['control_df']),
+                                     pd.read_pickle(inputs['new_decision_attributes']),
+                                     pd.read_pickle(inputs['existing_decision_attributes']))
+    Comparison_DF = attach_overlap_areas(Comparison_DF, pd.read_csv(inputs['intersection_attributes'],
+                                                                    low_memory=False))
+    store = _open_store(params)
+    try:
+        Comparison_DF, Requires_Judgement, Join_Results = run_decision_tree(Comparison_DF, store)
+    finally:
+        if store is not None:
+            store.close()
+    Comparison_DF.to_csv(outputs['comparison_output'], sep=',')
+    Requires_Judgement.to_csv(outputs['requires_judgement'], sep=',')
+    Join_Results.to_csv(outputs['join_results'], sep=',')
+    publish('NewCombinedMap_ComparisonOutput', Comparison_DF)
+    publish('Requires_Judgement', Requires_Judgement)
+    publish('Join_Results', Join_Results)
+
+
+# Sections 3.3. - 3.8. - Metadata checks and decision tree analysis as one Polars query plan (see Lazy_Decisions.py)
+def stage_lazy_decisions(inputs, outputs, params):
+    from .Lazy_Decisions import run_lazy_decisions
+    with trace('lazy_decisions', inputs=[inputs['intersection_attributes'], inputs['merged_attributes']],
+               count=True) as record:
+        results = run_lazy_decisions(inputs['intersection_attributes'], inputs['merged_attributes'],
+                                     inputs['confidence'], inputs['gui_tracking'])
+        record.rows_out = len(results['Join_Results'])
+    for name in ['JNCC_Missing_Confidence_output', 'GUI_Zero_Confidence', 'NotIn_UKMetaConf2012',
+                 'Zero_MESH_Confidence']:
+        if results[name].empty is False:
+            print(results[name])
+        else:
+            print('%s: No erroneous data present' % name)
+        results[name].to_csv(outputs[name], sep=',')
+        publish(name, results[name])
+    Comparison_DF = attach_overlap_areas(results['Comparison_DF'], pd.read_csv(inputs['intersection_attributes'],
+                                                                               low_memory=False))
+    store = _open_store(params)
+    if store is not None:
+        # The decision tree is evaluated within the query plan - reuse the recorded result of unchanged intersections
+        tree_results = Comparison_DF['Comparison_Result']
+        with store:
+            Comparison_DF = store.decide(Comparison_DF.drop(columns=['Comparison_Result']),
+                                         lambda new: tree_results.loc[new.index])
+    results['Comparison_DF'], results['Requires_Judgement'], results['Join_Results'] = split_decisions(Comparison_DF)
+    results['Comparison_DF'].to_csv(outputs['comparison_output'], sep=',')
+    results['Requires_Judgement'].to_csv(outputs['requires_judgement'], sep=',')
+    results['Join_Results'].to_csv(outputs['join_results'], sep=',')
+    publish('NewCombinedMap_ComparisonOutput', results['Comparison_DF'])
+    publish('Requires_Judgement', results['Requires_Judgement'])
+    publish('Join_Results', results['Join_Results'])
+
+
+# Section 3.8. - Joining decision results to geospatial data
+def stage_erase_losing_areas(inputs, outputs, params):
+    """Attach the comparison result to each intersection and erase the areas where the new map did not win from the
+    new survey maps. Intersections which require expert judgement are treated as losses for the new map (the existing
+    map is kept) until a judgement has been made.
+
+    The merged (rather than dissolved) new maps are erased so that their habitat attributes are kept when they are
+    added into the combined map in Section 3.9."""
+    import arcpy
+    gdb = _create_gdb(outputs['new_maps_win'])
+    with _XYPrecision(params):
+        Join_Results = pd.read_csv(inputs['join_results'])
+        results = dict(((x.NewGUI, x.ExistingGUI), x.Comparison_Result) for x in Join_Results.itertuples())
+
+        intersect = os.path.join(gdb, 'Survey_comb_intersection')
+        arcpy.CopyFeatures_management(inputs['intersect'], intersect)
+        arcpy.AddField_management(intersect, 'Comparison_Result', "TEXT", "", "", 50)
+        with arcpy.da.UpdateCursor(intersect, ['GUI_1', 'GUI', 'Comparison_Result']) as cursor:
+            for row in cursor:
+                cursor.updateRow([row[0], row[1], results.get((row[0], row[1]))])
+
+        losing = os.path.join(gdb, 'Survey_comb_intersection_newGUI_lose')
+        arcpy.Select_analysis(intersect, losing, "Comparison_Result IS NULL OR Comparison_Result <> GUI_1")
+        with trace('Erase', inputs=[inputs['merged'], losing], outputs=[outputs['new_maps_win']], count=True,
+                   geometry=True):
+            arcpy.Erase_analysis(inputs['merged'], losing, outputs['new_maps_win'], "#")
+
+
+# Section 3.9. - Readying the combined map for overwriting with the new survey data
+def stage_overwrite_combined(inputs, outputs, params):
+    """Erase the areas of the combined map (without the NE Evidence Base) covered by the winning new survey data, then
+    append the winning new survey data"""
+    import arcpy
+    _create_gdb(outputs['combined_map'])
+    with _XYPrecision(params):
+        with trace('Erase', inputs=[inputs['combined_map'], inputs['new_maps_win']], outputs=[outputs['combined_map']],
+                   count=True, geometry=True):
+            arcpy.Erase_analysis(inputs['combined_map'], inputs['new_maps_win'], outputs['combined_map'], "#")
+        with trace('Append', inputs=[inputs['new_maps_win']], outputs=[outputs['combined_map']], count=True):
+            arcpy.Append_management(inputs['new_maps_win'], outputs['combined_map'], "NO_TEST")
+
+
+# Section 4. - Reinserting the NE Evidence Base into the combined map
+def stage_reinsert_ne_evidence(inputs, outputs, params):
+    """Erase the areas of the updated combined map covered by the NE Evidence Base, then append the NE Evidence Base on
+    top of the survey data"""
+    import arcpy
+    _create_gdb(outputs['combined_map'])
+    with _XYPrecision(params):
+        with trace('Erase', inputs=[inputs['combined_map'], inputs['ne_evidence']], outputs=[outputs['combined_map']],
+                   count=True, geometry=True):
+            arcpy.Erase_analysis(inputs['combined_map'], inputs['ne_evidence'], outputs['combined_map'], "#")
+        with trace('Append', inputs=[inputs['ne_evidence']], outputs=[outputs['combined_map']], count=True):
+            arcpy.Append_management(inputs['ne_evidence'], outputs['combined_map'], "NO_TEST")
+
+        # The ArcGIS overlay tools carry AreaKm2 over from their inputs, so it is recalculated for every feature
+        from .Measures import calculate_area_field
+        with trace('calculate_area_field', inputs=[outputs['combined_map']], count=True) as record:
+            record.rows_out = calculate_area_field(outputs['combined_map'], params['area_field'],
+                                                   params['measure_workers'])
+
+
+# Export of the updated combined map to a Hilbert-sorted GeoParquet file (see GeoParquet.py)
+def stage_export_geoparquet(inputs, outputs, params):
+    from .GeoParquet import export_feature_class
+    with trace('export_geoparquet', inputs=[inputs['combined_map']], count=True) as record:
+        record.rows_out = export_feature_class(inputs['combined_map'], outputs['geoparquet'],
+                                               row_group_size=params['row_group_size'])
+
+
+# Comparison of the updated combined map with the previous version (see Change_Detection.py)
+def stage_change_detection(inputs, outputs, params):
+    from .Change_Detection import L3_FIELD, detect_changes, write_changes
+    from .GeoParquet import read_geoparquet
+    Previous = read_geoparquet(inputs['previous'], columns=['GUI', L3_FIELD])
+    Updated = read_geoparquet(inputs['combined_map'], columns=['GUI', L3_FIELD])
+    with trace('change_detection', rows_in=len(Previous) + len(Updated)) as record:
+        result = detect_changes(Previous, Updated)
+        record.rows_out = len(result['changes'])
+    print(result['statistics'])
+    write_changes(result, outputs['change_summary'], outputs['changes'])
+
+
+########################################################################################################################
+
+#                                                 PIPELINE DEFINITION                                                  #
+
+########################################################################################################################
+
+#   Code run by each stage beyond its own body (see Stage.code within Pipeline.py), so that a stage re-runs when the
+#   rules it applies change (e.g. the decision tree, DECISION_TREE_VERSION or the EUNIS code list). Only the code each
+#   stage uses is listed, as every stage downstream of a stage which re-runs also re-runs.
+_GEOMETRY_CODE = ['.Geometry_Buffers', '.Geometry_QA']
+_ARCPY_CODE = [_create_gdb, _XYPrecision]
+_LEVEL3_SETTINGS = ['useConcatenateBool', 'concatenatorDefault', 'removeL2Bool', 'keepList', 'sortListBool']
+_LEVEL3_CODE = [eunisToAllLevel3, collectConcatenator, '.EUNIS_Registry', EUNIS_CODES_PATH,
+                dict((x, getattr(Combined_Map_Functions, x)) for x in _LEVEL3_SETTINGS)]
+_CLASSIFIER_CODE = [read_table, remove_my_nan, habitat_classifier, confidence_check, '.EUNIS_Registry',
+                    EUNIS_CODES_PATH]
+_DECISION_CODE = [overlap_areas, attach_overlap_areas, split_decisions, _open_store, '.Decision_Store',
+                  DECISION_TREE_VERSION]
+STAGE_CODE = {
+    'ready_uksm': _ARCPY_CODE + _LEVEL3_CODE + [add_fields],
+    'generalise_uksm': ['.Generalised_Layer'] + _GEOMETRY_CODE,
+    'insert_uksm': _ARCPY_CODE + [_split_by_generalised, '.Generalised_Layer'] + _GEOMETRY_CODE,
+    'remove_ne_evidence': _ARCPY_CODE,
+    'identify_new_maps': [listUniqueValues],
+    'merge_new_maps': _ARCPY_CODE + [export_attributes, '.Reference_Reader'] + _GEOMETRY_CODE,
+    'intersect_new_maps': _ARCPY_CODE + [export_attributes, '.Measures', '.Overlay'] + _GEOMETRY_CODE,
+    'confidence_metadata': [load_confidence_metadata, read_table, confidence_check],
+    'control_frames': [build_control_frames, remove_my_nan, list_set],
+    'metadata_checks': [run_metadata_checks],
+    'new_map_attributes': [build_new_decision_attributes] + _CLASSIFIER_CODE,
+    'existing_map_attributes': [build_existing_decision_attributes] + _CLASSIFIER_CODE,
+    'decision_tree': [build_comparison, run_decision_tree, decision_tree] + _DECISION_CODE,
+    'lazy_decisions': ['.Lazy_Decisions', decision_tree] + _CLASSIFIER_CODE + _DECISION_CODE,
+    'erase_losing_areas': _ARCPY_CODE,
+    'overwrite_combined': _ARCPY_CODE,
+    'reinsert_ne_evidence': _ARCPY_CODE + ['.Measures', '.Overlay'] + _GEOMETRY_CODE,
+    'export_geoparquet': ['.GeoParquet'] + _GEOMETRY_CODE,
+    'change_detection': ['.Change_Detection', '.GeoParquet', '.Measures', '.Overlay', '.EUNIS_Registry',
+                         EUNIS_CODES_PATH] + _GEOMETRY_CODE}
+
+
+def build_pipeline(config):
+    """
+    Function Title: build_pipeline()
+    Define function to declare all stages of the combined map update. config is a dictionary holding:
+        checkpoint_dir       - folder to store the outputs of each stage within (use a local drive, e.g. D:)
+        combined_map         - the current combined map feature class
+        uksm                 - the new UKSeaMap feature class
+        mhw_land             - the landward side of the UK Mean High Water polygon
+        reference_gdb        - the EUNIS reference geodatabase (1_EUNIS_HabitatMaps.gdb)
+        confidence_metadata  - UK_METADATA_&_CONFIDENCE_2012_HOCI_additions.xls
+        gui_tracking         - GUI_tracking.xlsx
+    and optionally new_maps (the reviewed list of new maps from Section 3.1.), exclude_maps, max_workers, trace (a JSON
+    file to write stage measurements to - see Instrumentation.py), profile (stage names mapped to 'cprofile' or
+    'py-spy'), lazy (true to run Sections 3.3. - 3.8. as a single Polars query plan - see Lazy_Decisions.py),
+    decision_store (an SQLite file of the decisions and expert judgements made during earlier updates - see
+    Decision_Store.py; created if it does not exist), geoparquet (true to also export the updated combined map to
+    GeoParquet - see GeoParquet.py), previous_version (a GeoParquet export of the previous combined map to compare
+    the updated combined map with - see Change_Detection.py; requires geoparquet), generalise (true to select the
+    UKSeaMap polygons intersecting the combined map in Section 1.2.2. using a generalised UKSeaMap - see
+    Generalised_Layer.py), output_folder (a folder, e.g. on a network drive, to write the metadata check and decision
+    tree outputs to in the background - see Output_Writer.py), output_formats (e.g. ["parquet", "csv"]; Parquet only
+    by default) and any of the parameters within DEFAULT_PARAMETERS.
+    """
+    params = dict(DEFAULT_PARAMETERS)
+    params.update(dict((k, v) for k, v in config.items() if k in DEFAULT_PARAMETERS))
+    tracer = None
+    if config.get('trace'):
+        tracer = Tracer(config['trace'], profile=config.get('profile'))
+    writer = None
+    if config.get('output_folder'):
+        writer = OutputWriter(config['output_folder'], formats=config.get('output_formats', ['parquet']))
+    pipeline = Pipeline(config['checkpoint_dir'], max_workers=config.get('max_workers', 4), tracer=tracer,
+                        writer=writer)
+
+    def gdb(name):
+        return os.path.join('stage.gdb', name)
+
+    # XY resolution / tolerance of the overlay stages (see _XYPrecision)
+    precision = {'xy_resolution': params['xy_resolution'], 'xy_tolerance': params['xy_tolerance']}
+
+    # Section 1. - Updating the combined map with UKSeaMap
+    pipeline.add(Stage('ready_uksm', stage_ready_uksm, lock='arcpy',
+                       inputs={'uksm': config['uksm']},
+                       outputs={'uksm': gdb('UKSM_ready')},
+                       params={'l3_field': params['l3_field'], 'l3_field_length': params['l3_field_length']}))
+    insert_inputs = {'combined_map': config['combined_map'], 'uksm': StageOutput('ready_uksm', 'uksm'),
+                     'mhw_land': config['mhw_land']}
+    if config.get('generalise'):
+        pipeline.add(Stage('generalise_uksm', stage_generalise_uksm, lock='arcpy',
+                           inputs={'uksm': StageOutput('ready_uksm', 'uksm')},
+                           outputs={'generalised': 'UKSM_generalised.pkl'},
+                           params={'tolerances': params['generalise_tolerances']}))
+        insert_inputs['uksm_generalised'] = StageOutput('generalise_uksm', 'generalised')
+    pipeline.add(Stage('insert_uksm', stage_insert_uksm, lock='arcpy',
+                       inputs=insert_inputs,
+                       outputs={'combined_map': gdb('Combined_insert')},
+                       params=dict(precision, uksm_gui=params['uksm_gui'],
+                                   land_transformation=params['land_transformation'])))
+
+    # Section 2. - Removing the NE Evidence Base from the combined map
+    pipeline.add(Stage('remove_ne_evidence', stage_remove_ne_evidence, lock='arcpy',
+                       inputs={'combined_map': StageOutput('insert_uksm', 'combined_map')},
+                       outputs={'no_evidbase': gdb('Combined_map_no_evidbase'),
+                                'no_ne': gdb('Combined_map_no_NEevidencebase'),
+                                'ne_evidence': gdb('NE_evidence_base')},
+                       params={'ne_sources': params['ne_sources'], 'uksm_source': params['uksm_source']}))
+
+    # Section 3.1. - 3.2. - Identifying, merging and intersecting the new maps
+    pipeline.add(Stage('identify_new_maps', stage_identify_new_maps, lock='arcpy',
+                       inputs={'combined_map': StageOutput('remove_ne_evidence', 'no_evidbase'),
+                               'reference_gdb': config['reference_gdb']},
+                       outputs={'new_maps': 'new_maps.json'},
+                       params={'new_maps': config.get('new_maps'), 'exclude_maps': config.get('exclude_maps', []),
+                               'feature_dataset': params['feature_dataset']}))
+    pipeline.add(Stage('merge_new_maps', stage_merge_new_maps, lock='arcpy',
+                       inputs={'new_maps': StageOutput('identify_new_maps', 'new_maps'),
+                               'reference_gdb': config['reference_gdb']},
+                       outputs={'merged': gdb('new_merged_maps'), 'dissolved': gdb('new_maps_dissolved'),
+                                'merged_attributes': 'New_Merged_Maps_Attributes.csv'},
+                       params=dict(precision, feature_dataset=params['feature_dataset'],
+                                   copy_workers=params['copy_workers'])))
+    pipeline.add(Stage('intersect_new_maps', stage_intersect_new_maps, lock='arcpy',
+                       inputs={'combined_map': StageOutput('remove_ne_evidence', 'no_evidbase'),
+                               'dissolved': StageOutput('merge_new_maps', 'dissolved')},
+                       outputs={'intersect': gdb('new_maps_dissolved_combinedmap_intersect'),
+                                'intersection_attributes': 'Intersection_Attributes.csv'},
+                       params=dict(precision, measure_workers=params['measure_workers'])))
+
+    # Sections 3.3. - 3.7. - Metadata checks and decision tree analysis
+    metadata_check_outputs = {'JNCC_Missing_Confidence_output': 'JNCC_Missing_Confidence_output.csv',
+                              'GUI_Zero_Confidence': 'GUI_Zero_Confidence.csv',
+                              'NotIn_UKMetaConf2012': 'NotIn_UKMetaConf2012.csv',
+                              'Zero_MESH_Confidence': 'Zero_MESH_Confidence.csv'}
+    decision_outputs = {'comparison_output': 'NewCombinedMap_ComparisonOutput.csv',
+                        'requires_judgement': 'Requires_Judgement.csv',
+                        'join_results': 'Join_Results.csv'}
+    decision_inputs = {}
+    decision_params = {}
+    if config.get('decision_store'):
+        # The decision stage records its results within the store, so it is keyed on the expert judgements within the
+        # store rather than its content - importing new judgements re-runs the decision tree and the stages after it
+        from .Decision_Store import judgement_fingerprint
+        decision_params = {'decision_store': config['decision_store'],
+                           'judgements': judgement_fingerprint(config['decision_store'])}
+    if config.get('lazy'):
+        decision_stage = 'lazy_decisions'
+        outputs = dict(metadata_check_outputs)
+        outputs.update(decision_outputs)
+        decision_inputs.update({'intersection_attributes': StageOutput('intersect_new_maps', 'intersection_attributes'),
+                                'merged_attributes': StageOutput('merge_new_maps', 'merged_attributes'),
+                                'confidence': config['confidence_metadata'],
+                                'gui_tracking': config['gui_tracking']})
+        pipeline.add(Stage(decision_stage, stage_lazy_decisions, inputs=decision_inputs, outputs=outputs,
+                           params=decision_params))
+    else:
+        decision_stage = 'decision_tree'
+        _add_decision_stages(pipeline, config, metadata_check_outputs, decision_inputs, decision_params,
+                             decision_outputs)
+
+    # Sections 3.8. - 4. - Overwriting the combined map and reinserting the NE Evidence Base
+    pipeline.add(Stage('erase_losing_areas', stage_erase_losing_areas, lock='arcpy',
+                       inputs={'intersect': StageOutput('intersect_new_maps', 'intersect'),
+                               'join_results': StageOutput(decision_stage, 'join_results'),
+                               'merged': StageOutput('merge_new_maps', 'merged')},
+                       outputs={'new_maps_win': gdb('New_maps_win_processed')},
+                       params=precision))
+    pipeline.add(Stage('overwrite_combined', stage_overwrite_combined, lock='arcpy',
+                       inputs={'combined_map': StageOutput('remove_ne_evidence', 'no_ne'),
+                               'new_maps_win': StageOutput('erase_losing_areas', 'new_maps_win')},
+                       outputs={'combined_map': gdb('combinedmap_updated_surveydata')},
+                       params=precision))
+    pipeline.add(Stage('reinsert_ne_evidence', stage_reinsert_ne_evidence, lock='arcpy',
+                       inputs={'combined_map': StageOutput('overwrite_combined', 'combined_map'),
+                               'ne_evidence': StageOutput('remove_ne_evidence', 'ne_evidence')},
+                       outputs={'combined_map': gdb('combinedmap_updated')},
+                       params=dict(precision, area_field=params['area_field'],
+                                   measure_workers=params['measure_workers'])))
+    if config.get('geoparquet'):
+        pipeline.add(Stage('export_geoparquet', stage_export_geoparquet, lock='arcpy',
+                           inputs={'combined_map': StageOutput('reinsert_ne_evidence', 'combined_map')},
+                           outputs={'geoparquet': 'Combined_Map.parquet'},
+                           params={'row_group_size': params['row_group_size']}))
+        if config.get('previous_version'):
+            pipeline.add(Stage('change_detection', stage_change_detection,
+                               inputs={'previous': config['previous_version'],
+                                       'combined_map': StageOutput('export_geoparquet', 'geoparquet')},
+                               outputs={'change_summary': 'Change_Summary.csv', 'changes': 'Changes.parquet'}))
+    for name, stage in pipeline.stages.items():
+        stage.code = STAGE_CODE.get(name, [])
+    return pipeline
+
+
+def _add_decision_stages(pipeline, config, metadata_check_outputs, decision_inputs, decision_params, decision_outputs):
+    """Declare the Pandas stages of Sections 3.3. - 3.7."""
+    pipeline.add(Stage('confidence_metadata', stage_confidence_metadata,
+                       inputs={'confidence': config['confidence_metadata'], 'gui_tracking': config['gui_tracking']},
+                       outputs={'three_step': 'ThreeStep_GUI_Confidence.pkl', 'gui_tracking': 'GUI_Tracking.pkl'}))
+    pipeline.add(Stage('control_frames', stage_control_frames,
+                       inputs={'intersection_attributes': StageOutput('intersect_new_maps', 'intersection_attributes')},
+                       outputs={'intersected_maps': 'Intersected_Maps.pkl', 'control_df': 'Control_DF.pkl'}))
+    pipeline.add(Stage('metadata_checks', stage_metadata_checks,
+                       inputs={'control_df': StageOutput('control_frames', 'control_df'),
+                               'three_step': StageOutput('confidence_metadata', 'three_step'),
+                               'gui_tracking': StageOutput('confidence_metadata', 'gui_tracking')},
+                       outputs=metadata_check_outputs))
+    pipeline.add(Stage('new_map_attributes', stage_new_map_attributes,
+                       inputs={'merged_attributes': StageOutput('merge_new_maps', 'merged_attributes'),
+                               'three_step': StageOutput('confidence_metadata', 'three_step')},
+                       outputs={'new_decision_attributes': 'New_Decision_Attributes.pkl'}))
+    pipeline.add(Stage('existing_map_attributes', stage_existing_map_attributes,
+                       inputs={'intersection_attributes': StageOutput('intersect_new_maps', 'intersection_attributes'),
+                               'intersected_maps': StageOutput('control_frames', 'intersected_maps'),
+                               'three_step': StageOutput('confidence_metadata', 'three_step')},
+                       outputs={'existing_decision_attributes': 'Combined_Decision_Attributes.pkl'}))
+    decision_inputs = dict(decision_inputs)
+    decision_inputs.update({'intersection_attributes': StageOutput('intersect_new_maps', 'intersection_attributes'),
+                            'control_df': StageOutput('control_frames', 'control_df'),
+                            'new_decision_attributes': StageOutput('new_map_attributes', 'new_decision_attributes'),
+                            'existing_decision_attributes': StageOutput('existing_map_attributes',
+                                                                        'existing_decision_attributes')})
+    pipeline.add(Stage('decision_tree', stage_decision_tree, inputs=decision_inputs, outputs=decision_outputs,
+                       params=decision_params))
+
+
+#   Parameters which may be overridden within the update configuration file
+DEFAULT_PARAMETERS = {
+    'uksm_gui': 'UKSM16',
+    'uksm_source': 'UKSM18',
+    'ne_sources': ['NE_Ev_2', 'NE_Evid'],
+    'feature_dataset': 'Public',
+    'l3_field': 'E_L3_LON',
+    'l3_field_length': 50,
+    'land_transformation': 'ED_1950_To_WGS_1984_18',
+    'row_group_size': 10000,
+    'xy_resolution': None,      # e.g. '0.0000001 Degrees' - see _XYPrecision
+    'xy_tolerance': None,
+    'generalise_tolerances': [0.01, 0.001, 0.0001],
+    'copy_workers': None,       # e.g. 4 - copy the new maps locally before merging (see Reference_Reader.py)
+    'area_field': 'AreaKm2',
+    'measure_workers': None}    # e.g. 4 - measure areas within worker processes (see Measures.py)
+
@@ -0,0 +1,260 @@
+########################################################################################################################
+
+# Title: Decision Store
+
+# Script description:    Persistent record of the decision tree results and expert judgements made for each intersection
+#                        of a new survey map with an existing map (Sections 3.7. - 3.8.), held within an SQLite
+#                        database which is kept between combined map updates.
+#
+#                        Decisions are recorded against the two GUIs, their habitat classifications, their 3-step and
+#                        MESH confidence scores and the version of the decision tree (DECISION_TREE_VERSION within
+#                        Combined_Map_Functions.py). Any intersection with an unchanged record reuses the recorded
+#                        result, including expert judgements made during earlier updates, so only new or changed
+#                        intersections are run through the decision tree and added to Requires_Judgement.
+#
+#                        Once the intersections within Requires_Judgement.csv have been reviewed, add a column named
+#                        'Expert_Judgement' holding the winning GUI (and optionally 'Judged_By' and
+#                        'Judgement_Comment') and import the file with:
+#                            python -m combined_map.Decision_Store Combined_Map_Decisions.sqlite \
+#                                --import Requires_Judgement.csv
+#
+#                        The decision stage is keyed on a fingerprint of the expert judgements within the store
+#                        (judgement_fingerprint()) rather than on the store file, which the stage itself writes to -
+#                        so only importing judgements re-runs the decision tree and the stages after it. The
+#                        fingerprint is read without creating the store, which is created by the first decision stage.
+
+########################################################################################################################
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from urllib.request import pathname2url
+
+import pandas as pd
+
+from .Combined_Map_Functions import DECISION_TREE_VERSION
+
+#   Columns of Comparison_DF which identify a decision
+KEY_COLUMNS = ['NewGUI', 'ExistingGUI', 'New_Habitat_Classification', 'Existing_Habitat_Classification',
+               'New_3_Step_Confidence_Score', 'Existing_3_Step_Confidence_Score', 'New_MESH_Score',
+               'Existing_MESH_Score']
+SCORE_COLUMNS = ['New_3_Step_Confidence_Score', 'Existing_3_Step_Confidence_Score', 'New_MESH_Score',
+                 'Existing_MESH_Score']
+JUDGEMENT = 'Requires expert judgement'
+
+CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS decisions (
+    NewGUI TEXT NOT NULL,
+    ExistingGUI TEXT NOT NULL,
+    New_Habitat_Classification TEXT NOT NULL,
+    Existing_Habitat_Classification TEXT NOT NULL,
+    New_3_Step_Confidence_Score REAL NOT NULL,
+    Existing_3_Step_Confidence_Score REAL NOT NULL,
+    New_MESH_Score REAL NOT NULL,
+    Existing_MESH_Score REAL NOT NULL,
+    Tree_Version INTEGER NOT NULL,
+    Comparison_Result TEXT,
+    Decision_Source TEXT NOT NULL,
+    Judged_By TEXT,
+    Judgement_Comment TEXT,
+    Recorded TEXT NOT NULL,
+    PRIMARY KEY (NewGUI, ExistingGUI, New_Habitat_Classification, Existing_Habitat_Classification,
+                 New_3_Step_Confidence_Score, Existing_3_Step_Confidence_Score, New_MESH_Score, Existing_MESH_Score,
+                 Tree_Version))
+"""
+
+#   Conflict clause of imports - decision tree results keep any existing record, while expert judgements replace it
+_CONFLICT = 'ON CONFLICT (%s, Tree_Version) DO ' % ', '.join(KEY_COLUMNS)
+KEEP_EXISTING = _CONFLICT + 'NOTHING'
+REPLACE_EXISTING = _CONFLICT + 'UPDATE SET %s' % ', '.join(
+    '%s = excluded.%s' % (x, x) for x in ['Comparison_Result', 'Decision_Source', 'Judged_By', 'Judgement_Comment',
+                                          'Recorded'])
+
+
+def _keys(df):
+    """Return the key columns of a comparison DataFrame in the form stored within the database"""
+    keys = df[KEY_COLUMNS].copy()
+    for column in KEY_COLUMNS:
+        if column in SCORE_COLUMNS:
+            keys[column] = keys[column].astype(float)
+        else:
+            keys[column] = keys[column].astype(object).where(keys[column].notna(), None)
+    return keys
+
+
+def _fingerprint(connection, version):
+    """Hash the expert judgements recorded for a version of the decision tree (none if connection is None)"""
+    digest = hashlib.sha256(str(version).encode('utf-8'))
+    if connection is not None:
+        for row in connection.execute(
+                "SELECT %s, Comparison_Result FROM decisions WHERE Tree_Version = ? AND Decision_Source = 'expert' "
+                "ORDER BY %s" % (', '.join(KEY_COLUMNS), ', '.join(KEY_COLUMNS)), (version,)):
+            digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def judgement_fingerprint(path, version=DECISION_TREE_VERSION):
+    """
+    Function Title: judgement_fingerprint()
+    Define function to return the fingerprint of the expert judgements within a decision store file (as
+    DecisionStore.fingerprint()) without creating or writing to it - a store which does not exist yet holds no
+    judgements
+    """
+    if not os.path.exists(path):
+        return _fingerprint(None, version)
+    connection = sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(path)), uri=True)
+    try:
+        return _fingerprint(connection, version)
+    finally:
+        connection.close()
+
+
+class DecisionStore(object):
+    """
+    Class Title: DecisionStore
+    Decision tree results and expert judgements recorded during previous combined map updates
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(CREATE_TABLE)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _insert(self, rows, conflict):
+        """Write a DataFrame of rows to the decisions table within a single transaction, returning the number of rows
+        written. Rows conflicting with a record are handled by the conflict clause; any other error is raised."""
+        columns = list(rows.columns)
+        with self.connection:
+            cursor = self.connection.executemany('INSERT INTO decisions (%s) VALUES (%s) %s' % (
+                ', '.join(columns), ', '.join('?' * len(columns)), conflict), rows.itertuples(index=False, name=None))
+        return cursor.rowcount
+
+    def fingerprint(self, version=DECISION_TREE_VERSION):
+        """Return a hash of the expert judgements recorded for a version of the decision tree, which changes only when
+        judgements are imported"""
+        return _fingerprint(self.connection, version)
+
+    def lookup(self, Comparison_DF, version=DECISION_TREE_VERSION):
+        """
+        Return the recorded Comparison_Result and Decision_Source of every row of Comparison_DF (indexed as
+        Comparison_DF), along with a 'Recorded' column which is False for intersections without a record
+        """
+        stored = pd.read_sql_query('SELECT %s, Comparison_Result, Decision_Source FROM decisions WHERE Tree_Version = ?'
+                                   % ', '.join(KEY_COLUMNS), self.connection, params=(version,))
+        keys = _keys(Comparison_DF)
+        if stored.empty:
+            return pd.DataFrame({'Comparison_Result': None, 'Decision_Source': None, 'Recorded': False},
+                                index=Comparison_DF.index)
+        stored = _keys(stored).join(stored[['Comparison_Result', 'Decision_Source']])
+        found = pd.merge(keys.reset_index(drop=True), stored, on=KEY_COLUMNS, how='left', indicator=True)
+        found.index = Comparison_DF.index
+        found['Recorded'] = found['_merge'] == 'both'
+        return found[['Comparison_Result', 'Decision_Source', 'Recorded']]
+
+    def record(self, Comparison_DF, version=DECISION_TREE_VERSION):
+        """Record the decision tree results held within Comparison_DF, keeping any existing records. Rows missing any
+        of the key columns cannot be recorded, and are reported along with rows which were already recorded."""
+        if Comparison_DF.empty:
+            return 0
+        rows = _keys(Comparison_DF)
+        complete = rows.notna().all(axis=1)
+        rows = rows.loc[complete]
+        rows['Tree_Version'] = version
+        result = Comparison_DF.loc[complete, 'Comparison_Result'].astype(object)
+        rows['Comparison_Result'] = result.where(result.notna(), None)
+        rows['Decision_Source'] = 'decision_tree'
+        rows['Recorded'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        recorded = self._insert(rows, KEEP_EXISTING) if len(rows) else 0
+        if recorded < len(Comparison_DF):
+            print('%d of %d decisions were not recorded within %s (%d missing a key column, %d already recorded)'
+                  % (len(Comparison_DF) - recorded, len(Comparison_DF), self.path, (~complete).sum(),
+                     len(rows) - recorded))
+        return recorded
+
+    def record_judgements(self, Reviewed, judged_by=None, version=DECISION_TREE_VERSION):
+        """
+        Record the expert judgements within a reviewed copy of Requires_Judgement. The 'Expert_Judgement' column must
+        hold either the NewGUI or the ExistingGUI of the row; rows without a judgement are skipped and reported.
+        Judgements replace any earlier record of the intersection. Returns the number of judgements recorded.
+        """
+        judged = Reviewed['Expert_Judgement'].notna() & (Reviewed['Expert_Judgement'].astype(str).str.strip() != '')
+        if not judged.all():
+            print('%d of %d reviewed rows have no Expert_Judgement and were skipped' % ((~judged).sum(), len(judged)))
+        Reviewed = Reviewed.loc[judged]
+        judgement = Reviewed['Expert_Judgement'].astype(str).str.strip()
+        invalid = Reviewed.loc[(judgement != Reviewed['NewGUI']) & (judgement != Reviewed['ExistingGUI'])]
+        if not invalid.empty:
+            raise ValueError('Expert judgements must be the NewGUI or ExistingGUI of the intersection:\n%s'
+                             % invalid[['NewGUI', 'ExistingGUI', 'Expert_Judgement']])
+
+        rows = _keys(Reviewed)
+        incomplete = Reviewed.loc[rows.isna().any(axis=1)]
+        if not incomplete.empty:
+            raise ValueError('Expert judgements must have a value within each of %s:\n%s'
+                             % (', '.join(KEY_COLUMNS), incomplete[KEY_COLUMNS]))
+        rows['Tree_Version'] = version
+        rows['Comparison_Result'] = judgement.values
+        rows['Decision_Source'] = 'expert'
+        for column in ['Judged_By', 'Judgement_Comment']:
+            if column in Reviewed.columns:
+                values = Reviewed[column].astype(object)
+            else:
+                values = pd.Series(None, index=Reviewed.index, dtype=object)
+            if column == 'Judged_By' and judged_by is not None:
+                values = values.fillna(judged_by)
+            rows[column] = values.where(values.notna(), None)
+        rows['Recorded'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        return self._insert(rows, REPLACE_EXISTING) if len(rows) else 0
+
+    def decide(self, Comparison_DF, decide, version=DECISION_TREE_VERSION):
+        """
+        Return a copy of Comparison_DF with the Comparison_Result and Decision_Source of every intersection. Recorded
+        intersections reuse their recorded result ('stored' or 'expert'); all others are passed to decide (a function
+        returning the decision tree result of each row) and recorded ('decision_tree').
+        """
+        Comparison_DF = Comparison_DF.copy()
+        found = self.lookup(Comparison_DF, version)
+        Comparison_DF['Comparison_Result'] = found['Comparison_Result'].astype(object)
+        Comparison_DF['Decision_Source'] = found['Decision_Source'].replace({'decision_tree': 'stored'}).astype(object)
+
+        new = ~found['Recorded']
+        if new.any():
+            Comparison_DF.loc[new, 'Comparison_Result'] = list(decide(Comparison_DF.loc[new]))
+            Comparison_DF.loc[new, 'Decision_Source'] = 'decision_tree'
+            self.record(Comparison_DF.loc[new], version)
+        return Comparison_DF
+
+    def summary(self):
+        """Return the number of recorded decisions by decision tree version and source"""
+        return pd.read_sql_query(
+            "SELECT Tree_Version, Decision_Source, COUNT(*) AS Decisions, "
+            "SUM(Comparison_Result = '%s') AS Requires_Judgement FROM decisions "
+            "GROUP BY Tree_Version, Decision_Source ORDER BY Tree_Version, Decision_Source" % JUDGEMENT,
+            self.connection)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import expert judgements into the decision store, or summarise it')
+    parser.add_argument('store', help='The decision store (.sqlite)')
+    parser.add_argument('--import', dest='reviewed', help='A reviewed Requires_Judgement.csv with an Expert_Judgement '
+                                                          'column')
+    parser.add_argument('--judged-by', help='Name to record against judgements without a Judged_By value')
+    args = parser.parse_args()
+
+    with DecisionStore(args.store) as decision_store:
+        if args.reviewed:
+            imported = decision_store.record_judgements(pd.read_csv(args.reviewed, index_col=0), args.judged_by)
+            print('%d expert judgements recorded within %s' % (imported, args.store))
+        print(decision_store.summary())
@@ -0,0 +1,170 @@
+########################################################################################################################
+
+# Title: EUNIS Registry
+
+# Script description:    A registry of EUNIS habitat codes, mapping every code to its level, its level 2 and level 3
+#                        parents and its zone (intertidal / sub-tidal, by its level 2 habitat), so that HAB_TYPE and
+#                        E_L3_LON values are classified by looking their codes up rather than by searching them for
+#                        substrings (where e.g. 'A1' is also found within 'A10').
+#
+#                        The registry is built from the EUNIS code list shipped with the package (EUNIS_Codes.json -
+#                        the level 2 and level 3 codes of the EUNIS habitat classification 2012 under the level 1
+#                        habitats read from HAB_TYPE values: the seabed (A1 - A6; the pelagic water column, A7, and
+#                        ice-associated habitats, A8, are not mapped within the combined map), coastal habitats (B),
+#                        inland surface waters (C) and constructed habitats (J)).
+#
+#                        Codes are read from HAB_TYPE strings (e.g. 'A5.13/A5.14', 'A3.1 + A4.2') as whole tokens
+#                        (TOKEN_PATTERN), then looked up within the registry. Codes which are not listed (e.g. A9 or
+#                        C8.4) are not EUNIS codes and are left out. Codes below level 3 are looked up through their
+#                        level 3 parent (e.g. A5.251 through A5.2), as within a trie. The results for every string are
+#                        kept, so each distinct HAB_TYPE value is only read once.
+#
+#                        The registry is built once per process (get_registry()), or loaded from a file written by
+#                        save(), e.g. to fix the registry used throughout an update:
+#                            python -m combined_map.EUNIS_Registry EUNIS_Registry.json
+
+########################################################################################################################
+
+import argparse
+import json
+import os
+import re
+
+#   Zone of every level 2 habitat used to classify maps (habitat_classifier() within Combined_Map_Functions.py)
+LEVEL2_ZONES = {'A1': 'Intertidal', 'A2': 'Intertidal', 'B3': 'Intertidal',
+                'A3': 'Sub-tidal', 'A4': 'Sub-tidal', 'A5': 'Sub-tidal', 'A6': 'Sub-tidal'}
+
+#   Level 1 habitats held within the registry (those read from HAB_TYPE values by eunisToAllLevel3())
+LEVEL1_CODES = 'ABCJ'
+
+#   EUNIS code list the registry is built from - the level 3 codes of every level 2 habitat
+EUNIS_CODES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EUNIS_Codes.json')
+
+#   Whole EUNIS codes within a string - a level 1 letter, optionally followed by a level 2 digit and the digits of lower
+#   levels, not followed by any other letter or digit (so 'A10' is not read as 'A1')
+TOKEN_PATTERN = r'\b((?:[ABCJ][0-9](?:\.[0-9]*)?)|[ABCJ])\b'
+eunisTokenPattern = re.compile(TOKEN_PATTERN)
+
+#   Version of the registry file format
+REGISTRY_VERSION = 1
+
+
+def _parent(code):
+    """Return the parent of a code (e.g. A5.1 for A5.13, A5 for A5.1 and A for A5)"""
+    return code[:-1].rstrip('.')
+
+
+def _level(code):
+    """Return the level of a code from its digits (e.g. 4 for A5.13)"""
+    return 1 + sum(x.isdigit() for x in code)
+
+
+class EunisRegistry(object):
+    """
+    Class Title: EunisRegistry
+    EUNIS codes mapped to their level, level 2 parent, level 3 parent and zone (None for codes without a zone)
+    """
+
+    def __init__(self, codes):
+        self.codes = codes
+        self._tokens = {}
+        self._zones = {}
+
+    @classmethod
+    def build(cls, codes_path=EUNIS_CODES_PATH, level2_zones=LEVEL2_ZONES):
+        """Build the registry from a EUNIS code list (see EUNIS_Codes.json) - the level 3 codes of every level 2
+        habitat, whose level 1 habitat must be one of LEVEL1_CODES"""
+        with open(codes_path) as f:
+            habitats = json.load(f)['habitats']
+        codes = {}
+        for level2, level3_codes in sorted(habitats.items()):
+            if level2[0] not in LEVEL1_CODES or _level(level2) != 2:
+                raise ValueError('%s is not a level 2 habitat under %s' % (level2, ', '.join(LEVEL1_CODES)))
+            zone = level2_zones.get(level2)
+            codes[level2[0]] = [1, None, None, None]
+            codes[level2] = [2, level2, None, zone]
+            for level3 in level3_codes:
+                if _level(level3) != 3 or _parent(level3) != level2:
+                    raise ValueError('%s is not a level 3 habitat under %s' % (level3, level2))
+                codes[level3] = [3, level2, level3, zone]
+        return cls(codes)
+
+    def save(self, out_path):
+        """Write the registry to a JSON file"""
+        with open(out_path, 'w') as f:
+            json.dump({'version': REGISTRY_VERSION, 'codes': self.codes}, f)
+        return out_path
+
+    @classmethod
+    def load(cls, path):
+        """Read a registry written by save()"""
+        with open(path) as f:
+            registry = json.load(f)
+        if registry.get('version') != REGISTRY_VERSION:
+            raise ValueError('%s is not a version %d EUNIS registry' % (path, REGISTRY_VERSION))
+        return cls(registry['codes'])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def lookup(self, code):
+        """Return the level, level 2 parent, level 3 parent and zone of a code, through its level 3 parent if the code
+        is below level 3 (None for unknown codes)"""
+        entry = self.codes.get(code)
+        parent = code
+        while entry is None and _level(parent) > 3:
+            parent = _parent(parent)
+            entry = self.codes.get(parent)
+        return entry
+
+    def tokenise(self, text):
+        """Return the registered EUNIS codes within a string (e.g. a HAB_TYPE value), in order of appearance"""
+        tokens = self._tokens.get(text)
+        if tokens is None:
+            tokens = tuple(x for x in eunisTokenPattern.findall('' if text is None else str(text))
+                           if self.lookup(x) is not None)
+            self._tokens[text] = tokens
+        return tokens
+
+    def zones(self, text):
+        """Return the set of zones of the EUNIS codes within a string"""
+        zones = self._zones.get(text)
+        if zones is None:
+            zones = frozenset(self.lookup(x)[3] for x in self.tokenise(text)) - {None}
+            self._zones[text] = zones
+        return zones
+
+    def level3(self, code):
+        """Return the level 3 parent of a code, or the code itself if it is above level 3"""
+        entry = self.lookup(code)
+        return code if entry is None or entry[0] < 3 else entry[2]
+
+    def level(self, code):
+        """Return the level of a code (None for unknown codes)"""
+        return None if self.lookup(code) is None else _level(code)
+
+
+#   Registry shared by every function of the update, built (or loaded) on first use
+_registry = None
+
+
+def get_registry(path=None):
+    """
+    Function Title: get_registry()
+    Define function to return the EUNIS registry of this process, building it from the EUNIS code list on first use,
+    or loading it from a file written by EunisRegistry.save() if a path is given
+    """
+    global _registry
+    if path is not None:
+        _registry = EunisRegistry.load(path)
+    elif _registry is None:
+        _registry = EunisRegistry.build()
+    return _registry
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write the EUNIS registry to a file')
+    parser.add_argument('out_path', help='JSON file to write the registry to')
+    args = parser.parse_args()
+    built = EunisRegistry.build()
+    print('%d codes written to %s' % (len(built), built.save(args.out_path)))
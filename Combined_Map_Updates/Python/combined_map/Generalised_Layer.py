@@ -0,0 +1,168 @@
+########################################################################################################################
+
+# Title: Generalised Layer
+
+# Script description:    Pre-generalised versions of a large, highly detailed layer (e.g. UKSeaMap) at several
+#                        tolerances, used to settle spatial predicates between the layer and another layer (e.g.
+#                        Combined_extract in Section 1.2.2.) without testing full detail geometries wherever possible.
+#
+#                        Every feature carries its bounding box and convex hull, and at each tolerance an outer and an
+#                        inner approximation: the topology-preserving simplification of the feature grown and shrunk by
+#                        the tolerance (with mitred corners). The simplification lies within the tolerance of the
+#                        feature, so the outer approximation covers the feature and the inner approximation lies within
+#                        it (both are checked when built):
+#                            - a feature which is disjoint from the bounding box, convex hull or outer approximation of
+#                              another feature is clearly outside it;
+#                            - a feature which intersects (or lies within) an inner approximation clearly intersects
+#                              (or lies within) the feature.
+#                        Pairs of features are tested from the coarsest tolerance to the finest, and only pairs which
+#                        run along the boundary of a feature at every tolerance are tested on full detail geometry.
+#
+#                        Generalise a layer exported with Geometry_QA.read_layer_geometries() (or any DataFrame with a
+#                        'WKB' column) with GeneralisedLayer.build(), and store it with save() / load().
+
+########################################################################################################################
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .Geometry_Buffers import polygonal
+
+#   Tolerances (in the units of the layer, e.g. degrees) of the generalised versions, coarsest first
+DEFAULT_TOLERANCES = (0.01, 0.001, 0.0001)
+
+#   Predicates which can be settled on generalised geometry - predicate(layer feature, other feature)
+PREDICATES = ['intersects', 'contains']
+
+
+def _approximations(geometries, tolerance, hulls):
+    """Return the outer and inner approximations of geometries at tolerance"""
+    simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    # Simplified rings may move further than the tolerance (e.g. where the start of a ring is removed), so each feature
+    # is grown / shrunk by whichever is larger, with a margin as the Hausdorff distance is estimated
+    distance = np.fmax(shapely.hausdorff_distance(simplified, geometries, densify=0.1), tolerance) * 1.5
+    outer = polygonal(shapely.buffer(simplified, distance, join_style='mitre'))
+    inner = polygonal(shapely.buffer(simplified, -distance, join_style='mitre'))
+    # Features which collapse when simplified, or whose approximations touch the feature, are covered by their convex
+    # hull (grown by the tolerance) instead
+    failed = ~shapely.contains_properly(outer, geometries) & ~shapely.is_empty(geometries)
+    outer[failed] = shapely.buffer(hulls[failed], tolerance, join_style='mitre')
+    failed |= ~shapely.contains_properly(geometries, inner) & ~shapely.is_empty(inner)
+    inner[failed] = shapely.Polygon()
+    return outer, inner
+
+
+class GeneralisedLayer(object):
+    """
+    Class Title: GeneralisedLayer
+    The features of a layer with their bounding boxes, convex hulls and the outer and inner approximations at each
+    tolerance. oids are the object IDs of the features (e.g. the 'OID' column from read_layer_geometries()).
+    """
+
+    def __init__(self, geometries, hulls, outer, inner, tolerances, oids=None):
+        self.geometries = geometries
+        self.hulls = hulls
+        self.outer = outer
+        self.inner = inner
+        self.tolerances = list(tolerances)
+        self.oids = np.arange(len(geometries)) if oids is None else np.asarray(oids)
+        self.bounds = shapely.bounds(geometries)
+        self.statistics = {}
+        self._tree = None
+
+    @classmethod
+    def build(cls, layer, tolerances=DEFAULT_TOLERANCES):
+        """Generalise the features of a layer (a DataFrame with a 'WKB' column) at each tolerance"""
+        geometries = shapely.from_wkb(layer['WKB'].values)
+        hulls = shapely.convex_hull(geometries)
+        tolerances = sorted(tolerances, reverse=True)
+        outer, inner = [], []
+        for tolerance in tolerances:
+            level_outer, level_inner = _approximations(geometries, tolerance, hulls)
+            outer.append(level_outer)
+            inner.append(level_inner)
+        return cls(geometries, hulls, outer, inner, tolerances, layer['OID'].values if 'OID' in layer else None)
+
+    def to_frame(self):
+        """Return the generalised layer as a DataFrame of WKB columns, as stored by save()"""
+        columns = {'OID': self.oids, 'WKB': shapely.to_wkb(self.geometries), 'Hull': shapely.to_wkb(self.hulls)}
+        for tolerance, outer, inner in zip(self.tolerances, self.outer, self.inner):
+            columns['Outer_%r' % tolerance] = shapely.to_wkb(outer)
+            columns['Inner_%r' % tolerance] = shapely.to_wkb(inner)
+        return pd.DataFrame(columns)
+
+    @classmethod
+    def from_frame(cls, Generalised):
+        tolerances = sorted((float(x[len('Outer_'):]) for x in Generalised.columns if x.startswith('Outer_')),
+                            reverse=True)
+        return cls(shapely.from_wkb(Generalised['WKB'].values), shapely.from_wkb(Generalised['Hull'].values),
+                   [shapely.from_wkb(Generalised['Outer_%r' % x].values) for x in tolerances],
+                   [shapely.from_wkb(Generalised['Inner_%r' % x].values) for x in tolerances], tolerances,
+                   Generalised['OID'].values)
+
+    def save(self, path):
+        self.to_frame().to_pickle(path)
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_frame(pd.read_pickle(path))
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def vertex_counts(self):
+        """Return the number of vertices of the full detail features and of each generalised version"""
+        counts = {'full': int(shapely.get_num_coordinates(self.geometries).sum()),
+                  'hull': int(shapely.get_num_coordinates(self.hulls).sum())}
+        for tolerance, outer, inner in zip(self.tolerances, self.outer, self.inner):
+            counts['outer_%r' % tolerance] = int(shapely.get_num_coordinates(outer).sum())
+            counts['inner_%r' % tolerance] = int(shapely.get_num_coordinates(inner).sum())
+        return counts
+
+    def query(self, geometries, predicate='intersects'):
+        """
+        Return the pairs of indices (layer feature, geometry) for which predicate(layer feature, geometry) is true,
+        sorted by layer feature then geometry. The number of pairs settled at each level of detail is recorded within
+        statistics.
+        """
+        if predicate not in PREDICATES:
+            raise ValueError("Predicate must be one of %s, not '%s'" % (', '.join(PREDICATES), predicate))
+        if self._tree is None:
+            self._tree = shapely.STRtree(shapely.box(*self.bounds.T))
+            for level in [self.geometries, self.hulls] + self.outer + self.inner:
+                shapely.prepare(level)
+        geometries = np.asarray(geometries, dtype=object)
+        right, left = self._tree.query(geometries)
+        order = np.lexsort((right, left))
+        left, right = left[order], right[order]
+        test = shapely.intersects if predicate == 'intersects' else shapely.contains
+
+        result = np.zeros(len(left), dtype=bool)
+        undecided = np.ones(len(left), dtype=bool)
+        statistics = {'candidates': len(left)}
+
+        def settle(level, outer, inner):
+            pending = np.flatnonzero(undecided)
+            outside = ~test(outer[left[pending]], geometries[right[pending]])
+            inside = np.zeros(len(pending), dtype=bool)
+            if inner is not None:
+                inside[~outside] = test(inner[left[pending[~outside]]], geometries[right[pending[~outside]]])
+            result[pending[inside]] = True
+            undecided[pending[outside | inside]] = False
+            statistics[level] = int((outside | inside).sum())
+
+        settle('hull', self.hulls, None)
+        for tolerance, outer, inner in zip(self.tolerances, self.outer, self.inner):
+            settle(repr(tolerance), outer, inner)
+        pending = np.flatnonzero(undecided)
+        result[pending] = test(self.geometries[left[pending]], geometries[right[pending]])
+        statistics['full'] = len(pending)
+        self.statistics = statistics
+        return left[result], right[result]
+
+    def select(self, geometries, predicate='intersects'):
+        """Return a boolean array marking the layer features for which predicate holds with any of geometries"""
+        selected = np.zeros(len(self), dtype=bool)
+        selected[self.query(geometries, predicate)[0]] = True
+        return selected
@@ -0,0 +1,233 @@
+########################################################################################################################
+
+# Title: GeoParquet
+
+# Script description:    Export of the combined map (or any layer) to GeoParquet, sorted along a Hilbert curve so that
+#                        features which are close together are stored within the same row groups.
+#
+#                        Every feature carries its bounding box (the GeoParquet 1.1 'bbox' covering column), so the
+#                        row group statistics written by Parquet hold the extent of each row group along with the
+#                        minimum and maximum GUI and Source. read_geoparquet() uses these statistics to skip every row
+#                        group which cannot match a bounding box / GUI / Source filter, and memory-maps the file, so a
+#                        filtered read only touches a small part of the file. The files can also be opened directly
+#                        within QGIS / GDAL 3.8+, DuckDB or GeoPandas.
+#
+#                        Export a feature class with (from the ArcGIS Python console):
+#                            python -m combined_map.GeoParquet export <feature class> Combined_Map.parquet
+#                        and list the row group statistics of an exported file with:
+#                            python -m combined_map.GeoParquet stats Combined_Map.parquet
+
+########################################################################################################################
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+#   Fields of the combined map written alongside the geometry
+COMBINED_MAP_FIELDS = ['GUI', 'POLYGON', 'ORIG_HAB', 'ORIG_CLASS', 'HAB_TYPE', 'VERSION', 'DET_MTHD', 'DET_NAME',
+                       'DET_DATE', 'TRAN_COM', 'T_RELATE', 'VAL_COMM', 'E_L3_LON', 'Source']
+
+#   Fields for which row group minimum / maximum statistics are listed and used to skip row groups
+FILTER_FIELDS = ['GUI', 'Source']
+
+
+def hilbert_distance(x, y, extent, order=16):
+    """
+    Function Title: hilbert_distance()
+    Define function to return the distance along a Hilbert curve of order 'order' (a 2^order x 2^order grid) covering
+    extent (xmin, ymin, xmax, ymax) for arrays of x and y coordinates
+    """
+    n = 1 << order
+    xmin, ymin, xmax, ymax = extent
+    width = max(xmax - xmin, 1e-12)
+    height = max(ymax - ymin, 1e-12)
+    x = np.clip(((np.asarray(x, dtype=float) - xmin) / width * (n - 1)).astype(np.int64), 0, n - 1)
+    y = np.clip(((np.asarray(y, dtype=float) - ymin) / height * (n - 1)).astype(np.int64), 0, n - 1)
+
+    distance = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        distance += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # Rotate the quadrant so that the curve within it has the correct orientation
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return distance
+
+
+def _geometry_types(geometries):
+    names = {0: 'Point', 1: 'LineString', 3: 'Polygon', 4: 'MultiPoint', 5: 'MultiLineString', 6: 'MultiPolygon',
+             7: 'GeometryCollection'}
+    types = shapely.get_type_id(geometries[~shapely.is_missing(geometries)])
+    return sorted(names[x] for x in np.unique(types) if x in names)
+
+
+def write_geoparquet(layer, out_path, crs=None, row_group_size=10000, compression='zstd'):
+    """
+    Function Title: write_geoparquet()
+    Define function to write a layer (a DataFrame with a 'WKB' geometry column) to a Hilbert-sorted GeoParquet file.
+    crs is the PROJJSON definition of the coordinate system, or None for WGS 1984 (longitude / latitude). Returns the
+    number of row groups written.
+    """
+    geometries = shapely.from_wkb(layer['WKB'].values)
+    bounds = shapely.bounds(geometries)
+    valid = ~np.isnan(bounds).any(axis=1)
+    extent = (bounds[valid, 0].min(), bounds[valid, 1].min(), bounds[valid, 2].max(), bounds[valid, 3].max()) \
+        if valid.any() else (0.0, 0.0, 0.0, 0.0)
+
+    # Sort features by the Hilbert distance of the centre of their bounding box (null geometries last)
+    centres = np.where(valid[:, None], (bounds[:, :2] + bounds[:, 2:]) / 2, 0.0)
+    distance = hilbert_distance(centres[:, 0], centres[:, 1], extent)
+    distance[~valid] = np.iinfo(np.int64).max
+    order = np.argsort(distance, kind='stable')
+
+    attributes = layer.drop(columns=['WKB']).iloc[order].reset_index(drop=True)
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+    bbox = pa.StructArray.from_arrays(
+        [pa.array(bounds[order, i], mask=~valid[order]) for i in range(4)], names=['xmin', 'ymin', 'xmax', 'ymax'])
+    table = table.append_column('bbox', bbox)
+    table = table.append_column('geometry', pa.array(layer['WKB'].values[order], type=pa.binary()))
+
+    column = {'encoding': 'WKB', 'geometry_types': _geometry_types(geometries), 'bbox': list(extent),
+              'covering': {'bbox': {'xmin': ['bbox', 'xmin'], 'ymin': ['bbox', 'ymin'], 'xmax': ['bbox', 'xmax'],
+                                    'ymax': ['bbox', 'ymax']}}}
+    if crs is not None:
+        column['crs'] = crs
+    metadata = {'version': '1.1.0', 'primary_column': 'geometry', 'columns': {'geometry': column}}
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, geo=json.dumps(metadata)))
+
+    pq.write_table(table, out_path, row_group_size=row_group_size, compression=compression, write_statistics=True)
+    return (len(table) + row_group_size - 1) // row_group_size
+
+
+def row_group_statistics(path):
+    """
+    Function Title: row_group_statistics()
+    Define function to list the number of rows, the extent and the minimum / maximum GUI and Source of every row
+    group within a GeoParquet file written by write_geoparquet()
+    """
+    metadata = pq.ParquetFile(path).metadata
+    records = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        columns = dict((row_group.column(j).path_in_schema, row_group.column(j).statistics)
+                       for j in range(row_group.num_columns))
+        record = {'row_group': i, 'rows': row_group.num_rows}
+        for name, statistic in [('xmin', 'min'), ('ymin', 'min'), ('xmax', 'max'), ('ymax', 'max')]:
+            stats = columns.get('bbox.' + name)
+            record[name] = getattr(stats, statistic) if stats is not None and stats.has_min_max else np.nan
+        for field in FILTER_FIELDS:
+            stats = columns.get(field)
+            has_stats = stats is not None and stats.has_min_max
+            record[field + '_min'] = stats.min if has_stats else None
+            record[field + '_max'] = stats.max if has_stats else None
+        records.append(record)
+    columns = ['row_group', 'rows', 'xmin', 'ymin', 'xmax', 'ymax'] + \
+        [field + x for field in FILTER_FIELDS for x in ['_min', '_max']]
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
+def select_row_groups(statistics, bbox=None, gui=None, source=None):
+    """
+    Function Title: select_row_groups()
+    Define function to return the row groups which may hold features matching the filters, using the statistics from
+    row_group_statistics(). bbox is (xmin, ymin, xmax, ymax); gui and source are lists of values.
+    """
+    keep = np.ones(len(statistics), dtype=bool)
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        # Row groups without a recorded extent (e.g. all null geometries) cannot match a bounding box
+        keep &= ((statistics['xmin'] <= xmax) & (statistics['xmax'] >= xmin) & (statistics['ymin'] <= ymax) &
+                 (statistics['ymax'] >= ymin)).values
+    for field, values in [('GUI', gui), ('Source', source)]:
+        if values is None:
+            continue
+        low, high = statistics[field + '_min'], statistics[field + '_max']
+        in_range = np.zeros(len(statistics), dtype=bool)
+        for value in values:
+            in_range |= np.array([a is None or b is None or a <= value <= b for a, b in zip(low, high)])
+        keep &= in_range
+    return list(statistics.loc[keep, 'row_group'])
+
+
+def read_geoparquet(path, bbox=None, gui=None, source=None, columns=None):
+    """
+    Function Title: read_geoparquet()
+    Define function to read the features of a GeoParquet file written by write_geoparquet() which intersect bbox
+    (by bounding box) and / or have one of the given GUI / Source values, as a DataFrame with a 'WKB' geometry column.
+    Only the row groups which may hold matching features are read from the (memory-mapped) file.
+    """
+    parquet = pq.ParquetFile(path, memory_map=True)
+    row_groups = select_row_groups(row_group_statistics(path), bbox, gui, source)
+    if columns is not None:
+        filtered = [field for field, values in [('GUI', gui), ('Source', source)] if values is not None]
+        columns = list(columns) + [x for x in ['bbox', 'geometry'] + filtered if x not in columns]
+    table = parquet.read_row_groups(row_groups, columns=columns) if row_groups else \
+        parquet.schema_arrow.empty_table().select(columns or parquet.schema_arrow.names)
+
+    keep = np.ones(len(table), dtype=bool)
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        bounds = table.column('bbox').combine_chunks()
+        keep &= ((bounds.field('xmin').to_numpy(zero_copy_only=False) <= xmax) &
+                 (bounds.field('xmax').to_numpy(zero_copy_only=False) >= xmin) &
+                 (bounds.field('ymin').to_numpy(zero_copy_only=False) <= ymax) &
+                 (bounds.field('ymax').to_numpy(zero_copy_only=False) >= ymin))
+    for field, values in [('GUI', gui), ('Source', source)]:
+        if values is not None:
+            keep &= table.column(field).to_pandas().isin(values).values
+
+    Layer = table.filter(pa.array(keep)).drop_columns(['bbox']).to_pandas()
+    return Layer.rename(columns={'geometry': 'WKB'})
+
+
+def export_feature_class(inLayer, out_path, fields=None, row_group_size=10000):
+    """
+    Function Title: export_feature_class()
+    Define function to export an ArcGIS feature class (e.g. the combined map) to a Hilbert-sorted GeoParquet file
+    """
+    import arcpy
+    from .Geometry_QA import read_layer_geometries
+    if fields is None:
+        existing = [x.name for x in arcpy.ListFields(inLayer)]
+        fields = [x for x in COMBINED_MAP_FIELDS if x in existing]
+    Layer = read_layer_geometries(inLayer, fields).drop(columns=['OID'])
+
+    crs = None
+    spatial_reference = arcpy.Describe(inLayer).spatialReference
+    if spatial_reference.factoryCode not in (0, 4326):
+        # GeoParquet records the coordinate system as PROJJSON - pyproj is installed alongside ArcGIS Pro
+        import pyproj
+        crs = pyproj.CRS.from_epsg(spatial_reference.factoryCode).to_json_dict()
+    return write_geoparquet(Layer, out_path, crs=crs, row_group_size=row_group_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a layer to GeoParquet, or list the row group statistics of '
+                                                 'an exported file')
+    subparsers = parser.add_subparsers(dest='command')
+    export_parser = subparsers.add_parser('export', help='Export a feature class to GeoParquet (requires ArcGIS)')
+    export_parser.add_argument('feature_class')
+    export_parser.add_argument('out_path')
+    export_parser.add_argument('--row-group-size', type=int, default=10000)
+    stats_parser = subparsers.add_parser('stats', help='List the row group statistics of a GeoParquet file')
+    stats_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        written = export_feature_class(args.feature_class, args.out_path, row_group_size=args.row_group_size)
+        print('%d row groups written to %s' % (written, args.out_path))
+    elif args.command == 'stats':
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(row_group_statistics(args.path))
+    else:
+        parser.print_help()
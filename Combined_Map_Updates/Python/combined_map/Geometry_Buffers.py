@@ -0,0 +1,250 @@
+########################################################################################################################
+
+# Title: Geometry Buffers
+
+# Script description:    Compact in-memory store for the polygons of a layer (e.g. the combined map or UKSeaMap), used
+#                        by the overlay tools within Overlay.py in place of one Shapely / ArcPy geometry object per
+#                        feature.
+#
+#                        All coordinates of a layer are held within one contiguous array - as float64, or as int32
+#                        on a fixed-precision grid (e.g. precision=1e-7 degrees, about 1 cm) to halve its size - with
+#                        offset arrays marking the rings, polygon parts and features (the GeoArrow 'MultiPolygon'
+#                        layout), plus an array of the bounding box of every feature.
+#
+#                        The arrays can be copied once into shared memory, so that worker processes attach to them
+#                        without copying (share() / attach()). Workers then only create geometry objects for the
+#                        features they are overlaying, rather than receiving every geometry pickled from the main
+#                        process.
+
+########################################################################################################################
+
+from multiprocessing import shared_memory
+
+import numpy as np
+import shapely
+from shapely import GeometryType
+
+#   Arrays which make up a GeometryBuffers object, in the order they are held within shared memory
+ARRAYS = ['coords', 'ring_offsets', 'part_offsets', 'feature_offsets', 'bounds', 'multi', 'missing']
+
+
+def _ranges(starts, stops):
+    """Return the concatenation of np.arange(start, stop) for every pair of starts and stops"""
+    lengths = stops - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    repeated = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return np.arange(lengths.sum(), dtype=np.int64) + repeated
+
+
+def _offsets(lengths):
+    return np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+
+def polygonal(geometries):
+    """
+    Function Title: polygonal()
+    Define function to replace geometry collections (e.g. the result of an overlay which includes lines or points where
+    features touch) with the multi-polygon of their polygonal parts, as within the output of the ArcGIS overlay tools
+    """
+    geometries = np.array(geometries, dtype=object)
+    collections = np.flatnonzero(shapely.get_type_id(geometries) == GeometryType.GEOMETRYCOLLECTION)
+    for i in collections:
+        parts = shapely.get_parts(geometries[i])
+        parts = shapely.get_parts(parts[np.isin(shapely.get_type_id(parts), [GeometryType.POLYGON,
+                                                                              GeometryType.MULTIPOLYGON])])
+        geometries[i] = shapely.MultiPolygon(list(parts))
+    return geometries
+
+
+class GeometryBuffers(object):
+    """
+    Class Title: GeometryBuffers
+    The polygons of a layer held as flat coordinate, offset and bounding box arrays. Coordinates are float64, or
+    int32 counts of precision from origin if a precision is given.
+    """
+
+    def __init__(self, coords, ring_offsets, part_offsets, feature_offsets, bounds, multi, missing, precision=None,
+                 origin=(0.0, 0.0)):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.part_offsets = part_offsets
+        self.feature_offsets = feature_offsets
+        self.bounds = bounds
+        self.multi = multi
+        self.missing = missing
+        self.precision = precision
+        self.origin = tuple(origin)
+        self._shared = None
+
+    @classmethod
+    def from_geometries(cls, geometries, precision=None):
+        """
+        Build the buffers from an array of Shapely polygons / multi-polygons (None for null geometries). Only the
+        polygonal parts of geometry collections are kept.
+        """
+        geometries = polygonal(geometries)
+        geometry_type, coords, offsets = shapely.to_ragged_array(geometries)
+        if geometry_type == GeometryType.POLYGON:
+            ring_offsets, part_offsets = offsets
+            feature_offsets = np.arange(len(geometries) + 1)
+        elif geometry_type == GeometryType.MULTIPOLYGON:
+            ring_offsets, part_offsets, feature_offsets = offsets
+        else:
+            raise ValueError('Only polygon layers can be held within GeometryBuffers, not %s' % geometry_type.name)
+        buffers = cls(np.ascontiguousarray(coords), ring_offsets.astype(np.int64), part_offsets.astype(np.int64),
+                      feature_offsets.astype(np.int64), shapely.bounds(geometries),
+                      shapely.get_type_id(geometries) == GeometryType.MULTIPOLYGON, shapely.is_missing(geometries))
+        return buffers.to_precision(precision) if precision is not None else buffers
+
+    @classmethod
+    def from_wkb(cls, wkbs, precision=None, chunk_size=10000):
+        """
+        Build the buffers from an array of WKB geometries (e.g. the 'WKB' column of a layer), creating the geometry
+        objects chunk_size features at a time
+        """
+        wkbs = np.asarray(wkbs, dtype=object)
+        chunks = [cls.from_geometries(shapely.from_wkb(wkbs[i:i + chunk_size]))
+                  for i in range(0, len(wkbs), chunk_size)]
+        if not chunks:
+            return cls.from_geometries(np.array([], dtype=object))
+        buffers = cls.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+        return buffers.to_precision(precision) if precision is not None else buffers
+
+    @classmethod
+    def concatenate(cls, chunks):
+        """Join float64 buffers of consecutive sets of features into one"""
+        def offsets(name, base):
+            parts = [getattr(x, name)[:-1] + b for x, b in zip(chunks, base)]
+            return np.concatenate(parts + [[base[-1]]]).astype(np.int64)
+
+        coord_base = np.r_[0, np.cumsum([len(x.coords) for x in chunks])]
+        ring_base = np.r_[0, np.cumsum([len(x.ring_offsets) - 1 for x in chunks])]
+        part_base = np.r_[0, np.cumsum([len(x.part_offsets) - 1 for x in chunks])]
+        return cls(np.concatenate([x.coords for x in chunks]), offsets('ring_offsets', coord_base),
+                   offsets('part_offsets', ring_base), offsets('feature_offsets', part_base),
+                   np.concatenate([x.bounds for x in chunks]), np.concatenate([x.multi for x in chunks]),
+                   np.concatenate([x.missing for x in chunks]))
+
+    def to_precision(self, precision):
+        """
+        Return the buffers with int32 coordinates on a grid of the given precision (in the units of the layer, e.g.
+        1e-7 degrees) from the south-west corner of the layer. The origin is a multiple of the precision, so layers
+        share the same grid, and the bounding boxes are those of the rounded coordinates.
+        """
+        if self.precision is not None:
+            raise ValueError('The coordinates are already stored at a precision of %s' % self.precision)
+        valid = ~self.missing
+        origin = np.nanmin(self.bounds[valid, :2], axis=0) if valid.any() else np.zeros(2)
+        origin = tuple(np.floor(origin / precision) * precision)
+        grid = np.round((self.coords - np.array(origin)) / precision)
+        if len(grid) and grid.max() > np.iinfo(np.int32).max:
+            raise ValueError('The extent of the layer is too large to store at a precision of %s' % precision)
+        buffers = GeometryBuffers(grid.astype(np.int32), self.ring_offsets, self.part_offsets, self.feature_offsets,
+                                  self.bounds.copy(), self.multi, self.missing, precision, origin)
+        buffers.bounds[~self.missing] = buffers._coord_bounds()[~self.missing]
+        return buffers
+
+    def __len__(self):
+        return len(self.feature_offsets) - 1
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, x).nbytes for x in ARRAYS)
+
+    def decoded_coords(self, rows=None):
+        """Return the (float64) coordinates, or those of the given coordinate rows"""
+        coords = self.coords if rows is None else self.coords[rows]
+        if self.precision is None:
+            return coords
+        return coords * self.precision + np.array(self.origin)
+
+    def _coord_bounds(self):
+        """Return the bounding box of the (decoded) coordinates of every feature, NaN for features without any"""
+        starts = self.ring_offsets[self.part_offsets[self.feature_offsets[:-1]]]
+        stops = self.ring_offsets[self.part_offsets[self.feature_offsets[1:]]]
+        bounds = np.full((len(self), 4), np.nan)
+        filled = stops > starts
+        if filled.any():
+            # Features are stored one after another, so each filled feature runs up to the start of the next one
+            coords = self.decoded_coords()
+            bounds[filled, :2] = np.minimum.reduceat(coords, starts[filled])
+            bounds[filled, 2:] = np.maximum.reduceat(coords, starts[filled])
+        return bounds
+
+    def take(self, indices):
+        """Create the Shapely geometries of the features at indices"""
+        indices = np.asarray(indices, dtype=np.int64)
+        parts = _ranges(self.feature_offsets[indices], self.feature_offsets[indices + 1])
+        part_features = np.repeat(np.arange(len(indices)), self.feature_offsets[indices + 1] -
+                                  self.feature_offsets[indices])
+        # Parts without any rings (empty polygons) are left out - Shapely cannot build them from ragged arrays
+        filled = self.part_offsets[parts + 1] > self.part_offsets[parts]
+        parts, part_features = parts[filled], part_features[filled]
+        rings = _ranges(self.part_offsets[parts], self.part_offsets[parts + 1])
+        coords = _ranges(self.ring_offsets[rings], self.ring_offsets[rings + 1])
+
+        geometries = np.empty(len(indices), dtype=object)
+        built = np.bincount(part_features, minlength=len(indices)) > 0
+        if built.any():
+            feature_offsets = _offsets(np.bincount(part_features, minlength=len(indices))[built])
+            part_offsets = _offsets(self.part_offsets[parts + 1] - self.part_offsets[parts])
+            ring_offsets = _offsets(self.ring_offsets[rings + 1] - self.ring_offsets[rings])
+            geometries[built] = shapely.from_ragged_array(GeometryType.MULTIPOLYGON, self.decoded_coords(coords),
+                                                          (ring_offsets, part_offsets, feature_offsets))
+
+        # Return single polygons as polygons (not multi-polygons of one part), and null geometries as None
+        single = ~self.multi[indices]
+        geometries[single & built] = shapely.get_geometry(geometries[single & built], 0)
+        geometries[single & ~built] = shapely.Polygon()
+        geometries[~single & ~built] = shapely.MultiPolygon()
+        geometries[self.missing[indices]] = None
+        return geometries
+
+    def candidates(self, other, sort=True):
+        """
+        Return the pairs of indices (self, other) of features whose bounding boxes intersect, sorted by self then other
+        """
+        tree = shapely.STRtree(shapely.box(*other.bounds.T))
+        left, right = tree.query(shapely.box(*self.bounds.T))
+        if sort:
+            order = np.lexsort((right, left))
+            left, right = left[order], right[order]
+        return left, right
+
+    def share(self):
+        """Copy the arrays into a block of shared memory and return a handle which workers can attach() to"""
+        if self._shared is None:
+            layout = {}
+            size = 0
+            for name in ARRAYS:
+                array = getattr(self, name)
+                layout[name] = (size, array.dtype.str, array.shape)
+                size += (array.nbytes + 7) // 8 * 8
+            block = shared_memory.SharedMemory(create=True, size=max(size, 8))
+            for name in ARRAYS:
+                offset, dtype, shape = layout[name]
+                view = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+                view[...] = getattr(self, name)
+            self._shared = (block, {'name': block.name, 'layout': layout, 'precision': self.precision,
+                                    'origin': self.origin})
+        return self._shared[1]
+
+    @classmethod
+    def attach(cls, handle):
+        """Return GeometryBuffers viewing (not copying) the shared memory block of a handle from share()"""
+        block = shared_memory.SharedMemory(name=handle['name'])
+        arrays = {}
+        for name in ARRAYS:
+            offset, dtype, shape = handle['layout'][name]
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        buffers = cls(precision=handle['precision'], origin=handle['origin'], **arrays)
+        buffers._block = block
+        return buffers
+
+    def release(self):
+        """Free the shared memory block created by share()"""
+        if self._shared is not None:
+            self._shared[0].close()
+            self._shared[0].unlink()
+            self._shared = None
@@ -0,0 +1,193 @@
+########################################################################################################################
+
+# Title: Geometry QA
+
+# Script description:    Geometry validation, repair and overlap detection for habitat map layers (Section 1.1.5. of
+#                        Combined_Map_Updates.py).
+#
+#                        Geometries are read out of ArcGIS as well-known binary (WKB) so that the checks can run in a
+#                        process pool from a standard Python 3 console. Overlaps within a layer are found using an
+#                        STR-tree self-join, so only pairs of polygons with intersecting bounding boxes are compared.
+#                        Pairs which GEOS cannot intersect (e.g. a self-intersecting ring which has not yet been
+#                        repaired) are intersected once both polygons have been repaired, so a single invalid polygon
+#                        does not stop the overlap report.
+
+########################################################################################################################
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def read_layer_geometries(inLayer, fields=('GUI',)):
+    """
+    Function Title: read_layer_geometries()
+    Define function to read the object ID, the requested attribute fields and the geometry (as WKB) of every feature
+    within a layer into a Pandas DataFrame
+    """
+    import arcpy
+    records = []
+    with arcpy.da.SearchCursor(inLayer, ['OID@'] + list(fields) + ['SHAPE@WKB']) as cursor:
+        for row in cursor:
+            # Geometries are returned as a bytearray, or None if the feature has a null geometry
+            records.append(row[:-1] + (bytes(row[-1]) if row[-1] is not None else None,))
+    return pd.DataFrame.from_records(records, columns=['OID'] + list(fields) + ['WKB'])
+
+
+def write_repaired_geometries(inLayer, df):
+    """
+    Function Title: write_repaired_geometries()
+    Define function to write the repaired geometries from check_geometries() back into the layer they were read from
+    """
+    import arcpy
+    spatial_reference = arcpy.Describe(inLayer).spatialReference
+    repaired = df.loc[df['Repaired'], ['OID', 'WKB']]
+    repaired = dict(zip(repaired['OID'], repaired['WKB']))
+    with arcpy.da.UpdateCursor(inLayer, ['OID@', 'SHAPE@']) as cursor:
+        for row in cursor:
+            if row[0] in repaired:
+                cursor.updateRow([row[0], arcpy.FromWKB(bytearray(repaired[row[0]]), spatial_reference)])
+    return len(repaired)
+
+
+def _polygonal(geometry):
+    """
+    Function Title: _polygonal()
+    Define function to keep only the polygon parts of a repaired geometry - make_valid() can return collapsed lines
+    and points alongside the polygons when repairing self-intersecting rings
+    """
+    if geometry is None or shapely.get_type_id(geometry) in (3, 6):
+        return geometry
+    parts = shapely.get_parts(geometry)
+    parts = parts[shapely.get_type_id(parts) == 3]
+    if len(parts) == 0:
+        return shapely.Polygon()
+    return shapely.multipolygons(parts) if len(parts) > 1 else parts[0]
+
+
+def _validate_chunk(wkbs):
+    """
+    Function Title: _validate_chunk()
+    Define function to validate and repair one chunk of WKB geometries - executed within each worker process
+    """
+    geometries = shapely.from_wkb(np.asarray(wkbs, dtype=object))
+    valid = shapely.is_valid(geometries)
+    reasons = shapely.is_valid_reason(geometries)
+    missing = shapely.is_missing(geometries)
+    reasons[missing] = 'Null geometry'
+    invalid = ~valid & ~missing
+    repaired = geometries.copy()
+    repaired[invalid] = [_polygonal(x) for x in shapely.make_valid(geometries[invalid])]
+    return valid.tolist(), reasons.tolist(), invalid.tolist(), shapely.to_wkb(repaired).tolist()
+
+
+def _intersect_pairs(left, right):
+    """Intersect pairs of geometries. If GEOS cannot intersect a pair, each pair is intersected on its own and the
+    pairs which fail are intersected again once both geometries have been repaired (as within check_geometries())"""
+    try:
+        return shapely.intersection(left, right)
+    except shapely.errors.GEOSException:
+        pass
+    overlap = np.empty(len(left), dtype=object)
+    for i in range(len(left)):
+        try:
+            overlap[i] = shapely.intersection(left[i], right[i])
+        except shapely.errors.GEOSException:
+            overlap[i] = shapely.intersection(_polygonal(shapely.make_valid(left[i])),
+                                              _polygonal(shapely.make_valid(right[i])))
+    return overlap
+
+
+def check_geometries(df, workers=None, chunk_size=5000):
+    """
+    Function Title: check_geometries()
+    Define function to validate every geometry within the 'WKB' column of a DataFrame and repair any invalid geometries.
+    Chunks of geometries are processed within a pool of worker processes (set workers=1 to run in the current process).
+    Returns a copy of the DataFrame with 'Valid', 'Validity_Reason' and 'Repaired' columns, and the repaired WKB.
+    """
+    wkbs = df['WKB'].tolist()
+    chunks = [wkbs[i:i + chunk_size] for i in range(0, len(wkbs), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [_validate_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = list(executor.map(_validate_chunk, chunks))
+
+    checked = df.copy()
+    checked['Valid'] = [x for result in results for x in result[0]]
+    checked['Validity_Reason'] = [x for result in results for x in result[1]]
+    checked['Repaired'] = [x for result in results for x in result[2]]
+    checked['WKB'] = [x for result in results for x in result[3]]
+    return checked
+
+
+def find_overlaps(df, gui_field='GUI', sliver_area=0.0, sliver_thinness=0.05):
+    """
+    Function Title: find_overlaps()
+    Define function to identify all overlapping polygons within a layer using an STR-tree self-join. Only pairs of
+    polygons whose bounding boxes intersect are tested, so the run time is proportional to the number of candidate
+    pairs rather than the square of the number of polygons.
+
+    An overlap is flagged as a sliver if its area is at or below sliver_area, or if its thinness ratio
+    (4 * pi * area / perimeter ** 2, 1 for a circle and approaching 0 for a thin strip) is below sliver_thinness.
+
+    Pairs including an invalid polygon are intersected once the polygon has been repaired, but the overlaps are most
+    reliable when df has been checked with check_geometries() (or repaired with write_repaired_geometries()) first.
+
+    Returns a DataFrame of all overlapping pairs and a summary of overlap and sliver areas for each GUI.
+    """
+    geometries = shapely.from_wkb(df['WKB'].values)
+    tree = shapely.STRtree(geometries)
+
+    # Query the tree with the layer itself - only keep each unordered pair once and drop self-matches
+    left, right = tree.query(geometries, predicate='intersects')
+    keep = left < right
+    left, right = left[keep], right[keep]
+
+    # Polygons which only share an edge or vertex intersect, but do not overlap
+    overlap = _intersect_pairs(geometries[left], geometries[right])
+    area = shapely.area(overlap)
+    keep = area > 0
+    left, right, overlap, area = left[keep], right[keep], overlap[keep], area[keep]
+
+    perimeter = shapely.length(overlap)
+    thinness = np.where(perimeter > 0, 4 * np.pi * area / np.maximum(perimeter, 1e-300) ** 2, 0.0)
+
+    gui = df[gui_field].values
+    Overlap_Pairs = pd.DataFrame({
+        'OID_1': df['OID'].values[left] if 'OID' in df else left,
+        'OID_2': df['OID'].values[right] if 'OID' in df else right,
+        gui_field + '_1': gui[left],
+        gui_field + '_2': gui[right],
+        'Overlap_Area': area,
+        'Thinness': thinness,
+        'Sliver': (area <= sliver_area) | (thinness < sliver_thinness)})
+
+    # Each overlap counts against both of the GUIs involved (once only if the overlap is within a single GUI)
+    Both_Sides = pd.concat([
+        Overlap_Pairs[[gui_field + '_1', 'Overlap_Area', 'Sliver']].set_axis([gui_field, 'Overlap_Area', 'Sliver'],
+                                                                             axis=1),
+        Overlap_Pairs.loc[Overlap_Pairs[gui_field + '_1'] != Overlap_Pairs[gui_field + '_2'],
+                          [gui_field + '_2', 'Overlap_Area', 'Sliver']].set_axis([gui_field, 'Overlap_Area', 'Sliver'],
+                                                                                 axis=1)],
+        ignore_index=True)
+    Both_Sides['Sliver_Area'] = Both_Sides['Overlap_Area'].where(Both_Sides['Sliver'], 0.0)
+
+    Overlap_Report = Both_Sides.groupby(gui_field).agg(
+        Overlap_Count=('Overlap_Area', 'size'), Overlap_Area=('Overlap_Area', 'sum'),
+        Sliver_Count=('Sliver', 'sum'), Sliver_Area=('Sliver_Area', 'sum')).reset_index()
+
+    # Attach the validity results from check_geometries() where these are available
+    if 'Valid' in df:
+        Validity = df.groupby(gui_field).agg(
+            Invalid_Count=('Valid', lambda x: int((~x.astype(bool)).sum())),
+            Repaired_Count=('Repaired', 'sum')).reset_index()
+        Overlap_Report = pd.merge(Validity, Overlap_Report, on=gui_field, how='left').fillna(
+            {'Overlap_Count': 0, 'Overlap_Area': 0.0, 'Sliver_Count': 0, 'Sliver_Area': 0.0})
+
+    return Overlap_Pairs, Overlap_Report
@@ -0,0 +1,500 @@
+########################################################################################################################
+
+# Title: Instrumentation
+
+# Script description:    Per-stage measurements for the combined map update - wall and CPU time, peak memory, feature /
+#                        row counts in and out, polygon part and vertex counts in and out (geometry=True), and bytes
+#                        read and written. Measurements are written to a JSON trace, summarised as a table, and traces
+#                        from two runs can be compared to find regressions.
+#
+#                        Any step can be measured with:
+#                            with trace('Erase', inputs=[...], outputs=[...], count=True) as record:
+#                                arcpy.Erase_analysis(...)
+#                        which does nothing unless a Tracer has been activated with set_tracer(). Individual stages can
+#                        also be profiled with cProfile or sampled with py-spy (if installed).
+#
+#                        Memory, CPU and I/O are measured for the whole Python process (including any finished worker
+#                        processes), so stages which run concurrently will share these measurements.
+
+########################################################################################################################
+
+import cProfile
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+########################################################################################################################
+
+#                                             PROCESS MEASUREMENTS                                                     #
+
+########################################################################################################################
+
+def _rss():
+    """Return the current resident set size of this process in bytes, or None if it cannot be measured"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+def _io_bytes():
+    """Return the (read, written) storage bytes of this process so far, or (None, None) if these cannot be measured"""
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return counters.read_bytes, counters.write_bytes
+        except (AttributeError, NotImplementedError, psutil.Error):
+            pass
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _cpu_seconds():
+    """Return the user + system CPU time of this process and its finished child processes"""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def _path_bytes(paths):
+    """Return the total size of a list of files / folders (e.g. file geodatabases)"""
+    total = 0
+    for path in paths or []:
+        path = str(path)
+        # Feature classes are measured by the geodatabase containing them
+        while path and not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, x)) for x in files)
+    return total
+
+
+def count_features(item):
+    """
+    Function Title: count_features()
+    Define function to count the rows / features held within a DataFrame, list, .csv, .pkl or .json file, or ArcGIS
+    feature class / table. Returns None if the item cannot be counted.
+    """
+    if hasattr(item, '__len__') and not isinstance(item, str):
+        return len(item)
+    path = str(item)
+    try:
+        if path.lower().endswith('.csv'):
+            with open(path, 'rb') as f:
+                return max(sum(1 for _ in f) - 1, 0)
+        if path.lower().endswith('.pkl'):
+            import pandas as pd
+            return len(pd.read_pickle(path))
+        if path.lower().endswith('.json'):
+            with open(path) as f:
+                return len(json.load(f))
+        import arcpy
+        return int(arcpy.GetCount_management(path).getOutput(0))
+    except Exception:
+        return None
+
+
+def count_geometry(item):
+    """
+    Function Title: count_geometry()
+    Define function to count the polygon parts and vertices held within a layer (a DataFrame with a 'WKB' column) or
+    ArcGIS feature class. Returns (None, None) if the item cannot be counted.
+    """
+    if hasattr(item, 'columns'):
+        if 'WKB' not in item.columns:
+            return None, None
+        import shapely
+        geometries = shapely.from_wkb(item['WKB'].values)
+        return int(shapely.get_num_geometries(geometries).sum()), int(shapely.get_num_coordinates(geometries).sum())
+    try:
+        import arcpy
+        parts = vertices = 0
+        with arcpy.da.SearchCursor(str(item), ['SHAPE@']) as cursor:
+            for row in cursor:
+                if row[0] is not None:
+                    parts += row[0].partCount
+                    vertices += row[0].pointCount
+        return parts, vertices
+    except Exception:
+        return None, None
+
+
+def _count_geometry(items):
+    counts = [count_geometry(x) for x in items]
+    if not counts or any(None in x for x in counts):
+        return None, None
+    return sum(x[0] for x in counts), sum(x[1] for x in counts)
+
+
+class _MemorySampler(threading.Thread):
+    """Background thread recording the peak resident set size while a stage runs"""
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.peak = _rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = _rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        rss = _rss()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+        return self.peak
+
+
+########################################################################################################################
+
+#                                                    TRACING                                                           #
+
+########################################################################################################################
+
+class StageRecord(object):
+    """
+    Class Title: StageRecord
+    Measurements of a single stage. Counts which are not measured automatically can be set within the stage, e.g.
+    record.rows_out = len(Comparison_DF)
+    """
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.started = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_bytes = None
+        self.rows_in = None
+        self.rows_out = None
+        self.parts_in = None
+        self.parts_out = None
+        self.vertices_in = None
+        self.vertices_out = None
+        self.bytes_read = None
+        self.bytes_written = None
+        self.profile = None
+        self.error = None
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class _NullRecord(object):
+    """Stand-in used by trace() when no Tracer is active - accepts and ignores any measurements"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+class Tracer(object):
+    """
+    Class Title: Tracer
+    Collects a StageRecord for every traced stage.
+
+    profile maps stage names to 'cprofile' or 'py-spy' to profile those stages - cProfile statistics (.prof) or py-spy
+    flame graphs (.svg) are written to profile_dir. sample_interval is the time in seconds between memory samples.
+    """
+
+    def __init__(self, trace_path=None, profile=None, profile_dir=None, sample_interval=0.05):
+        self.trace_path = trace_path
+        self.profile = dict(profile or {})
+        self.profile_dir = profile_dir or (os.path.dirname(os.path.abspath(trace_path)) if trace_path else os.getcwd())
+        self.sample_interval = sample_interval
+        self.records = []
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _start_profiler(self, record):
+        mode = self.profile.get(record.name)
+        if not mode:
+            return None
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        stem = os.path.join(self.profile_dir, '%s_%s' % (record.name, time.strftime('%Y%m%d_%H%M%S')))
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            record.profile = stem + '.prof'
+            return profiler
+        if mode == 'py-spy':
+            # On Windows py-spy runs within its own process group, so that stopping it (see _stop_profiler()) does not
+            # also interrupt this process and the rest of its console
+            creationflags = subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+            try:
+                process = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()), '--output', stem + '.svg',
+                                            '--nonblocking'], creationflags=creationflags)
+            except OSError:
+                print("py-spy is not installed - stage '%s' will not be sampled" % record.name)
+                return None
+            record.profile = stem + '.svg'
+            return process
+        raise ValueError("Unknown profiler '%s' for stage '%s'" % (mode, record.name))
+
+    @staticmethod
+    def _stop_profiler(profiler, record):
+        if profiler is None:
+            return
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(record.profile)
+        else:
+            # py-spy writes its output when interrupted - CTRL_C_EVENT would be sent to the whole console process group,
+            # while CTRL_BREAK_EVENT only reaches py-spy's own process group
+            profiler.send_signal(signal.CTRL_BREAK_EVENT if os.name == 'nt' else signal.SIGINT)
+            profiler.wait()
+
+    def stage(self, name, inputs=None, outputs=None, count=False, rows_in=None, geometry=False):
+        """
+        Return a context manager measuring the stage 'name'. inputs and outputs are the files / feature classes read and
+        written by the stage - these are counted if count is True (outside the timed section), and are used to estimate
+        the bytes read and written where the operating system does not report these. If geometry is True the polygon
+        parts and vertices of the inputs and outputs are also counted (outside the timed section).
+        """
+        return _StageContext(self, name, inputs, outputs, count, rows_in, geometry)
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+        if self.trace_path:
+            self.write_trace(self.trace_path)
+
+    def write_trace(self, path):
+        """Write all records to a JSON trace file (rewritten after each stage so that a failed run keeps its trace)"""
+        with self._lock:
+            trace_data = {'started': self.started, 'host': platform.node(), 'python': sys.version.split()[0],
+                          'stages': [x.as_dict() for x in self.records]}
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(trace_data, f, indent=2)
+        os.replace(tmp, path)
+
+    def summary(self):
+        """Return a table summarising every stage"""
+        return summary_table([x.as_dict() for x in self.records])
+
+
+class _StageContext(object):
+
+    def __init__(self, tracer, name, inputs, outputs, count, rows_in, geometry=False):
+        self.tracer = tracer
+        self.inputs = _paths(inputs)
+        self.outputs = _paths(outputs)
+        self.count = count
+        self.geometry = geometry
+        stack = getattr(tracer._local, 'stack', None)
+        if stack is None:
+            stack = tracer._local.stack = []
+        self.stack = stack
+        self.record = StageRecord(name, parent=stack[-1].name if stack else None)
+        self.record.rows_in = rows_in
+
+    def __enter__(self):
+        record = self.record
+        if self.count and record.rows_in is None and self.inputs:
+            counts = [count_features(x) for x in self.inputs]
+            record.rows_in = None if None in counts else sum(counts)
+        if self.geometry and self.inputs:
+            record.parts_in, record.vertices_in = _count_geometry(self.inputs)
+        self.stack.append(record)
+        record.started = time.strftime('%Y-%m-%d %H:%M:%S')
+        self._io = _io_bytes()
+        self._sampler = _MemorySampler(self.tracer.sample_interval)
+        self._sampler.start()
+        self._profiler = self.tracer._start_profiler(record)
+        self._cpu = _cpu_seconds()
+        self._wall = time.perf_counter()
+        return record
+
+    def __exit__(self, exc_type, exc_value, tb):
+        record = self.record
+        record.wall_seconds = time.perf_counter() - self._wall
+        record.cpu_seconds = _cpu_seconds() - self._cpu
+        self.tracer._stop_profiler(self._profiler, record)
+        record.peak_rss_bytes = self._sampler.stop()
+        read, written = _io_bytes()
+        if read is not None and self._io[0] is not None:
+            record.bytes_read, record.bytes_written = read - self._io[0], written - self._io[1]
+        else:
+            record.bytes_read, record.bytes_written = _path_bytes(self.inputs), _path_bytes(self.outputs)
+        if exc_type is not None:
+            record.error = '%s: %s' % (exc_type.__name__, exc_value)
+        elif self.count and record.rows_out is None and self.outputs:
+            counts = [count_features(x) for x in self.outputs]
+            record.rows_out = None if None in counts else sum(counts)
+        if exc_type is None and self.geometry and self.outputs:
+            record.parts_out, record.vertices_out = _count_geometry(self.outputs)
+        self.stack.pop()
+        self.tracer.add(record)
+        return False
+
+
+def _paths(items):
+    if items is None:
+        return []
+    if isinstance(items, dict):
+        return list(items.values())
+    if isinstance(items, (list, tuple)):
+        return list(items)
+    return [items]
+
+
+########################################################################################################################
+
+#                                               ACTIVE TRACER                                                          #
+
+########################################################################################################################
+
+_active_tracer = None
+
+
+def set_tracer(tracer):
+    """
+    Function Title: set_tracer()
+    Define function to activate a Tracer for every call to trace() (or deactivate tracing with set_tracer(None))
+    """
+    global _active_tracer
+    _active_tracer = tracer
+    return tracer
+
+
+def get_tracer():
+    return _active_tracer
+
+
+def trace(name, inputs=None, outputs=None, count=False, rows_in=None, geometry=False):
+    """
+    Function Title: trace()
+    Define function to measure a stage with the active Tracer - does nothing if no Tracer has been activated
+    """
+    if _active_tracer is None:
+        return _NullRecord()
+    return _active_tracer.stage(name, inputs=inputs, outputs=outputs, count=count, rows_in=rows_in, geometry=geometry)
+
+
+########################################################################################################################
+
+#                                              SUMMARIES AND COMPARISON                                                #
+
+########################################################################################################################
+
+def _format(value, unit=None):
+    if value is None:
+        return '-'
+    if unit == 'bytes':
+        for suffix in ['B', 'KB', 'MB', 'GB']:
+            if abs(value) < 1024 or suffix == 'GB':
+                return '%.1f %s' % (value, suffix) if suffix != 'B' else '%d B' % value
+            value /= 1024.0
+    if isinstance(value, float):
+        return '%.2f' % value
+    return str(value)
+
+
+def summary_table(records):
+    """
+    Function Title: summary_table()
+    Define function to format a list of stage records (from a Tracer or a JSON trace) as a text table
+    """
+    columns = [('Stage', 'name', None), ('Wall (s)', 'wall_seconds', None), ('CPU (s)', 'cpu_seconds', None),
+               ('Peak RSS', 'peak_rss_bytes', 'bytes'), ('Rows in', 'rows_in', None), ('Rows out', 'rows_out', None),
+               ('Vertices in', 'vertices_in', None), ('Vertices out', 'vertices_out', None),
+               ('Read', 'bytes_read', 'bytes'), ('Written', 'bytes_written', 'bytes')]
+    rows = []
+    for record in records:
+        name = ('  ' + record['name']) if record.get('parent') else record['name']
+        if record.get('error'):
+            name += ' (failed)'
+        rows.append([name] + [_format(record.get(key), unit) for _, key, unit in columns[1:]])
+    widths = [max([len(title)] + [len(row[i]) for row in rows]) for i, (title, _, _) in enumerate(columns)]
+    lines = ['  '.join(title.ljust(widths[i]) if i == 0 else title.rjust(widths[i])
+                       for i, (title, _, _) in enumerate(columns))]
+    lines.append('  '.join('-' * width for width in widths))
+    for row in rows:
+        lines.append('  '.join(value.ljust(widths[i]) if i == 0 else value.rjust(widths[i])
+                               for i, value in enumerate(row)))
+    return '\n'.join(lines)
+
+
+def load_trace(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_traces(baseline_path, current_path, threshold=0.2, min_seconds=1.0):
+    """
+    Function Title: compare_traces()
+    Define function to compare the wall time and peak memory of each stage between two JSON traces. Returns a list of
+    (stage, measure, baseline, current, change) for every stage which has become more than threshold (20 %) slower or
+    larger. Stages taking less than min_seconds within both runs are ignored for timing. Stages are matched by name and
+    parent, and repeated stages are summed.
+    """
+    def totals(trace_data):
+        result = {}
+        for record in trace_data['stages']:
+            key = (record.get('parent'), record['name'])
+            total = result.setdefault(key, {'wall_seconds': 0.0, 'peak_rss_bytes': 0})
+            total['wall_seconds'] += record.get('wall_seconds') or 0.0
+            total['peak_rss_bytes'] = max(total['peak_rss_bytes'], record.get('peak_rss_bytes') or 0)
+        return result
+
+    baseline = totals(load_trace(baseline_path))
+    current = totals(load_trace(current_path))
+    regressions = []
+    for key in sorted(set(baseline) & set(current), key=lambda x: (x[0] or '', x[1])):
+        for measure in ['wall_seconds', 'peak_rss_bytes']:
+            old, new = baseline[key][measure], current[key][measure]
+            if measure == 'wall_seconds' and max(old, new) < min_seconds:
+                continue
+            if old > 0 and (new - old) / float(old) > threshold:
+                regressions.append(('/'.join(x for x in key if x), measure, old, new, (new - old) / float(old)))
+    return regressions
+
+
+if __name__ == '__main__':
+    # Summarise one trace, or compare two traces: python -m combined_map.Instrumentation baseline.json [current.json]
+    if len(sys.argv) == 2:
+        print(summary_table(load_trace(sys.argv[1])['stages']))
+    elif len(sys.argv) == 3:
+        found = compare_traces(sys.argv[1], sys.argv[2])
+        for stage_name, measure, old, new, change in found:
+            print('%s: %s %s -> %s (%+.0f %%)' % (stage_name, measure, _format(old), _format(new), change * 100))
+        if not found:
+            print('No regressions found')
+        sys.exit(1 if found else 0)
+    else:
+        print('Usage: python -m combined_map.Instrumentation trace.json [current_trace.json]')
+        sys.exit(2)
@@ -0,0 +1,238 @@
+########################################################################################################################
+
+# Title: Lazy Decisions
+
+# Script description:    Sections 3.3. - 3.8. of the combined map update (metadata checks and decision tree analysis)
+#                        expressed as a single Polars query plan, as an optional alternative to the Pandas functions
+#                        within Combined_Map_Stages.py.
+#
+#                        The intersection and merged map attribute tables are scanned lazily, so only the columns
+#                        used by the decision tree are read, and the intermediate DataFrames of the Pandas version
+#                        (Intersected_Maps, Control_DF, Combined_Attributes, Combined_Aggregated_Attributes,
+#                        New_Decision_Attributes etc.) are never materialised. Only the metadata check outputs, the
+#                        comparison output, Requires_Judgement and Join_Results are collected, in one multi-threaded
+#                        pass which shares the common parts of their plans.
+#
+#                        The results are identical to those of the Pandas version (including the index and data types
+#                        written to the output .csv files), so either version may be used within the pipeline. The zone
+#                        of every distinct HAB_TYPE value is looked up within the EUNIS registry, as by
+#                        habitat_classifier(). The decision tree itself is a Polars expression reproducing one version
+#                        of decision_tree() (LAZY_DECISION_TREE_VERSION) - the plan is not built once the rules of
+#                        decision_tree() move on to another DECISION_TREE_VERSION.
+#                        Polars must be installed to use this module (pip install polars).
+
+########################################################################################################################
+
+import polars as pl
+
+from .Combined_Map_Functions import DECISION_TREE_VERSION
+from .Combined_Map_Stages import read_table
+from .EUNIS_Registry import get_registry
+
+#   Strings read as 'nan' by pd.read_csv(), so that both versions read the same values as missing
+PANDAS_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>',
+                    'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+#   Version of decision_tree() (DECISION_TREE_VERSION within Combined_Map_Functions.py) which _decision() reproduces -
+#   update _decision() and this version together whenever the rules of decision_tree() change
+LAZY_DECISION_TREE_VERSION = 1
+
+SCORE_COLUMNS = ['New_3_Step_Confidence_Score', 'Existing_3_Step_Confidence_Score', 'New_MESH_Score',
+                 'Existing_MESH_Score']
+
+
+def scan_attributes(path):
+    """
+    Function Title: scan_attributes()
+    Define function to lazily scan an attribute table exported from ArcGIS (.csv), reading missing values as
+    pd.read_csv() does
+    """
+    return pl.scan_csv(path, null_values=PANDAS_NA_VALUES, infer_schema_length=None,
+                       schema_overrides={'HAB_TYPE': pl.String})
+
+
+def load_confidence_frames(confidence_path, tracking_path):
+    """
+    Function Title: load_confidence_frames()
+    Section 3.4.1. - Load the confidence scores and GUI tracking document (small Excel spreadsheets) with Pandas, so
+    that their data types match the Pandas version, and return them as LazyFrames
+    """
+    UK_Meta_Confidence = read_table(confidence_path, 'Confidence scores')[['GUI', 'NewTotal', 'Overall score']]
+    GUI_Tracking = read_table(tracking_path, 'Sheet1')[['Globally unique ID', 'Dataset Title']]
+    ThreeStep_GUI_Confidence = pl.from_pandas(UK_Meta_Confidence).lazy().with_columns(
+        _confidence_check('NewTotal').alias('Confidence_check'))
+    return ThreeStep_GUI_Confidence, pl.from_pandas(GUI_Tracking).lazy()
+
+
+def _confidence_check(column):
+    """Expression equivalent of confidence_check()"""
+    return pl.when(pl.col(column) >= 0).then(pl.lit('3-Step confidence present')) \
+        .otherwise(pl.lit('Requires 3-Step confidence'))
+
+
+def _zone_flags(attributes):
+    """Table of every distinct HAB_TYPE value and whether it holds an intertidal or sub-tidal EUNIS code, looked up
+    within the EUNIS registry (EUNIS_Registry.py) exactly as by habitat_classifier()"""
+    registry = get_registry()
+
+    def flags(zone):
+        return lambda habitats: pl.Series([zone in registry.zones(x) for x in habitats], dtype=pl.Boolean)
+
+    return attributes.select('HAB_TYPE').unique().with_columns(
+        pl.col('HAB_TYPE').map_batches(flags('Intertidal'), return_dtype=pl.Boolean).alias('Intertidal'),
+        pl.col('HAB_TYPE').map_batches(flags('Sub-tidal'), return_dtype=pl.Boolean).alias('Sub-tidal'))
+
+
+def _habitat_classification():
+    """Expression equivalent of habitat_classifier(), aggregating the zone flags (see _zone_flags()) of each GUI"""
+    intertidal = pl.col('Intertidal').any()
+    subtidal = pl.col('Sub-tidal').any()
+    return pl.when(intertidal & subtidal).then(pl.lit('Mixed habitat')) \
+        .when(intertidal).then(pl.lit('Intertidal')) \
+        .when(subtidal).then(pl.lit('Sub-tidal')) \
+        .otherwise(pl.lit('Error')).alias('Habitat_Classification')
+
+
+def _decision():
+    """Expression equivalent of decision_tree(), with missing confidence scores treated as 0"""
+    new_3, existing_3, new_mesh, existing_mesh = [pl.col(x).fill_null(0) for x in SCORE_COLUMNS]
+    new, existing = pl.col('NewGUI'), pl.col('ExistingGUI')
+    new_class, existing_class = pl.col('New_Habitat_Classification'), pl.col('Existing_Habitat_Classification')
+    compared = new_class.is_in(['Mixed habitat', 'Sub-tidal']) & existing_class.is_in(['Mixed habitat', 'Sub-tidal'])
+    judgement = pl.lit('Requires expert judgement')
+    return pl.when(new_class == 'Intertidal').then(new) \
+        .when(new_class.is_in(['Mixed habitat', 'Sub-tidal']) & (existing_class == 'Intertidal')).then(existing) \
+        .when(compared & (new_3 > existing_3)).then(new) \
+        .when(compared & (new_3 < existing_3)).then(existing) \
+        .when(compared & (new_3 == existing_3) & (new_mesh > existing_mesh)).then(new) \
+        .when(compared & (new_3 == existing_3) & (new_mesh < existing_mesh)).then(existing) \
+        .when(compared & (new_3 == existing_3) & (new_mesh == existing_mesh)).then(judgement) \
+        .alias('Comparison_Result')
+
+
+def _decision_attributes(attributes, ThreeStep_GUI_Confidence, mcz_field):
+    """
+    Sections 3.5. / 3.6. - Classify the habitats of each map and attach the first confidence scores and MCZ value
+    recorded for its GUI (as pd.merge(..., how='left') followed by drop_duplicates(subset=['GUI']))
+    """
+    classified = attributes.filter(pl.col('GUI').is_not_null()) \
+        .join(_zone_flags(attributes), on='HAB_TYPE', how='left', nulls_equal=True) \
+        .group_by('GUI').agg(_habitat_classification()).sort('GUI')
+    confidence = ThreeStep_GUI_Confidence.select(['GUI', 'NewTotal', 'Overall score']) \
+        .unique(subset=['GUI'], keep='first', maintain_order=True)
+    mcz = attributes.select(['GUI', mcz_field]).unique(subset=['GUI'], keep='first', maintain_order=True)
+    return classified.join(confidence, on='GUI', how='left', maintain_order='left') \
+        .with_columns(_confidence_check('NewTotal').alias('Confidence_check')) \
+        .join(mcz, on='GUI', how='left', maintain_order='left')
+
+
+def build_decision_plan(intersection_path, merged_path, confidence_path, tracking_path):
+    """
+    Function Title: build_decision_plan()
+    Define function to build the query plans of Sections 3.3. - 3.8. Returns a dictionary of LazyFrames holding the
+    outputs of run_metadata_checks() and run_decision_tree(), and of the columns which Pandas would hold as floats.
+    """
+    if LAZY_DECISION_TREE_VERSION != DECISION_TREE_VERSION:
+        raise ValueError('The lazy decision tree reproduces version %d of decision_tree(), but version %d is in use - '
+                         'update _decision() within Lazy_Decisions.py, or run the decision tree with Pandas'
+                         % (LAZY_DECISION_TREE_VERSION, DECISION_TREE_VERSION))
+    Intersection_Attributes = scan_attributes(intersection_path)
+    Merged_Attributes = scan_attributes(merged_path)
+    ThreeStep_GUI_Confidence, GUI_Tracking = load_confidence_frames(confidence_path, tracking_path)
+
+    # Section 3.3. - Unique intersections between new and existing maps
+    Control_DF = Intersection_Attributes.select(['GUI_1', 'GUI']) \
+        .unique(keep='first', maintain_order=True).rename({'GUI_1': 'NewGUI', 'GUI': 'ExistingGUI'})
+
+    # Section 3.4. - Metadata checks 1 - 4
+    Non_UKSM_Intersections = Control_DF.filter(~pl.col('ExistingGUI').is_in(['UKSM']).fill_null(False))
+    JNCC_Missing_Confidence = ThreeStep_GUI_Confidence \
+        .join(Non_UKSM_Intersections.select(pl.col('NewGUI').alias('GUI')).unique(), on='GUI', how='semi',
+              nulls_equal=True, maintain_order='left') \
+        .join(GUI_Tracking, left_on='GUI', right_on='Globally unique ID', how='left', nulls_equal=True,
+              maintain_order='left_right') \
+        .with_row_index('index')
+    checks = {
+        'JNCC_Missing_Confidence_output': JNCC_Missing_Confidence.filter(
+            pl.col('Confidence_check') == 'Requires 3-Step confidence'),
+        'GUI_Zero_Confidence': JNCC_Missing_Confidence.filter(pl.col('NewTotal') == 0),
+        'NotIn_UKMetaConf2012': Control_DF.join(ThreeStep_GUI_Confidence.select('GUI'), left_on='ExistingGUI',
+                                                right_on='GUI', how='anti', nulls_equal=True, maintain_order='left')
+        .select(pl.col('ExistingGUI').alias('MissingGUI')).unique(maintain_order=True).with_row_index('index'),
+        'Zero_MESH_Confidence': JNCC_Missing_Confidence.filter(pl.col('Overall score') == 0)}
+
+    # Sections 3.5. - 3.6. - Decision attributes of the new and intersected existing maps
+    New_Decision_Attributes = _decision_attributes(Merged_Attributes, ThreeStep_GUI_Confidence, 'MCZ_Source')
+    Combined_Decision_Attributes = _decision_attributes(Intersection_Attributes, ThreeStep_GUI_Confidence,
+                                                        'MCZ_Original_survey')
+
+    # Sections 3.7. - 3.8. - Comparison data set and decision tree analysis
+    New = New_Decision_Attributes.select(
+        pl.col('GUI').alias('NewGUI'), pl.col('Habitat_Classification').alias('New_Habitat_Classification'),
+        pl.col('NewTotal').alias('New_3_Step_Confidence_Score'), pl.col('Overall score').alias('New_MESH_Score'),
+        pl.col('MCZ_Source').alias('New_MCZ_Source'))
+    Existing = Combined_Decision_Attributes.select(
+        pl.col('GUI').alias('ExistingGUI'),
+        pl.col('Habitat_Classification').alias('Existing_Habitat_Classification'),
+        pl.col('NewTotal').alias('Existing_3_Step_Confidence_Score'),
+        pl.col('Overall score').alias('Existing_MESH_Score'),
+        pl.col('MCZ_Original_survey').alias('Existing_MCZ_Original_survey'))
+    Comparison_DF = Control_DF \
+        .join(New, on='NewGUI', how='inner', maintain_order='left_right') \
+        .join(Existing, on='ExistingGUI', how='inner', maintain_order='left_right') \
+        .select(['NewGUI', 'ExistingGUI', 'New_Habitat_Classification', 'Existing_Habitat_Classification',
+                 'New_3_Step_Confidence_Score', 'Existing_3_Step_Confidence_Score', 'New_MESH_Score',
+                 'Existing_MESH_Score', 'New_MCZ_Source', 'Existing_MCZ_Original_survey']) \
+        .with_columns(_decision()) \
+        .with_row_index('index')
+
+    plan = dict(checks)
+    plan['Comparison_DF'] = Comparison_DF
+    plan['Requires_Judgement'] = Comparison_DF.filter(pl.col('Comparison_Result') == 'Requires expert judgement')
+    plan['Join_Results'] = Comparison_DF.select(['index', 'NewGUI', 'ExistingGUI', 'Comparison_Result'])
+
+    # Pandas stores a column of integers as floats once it holds a missing value - record where a left join (or the
+    # attribute table itself) introduces missing values, so the collected outputs can be given the same data types
+    plan['New_Missing'] = pl.concat([
+        New.select(pl.exclude('New_MCZ_Source').is_null().any()),
+        Merged_Attributes.select(pl.col('MCZ_Source').is_null().any().alias('New_MCZ_Source'))], how='horizontal')
+    plan['Existing_Missing'] = pl.concat([
+        Existing.select(pl.exclude('Existing_MCZ_Original_survey').is_null().any()),
+        Intersection_Attributes.select(pl.col('MCZ_Original_survey').is_null().any()
+                                       .alias('Existing_MCZ_Original_survey'))], how='horizontal')
+    return plan
+
+
+def _to_pandas(df, float_columns=()):
+    """Convert a collected output to Pandas, using the row index column as the DataFrame index"""
+    casts = [pl.col(x).cast(pl.Float64) for x in float_columns if x in df.columns and df.schema[x].is_integer()]
+    Output = df.with_columns(casts).to_pandas()
+    if 'index' in Output.columns:
+        Output = Output.set_index('index')
+        Output.index.name = None
+    return Output
+
+
+def run_lazy_decisions(intersection_path, merged_path, confidence_path, tracking_path):
+    """
+    Function Title: run_lazy_decisions()
+    Define function to collect the outputs of Sections 3.3. - 3.8. Returns a dictionary of Pandas DataFrames holding
+    the four metadata check outputs, Comparison_DF, Requires_Judgement and Join_Results, identical to those returned by
+    run_metadata_checks() and run_decision_tree()
+    """
+    plan = build_decision_plan(intersection_path, merged_path, confidence_path, tracking_path)
+    names = list(plan)
+    collected = dict(zip(names, pl.collect_all([plan[x] for x in names])))
+
+    # Columns of the comparison data set which would hold a missing value within the Pandas version
+    missing = collected.pop('New_Missing').to_dicts()[0]
+    missing.update(collected.pop('Existing_Missing').to_dicts()[0])
+    float_columns = [x for x, v in missing.items() if v]
+
+    outputs = {}
+    for name, df in collected.items():
+        outputs[name] = _to_pandas(df, float_columns)
+    for name in ['Comparison_DF', 'Requires_Judgement']:
+        for column in SCORE_COLUMNS:
+            outputs[name][column] = outputs[name][column].fillna(0)
+    return outputs
@@ -0,0 +1,152 @@
+########################################################################################################################
+
+# Title: Measures
+
+# Script description:    Areas (km2) and perimeters (km) of every polygon within a layer in WGS 1984 longitude /
+#                        latitude, calculated on the WGS 1984 ellipsoid in one pass over the coordinates of the layer
+#                        (see Geometry_Buffers.py) rather than one geometry at a time:
+#                            - areas are calculated within the Lambert cylindrical equal-area projection of the
+#                              ellipsoid, which preserves area exactly;
+#                            - perimeters are summed from the length of every edge on the ellipsoid, using the
+#                              meridian and prime vertical radii of curvature at the middle of the edge (suited to the
+#                              short edges of habitat polygons).
+#
+#                        Large layers are measured in chunks of features, which can be run across several worker
+#                        processes sharing the layer within shared memory (workers=N, as within Overlay.py).
+#
+#                        Used to complete the AreaKm2 field of the updated combined map (calculate_area_field()), the
+#                        area of the overlap between each new and existing map within the decision tree outputs (see
+#                        Combined_Map_Stages.py) and the areas within Change_Detection.py.
+
+########################################################################################################################
+
+import numpy as np
+
+from . import Overlay
+from .Geometry_Buffers import GeometryBuffers
+
+#   WGS 1984 ellipsoid - semi-major axis (m) and flattening
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257223563
+ECCENTRICITY_2 = FLATTENING * (2 - FLATTENING)
+
+
+def _authalic_q(latitude):
+    """Return q (Snyder, 1987, eq. 3-12) of latitudes in radians, proportional to the area between them and the
+    equator"""
+    e = np.sqrt(ECCENTRICITY_2)
+    sin_lat = np.sin(latitude)
+    return (1 - ECCENTRICITY_2) * (sin_lat / (1 - ECCENTRICITY_2 * sin_lat ** 2) -
+                                   np.log((1 - e * sin_lat) / (1 + e * sin_lat)) / (2 * e))
+
+
+def measure_buffers(buffers, start=0, stop=None):
+    """
+    Function Title: measure_buffers()
+    Define function to calculate the area (km2) and perimeter (km) of the features from start to stop of a
+    GeometryBuffers object. Null geometries are given NaN values.
+    """
+    stop = len(buffers) if stop is None else stop
+    feature_offsets = buffers.feature_offsets[start:stop + 1]
+    part_offsets = buffers.part_offsets[feature_offsets[0]:feature_offsets[-1] + 1]
+    ring_offsets = buffers.ring_offsets[part_offsets[0]:part_offsets[-1] + 1]
+    coords = buffers.decoded_coords(slice(ring_offsets[0], ring_offsets[-1]))
+    feature_offsets, part_offsets = feature_offsets - feature_offsets[0], part_offsets - part_offsets[0]
+    ring_offsets = ring_offsets - ring_offsets[0]
+    features, rings = stop - start, len(ring_offsets) - 1
+
+    longitude, latitude = np.radians(coords[:, 0]), np.radians(coords[:, 1])
+    x, y = SEMI_MAJOR_AXIS * longitude, SEMI_MAJOR_AXIS * _authalic_q(latitude) / 2
+
+    # Every vertex but the last of each ring starts an edge - twice the area of each ring is the sum of the cross
+    # products of its edges (the shoelace formula)
+    edge = np.ones(max(len(coords) - 1, 0), dtype=bool)
+    edge[ring_offsets[1:-1] - 1] = False
+    cross = np.where(edge, x[:-1] * y[1:] - x[1:] * y[:-1], 0.0)
+    middle = (latitude[:-1] + latitude[1:]) / 2
+    curvature = 1 - ECCENTRICITY_2 * np.sin(middle) ** 2
+    meridian = SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_2) / curvature ** 1.5
+    prime_vertical = SEMI_MAJOR_AXIS / np.sqrt(curvature)
+    lengths = np.where(edge, np.hypot(meridian * np.diff(latitude),
+                                      prime_vertical * np.cos(middle) * np.diff(longitude)), 0.0)
+
+    ring_of_edge = np.repeat(np.arange(rings), np.diff(ring_offsets))[:len(edge)]
+    ring_areas = np.abs(np.bincount(ring_of_edge, cross, minlength=rings)) / 2
+    ring_lengths = np.bincount(ring_of_edge, lengths, minlength=rings)
+
+    # The first ring of each polygon part is its exterior ring, and all others are holes
+    sign = -np.ones(rings)
+    sign[part_offsets[:-1][np.diff(part_offsets) > 0]] = 1
+    feature_of_ring = np.repeat(np.repeat(np.arange(features), np.diff(feature_offsets)), np.diff(part_offsets))
+    area = np.bincount(feature_of_ring, ring_areas * sign, minlength=features) / 1e6
+    length = np.bincount(feature_of_ring, ring_lengths, minlength=features) / 1e3
+    missing = buffers.missing[start:stop]
+    area[missing], length[missing] = np.nan, np.nan
+    return area, length
+
+
+def _measure_task(task):
+    start, stop = task
+    return measure_buffers(Overlay._layers['layer'], start, stop)
+
+
+def measure_layer(layer, workers=None, chunk_size=50000):
+    """
+    Function Title: measure_layer()
+    Define function to calculate the area (km2) and perimeter (km) of every feature of a layer (a DataFrame with a
+    'WKB' column, or GeometryBuffers), chunk_size features at a time, within worker processes if workers > 1
+    """
+    if len(layer) == 0:
+        return np.zeros(0), np.zeros(0)
+    buffers = layer if isinstance(layer, GeometryBuffers) else GeometryBuffers.from_wkb(layer['WKB'].values)
+    tasks = Overlay._chunks(len(buffers), chunk_size)
+    if workers is None or workers <= 1 or len(tasks) == 1:
+        results = [measure_buffers(buffers, start, stop) for start, stop in tasks]
+    else:
+        results = Overlay._run_parallel({'layer': buffers}, _measure_task, tasks, workers)
+    return np.concatenate([x[0] for x in results]), np.concatenate([x[1] for x in results])
+
+
+def measure_geometries(geometries):
+    """
+    Function Title: measure_geometries()
+    Define function to calculate the area (km2) and perimeter (km) of an array of Shapely polygons / multi-polygons
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if len(geometries) == 0:
+        return np.zeros(0), np.zeros(0)
+    return measure_buffers(GeometryBuffers.from_geometries(geometries))
+
+
+def add_area_field(layer, field='AreaKm2', workers=None):
+    """
+    Function Title: add_area_field()
+    Define function to return a copy of a layer (a DataFrame with a 'WKB' column) with the area (km2) of every feature
+    within field
+    """
+    Measured = layer.copy()
+    Measured[field] = measure_layer(layer, workers)[0]
+    return Measured
+
+
+def calculate_area_field(inLayer, field='AreaKm2', workers=None):
+    """
+    Function Title: calculate_area_field()
+    Define function to complete the area (km2) field of an ArcGIS feature class in WGS 1984 longitude / latitude (e.g.
+    AreaKm2 of the combined map, which is not updated by the ArcGIS overlay tools), adding the field if needed
+    """
+    import arcpy
+    from .Geometry_QA import read_layer_geometries
+    spatial_reference = arcpy.Describe(inLayer).spatialReference
+    if spatial_reference.type != 'Geographic':
+        raise ValueError('%s must be in longitude / latitude to calculate %s, not %s' % (inLayer, field,
+                                                                                         spatial_reference.name))
+    if field not in [x.name for x in arcpy.ListFields(inLayer)]:
+        arcpy.AddField_management(inLayer, field, "DOUBLE")
+    Layer = read_layer_geometries(inLayer, [])
+    areas = dict(zip(Layer['OID'], measure_layer(Layer, workers)[0]))
+    with arcpy.da.UpdateCursor(inLayer, ['OID@', field]) as cursor:
+        for row in cursor:
+            area = areas.get(row[0])
+            cursor.updateRow([row[0], None if area is None or np.isnan(area) else float(area)])
+    return len(areas)
@@ -0,0 +1,193 @@
+########################################################################################################################
+
+# Title: Output Writer
+
+# Script description:    Background writer for the tables handed over to the mapping team during an update - the
+#                        metadata check outputs (JNCC_Missing_Confidence_output, GUI_Zero_Confidence,
+#                        NotIn_UKMetaConf2012, Zero_MESH_Confidence), the intersection attributes (in place of the
+#                        TableToExcel output) and the decision tree outputs (NewCombinedMap_ComparisonOutput,
+#                        Requires_Judgement, Join_Results) - which are usually written to network drives (J:\, Z:\).
+#
+#                        Each table is queued with publish() (or OutputWriter.write()) and written by a small pool of
+#                        background threads, so the stages producing them carry straight on rather than waiting on the
+#                        network drive. Tables are written as Parquet (compact, and keeping the column types), and
+#                        optionally as .csv for opening in Excel. Every file is first written to a temporary file
+#                        within the output folder and then renamed into place, so a reader never sees a partly written
+#                        file and an interrupted write leaves any earlier version in place. Failed writes are retried
+#                        (e.g. after the network drive drops out), then reported when the writer is waited on.
+#
+#                        Within the pipeline (see Combined_Map_Stages.py) set output_folder within the update config
+#                        file (and output_formats, e.g. ["parquet", "csv"]). The pipeline waits for every queued table
+#                        once all of its stages have finished. The stage outputs within the checkpoint folder are still
+#                        written by each stage, as the stages after it read them.
+
+########################################################################################################################
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .Instrumentation import trace
+
+#   File extensions of the formats which tables can be written in
+FORMATS = {'parquet': '.parquet', 'csv': '.csv'}
+
+
+def _arrow_safe(df):
+    """Return a DataFrame which can be written to Parquet - object columns holding anything other than strings (e.g.
+    the lists of GUIs within the control DataFrame, or a mix of numbers and text) are written as text. The queued
+    DataFrame is never modified, as a stage may still be using it."""
+    Safe = df.copy(deep=False)
+    for column in df.columns[df.dtypes.values == object]:
+        values = df[column].dropna()
+        if not values.map(lambda x: isinstance(x, str)).all():
+            Safe[column] = df[column].map(lambda x: x if x is None or isinstance(x, str) else str(x))
+    Safe.columns = [str(x) for x in Safe.columns]
+    return Safe
+
+
+def write_table(df, path, file_format=None, index=True):
+    """
+    Function Title: write_table()
+    Define function to write a DataFrame to a Parquet or .csv file (by the extension of path if file_format is not
+    given) through a temporary file within the same folder, which replaces path once it is complete
+    """
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    if file_format not in FORMATS:
+        raise ValueError("Unknown output format '%s' - use one of %s" % (file_format, ', '.join(sorted(FORMATS))))
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmp = os.path.join(folder, '.%s.%s.tmp' % (os.path.basename(path), uuid.uuid4().hex[:8]))
+    try:
+        if file_format == 'parquet':
+            _arrow_safe(df).to_parquet(tmp, index=index, compression='zstd')
+        else:
+            df.to_csv(tmp, sep=',', index=index)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+class OutputWriter(object):
+    """
+    Class Title: OutputWriter
+    Writes named tables to folder in each of formats on max_workers background threads. Tables must not be modified
+    once they have been queued. A failed write is tried up to attempts times, retry_seconds apart.
+    """
+
+    def __init__(self, folder, formats=('parquet',), max_workers=2, attempts=3, retry_seconds=5):
+        unknown = [x for x in formats if x not in FORMATS]
+        if unknown:
+            raise ValueError("Unknown output format(s) %s - use %s" % (', '.join(unknown), ', '.join(sorted(FORMATS))))
+        self.folder = folder
+        self.formats = list(formats)
+        self.max_workers = max_workers
+        self.attempts = attempts
+        self.retry_seconds = retry_seconds
+        self.written = []
+        self._futures = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def paths(self, name):
+        """Return the paths a table is written to"""
+        return [os.path.join(self.folder, name + FORMATS[x]) for x in self.formats]
+
+    def _write(self, name, df, path, file_format, index):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                start = time.perf_counter()
+                with trace('write_output', outputs=[path], rows_in=len(df)) as record:
+                    write_table(df, path, file_format, index)
+                    record.rows_out = len(df)
+                with self._lock:
+                    self.written.append({'name': name, 'path': path, 'rows': len(df),
+                                         'seconds': time.perf_counter() - start, 'attempts': attempt})
+                return path
+            except (IOError, OSError) as e:
+                if attempt == self.attempts:
+                    raise
+                print('Writing %s failed (%s) - retrying in %d s' % (path, e, self.retry_seconds))
+                time.sleep(self.retry_seconds)
+
+    def write(self, name, df, index=True):
+        """Queue a table to be written as name.parquet / name.csv within the output folder, returning the futures of
+        its writes"""
+        futures = []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='OutputWriter')
+            for file_format, path in zip(self.formats, self.paths(name)):
+                futures.append(self._executor.submit(self._write, name, df, path, file_format, index))
+                self._futures.append((path, futures[-1]))
+        return futures
+
+    def pending(self):
+        """Return the number of writes which have not finished"""
+        with self._lock:
+            return len([x for _, x in self._futures if not x.done()])
+
+    def wait(self):
+        """Wait for every queued write to finish, raising an IOError listing any which failed"""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        failures = ['%s - %s' % (path, x.exception()) for path, x in futures if x.exception() is not None]
+        if failures:
+            raise IOError('%d output(s) could not be written to %s:\n%s' % (len(failures), self.folder,
+                                                                            '\n'.join(failures)))
+        return len(futures)
+
+    def close(self):
+        """Wait for every queued write, then stop the background threads"""
+        try:
+            return self.wait()
+        finally:
+            with self._lock:
+                executor, self._executor = self._executor, None
+            if executor is not None:
+                executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+
+########################################################################################################################
+
+#                                               ACTIVE WRITER                                                          #
+
+########################################################################################################################
+
+_active_writer = None
+
+
+def set_writer(writer):
+    """
+    Function Title: set_writer()
+    Define function to activate an OutputWriter for every call to publish() (or deactivate it with set_writer(None))
+    """
+    global _active_writer
+    _active_writer = writer
+    return writer
+
+
+def get_writer():
+    return _active_writer
+
+
+def publish(name, df, index=True):
+    """
+    Function Title: publish()
+    Define function to queue a table with the active OutputWriter - does nothing if no OutputWriter has been activated
+    """
+    if _active_writer is None:
+        return []
+    return _active_writer.write(name, df, index)
@@ -0,0 +1,343 @@
+########################################################################################################################
+
+# Title: Overlay
+
+# Script description:    Open-source equivalents of the ArcGIS overlay tools used within the combined map update (Merge,
+#                        Dissolve, Intersect, Erase and Append), for layers held as Pandas DataFrames with a 'WKB'
+#                        geometry column (see Geometry_QA.read_layer_geometries()).
+#
+#                        These allow the geometry stages of the update to be run and benchmarked outside ArcGIS. Each
+#                        tool uses an STR-tree to find candidate pairs of features, so only features with
+#                        intersecting bounding boxes are overlaid.
+#
+#                        clip_layer() clips a layer to a rectangle (e.g. the tiles of Tiled_Update.py).
+#
+#                        Erase, Intersect and Dissolve can be run across several worker processes (workers=N). The
+#                        layers are then held as GeometryBuffers (Geometry_Buffers.py) within shared memory, which
+#                        every worker reads without copying; only the indices of the features to overlay are sent to
+#                        each worker. The results are identical to those of a single process.
+#
+#                        precision=... (e.g. 1e-7 degrees) rounds the input coordinates to a grid of that size, so the
+#                        layers can be held as int32 rather than float64 coordinates (halving their size). The
+#                        coordinates are rounded in the same way whatever the number of workers, so the results still
+#                        do not depend on it, but they may differ from full precision by up to half the precision.
+#
+#                        Erase, Intersect and Dissolve can also be run with a fixed-precision model (grid_size=...,
+#                        e.g. 1e-7 degrees, about 1 cm). Input coordinates are snapped to the grid and overlaid with
+#                        topology-preserving noding on the same grid (GEOS OverlayNG), so no vertex is created closer
+#                        to another than the grid size. This stops the slivers and near-duplicate vertices created by
+#                        floating-point noise from building up as the same boundaries are overlaid in each update.
+#                        snap_layer() snaps a whole layer, and count_geometry() (Instrumentation.py) reports the part
+#                        and vertex counts of a layer before and after.
+#
+#                        Without a grid size, GEOS can fail to node valid features whose edges almost coincide (a
+#                        TopologyException, e.g. "Ring edge missing"). Only the features (or groups of features) which
+#                        fail are then re-overlaid with snap rounding on a very fine grid (ROBUST_GRID_SIZE, 1e-12 in
+#                        the units of the layers), so their results may differ from full precision by up to that grid
+#                        size; every other feature keeps its full-precision result.
+
+########################################################################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .Geometry_Buffers import GeometryBuffers, polygonal
+
+#   Grid size (in the units of the layers) overlays are re-run on when GEOS cannot node the inputs at full precision
+ROBUST_GRID_SIZE = 1e-12
+
+
+def _geometries(layer, precision=None):
+    """Return the geometries of a layer, with their coordinates rounded to precision as within GeometryBuffers"""
+    if precision is None:
+        return shapely.from_wkb(layer['WKB'].values)
+    buffers = GeometryBuffers.from_wkb(layer['WKB'].values, precision)
+    return buffers.take(np.arange(len(buffers)))
+
+
+def _snap(geometries, grid_size):
+    """Snap geometries to the grid, keeping them valid (collapsed slivers become empty geometries)"""
+    if grid_size is None:
+        return geometries
+    return polygonal(shapely.set_precision(geometries, grid_size))
+
+
+def snap_layer(layer, grid_size):
+    """
+    Function Title: snap_layer()
+    Define function to snap every feature of a layer to a grid of grid_size (in the units of the layer). Features which
+    collapse to slivers without any area are dropped.
+    """
+    snapped = _snap(_geometries(layer), grid_size)
+    keep = ~shapely.is_empty(snapped) & (shapely.area(snapped) > 0)
+    Snapped = layer.loc[keep].copy()
+    Snapped['WKB'] = shapely.to_wkb(snapped[keep])
+    return Snapped.reset_index(drop=True)
+
+
+def select_by_location(layer, selecting, generalised=None):
+    """
+    Function Title: select_by_location()
+    Equivalent of arcpy.SelectLayerByLocation_management(layer, 'INTERSECT', selecting) - return a boolean array
+    marking the features of layer which intersect any feature of selecting. generalised is an optional GeneralisedLayer
+    of layer (see Generalised_Layer.py), which settles most features without testing their full detail geometry.
+    """
+    if generalised is not None:
+        return generalised.select(_geometries(selecting))
+    selected = np.zeros(len(layer), dtype=bool)
+    selected[shapely.STRtree(_geometries(selecting)).query(_geometries(layer), predicate='intersects')[0]] = True
+    return selected
+
+
+def merge_layers(layers):
+    """
+    Function Title: merge_layers()
+    Equivalent of arcpy.Merge_management() - combine the features of several layers into one layer
+    """
+    return pd.concat(layers, ignore_index=True, sort=False)
+
+
+def append_layer(source, target):
+    """
+    Function Title: append_layer()
+    Equivalent of arcpy.Append_management(..., "NO_TEST") - add the features of source to target, keeping only the
+    fields of target
+    """
+    return pd.concat([target, source.reindex(columns=target.columns)], ignore_index=True)
+
+
+########################################################################################################################
+
+#                                          WORKER PROCESSES (SHARED MEMORY)                                            #
+
+########################################################################################################################
+
+#   Layers attached by each worker process, by name
+_layers = {}
+
+
+def _attach_layers(handles):
+    for name, handle in handles.items():
+        _layers[name] = GeometryBuffers.attach(handle)
+
+
+def _run_parallel(layers, func, tasks, workers):
+    """Share the layers (a dictionary of GeometryBuffers) and run func over every task within worker processes"""
+    handles = dict((name, buffers.share()) for name, buffers in layers.items())
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_layers, initargs=(handles,)) as executor:
+            return list(executor.map(func, tasks))
+    finally:
+        for buffers in layers.values():
+            buffers.release()
+
+
+def _chunks(total, chunk_size):
+    return [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+
+
+########################################################################################################################
+
+#                                                  OVERLAY TOOLS                                                       #
+
+########################################################################################################################
+
+def _dissolve_groups(geometries, groups, grid_size=None):
+    """Union the geometries of each group (a list of index arrays)"""
+    return [_union(_snap(geometries[group], grid_size), grid_size) for group in groups]
+
+
+def _dissolve_task(task):
+    groups, grid_size = task
+    indices = np.unique(np.concatenate(groups)) if groups else np.zeros(0, dtype=np.int64)
+    geometries = np.empty(len(_layers['layer']), dtype=object)
+    geometries[indices] = _layers['layer'].take(indices)
+    return shapely.to_wkb(np.array(_dissolve_groups(geometries, groups, grid_size), dtype=object))
+
+
+def dissolve_layer(layer, field, workers=None, chunk_size=200, precision=None, grid_size=None):
+    """
+    Function Title: dissolve_layer()
+    Equivalent of arcpy.Dissolve_management(..., field, "#", "MULTI_PART") - union all features sharing the same value
+    of field into a single multi-part feature. chunk_size is the number of groups sent to each worker at a time,
+    precision the grid the input coordinates are rounded to and grid_size the precision of a fixed-precision overlay.
+    """
+    codes, values = pd.factorize(layer[field], sort=True)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+    groups = [order[bounds[i]:bounds[i + 1]] for i in range(len(values))]
+
+    if workers is None or workers <= 1:
+        geometries = _geometries(layer, precision)
+        dissolved = shapely.to_wkb(np.array(_dissolve_groups(geometries, groups, grid_size), dtype=object))
+    else:
+        tasks = [(groups[a:b], grid_size) for a, b in _chunks(len(groups), chunk_size)]
+        results = _run_parallel({'layer': GeometryBuffers.from_wkb(layer['WKB'].values, precision)},
+                                _dissolve_task, tasks, workers)
+        dissolved = np.concatenate(results) if results else np.array([], dtype=object)
+    return pd.DataFrame({field: values, 'WKB': dissolved})
+
+
+def _union_by_group(left, geometries, grid_size=None):
+    """Return the indices of the left features with candidates and the union of their candidate geometries"""
+    order = np.argsort(left, kind='stable')
+    left, geometries = left[order], geometries[order]
+    starts = np.flatnonzero(np.r_[True, left[1:] != left[:-1]]) if len(left) else np.array([], dtype=int)
+    ends = np.r_[starts[1:], len(left)]
+    unions = [geometries[a] if b - a == 1 else _union(geometries[a:b], grid_size) for a, b in zip(starts, ends)]
+    return left[starts], np.array(unions, dtype=object)
+
+
+def _union(geometries, grid_size=None):
+    """Return the union of geometries, re-running it on ROBUST_GRID_SIZE if GEOS cannot node them at full precision"""
+    try:
+        return shapely.union_all(geometries, grid_size=grid_size)
+    except shapely.errors.GEOSException:
+        if grid_size is not None:
+            raise
+        return shapely.union_all(geometries, grid_size=ROBUST_GRID_SIZE)
+
+
+def _pairwise(operation, left, right, grid_size=None):
+    """Run a pairwise overlay operation (e.g. shapely.difference) over arrays of geometries. If GEOS cannot node a pair
+    at full precision, each pair is run on its own and only the pairs which fail are re-run on ROBUST_GRID_SIZE."""
+    try:
+        return operation(left, right, grid_size=grid_size)
+    except shapely.errors.GEOSException:
+        if grid_size is not None:
+            raise
+    left, right = np.broadcast_arrays(np.asarray(left, dtype=object), np.asarray(right, dtype=object))
+    result = np.empty(left.shape, dtype=object)
+    for i in range(len(result)):
+        try:
+            result[i] = operation(left[i], right[i])
+        except shapely.errors.GEOSException:
+            result[i] = operation(left[i], right[i], grid_size=ROBUST_GRID_SIZE)
+    return result
+
+
+def clip_layer(layer, bounds, grid_size=None):
+    """
+    Function Title: clip_layer()
+    Define function to clip the features of a layer to a rectangle (xmin, ymin, xmax, ymax), dropping features outside
+    it
+    """
+    clipped = polygonal(_pairwise(shapely.intersection, _geometries(layer), shapely.box(*bounds), grid_size))
+    keep = ~shapely.is_empty(clipped) & (shapely.area(clipped) > 0)
+    Clipped = layer.loc[keep].copy()
+    Clipped['WKB'] = shapely.to_wkb(clipped[keep])
+    return Clipped.reset_index(drop=True)
+
+
+def _erase_geometries(geometries, erasers, left, right, grid_size=None):
+    """Erase the candidate erasers (pairs of left / right indices, sorted) from geometries"""
+    geometries = _snap(geometries, grid_size)
+    if grid_size is not None and len(right):
+        used = np.unique(right)
+        erasers = erasers.copy()
+        erasers[used] = _snap(erasers[used], grid_size)
+    if len(left):
+        hit = shapely.intersects(geometries[left], erasers[right])
+        left, right = left[hit], right[hit]
+    result = geometries.copy()
+    if len(left):
+        features, unions = _union_by_group(left, erasers[right], grid_size)
+        result[features] = polygonal(_pairwise(shapely.difference, geometries[features], unions, grid_size))
+    keep = ~shapely.is_empty(result) & (shapely.area(result) > 0)
+    return keep, shapely.to_wkb(result[keep])
+
+
+def _erase_task(task):
+    start, stop, left, right, grid_size = task
+    layer, eraser = _layers['layer'], _layers['eraser']
+    used = np.unique(right)
+    erasers = np.empty(len(eraser), dtype=object)
+    erasers[used] = eraser.take(used)
+    return _erase_geometries(layer.take(np.arange(start, stop)), erasers, left - start, right, grid_size)
+
+
+def erase_layer(layer, eraser, workers=None, chunk_size=2000, precision=None, grid_size=None):
+    """
+    Function Title: erase_layer()
+    Equivalent of arcpy.Erase_analysis() - remove the areas of layer covered by any feature of eraser. Features which
+    are completely erased are dropped. chunk_size is the number of features sent to each worker at a time, precision
+    the grid the input coordinates are rounded to and grid_size the precision of a fixed-precision overlay.
+    """
+    if workers is None or workers <= 1:
+        geometries = _geometries(layer, precision)
+        erasers = _geometries(eraser, precision)
+        left, right = shapely.STRtree(erasers).query(geometries)
+        order = np.lexsort((right, left))
+        keep, wkbs = _erase_geometries(geometries, erasers, left[order], right[order], grid_size)
+    else:
+        layer_buffers = GeometryBuffers.from_wkb(layer['WKB'].values, precision)
+        eraser_buffers = GeometryBuffers.from_wkb(eraser['WKB'].values, precision)
+        left, right = layer_buffers.candidates(eraser_buffers)
+        tasks = []
+        for start, stop in _chunks(len(layer_buffers), chunk_size):
+            a, b = np.searchsorted(left, [start, stop])
+            tasks.append((start, stop, left[a:b], right[a:b], grid_size))
+        results = _run_parallel({'layer': layer_buffers, 'eraser': eraser_buffers}, _erase_task, tasks, workers)
+        keep = np.concatenate([x[0] for x in results]) if results else np.zeros(0, dtype=bool)
+        wkbs = np.concatenate([x[1] for x in results]) if results else np.array([], dtype=object)
+
+    erased = layer.loc[keep].copy()
+    erased['WKB'] = wkbs
+    return erased.reset_index(drop=True)
+
+
+def _intersect_geometries(left_geometries, right_geometries, grid_size=None):
+    """Intersect pairs of geometries, returning which pairs overlap, the overlaps and their areas"""
+    left_geometries, right_geometries = _snap(left_geometries, grid_size), _snap(right_geometries, grid_size)
+    overlap = np.empty(len(left_geometries), dtype=object)
+    hit = shapely.intersects(left_geometries, right_geometries)
+    overlap[hit] = polygonal(_pairwise(shapely.intersection, left_geometries[hit], right_geometries[hit],
+                                            grid_size))
+    area = np.zeros(len(left_geometries))
+    area[hit] = shapely.area(overlap[hit])
+    keep = area > 0
+    return keep, shapely.to_wkb(overlap[keep]), area[keep]
+
+
+def _intersect_task(task):
+    left, right, grid_size = task
+    return _intersect_geometries(_layers['left'].take(left), _layers['right'].take(right), grid_size)
+
+
+def intersect_layers(left_layer, right_layer, workers=None, chunk_size=5000, precision=None, grid_size=None):
+    """
+    Function Title: intersect_layers()
+    Equivalent of arcpy.Intersect_analysis([left_layer, right_layer], ..., "ALL", "", "INPUT") - return a feature for
+    every overlapping pair of features, holding the attributes of both. Fields of right_layer which share a name with
+    a field of left_layer are suffixed with '_1', as within ArcGIS. chunk_size is the number of pairs of features sent
+    to each worker at a time, precision the grid the input coordinates are rounded to and grid_size the precision of a
+    fixed-precision overlay.
+    """
+    if workers is None or workers <= 1:
+        left_geometries = _geometries(left_layer, precision)
+        right_geometries = _geometries(right_layer, precision)
+        right, left = shapely.STRtree(left_geometries).query(right_geometries)
+        order = np.lexsort((right, left))
+        left, right = left[order], right[order]
+        keep, overlap, area = _intersect_geometries(left_geometries[left], right_geometries[right], grid_size)
+    else:
+        left_buffers = GeometryBuffers.from_wkb(left_layer['WKB'].values, precision)
+        right_buffers = GeometryBuffers.from_wkb(right_layer['WKB'].values, precision)
+        left, right = left_buffers.candidates(right_buffers)
+        tasks = [(left[a:b], right[a:b], grid_size) for a, b in _chunks(len(left), chunk_size)]
+        results = _run_parallel({'left': left_buffers, 'right': right_buffers}, _intersect_task, tasks, workers)
+        keep = np.concatenate([x[0] for x in results]) if results else np.zeros(0, dtype=bool)
+        overlap = np.concatenate([x[1] for x in results]) if results else np.array([], dtype=object)
+        area = np.concatenate([x[2] for x in results]) if results else np.zeros(0)
+    left, right = left[keep], right[keep]
+
+    left_attributes = left_layer.drop(columns=['WKB']).iloc[left].reset_index(drop=True)
+    right_attributes = right_layer.drop(columns=['WKB']).iloc[right].reset_index(drop=True)
+    right_attributes.columns = [x + '_1' if x in left_attributes.columns else x for x in right_attributes.columns]
+    intersected = pd.concat([left_attributes, right_attributes], axis=1)
+    intersected['Shape_Area'] = area
+    intersected['WKB'] = overlap
+    return intersected
@@ -0,0 +1,354 @@
+########################################################################################################################
+
+# Title: Pipeline
+
+# Script description:    A small stage runner for the combined map update. Each stage declares its inputs (external
+#                        files / geodatabases, or the outputs of other stages), its outputs and its parameters.
+#
+#                        Every stage writes its outputs into a checkpoint folder named after a hash of its inputs,
+#                        parameters and code. A stage whose checkpoint already exists is skipped, so a failed run can
+#                        simply be started again and will resume from the last stage which completed. Stages which do
+#                        not depend on each other are run concurrently.
+
+########################################################################################################################
+
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .Instrumentation import set_tracer, trace
+from .Output_Writer import set_writer
+
+
+class StageOutput(object):
+    """
+    Class Title: StageOutput
+    Reference to a named output of another stage, used when declaring the inputs of a stage
+    """
+
+    def __init__(self, stage, output):
+        self.stage = stage
+        self.output = output
+
+    def __repr__(self):
+        return 'StageOutput(%r, %r)' % (self.stage, self.output)
+
+
+class Stage(object):
+    """
+    Class Title: Stage
+    A single step of the pipeline.
+
+    func is called as func(inputs, outputs, params), where inputs and outputs are dictionaries of file paths and params
+    is the dictionary of parameters given here. inputs maps names to external paths or StageOutput references; outputs
+    maps names to file names, which are created within the checkpoint folder of the stage. Stages sharing a lock name
+    (e.g. 'arcpy') never run at the same time. Increase version to force the stage to re-run with unchanged inputs.
+
+    code lists the code which func runs beyond its own body, so that the stage re-runs when that code changes: functions
+    (whose source is hashed), modules of the package named relative to it (e.g. '.Overlay', whose file is hashed -
+    including any version constants such as DECISION_TREE_VERSION), paths of data files read by the code (e.g. the EUNIS
+    code list, whose file is hashed) and any other values (hashed by their repr()).
+    """
+
+    def __init__(self, name, func, inputs=None, outputs=None, params=None, lock=None, version=1, code=None):
+        self.name = name
+        self.func = func
+        self.inputs = dict(inputs or {})
+        self.outputs = dict(outputs or {})
+        self.params = dict(params or {})
+        self.lock = lock
+        self.version = version
+        self.code = list(code or [])
+
+    def upstream(self):
+        return sorted(set(x.stage for x in self.inputs.values() if isinstance(x, StageOutput)))
+
+
+class Pipeline(object):
+    """
+    Class Title: Pipeline
+    Runs a set of stages in dependency order, caching the outputs of each stage within checkpoint_dir. If a Tracer
+    (see Instrumentation.py) is given, every stage which runs is measured, along with any steps traced within it. If
+    an OutputWriter (see Output_Writer.py) is given, the tables published by the stages are written in the background,
+    and each run waits for them once its stages have finished.
+    """
+
+    def __init__(self, checkpoint_dir, max_workers=4, tracer=None, writer=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.max_workers = max_workers
+        self.tracer = tracer
+        self.writer = writer
+        self.stages = {}
+        self._locks = {}
+        self._hash_lock = threading.Lock()
+        self._hash_cache_path = os.path.join(checkpoint_dir, '_content_hashes.json')
+        self._hash_cache = None
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError("Stage '%s' has already been added to the pipeline" % stage.name)
+        self.stages[stage.name] = stage
+        return stage
+
+    # ---------------------------------------------------------------------------------------------------------------- #
+    # Dependency ordering
+
+    def _check(self, targets):
+        """Return the set of stages required to build the targets, checking all references and for cycles"""
+        required = set()
+        visiting = set()
+
+        def visit(name, path):
+            if name not in self.stages:
+                raise KeyError("Unknown stage '%s' (required by %s)" % (name, ' -> '.join(path) or 'run()'))
+            if name in required:
+                return
+            if name in visiting:
+                raise ValueError('Cycle between stages: %s' % ' -> '.join(path + [name]))
+            visiting.add(name)
+            stage = self.stages[name]
+            for ref in stage.inputs.values():
+                if isinstance(ref, StageOutput):
+                    visit(ref.stage, path + [name])
+                    if ref.output not in self.stages[ref.stage].outputs:
+                        raise KeyError("Stage '%s' has no output '%s' (required by '%s')"
+                                       % (ref.stage, ref.output, name))
+            visiting.discard(name)
+            required.add(name)
+
+        for target in targets:
+            visit(target, [])
+        return required
+
+    # ---------------------------------------------------------------------------------------------------------------- #
+    # Content hashing
+
+    def _load_hash_cache(self):
+        if self._hash_cache is None:
+            try:
+                with open(self._hash_cache_path) as f:
+                    self._hash_cache = json.load(f)
+            except (IOError, ValueError):
+                self._hash_cache = {}
+        return self._hash_cache
+
+    def _save_hash_cache(self):
+        tmp = self._hash_cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._hash_cache, f)
+        os.replace(tmp, self._hash_cache_path)
+
+    def _file_digest(self, path):
+        """
+        Return the SHA-256 digest of a file. Digests are remembered against the size and modification time of the file,
+        so large unchanged inputs are only read once.
+        """
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self._hash_lock:
+            cached = self._load_hash_cache().get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self._hash_lock:
+            self._load_hash_cache()[path] = [signature, digest]
+        return digest
+
+    def content_hash(self, path):
+        """
+        Return a hash of the contents of a file, or of every file within a folder (e.g. a file geodatabase). Lock files
+        written by ArcGIS are ignored. Feature classes are hashed by the geodatabase containing them.
+        """
+        path = os.path.abspath(path)
+        # Feature classes within a geodatabase are not files - hash the whole geodatabase instead
+        container = path
+        while not os.path.exists(container) and os.path.dirname(container) != container:
+            container = os.path.dirname(container)
+        if container != path:
+            if not container.lower().endswith('.gdb'):
+                raise IOError("Input '%s' does not exist" % path)
+            path = container
+        if os.path.isfile(path):
+            return self._file_digest(path)
+        sha = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.lock'):
+                    continue
+                full = os.path.join(root, name)
+                sha.update(os.path.relpath(full, path).replace(os.sep, '/').encode('utf-8'))
+                sha.update(self._file_digest(full).encode('ascii'))
+        return sha.hexdigest()
+
+    @staticmethod
+    def _source(func):
+        """Return the source of a function, or its name if the source cannot be read"""
+        try:
+            return inspect.getsource(func)
+        except (IOError, OSError, TypeError):
+            return getattr(func, '__qualname__', repr(func))
+
+    def _code_hash(self, stage, item):
+        """Return the hash of an entry of Stage.code - modules are found without being imported, so hashing the code
+        of a stage does not import ArcPy, Shapely or Polars"""
+        if isinstance(item, str) and os.path.isfile(item):
+            return self._file_digest(item)
+        if isinstance(item, str):
+            spec = importlib.util.find_spec(item, stage.func.__module__.rpartition('.')[0] or None)
+            if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+                raise ImportError("Stage '%s' depends on module '%s', which cannot be found" % (stage.name, item))
+            return self._file_digest(spec.origin)
+        text = self._source(item) if callable(item) else repr(item)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _stage_key(self, stage, keys):
+        """Hash the stage name, version, code (including the helper code listed within Stage.code), parameters and
+        inputs into the key of its checkpoint"""
+        code = [self._source(stage.func)] + [self._code_hash(stage, x) for x in stage.code]
+        inputs = {}
+        for name, ref in sorted(stage.inputs.items()):
+            if isinstance(ref, StageOutput):
+                inputs[name] = [ref.stage, keys[ref.stage], ref.output]
+            else:
+                inputs[name] = self.content_hash(ref)
+        payload = json.dumps({'stage': stage.name, 'version': stage.version, 'code': code, 'inputs': inputs,
+                              'outputs': sorted(stage.outputs.items()), 'params': stage.params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    # ---------------------------------------------------------------------------------------------------------------- #
+    # Execution
+
+    def _checkpoint(self, stage, key):
+        return os.path.join(self.checkpoint_dir, stage.name, key[:16])
+
+    def _run_stage(self, stage, key, resolved, force, runnable=None):
+        folder = self._checkpoint(stage, key)
+        marker = os.path.join(folder, '_stage.json')
+        outputs = dict((name, os.path.join(folder, filename)) for name, filename in stage.outputs.items())
+
+        if os.path.exists(marker) and stage.name not in force:
+            print("Stage '%s' is up to date, reusing %s" % (stage.name, folder))
+            return outputs, False
+        if runnable is not None and stage.name not in runnable:
+            raise IOError("Stage '%s' has no checkpoint for its current inputs - run it first" % stage.name)
+
+        # Clear any partial outputs left behind by an earlier failed run
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        os.makedirs(folder)
+
+        inputs = {}
+        for name, ref in stage.inputs.items():
+            inputs[name] = resolved[ref.stage][ref.output] if isinstance(ref, StageOutput) else ref
+
+        lock = self._locks.setdefault(stage.lock, threading.Lock()) if stage.lock else None
+        if lock:
+            lock.acquire()
+        try:
+            print("Running stage '%s' ..." % stage.name)
+            start = time.time()
+            with trace(stage.name, inputs=inputs, outputs=outputs, count=True):
+                stage.func(inputs, outputs, stage.params)
+            elapsed = time.time() - start
+        finally:
+            if lock:
+                lock.release()
+
+        missing = [path for path in outputs.values() if not os.path.exists(path)]
+        if missing:
+            raise IOError("Stage '%s' did not write its outputs: %s" % (stage.name, ', '.join(missing)))
+
+        # The marker is written last - a checkpoint only counts once all of its outputs exist
+        with open(marker, 'w') as f:
+            json.dump({'stage': stage.name, 'key': key, 'outputs': outputs, 'seconds': elapsed,
+                       'completed': time.strftime('%Y-%m-%d %H:%M:%S')}, f, indent=2)
+        print("Stage '%s' complete (%.1f s)" % (stage.name, elapsed))
+        return outputs, True
+
+    def run(self, targets=None, force=(), only=False):
+        """
+        Run all stages required to build the target stages (or every stage if no targets are given), skipping those
+        with an up to date checkpoint. Stages named within force are always re-run. If only is true, just the target
+        stages are run and every upstream stage must already have an up to date checkpoint (e.g. to re-run the
+        decision tree away from ArcGIS). Returns a dictionary of the output paths of each stage which was required.
+        """
+        targets = list(targets or self.stages)
+        runnable = set(targets) if only else None
+        required = self._check(targets)
+        if not os.path.isdir(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+        force = set(force)
+        if self.tracer is not None:
+            set_tracer(self.tracer)
+        if self.writer is not None:
+            set_writer(self.writer)
+
+        keys = {}
+        resolved = {}
+        pending = set(required)
+        running = {}
+        failure = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while (pending or running) and failure is None:
+                # Submit every stage whose upstream stages have all completed
+                for name in sorted(pending):
+                    stage = self.stages[name]
+                    if all(x in resolved for x in stage.upstream()):
+                        # Downstream stages re-run whenever an upstream stage is forced
+                        if any(x in force for x in stage.upstream()):
+                            force.add(name)
+                        keys[name] = self._stage_key(stage, keys)
+                        running[executor.submit(self._run_stage, stage, keys[name], resolved, force,
+                                                runnable)] = name
+                        pending.discard(name)
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        resolved[name], _ = future.result()
+                    except Exception as e:
+                        print("Stage '%s' failed: %s" % (name, e))
+                        failure = failure or (name, e)
+
+            # Let any stages which are still running finish, so that their checkpoints are kept for resuming
+            for future in list(running):
+                try:
+                    resolved[running[future]], _ = future.result()
+                except Exception as e:
+                    print("Stage '%s' failed: %s" % (running[future], e))
+
+        with self._hash_lock:
+            if self._hash_cache is not None:
+                self._save_hash_cache()
+
+        if self.writer is not None:
+            # Tables published by the stages which ran are still written if a later stage failed
+            pending = self.writer.pending()
+            if pending:
+                print('Waiting for %d output(s) to be written to %s ...' % (pending, self.writer.folder))
+            try:
+                self.writer.wait()
+            except IOError as e:
+                print(e)
+                failure = failure or ('output writer', e)
+
+        if self.tracer is not None:
+            print(self.tracer.summary())
+
+        if failure is not None:
+            raise RuntimeError("Pipeline stopped at stage '%s': %s" % failure)
+        return resolved
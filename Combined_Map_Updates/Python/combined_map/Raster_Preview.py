@@ -0,0 +1,301 @@
+########################################################################################################################
+
+# Title: Raster Preview
+
+# Script description:    A quick preview of the outcome of the combined map update on grids of cells, for trying
+#                        changes to the decision rules or the confidence scores without running the vector overlays.
+#
+#                        The combined map and the new survey maps are rasterised once to a chosen cell size (e.g. 0.01
+#                        degrees), as integer grids coded by feature / GUI (PreviewGrids.build()). From the grids:
+#                            - the intersections between the new maps and the existing survey maps, with the area of
+#                              each, stand in for the intersection attributes of Section 3.2.
+#                              (intersection_attributes()), so the decision tree can be re-run within seconds;
+#                            - the decision tree results (Join_Results) are applied to every cell with array
+#                              operations (apply_decisions()), giving the GUI of every cell of the updated map and the
+#                              outcome of every cell (OUTCOMES);
+#                            - the area (km2, on the WGS 1984 ellipsoid) of each outcome, and won / lost by each new
+#                              map, is totalled (area_statistics()) and a quick-look image of the outcomes written as
+#                              a .png (write_quicklook()).
+#
+#                        Each cell takes the value of the last feature covering its centre. The preview is only as
+#                        precise as the cell size, and does not insert UKSeaMap (Section 1.2.) - the vector update is
+#                        still run for the final product. Preview an update from the command line with:
+#                            python -m combined_map.Raster_Preview Combined_Map.parquet New_Maps.parquet out_folder
+#                                --cell-size 0.01 --merged-attributes ... --confidence ... --gui-tracking ...
+
+########################################################################################################################
+
+import argparse
+import os
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .Measures import SEMI_MAJOR_AXIS, _authalic_q
+
+#   Outcome of every cell of the preview, by code
+OUTCOMES = ['Not mapped', 'No new map', 'New map wins', 'Existing map kept', 'Requires expert judgement',
+            'NE Evidence Base kept', 'New map over UKSeaMap', 'New map over unmapped area']
+
+#   Colour (RGB) of each outcome within the quick-look image
+OUTCOME_COLOURS = [(255, 255, 255), (210, 210, 210), (26, 152, 80), (215, 48, 39), (253, 174, 97), (117, 112, 179),
+                   (102, 189, 99), (166, 217, 106)]
+
+#   Source values of the NE Evidence Base (Section 2.) and of UKSeaMap, which are not intersected with the new maps
+NE_SOURCES = ['NE_Ev_2', 'NE_Evid']
+UKSM_SOURCE = 'UKSM18'
+
+#   Kinds of combined map feature within the grids
+SURVEY, NE_EVIDENCE, UKSEAMAP = 1, 2, 3
+
+
+def rasterise(layer, values, extent, cell_size, grid=None):
+    """
+    Function Title: rasterise()
+    Define function to burn values (one integer per feature of layer) into a grid of cell_size over extent (xmin, ymin,
+    xmax, ymax), row 0 being the northern edge. Each cell takes the value of the last feature covering its centre;
+    cells covered by no feature keep their value within grid (0 for a new grid).
+    """
+    xmin, ymin, xmax, ymax = extent
+    shape = (int(np.ceil((ymax - ymin) / cell_size)), int(np.ceil((xmax - xmin) / cell_size)))
+    grid = np.zeros(shape, dtype=np.int32) if grid is None else grid
+    geometries = shapely.from_wkb(layer['WKB'].values)
+    shapely.prepare(geometries)
+    bounds = shapely.bounds(geometries)
+    first_column = np.ceil((bounds[:, 0] - xmin) / cell_size - 0.5)
+    last_column = np.floor((bounds[:, 2] - xmin) / cell_size - 0.5)
+    first_row = np.ceil((ymax - bounds[:, 3]) / cell_size - 0.5)
+    last_row = np.floor((ymax - bounds[:, 1]) / cell_size - 0.5)
+    for i in np.flatnonzero(~np.isnan(bounds).any(axis=1)):
+        c0, c1 = int(max(first_column[i], 0)), int(min(last_column[i], shape[1] - 1))
+        r0, r1 = int(max(first_row[i], 0)), int(min(last_row[i], shape[0] - 1))
+        if c1 < c0 or r1 < r0:
+            continue
+        x = xmin + (np.arange(c0, c1 + 1) + 0.5) * cell_size
+        y = ymax - (np.arange(r0, r1 + 1) + 0.5) * cell_size
+        inside = shapely.contains_xy(geometries[i], x[np.newaxis, :], y[:, np.newaxis])
+        grid[r0:r1 + 1, c0:c1 + 1][inside] = values[i]
+    return grid
+
+
+class PreviewGrids(object):
+    """
+    Class Title: PreviewGrids
+    The combined map and the new survey maps rasterised to the same grid. existing holds the number of the combined map
+    feature within every cell (its row within features, plus 1), and new the code of the new map GUI within every cell
+    (its position within guis, plus 1). 0 marks cells without a feature.
+    """
+
+    def __init__(self, extent, cell_size, features, guis, existing, new):
+        self.extent = tuple(extent)
+        self.cell_size = cell_size
+        self.features = features.reset_index(drop=True)
+        self.guis = np.asarray(guis, dtype=object)
+        self.existing = existing
+        self.new = new
+        # GUI code and kind (SURVEY, NE_EVIDENCE or UKSEAMAP) of every combined map feature, indexed by feature number
+        self.feature_guis = np.r_[0, pd.Categorical(self.features['GUI'], categories=self.guis).codes + 1]
+        self.feature_guis = self.feature_guis.astype(np.int32)
+        self.feature_kinds = np.r_[0, np.where(self.features['Source'].isin(NE_SOURCES), NE_EVIDENCE,
+                                               np.where(self.features['Source'] == UKSM_SOURCE, UKSEAMAP, SURVEY))]
+        self.feature_kinds = self.feature_kinds.astype(np.int8)
+
+    @classmethod
+    def build(cls, combined_map, new_maps, cell_size, extent=None):
+        """Rasterise the combined map and the new maps (DataFrames with a 'WKB' column) to cell_size, over the extent
+        of both layers unless an extent (xmin, ymin, xmax, ymax) is given"""
+        if extent is None:
+            bounds = np.vstack([shapely.bounds(shapely.from_wkb(x['WKB'].values)) for x in [combined_map, new_maps]])
+            bounds = bounds[~np.isnan(bounds).any(axis=1)]
+            extent = (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max())
+        guis = pd.unique(pd.concat([combined_map['GUI'], new_maps['GUI']], ignore_index=True))
+        new_codes = pd.Categorical(new_maps['GUI'], categories=guis).codes + 1
+        existing = rasterise(combined_map, np.arange(1, len(combined_map) + 1), extent, cell_size)
+        new = rasterise(new_maps, new_codes, extent, cell_size)
+        return cls(extent, cell_size, combined_map.drop(columns=['WKB']), guis, existing, new)
+
+    @property
+    def shape(self):
+        return self.existing.shape
+
+    def existing_guis(self):
+        """Return the grid of the GUI code of the combined map within every cell"""
+        return self.feature_guis[self.existing]
+
+    def cell_areas(self):
+        """Return the area (km2) of the cells of every row of the grid on the WGS 1984 ellipsoid, as a column"""
+        ymax = self.extent[3]
+        edges = np.radians(np.clip(ymax - np.arange(self.shape[0] + 1) * self.cell_size, -90, 90))
+        q = _authalic_q(edges)
+        areas = SEMI_MAJOR_AXIS ** 2 * np.radians(self.cell_size) * (q[:-1] - q[1:]) / 2 / 1e6
+        return areas[:, np.newaxis]
+
+    def _overlaid(self):
+        """Return a mask of the cells where a new map covers an existing survey map which is compared with it"""
+        return (self.new > 0) & (self.feature_kinds[self.existing] == SURVEY)
+
+    def intersection_attributes(self):
+        """
+        Function Title: intersection_attributes()
+        Define function to list every intersection between a new map and an existing survey map within the grid, with
+        the attributes of the existing feature, the new map GUI (GUI_1) and the area of the intersection (km2), in
+        place of the intersection attributes exported in Section 3.2.
+        """
+        overlaid = self._overlaid()
+        areas = np.broadcast_to(self.cell_areas(), self.shape)[overlaid]
+        pairs = self.existing[overlaid].astype(np.int64) * (len(self.guis) + 1) + self.new[overlaid]
+        pairs, inverse = np.unique(pairs, return_inverse=True)
+        features, new = pairs // (len(self.guis) + 1), pairs % (len(self.guis) + 1)
+
+        Intersection_Attributes = self.features.iloc[features - 1].reset_index(drop=True)
+        Intersection_Attributes['GUI_1'] = self.guis[new - 1]
+        Intersection_Attributes['Shape_Area'] = np.bincount(inverse, minlength=len(pairs)) * self.cell_size ** 2
+        Intersection_Attributes['Overlap_Area_km2'] = np.bincount(inverse, areas, minlength=len(pairs))
+        return Intersection_Attributes
+
+    def apply_decisions(self, Join_Results):
+        """
+        Function Title: apply_decisions()
+        Define function to apply the decision tree results (NewGUI, ExistingGUI and Comparison_Result) to every cell,
+        returning the grid of the GUI code of every cell of the updated map and the grid of the outcome of every cell
+        (see OUTCOMES). Intersections without a result keep the existing map, as within Section 3.8.
+        """
+        existing_guis = self.existing_guis()
+        kinds = self.feature_kinds[self.existing]
+        codes = dict((gui, code + 1) for code, gui in enumerate(self.guis))
+        width = len(self.guis) + 1
+
+        # Outcome of every decided pair of new / existing GUI codes, sorted by pair
+        Known = Join_Results.loc[Join_Results['NewGUI'].isin(codes) & Join_Results['ExistingGUI'].isin(codes)]
+        pairs = Known['NewGUI'].map(codes).values.astype(np.int64) * width + Known['ExistingGUI'].map(codes).values
+        decided = np.where(Known['Comparison_Result'].values == Known['NewGUI'].values, 2,
+                           np.where(Known['Comparison_Result'].values == 'Requires expert judgement', 4, 3))
+        order = np.argsort(pairs, kind='stable')
+        pairs, decided = pairs[order], decided[order]
+
+        outcome = np.where(self.existing > 0, 1, 0).astype(np.uint8)
+        covered = self.new > 0
+        outcome[covered & (self.existing == 0)] = 7
+        outcome[covered & (kinds == UKSEAMAP)] = 6
+        outcome[covered & (kinds == NE_EVIDENCE)] = 5
+        overlaid = self._overlaid()
+        cell_pairs = self.new[overlaid].astype(np.int64) * width + existing_guis[overlaid]
+        position = np.clip(np.searchsorted(pairs, cell_pairs), 0, max(len(pairs) - 1, 0))
+        found = (pairs[position] == cell_pairs) if len(pairs) else np.zeros(len(cell_pairs), dtype=bool)
+        outcome[overlaid] = np.where(found, decided[position] if len(pairs) else 3, 3)
+
+        updated = np.where(np.isin(outcome, [2, 6, 7]), self.new, existing_guis).astype(np.int32)
+        return updated, outcome
+
+
+def area_statistics(grids, updated, outcome):
+    """
+    Function Title: area_statistics()
+    Define function to total the area (km2) and number of cells of each outcome, and the area of each outcome within
+    each new map, from the grids returned by PreviewGrids.apply_decisions()
+    """
+    areas = np.broadcast_to(grids.cell_areas(), grids.shape)
+    Outcome_Areas = pd.DataFrame({'Outcome': OUTCOMES,
+                                  'Cells': np.bincount(outcome.ravel(), minlength=len(OUTCOMES)),
+                                  'Area_km2': np.bincount(outcome.ravel(), areas.ravel(), minlength=len(OUTCOMES))})
+
+    covered = grids.new > 0
+    width = len(OUTCOMES)
+    totals = np.bincount(grids.new[covered].astype(np.int64) * width + outcome[covered], areas[covered],
+                         minlength=(len(grids.guis) + 1) * width).reshape(-1, width)[1:]
+    New_Map_Areas = pd.DataFrame(totals, columns=OUTCOMES)
+    New_Map_Areas.insert(0, 'NewGUI', grids.guis)
+    New_Map_Areas = New_Map_Areas.loc[New_Map_Areas[OUTCOMES].sum(axis=1) > 0]
+    New_Map_Areas = New_Map_Areas.loc[:, (New_Map_Areas != 0).any(axis=0)].reset_index(drop=True)
+    Updated_Areas = pd.DataFrame({'GUI': grids.guis, 'Area_km2': np.bincount(updated.ravel(), areas.ravel(),
+                                                                             minlength=len(grids.guis) + 1)[1:]})
+    return Outcome_Areas, New_Map_Areas, Updated_Areas.loc[Updated_Areas['Area_km2'] > 0].reset_index(drop=True)
+
+
+def write_quicklook(outcome, out_path, colours=OUTCOME_COLOURS):
+    """
+    Function Title: write_quicklook()
+    Define function to write the outcome of every cell as a colour-coded .png image (see OUTCOME_COLOURS), with north
+    at the top
+    """
+    image = np.asarray(colours, dtype=np.uint8)[outcome]
+    # Each row of a PNG starts with its filter type (0 - none)
+    rows = np.concatenate([np.zeros((image.shape[0], 1), dtype=np.uint8), image.reshape(image.shape[0], -1)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', image.shape[1], image.shape[0], 8, 2, 0, 0, 0)
+    with open(out_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) +
+                chunk(b'IEND', b''))
+    return out_path
+
+
+def preview_update(combined_map, new_maps, cell_size, tables=None, Join_Results=None, extent=None, out_folder=None,
+                   grids=None):
+    """
+    Function Title: preview_update()
+    Define function to preview the outcome of an update on a grid of cell_size. The decision tree is run on the
+    intersections found within the grid, using the 'merged_attributes', 'confidence' and 'gui_tracking' tables
+    (paths), unless the decision tree results are given as Join_Results. Pass the grids of an earlier preview to try
+    other decisions without rasterising the maps again. Writes the area statistics (.csv), the grids (.npz) and a
+    quick-look image (.png) to out_folder if given. Returns a dictionary of the results.
+    """
+    from .Instrumentation import trace
+    if grids is None:
+        with trace('rasterise', rows_in=len(combined_map) + len(new_maps)) as record:
+            grids = PreviewGrids.build(combined_map, new_maps, cell_size, extent)
+            record.rows_out = grids.existing.size
+    Requires_Judgement = None
+    if Join_Results is None:
+        from .Tiled_Update import decide_intersections
+        with trace('preview_decisions') as record:
+            Intersection_Attributes = grids.intersection_attributes()
+            _, Requires_Judgement, Join_Results = decide_intersections(Intersection_Attributes, tables)
+            record.rows_in, record.rows_out = len(Intersection_Attributes), len(Join_Results)
+    with trace('apply_decisions', rows_in=grids.existing.size) as record:
+        updated, outcome = grids.apply_decisions(Join_Results)
+        Outcome_Areas, New_Map_Areas, Updated_Areas = area_statistics(grids, updated, outcome)
+        record.rows_out = len(Outcome_Areas)
+
+    results = {'grids': grids, 'updated': updated, 'outcome': outcome, 'Join_Results': Join_Results,
+               'Requires_Judgement': Requires_Judgement, 'Outcome_Areas': Outcome_Areas,
+               'New_Map_Areas': New_Map_Areas, 'Updated_Areas': Updated_Areas}
+    if out_folder is not None:
+        if not os.path.isdir(out_folder):
+            os.makedirs(out_folder)
+        for name in ['Join_Results', 'Outcome_Areas', 'New_Map_Areas', 'Updated_Areas']:
+            results[name].to_csv(os.path.join(out_folder, 'Preview_%s.csv' % name), sep=',', index=False)
+        np.savez_compressed(os.path.join(out_folder, 'Preview_Grids.npz'), updated=updated, outcome=outcome,
+                            existing=grids.existing_guis(), new=grids.new, guis=grids.guis.astype(str),
+                            extent=np.array(grids.extent), cell_size=grids.cell_size)
+        write_quicklook(outcome, os.path.join(out_folder, 'Preview_Outcome.png'))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Preview the outcome of a combined map update on a grid of cells')
+    parser.add_argument('combined_map', help='GeoParquet file of the combined map (see GeoParquet.py)')
+    parser.add_argument('new_maps', help='GeoParquet file of the merged new survey maps')
+    parser.add_argument('out_folder', help='Folder to write the area statistics, grids and quick-look image to')
+    parser.add_argument('--cell-size', type=float, default=0.01, help='Cell size in degrees')
+    parser.add_argument('--merged-attributes', help='Merged new map attributes table (Section 3.2.)')
+    parser.add_argument('--confidence', help='Confidence scores spreadsheet')
+    parser.add_argument('--gui-tracking', help='GUI tracking document')
+    parser.add_argument('--join-results', help='Decision tree results to apply in place of running the decision tree')
+    args = parser.parse_args()
+
+    from .GeoParquet import read_geoparquet
+    preview_tables = {'merged_attributes': args.merged_attributes, 'confidence': args.confidence,
+                      'gui_tracking': args.gui_tracking}
+    if args.join_results is None and None in preview_tables.values():
+        parser.error('--merged-attributes, --confidence and --gui-tracking are needed unless --join-results is given')
+    preview = preview_update(read_geoparquet(args.combined_map), read_geoparquet(args.new_maps), args.cell_size,
+                             preview_tables, None if args.join_results is None else pd.read_csv(args.join_results),
+                             out_folder=args.out_folder)
+    with pd.option_context('display.width', 200):
+        print(preview['Outcome_Areas'])
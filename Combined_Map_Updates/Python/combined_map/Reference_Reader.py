@@ -0,0 +1,222 @@
+########################################################################################################################
+
+# Title: Reference Reader
+
+# Script description:    Bulk reading and copying of the many feature classes held within a geodatabase - e.g. the
+#                        survey maps within the EUNIS reference geodatabase (1_EUNIS_HabitatMaps.gdb, Section 3.1.3.)
+#                        or the combined map geodatabase copied class by class in Section 3.2.3.
+#
+#                        Feature classes are read / copied through a bounded pool of workers, so the fixed cost of
+#                        opening each class overlaps with reading the others. No more than max_pending classes are
+#                        submitted at once, which keeps memory bounded however many classes are read. Results are keyed
+#                        by feature class name and combined in name order, so they do not depend on the order in which
+#                        the workers finish (feature classes of the same name within different feature datasets must
+#                        be read separately). Every call returns its throughput (features / s and MB / s) alongside
+#                        the results.
+#
+#                        Feature classes are read with ArcPy cursors on a pool of threads. GeoParquet files (e.g.
+#                        survey maps exported with GeoParquet.py) can be read in the same way, without ArcPy. Copies
+#                        are made with the ArcPy geoprocessing tools, which cannot run on several threads at once, so
+#                        they run within a pool of worker processes (set workers=1 within the ArcGIS Python window).
+#                        Creating a feature class takes a schema lock on its file geodatabase, so each worker copies
+#                        into a scratch geodatabase of its own, and the copies are then written into the output
+#                        geodatabase one at a time.
+
+########################################################################################################################
+
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from .Instrumentation import _path_bytes
+
+
+def list_feature_classes(workspace, feature_dataset=None):
+    """
+    Function Title: list_feature_classes()
+    Define function to list the full paths of every feature class within a geodatabase (or one of its feature datasets),
+    or of every GeoParquet file within a folder, sorted by name
+    """
+    if not workspace.lower().endswith('.gdb') and os.path.isdir(workspace):
+        return sorted(os.path.join(workspace, x) for x in os.listdir(workspace) if x.lower().endswith('.parquet'))
+    import arcpy
+    paths = []
+    for folder, datasets, features in arcpy.da.Walk(workspace, datatype='FeatureClass'):
+        if feature_dataset is None or os.path.basename(folder) == feature_dataset:
+            paths += [os.path.join(folder, x) for x in features]
+    return sorted(paths, key=feature_class_name)
+
+
+def feature_class_name(path):
+    """Return the name of a feature class (or GeoParquet file) from its path"""
+    name = os.path.basename(str(path).rstrip('/\\'))
+    return name[:-len('.parquet')] if name.lower().endswith('.parquet') else name
+
+
+def _check_names(paths):
+    """Raise a ValueError if several of the paths have the same feature class name (e.g. within different feature
+    datasets), as the results of each are keyed by name"""
+    names = {}
+    for path in paths:
+        names.setdefault(feature_class_name(path), []).append(str(path))
+    duplicates = ['%s (%s)' % (name, ', '.join(x)) for name, x in sorted(names.items()) if len(x) > 1]
+    if duplicates:
+        raise ValueError('Feature class names must be unique: %s' % '; '.join(duplicates))
+
+
+def _read_one(path, fields):
+    """Read the attributes and geometry (as WKB) of one feature class or GeoParquet file"""
+    if path.lower().endswith('.parquet'):
+        from .GeoParquet import read_geoparquet
+        return read_geoparquet(path, columns=fields)
+    from .Geometry_QA import read_layer_geometries
+    return read_layer_geometries(path, fields)
+
+
+def _copy_one(source, target):
+    """Copy one feature class, returning the number of features copied"""
+    import arcpy
+    arcpy.CopyFeatures_management(source, target)
+    return int(arcpy.GetCount_management(target).getOutput(0))
+
+
+#   Scratch geodatabase of each copy worker process (see _start_copy_worker())
+_scratch_gdb = None
+
+
+def _start_copy_worker(scratch_folder):
+    """Create the scratch geodatabase of a copy worker process"""
+    global _scratch_gdb
+    import arcpy
+    name = 'Copy_%d.gdb' % os.getpid()
+    arcpy.CreateFileGDB_management(scratch_folder, name)
+    _scratch_gdb = os.path.join(scratch_folder, name)
+
+
+def _copy_to_scratch(source, target):
+    """Copy one feature class into the scratch geodatabase of the worker process - executed within each worker
+    process. Returns the path of the copy."""
+    scratch = os.path.join(_scratch_gdb, os.path.basename(target))
+    _copy_one(source, scratch)
+    return scratch
+
+
+def _bounded_map(executor, func, items, max_pending):
+    """Yield (item, result, error) for every item as its call completes, with at most max_pending calls submitted"""
+    items = list(items)
+    running = {}
+    while items or running:
+        while items and len(running) < max_pending:
+            item = items.pop(0)
+            running[executor.submit(func, *item)] = item
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            item = running.pop(future)
+            error = future.exception()
+            yield item, None if error is not None else future.result(), error
+
+
+def _statistics(count, features, nbytes, seconds, workers, failed):
+    return {'feature_classes': count, 'features': features, 'bytes': nbytes, 'seconds': seconds, 'workers': workers,
+            'features_per_second': features / seconds if seconds > 0 else None,
+            'mb_per_second': nbytes / 1e6 / seconds if seconds > 0 else None, 'failed': failed}
+
+
+def read_feature_classes(paths, fields=('GUI',), workers=4, max_pending=None):
+    """
+    Function Title: read_feature_classes()
+    Define function to read many feature classes (or GeoParquet files) concurrently through a pool of worker threads.
+    Returns a dictionary of feature class names mapped to DataFrames (as from Geometry_QA.read_layer_geometries()),
+    and the statistics of the read: the number of feature classes and features read, the bytes read into memory, the
+    elapsed seconds, features / s and MB / s. Raises an IOError naming every feature class which could not be read.
+    """
+    _check_names(paths)
+    fields = list(fields) if fields is not None else None
+    workers = max(1, workers or 1)
+    layers, failed = {}, {}
+    nbytes = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (path, _), Layer, error in _bounded_map(executor, _read_one, [(str(x), fields) for x in paths],
+                                                    max_pending or workers * 2):
+            if error is not None:
+                failed[feature_class_name(path)] = str(error)
+                continue
+            layers[feature_class_name(path)] = Layer
+            nbytes += int(Layer.memory_usage(index=False, deep=True).sum())
+    statistics = _statistics(len(layers), sum(len(x) for x in layers.values()), nbytes, time.perf_counter() - start,
+                             workers, failed)
+    if failed:
+        raise IOError('Could not read %d feature class(es): %s' % (len(failed), ', '.join(sorted(failed))))
+    return layers, statistics
+
+
+def concat_feature_classes(layers, name_field='Feature_Class'):
+    """
+    Function Title: concat_feature_classes()
+    Define function to combine the DataFrames from read_feature_classes() into one, in feature class name order, with
+    the name of each feature class within name_field
+    """
+    if not layers:
+        return pd.DataFrame(columns=[name_field, 'WKB'])
+    return pd.concat([layers[x].assign(**{name_field: x}) for x in sorted(layers)], ignore_index=True)
+
+
+def copy_feature_classes(paths, out_gdb, workers=None, max_pending=None, prefix=''):
+    """
+    Function Title: copy_feature_classes()
+    Define function to copy many feature classes (e.g. from list_feature_classes()) into a geodatabase, naming each
+    copy prefix + its name. The feature classes are read concurrently within a pool of worker processes, each copying
+    into its own scratch geodatabase, then written into out_gdb one at a time (set workers=1 to copy directly within
+    the current process). Returns the copied feature class paths keyed by name, and the statistics of the copy as
+    within read_feature_classes() (bytes being the growth of the output geodatabase).
+    """
+    _check_names(paths)
+    items = [(str(x), os.path.join(out_gdb, prefix + feature_class_name(x))) for x in paths]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(items) or 1))
+    copied, failed = {}, {}
+    features = 0
+    size = _path_bytes([out_gdb])
+    start = time.perf_counter()
+    if workers == 1:
+        for source, target in items:
+            try:
+                features += _copy_one(source, target)
+                copied[feature_class_name(source)] = target
+            except Exception as e:
+                failed[feature_class_name(source)] = str(e)
+    else:
+        scratch_folder = tempfile.mkdtemp(prefix='Copy_', dir=os.path.dirname(os.path.abspath(out_gdb)))
+        try:
+            scratch = {}
+            with ProcessPoolExecutor(max_workers=workers, initializer=_start_copy_worker,
+                                     initargs=(scratch_folder,)) as executor:
+                for (source, target), copy, error in _bounded_map(executor, _copy_to_scratch, items,
+                                                                  max_pending or workers * 2):
+                    if error is not None:
+                        failed[feature_class_name(source)] = str(error)
+                    else:
+                        scratch[source] = copy
+            # Written once every worker has finished, so no worker holds a lock on the scratch geodatabases
+            for source, target in items:
+                if source in scratch:
+                    features += _copy_one(scratch[source], target)
+                    copied[feature_class_name(source)] = target
+        finally:
+            shutil.rmtree(scratch_folder, ignore_errors=True)
+    statistics = _statistics(len(copied), features, max(_path_bytes([out_gdb]) - size, 0),
+                             time.perf_counter() - start, workers, failed)
+    if failed:
+        raise IOError('Could not copy %d feature class(es): %s' % (len(failed), ', '.join(sorted(failed))))
+    return copied, statistics
+
+
+def format_statistics(statistics):
+    """Return the statistics of a bulk read / copy as one line of text"""
+    return ('%d feature classes, %d features in %.1f s with %d workers (%.0f features/s, %.1f MB/s)'
+            % (statistics['feature_classes'], statistics['features'], statistics['seconds'], statistics['workers'],
+               statistics['features_per_second'] or 0, statistics['mb_per_second'] or 0))
@@ -0,0 +1,322 @@
+########################################################################################################################
+
+# Title: Scaling
+
+# Script description:    Scaling benchmark of the decision stages of the update (Sections 3.3. - 3.7.) against the
+#                        overlap density of the new survey maps, which varies widely between update cycles:
+#                          - new_per_existing - the number of new maps intersecting each existing map, i.e. the number
+#                            of rows of Control_DF per existing GUI;
+#                          - rows_per_gui - the number of polygons (HAB_TYPE rows) of each map.
+#                        Each parameter is swept in turn over synthetic attribute tables (generate_decision_tables()
+#                        within Synthetic_Data.py), with the other held at its default. At every point the time and
+#                        peak memory of remove_my_nan, list_set, habitat_classifier, confidence_check, decision_tree and
+#                        the merges of the comparison data set (build_comparison() and attach_overlap_areas()) are
+#                        measured over the DataFrames they are applied to within Combined_Map_Stages.py.
+#
+#                        A power law (time = c * rows ^ exponent) is fitted to the times and peak memory of every
+#                        function along each sweep, against the rows the function is applied to at each point (or
+#                        against the parameter itself where those rows do not change along the sweep). An exponent of
+#                        1 means the function scales linearly with its input, 2 quadratically, and 0 means the function
+#                        does not depend on it. Every time is repeated, and an exponent is only reported as worse than
+#                        the baseline if the increase is beyond the tolerance with 95% confidence, given the standard
+#                        errors of both fits. Run with:
+#                            python -m combined_map.Scaling --output scaling.json
+#                        and check a change against an earlier run (exits with 1 if any function now scales worse):
+#                            python -m combined_map.Scaling --baseline scaling.json
+#                            python -m combined_map.Scaling --compare scaling.json scaling_new.json
+#
+#                        Times are measured over several repeats (see measure()), and memory is the peak of the Python /
+#                        NumPy allocations traced by tracemalloc during one call (measured separately, as tracing slows
+#                        the call down).
+
+########################################################################################################################
+
+import argparse
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from .Combined_Map_Functions import remove_my_nan, list_set, confidence_check, habitat_classifier, decision_tree
+from .Combined_Map_Stages import build_control_frames, build_new_decision_attributes, \
+    build_existing_decision_attributes, build_comparison, attach_overlap_areas
+from .Synthetic_Data import generate_decision_tables
+
+#   Values of each overlap density parameter swept, and the value used while the other parameter is swept
+SWEEPS = {'new_per_existing': [1, 2, 4, 8, 16],
+          'rows_per_gui': [4, 8, 16, 32, 64]}
+DEFAULTS = {'new_per_existing': 2, 'rows_per_gui': 10}
+
+#   Existing maps within the synthetic tables - enough that every function runs for several milliseconds
+EXISTING_MAPS = 1000
+
+#   Fitted exponents are compared at 95% confidence (two-sided normal quantile)
+CONFIDENCE_Z = 1.96
+
+#   Functions measured at every point of a sweep
+FUNCTIONS = ['remove_my_nan', 'list_set', 'habitat_classifier', 'confidence_check', 'decision_tree',
+             'merge_comparison', 'merge_overlap_areas']
+
+
+def _aggregate(Attributes, column):
+    """Group a column of an attribute table into a list per GUI, as within Sections 3.3.1., 3.5.1. and 3.6.1."""
+    Aggregated = pd.DataFrame(Attributes.groupby(['GUI'])[column].apply(list)).reset_index(inplace=False)
+    Aggregated.columns = ['GUI', column]
+    return Aggregated
+
+
+def decision_inputs(tables):
+    """
+    Function Title: decision_inputs()
+    Define function to build the DataFrames each measured function is applied to within Sections 3.3. - 3.7. from the
+    synthetic tables. Returns a dictionary of function names mapped to a (callable, input rows) tuple.
+    """
+    Intersection_Attributes = tables['intersection_attributes']
+    Merged_Attributes = tables['merged_attributes'].copy()
+    Merged_Attributes['HAB_TYPE'] = Merged_Attributes['HAB_TYPE'].astype(str)
+
+    Intersected_Maps, Control_DF = build_control_frames(Intersection_Attributes)
+    ThreeStep_GUI_Confidence = tables['confidence'][['GUI', 'NewTotal', 'Overall score']].copy()
+    ThreeStep_GUI_Confidence['Confidence_check'] = ThreeStep_GUI_Confidence.apply(lambda df: confidence_check(df),
+                                                                                  axis=1)
+    New_Decision_Attributes = build_new_decision_attributes(Merged_Attributes, ThreeStep_GUI_Confidence)
+    Combined_Decision_Attributes = build_existing_decision_attributes(Intersection_Attributes, Intersected_Maps,
+                                                                      ThreeStep_GUI_Confidence)
+    Comparison_DF = build_comparison(Control_DF, New_Decision_Attributes, Combined_Decision_Attributes)
+
+    # Lists of GUIs / habitats before their 'nan' values are removed (Sections 3.3.2., 3.5.1. and 3.6.1.)
+    Raw_Lists = [_aggregate(Intersection_Attributes, 'GUI_1'), _aggregate(Merged_Attributes, 'HAB_TYPE'),
+                 _aggregate(Intersection_Attributes, 'HAB_TYPE')]
+    Habitats = []
+    for Aggregated in Raw_Lists[1:]:
+        Aggregated = Aggregated.copy()
+        Aggregated['HAB_TYPE'] = Aggregated.apply(lambda df: remove_my_nan(df, 'HAB_TYPE'), axis=1)
+        Habitats.append(Aggregated)
+
+    def run_remove_my_nan():
+        return [x.apply(lambda df: remove_my_nan(df, x.columns[1]), axis=1) for x in Raw_Lists]
+
+    def run_list_set():
+        return Intersected_Maps['NewMap_GUI'].apply(list_set)
+
+    def run_habitat_classifier():
+        return [x.apply(lambda df: habitat_classifier(df), axis=1) for x in Habitats]
+
+    # Confidence scores checked within Sections 3.4.1., 3.5.3. and 3.6.3.
+    Confidence_Scores = [ThreeStep_GUI_Confidence] + [
+        ThreeStep_GUI_Confidence.loc[ThreeStep_GUI_Confidence['GUI'].isin(x['GUI'])]
+        for x in [New_Decision_Attributes, Combined_Decision_Attributes]]
+
+    def run_confidence_check():
+        return [x.apply(lambda df: confidence_check(df), axis=1) for x in Confidence_Scores]
+
+    def run_decision_tree():
+        return Comparison_DF.apply(lambda df: decision_tree(df), axis=1)
+
+    def run_merge_comparison():
+        return build_comparison(Control_DF, New_Decision_Attributes, Combined_Decision_Attributes)
+
+    def run_merge_overlap_areas():
+        return attach_overlap_areas(Comparison_DF, Intersection_Attributes)
+
+    return {'remove_my_nan': (run_remove_my_nan, sum(x.iloc[:, 1].map(len).sum() for x in Raw_Lists)),
+            'list_set': (run_list_set, int(Intersected_Maps['NewMap_GUI'].map(len).sum())),
+            'habitat_classifier': (run_habitat_classifier, int(sum(x['HAB_TYPE'].map(len).sum() for x in Habitats))),
+            'confidence_check': (run_confidence_check, sum(len(x) for x in Confidence_Scores)),
+            'decision_tree': (run_decision_tree, len(Comparison_DF)),
+            'merge_comparison': (run_merge_comparison, len(Control_DF)),
+            'merge_overlap_areas': (run_merge_overlap_areas, len(Comparison_DF) + len(Intersection_Attributes))}
+
+
+def measure(func, repeats=3, min_seconds=0.02):
+    """
+    Function Title: measure()
+    Define function to return the time (seconds) of a call within each of several repeats, each running the function
+    enough times to take at least min_seconds, and the peak memory (bytes) allocated during a single traced call
+    """
+    timer = timeit.Timer(func)
+    number = max(1, int(np.ceil(min_seconds / max(timer.timeit(1), 1e-9))))
+    samples = [x / number for x in timer.repeat(repeats, number)]
+    tracemalloc.start()
+    try:
+        func()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return samples, peak_bytes
+
+
+def fit_power_law(values, measurements):
+    """
+    Function Title: fit_power_law()
+    Define function to fit measurement = coefficient * value ^ exponent by least squares on log-log axes, where each
+    measurement may be a list of repeats at its value. Returns (exponent, coefficient, standard error of the exponent).
+    """
+    x, y = [], []
+    for value, measured in zip(values, measurements):
+        for repeat in np.atleast_1d(measured):
+            x.append(value)
+            y.append(repeat)
+    x = np.log(np.asarray(x, dtype=float))
+    y = np.log(np.maximum(np.asarray(y, dtype=float), 1e-12))
+    exponent, intercept = np.polyfit(x, y, 1)
+    spread = np.sum((x - x.mean()) ** 2)
+    residuals = y - (exponent * x + intercept)
+    standard_error = np.sqrt(np.sum(residuals ** 2) / (len(x) - 2) / spread) if len(x) > 2 and spread > 0 else np.inf
+    return float(exponent), float(np.exp(intercept)), float(standard_error)
+
+
+def run_sweep(parameter, values=None, existing_maps=EXISTING_MAPS, seed=0, repeats=5):
+    """
+    Function Title: run_sweep()
+    Define function to measure every function at each value of one overlap density parameter ('new_per_existing' or
+    'rows_per_gui'), holding the other at its default, and fit the scaling of each function with its input rows along
+    the sweep
+    """
+    values = values or SWEEPS[parameter]
+    points = []
+    for value in values:
+        settings = dict(DEFAULTS)
+        settings[parameter] = value
+        tables = generate_decision_tables(existing_maps=existing_maps, seed=seed, **settings)
+        inputs = decision_inputs(tables)
+        point = {'value': value, 'intersection_rows': len(tables['intersection_attributes']), 'functions': {}}
+        for name in FUNCTIONS:
+            func, rows = inputs[name]
+            samples, peak_bytes = measure(func, repeats)
+            point['functions'][name] = {'rows': int(rows), 'seconds': min(samples), 'samples': samples,
+                                        'peak_bytes': peak_bytes}
+        print('%s = %s: %d intersection rows, %.3f s' % (parameter, value, point['intersection_rows'],
+                                                         sum(x['seconds'] for x in point['functions'].values())))
+        points.append(point)
+
+    fits = {}
+    for name in FUNCTIONS:
+        rows = [x['functions'][name]['rows'] for x in points]
+        # Fit against the rows the function is applied to, unless they barely change along the sweep
+        against = 'rows' if max(rows) >= 2 * max(min(rows), 1) else parameter
+        sizes = rows if against == 'rows' else values
+        time_exponent, time_coefficient, time_error = fit_power_law(
+            sizes, [x['functions'][name]['samples'] for x in points])
+        memory_exponent, memory_coefficient, memory_error = fit_power_law(
+            sizes, [x['functions'][name]['peak_bytes'] for x in points])
+        fits[name] = {'against': against,
+                      'time_exponent': time_exponent, 'time_coefficient': time_coefficient,
+                      'time_exponent_error': time_error,
+                      'memory_exponent': memory_exponent, 'memory_coefficient': memory_coefficient,
+                      'memory_exponent_error': memory_error}
+    return {'values': list(values), 'held': dict((k, v) for k, v in DEFAULTS.items() if k != parameter),
+            'points': points, 'fits': fits}
+
+
+def run_scaling(sweeps=None, existing_maps=EXISTING_MAPS, seed=0, repeats=5):
+    """
+    Function Title: run_scaling()
+    Define function to run every sweep (all of SWEEPS by default). Returns the scaling results.
+    """
+    results = {'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(),
+               'python': sys.version.split()[0], 'pandas': pd.__version__, 'seed': seed,
+               'existing_maps': existing_maps, 'sweeps': {}}
+    for parameter, values in (sweeps or SWEEPS).items():
+        print('Sweeping %s over %s ...' % (parameter, ', '.join(str(x) for x in values)))
+        results['sweeps'][parameter] = run_sweep(parameter, values, existing_maps, seed, repeats)
+    return results
+
+
+def scaling_table(results):
+    """
+    Function Title: scaling_table()
+    Define function to format the fitted time and memory exponents (and standard errors) of every function along every
+    sweep as a text table. Exponents fitted against the swept parameter rather than input rows are marked with *.
+    """
+    sweeps = list(results['sweeps'])
+    lines = ['%-22s' % 'Function' + ''.join('%20s%20s' % (x + ' time', 'memory') for x in sweeps)]
+    for name in FUNCTIONS:
+        line = '%-22s' % name
+        for parameter in sweeps:
+            fit = results['sweeps'][parameter]['fits'].get(name)
+            if fit is None:
+                line += '%20s%20s' % ('-', '-')
+                continue
+            mark = '' if fit.get('against', 'rows') == 'rows' else '*'
+            line += ''.join('%20s' % ('n^%.2f (%.2f)%s' % (fit[x + '_exponent'], fit.get(x + '_exponent_error', 0),
+                                                           mark)) for x in ['time', 'memory'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def compare_scaling(baseline, current, tolerance=0.25):
+    """
+    Function Title: compare_scaling()
+    Define function to compare the fitted exponents of every function along every sweep between two scaling results.
+    Returns a list of (sweep, function, measure, baseline exponent, current exponent) for each function which now
+    scales worse by more than tolerance (e.g. from n^1.0 to n^1.3) with 95% confidence - the increase less
+    CONFIDENCE_Z standard errors of the difference must exceed tolerance. Fits against different sizes (rows or the
+    parameter) are not compared.
+    """
+    regressions = []
+    for parameter, sweep in current['sweeps'].items():
+        if parameter not in baseline['sweeps']:
+            continue
+        for name, fit in sweep['fits'].items():
+            old = baseline['sweeps'][parameter]['fits'].get(name)
+            if old is None or old.get('against', parameter) != fit.get('against', parameter):
+                continue
+            for measured in ['time', 'memory']:
+                key = measured + '_exponent'
+                error = np.hypot(fit.get(key + '_error', 0.0), old.get(key + '_error', 0.0))
+                if fit[key] - old[key] - CONFIDENCE_Z * error > tolerance:
+                    regressions.append((parameter, name, measured, old[key], fit[key]))
+    return regressions
+
+
+def _report(regressions):
+    """Print the functions which scale worse than the baseline, returning the exit code of the command line"""
+    for parameter, name, measured, old, new in regressions:
+        print('%s %s (%s): n^%.2f -> n^%.2f' % (name, measured, parameter, old, new))
+    if not regressions:
+        print('No scaling regressions found')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how the decision stages scale with overlap density')
+    parser.add_argument('--existing-maps', type=int, default=EXISTING_MAPS,
+                        help='Existing maps within the synthetic tables')
+    parser.add_argument('--new-per-existing', type=int, nargs='*', default=SWEEPS['new_per_existing'],
+                        help='Values of new maps per existing map to sweep')
+    parser.add_argument('--rows-per-gui', type=int, nargs='*', default=SWEEPS['rows_per_gui'],
+                        help='Values of polygons (HAB_TYPE rows) per map to sweep')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Increase in a fitted exponent treated as a regression')
+    parser.add_argument('--output', help='JSON file to write the scaling results to')
+    parser.add_argument('--baseline', help='Scaling results to check this run against')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='Compare two scaling result files instead of running the sweeps')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline_results = json.load(f)
+        with open(args.compare[1]) as f:
+            current_results = json.load(f)
+        sys.exit(_report(compare_scaling(baseline_results, current_results, args.tolerance)))
+
+    scaling_results = run_scaling({'new_per_existing': args.new_per_existing, 'rows_per_gui': args.rows_per_gui},
+                                  args.existing_maps, args.seed, args.repeats)
+    print(scaling_table(scaling_results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(scaling_results, f, indent=2)
+        print('Scaling results written to %s' % args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_results = json.load(f)
+        sys.exit(_report(compare_scaling(baseline_results, scaling_results, args.tolerance)))
@@ -0,0 +1,269 @@
+########################################################################################################################
+
+# Title: Synthetic Data
+
+# Script description:    Generates realistic synthetic inputs for the combined map update, so that the update can be
+#                        tested and benchmarked away from the J:\ and Z:\ drives and the EUNIS reference geodatabase.
+#
+#                        The generated data follow the EMODnet Seabed Habitats Translated Habitat DEF data structure
+#                        (add_fields within Combined_Map_Functions.py):
+#                          - a UKSeaMap-like background of large modelled polygons (GUI 'UKSM16', Source 'UKSM18')
+#                          - existing survey maps within the combined map, including NE Evidence Base data
+#                          - new survey maps which overlap the existing survey maps
+#                          - the confidence scores spreadsheet and GUI tracking document, including the missing and
+#                            zero scores which the metadata checks of Section 3.4. look for
+#                          - the merged new map and intersection attribute tables used within Sections 3.3. - 3.6.
+#                            (which can also be generated alone, at a given overlap density, for Scaling.py)
+#
+#                        Layers are Pandas DataFrames with a 'WKB' geometry column, in WGS84 longitude / latitude.
+
+########################################################################################################################
+
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import affinity
+
+from .Combined_Map_Functions import add_fields, eunisToAllLevel3
+from .Overlay import dissolve_layer, erase_layer, intersect_layers, merge_layers
+
+#   EUNIS codes used to attribute the synthetic maps
+INTERTIDAL_CODES = ['A1.1', 'A1.11', 'A1.2', 'A1.3', 'A2.1', 'A2.2', 'A2.3', 'A2.4', 'A2.5', 'A2.61', 'A2.7', 'B3.1']
+SUBTIDAL_CODES = ['A3.1', 'A3.2', 'A3.3', 'A4.1', 'A4.2', 'A4.13', 'A5.1', 'A5.13', 'A5.2', 'A5.25', 'A5.3', 'A5.4',
+                  'A5.5', 'A5.6', 'A6.1', 'A6.5']
+UKSM_CODES = ['A3.1', 'A3.2', 'A4.1', 'A4.2', 'A5.1', 'A5.2', 'A5.3', 'A5.4', 'A5.1/A5.2', 'A5.2/A5.3', 'A5.1+A5.4',
+              'A6.3', 'A6.5', 'A4.27']
+NON_EUNIS_VALUES = ['Deep sea seabed', 'Not mapped']
+
+#   Source values of existing survey maps (NE_Ev_2 and NE_Evid are the NE Evidence Base - Section 2.)
+EXISTING_SOURCES = ['JNCC', 'JNCC', 'CEFAS', 'MCZ', 'SNH', 'NRW', 'NE_Evid', 'NE_Ev_2']
+
+#   Default extent of the synthetic maps (UK continental shelf, WGS84)
+UK_EXTENT = (-11.0, 48.5, 3.0, 61.5)
+
+
+def _random_habitat(rng, zone):
+    """Return a HAB_TYPE value for a polygon within a survey of the given zone ('Intertidal', 'Sub-tidal' or 'Mixed')"""
+    roll = rng.random()
+    if roll < 0.02:
+        return None
+    if roll < 0.025:
+        return NON_EUNIS_VALUES[rng.integers(len(NON_EUNIS_VALUES))]
+    if zone == 'Mixed':
+        zone = 'Intertidal' if rng.random() < 0.4 else 'Sub-tidal'
+    codes = INTERTIDAL_CODES if zone == 'Intertidal' else SUBTIDAL_CODES
+    habitat = codes[rng.integers(len(codes))]
+    # Mosaic habitats, e.g. 'A5.2/A5.3' or 'A5.1+A5.4'
+    if rng.random() < 0.15:
+        habitat += ['/', '+'][rng.integers(2)] + codes[rng.integers(len(codes))]
+    return habitat
+
+
+def _survey_polygons(rng, centre, radius, n_polygons):
+    """Return the polygons of a single survey - Voronoi cells of random points within an elliptical survey area"""
+    boundary = affinity.rotate(affinity.scale(shapely.Point(centre).buffer(radius, 8),
+                                              1.0, rng.uniform(0.4, 1.0)), rng.uniform(0, 180))
+    xmin, ymin, xmax, ymax = boundary.bounds
+    points = shapely.multipoints(np.column_stack([rng.uniform(xmin, xmax, n_polygons * 2),
+                                                  rng.uniform(ymin, ymax, n_polygons * 2)]))
+    points = shapely.intersection(points, boundary)
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=boundary))
+    cells = shapely.intersection(cells, boundary)
+    return cells[~shapely.is_empty(cells) & (shapely.area(cells) > 0)][:n_polygons]
+
+
+def _survey_layer(rng, guis, centres, radius, polygons_per_survey, sources, mcz_field):
+    """Return a layer of survey maps in the Translated Habitat DEF structure"""
+    records = []
+    geometries = []
+    base_date = datetime.date(2000, 1, 1)
+    for gui, centre, source in zip(guis, centres, sources):
+        zone = ['Sub-tidal', 'Sub-tidal', 'Sub-tidal', 'Intertidal', 'Mixed'][rng.integers(5)]
+        cells = _survey_polygons(rng, centre, radius * rng.uniform(0.5, 1.5),
+                                 max(1, int(rng.poisson(polygons_per_survey))))
+        det_date = base_date + datetime.timedelta(days=int(rng.integers(0, 7000)))
+        for polygon_id, cell in enumerate(cells, 1):
+            habitat = _random_habitat(rng, zone)
+            records.append({'GUI': gui, 'POLYGON': polygon_id, 'ORIG_HAB': 'Original habitat %d' % polygon_id,
+                            'ORIG_CLASS': 'Survey classification', 'HAB_TYPE': habitat, 'VERSION': 'EUNIS 2007-11',
+                            'DET_MTHD': 'Expert interpretation', 'DET_NAME': 'Synthetic', 'DET_DATE': det_date,
+                            'TRAN_COM': '#', 'T_RELATE': '=', 'VAL_COMM': '#', 'Source': source,
+                            'E_L3_LON': eunisToAllLevel3(habitat or ''), mcz_field: 'Survey %s' % gui})
+            geometries.append(cell)
+    layer = pd.DataFrame.from_records(records, columns=[x[0] for x in add_fields] + ['Source', 'E_L3_LON', mcz_field])
+    layer['WKB'] = shapely.to_wkb(np.array(geometries, dtype=object))
+    return layer
+
+
+def _uksm_layer(rng, n_polygons, extent):
+    """Return a UKSeaMap-like background layer - large Voronoi cells covering the whole extent"""
+    xmin, ymin, xmax, ymax = extent
+    points = shapely.multipoints(np.column_stack([rng.uniform(xmin, xmax, n_polygons),
+                                                  rng.uniform(ymin, ymax, n_polygons)]))
+    box = shapely.box(*extent)
+    cells = shapely.intersection(shapely.get_parts(shapely.voronoi_polygons(points, extend_to=box)), box)
+    habitats = [UKSM_CODES[i] for i in rng.integers(len(UKSM_CODES), size=len(cells))]
+    layer = pd.DataFrame({'GUI': 'UKSM16', 'POLYGON': np.arange(1, len(cells) + 1), 'ORIG_HAB': habitats,
+                          'HAB_TYPE': habitats, 'VERSION': 'EUNIS 2007-11', 'DET_MTHD': 'Predictive model',
+                          'Source': 'UKSM18', 'E_L3_LON': [eunisToAllLevel3(x) for x in habitats],
+                          'MCZ_Original_survey': None})
+    layer['WKB'] = shapely.to_wkb(cells)
+    return layer
+
+
+def _confidence_tables(rng, guis):
+    """Return the confidence scores and GUI tracking tables, with some missing and zero scores"""
+    roll = rng.random(len(guis))
+    confidence = pd.DataFrame({'GUI': guis,
+                               # Scores are coarse, so that some intersections tie and require expert judgement
+                               'NewTotal': rng.integers(1, 11, len(guis)) * 10.0,
+                               'Overall score': rng.integers(1, 11, len(guis)) * 10.0})
+    confidence.loc[roll < 0.05, 'NewTotal'] = np.nan
+    confidence.loc[(roll >= 0.05) & (roll < 0.08), 'NewTotal'] = 0.0
+    confidence.loc[(roll >= 0.08) & (roll < 0.10), 'Overall score'] = 0.0
+    # Maps missing from the confidence spreadsheet altogether (Metadata Check 3)
+    confidence = confidence.loc[roll < 0.97].reset_index(drop=True)
+
+    gui_tracking = pd.DataFrame({'Globally unique ID': guis,
+                                 'Dataset Title': ['Synthetic habitat survey %s' % x for x in guis]})
+    return confidence, gui_tracking
+
+
+def generate_update_inputs(scale=1, seed=0, extent=UK_EXTENT, uksm_polygons=200, existing_surveys=40,
+                           new_surveys=20, polygons_per_survey=10, new_per_existing=1.0):
+    """
+    Function Title: generate_update_inputs()
+    Define function to generate all inputs of a combined map update. The number of UKSeaMap polygons and survey maps
+    is multiplied by scale; surveys become smaller as scale increases, so the overlap between maps stays realistic.
+    new_per_existing controls how many new survey maps overlap each existing survey map (the overlap density).
+
+    Returns a dictionary of DataFrames - the layers 'uksm', 'existing_maps', 'combined_map' and 'new_maps', and the
+    tables 'confidence', 'gui_tracking', 'merged_attributes' and 'intersection_attributes'.
+    """
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = extent
+    n_existing = int(existing_surveys * scale)
+    n_new = int(new_surveys * scale)
+    radius = 0.1 * min(xmax - xmin, ymax - ymin) / np.sqrt(scale)
+
+    # Existing survey maps - NE Evidence Base and other sources
+    existing_guis = ['GB%06d' % (i + 1) for i in range(n_existing)]
+    existing_centres = np.column_stack([rng.uniform(xmin + radius, xmax - radius, n_existing),
+                                        rng.uniform(ymin + radius, ymax - radius, n_existing)])
+    sources = [EXISTING_SOURCES[i] for i in rng.integers(len(EXISTING_SOURCES), size=n_existing)]
+    existing_maps = _survey_layer(rng, existing_guis, existing_centres, radius, polygons_per_survey, sources,
+                                  'MCZ_Original_survey')
+
+    # New survey maps placed over existing survey maps
+    new_guis = ['GB%06d' % (500001 + i) for i in range(n_new)]
+    hosts = rng.integers(n_existing, size=n_new)
+    offsets = rng.normal(0, radius * 0.5 / max(new_per_existing, 1e-9) ** 0.5, (n_new, 2))
+    new_centres = existing_centres[hosts] + offsets
+    new_maps = _survey_layer(rng, new_guis, new_centres, radius, polygons_per_survey, ['JNCC'] * n_new, 'MCZ_Source')
+
+    # Combined map - the existing survey maps on top of the UKSeaMap background
+    uksm = _uksm_layer(rng, int(uksm_polygons * scale), extent)
+    combined_map = merge_layers([existing_maps, erase_layer(uksm, existing_maps)])
+
+    # Attribute tables exported from the merged new maps and their intersection with the combined map (Section 3.2.)
+    combined_no_evidbase = combined_map.loc[~combined_map['Source'].isin(['NE_Ev_2', 'NE_Evid', 'UKSM18'])]
+    intersect = intersect_layers(combined_no_evidbase, dissolve_layer(new_maps, 'GUI'))
+
+    confidence, gui_tracking = _confidence_tables(rng, existing_guis + new_guis)
+    return {'uksm': uksm,
+            'existing_maps': existing_maps,
+            'combined_map': combined_map,
+            'new_maps': new_maps,
+            'confidence': confidence,
+            'gui_tracking': gui_tracking,
+            'merged_attributes': new_maps.drop(columns=['WKB']),
+            'intersection_attributes': intersect.drop(columns=['WKB'])}
+
+
+def generate_decision_tables(existing_maps=200, new_per_existing=2.0, rows_per_gui=10.0, seed=0):
+    """
+    Function Title: generate_decision_tables()
+    Define function to generate the tables read by Sections 3.3. - 3.8. without the geometry of the maps, so that the
+    overlap density can be set directly: every existing map is intersected by new_per_existing new maps, and every map
+    has rows_per_gui polygons (HAB_TYPE rows), on average. Each polygon of an existing map is cut once by every new map
+    intersecting it.
+
+    Returns a dictionary of DataFrames - 'confidence', 'gui_tracking', 'merged_attributes' and
+    'intersection_attributes' (as returned by generate_update_inputs()).
+    """
+    rng = np.random.default_rng(seed)
+    existing_guis = ['GB%06d' % (i + 1) for i in range(existing_maps)]
+    new_guis = ['GB%06d' % (500001 + i) for i in range(existing_maps)]
+    zones = ['Sub-tidal', 'Sub-tidal', 'Sub-tidal', 'Intertidal', 'Mixed']
+
+    # New maps - rows_per_gui polygons each
+    polygons = np.maximum(1, rng.poisson(rows_per_gui, len(new_guis)))
+    gui = np.repeat(new_guis, polygons)
+    zone = np.repeat([zones[i] for i in rng.integers(len(zones), size=len(new_guis))], polygons)
+    merged_attributes = pd.DataFrame({'GUI': gui, 'POLYGON': np.concatenate([np.arange(1, x + 1) for x in polygons]),
+                                      'HAB_TYPE': [_random_habitat(rng, x) for x in zone],
+                                      'MCZ_Source': ['Survey %s' % x for x in gui]})
+
+    # Existing maps - rows_per_gui polygons each, every polygon cut by each of the new maps intersecting the map
+    records = []
+    for existing_gui in existing_guis:
+        zone = zones[rng.integers(len(zones))]
+        habitats = [_random_habitat(rng, zone) for _ in range(max(1, int(rng.poisson(rows_per_gui))))]
+        touching = rng.choice(len(new_guis), size=min(len(new_guis), max(1, int(rng.poisson(new_per_existing)))),
+                              replace=False)
+        for new_gui in touching:
+            for polygon_id, habitat in enumerate(habitats, 1):
+                records.append((existing_gui, polygon_id, habitat, new_guis[new_gui]))
+    intersection_attributes = pd.DataFrame.from_records(records, columns=['GUI', 'POLYGON', 'HAB_TYPE', 'GUI_1'])
+    intersection_attributes['MCZ_Original_survey'] = 'Survey ' + intersection_attributes['GUI']
+    intersection_attributes['Overlap_Area_km2'] = rng.lognormal(0, 1.5, len(records))
+
+    confidence, gui_tracking = _confidence_tables(rng, existing_guis + new_guis)
+    return {'confidence': confidence,
+            'gui_tracking': gui_tracking,
+            'merged_attributes': merged_attributes,
+            'intersection_attributes': intersection_attributes}
+
+
+#   File names used by write_update_inputs() - tables match the file names used by the pipeline stages
+INPUT_FILES = {'uksm': 'UKSM.pkl',
+               'existing_maps': 'Existing_maps.pkl',
+               'combined_map': 'Combined_map.pkl',
+               'new_maps': 'New_maps.pkl',
+               'confidence': 'UK_METADATA_&_CONFIDENCE_2012_HOCI_additions.csv',
+               'gui_tracking': 'GUI_tracking.csv',
+               'merged_attributes': 'New_Merged_Maps_Attributes.csv',
+               'intersection_attributes': 'Intersection_Attributes.csv'}
+
+
+def write_update_inputs(data, out_dir):
+    """
+    Function Title: write_update_inputs()
+    Define function to write generated inputs to a folder - layers as pickled DataFrames and tables as .csv files.
+    Returns a dictionary of the paths written.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    paths = {}
+    for name, df in data.items():
+        paths[name] = os.path.join(out_dir, INPUT_FILES[name])
+        if paths[name].endswith('.csv'):
+            df.to_csv(paths[name], sep=',', index=False)
+        else:
+            df.to_pickle(paths[name])
+    return paths
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate synthetic combined map update inputs')
+    parser.add_argument('out_dir', help='Folder to write the inputs to')
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for layer_name, layer_path in write_update_inputs(generate_update_inputs(args.scale, args.seed),
+                                                      args.out_dir).items():
+        print('%s: %s' % (layer_name, layer_path))
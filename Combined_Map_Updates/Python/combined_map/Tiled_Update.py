@@ -0,0 +1,712 @@
+########################################################################################################################
+
+# Title: Tiled Update
+
+# Script description:    The geometry of the combined map update run tile by tile across a grid of spatial tiles, so
+#                        the update can be shared between several worker processes on one or more machines rather than
+#                        run as one job within one ArcGIS session.
+#
+#                        The update is run in two phases of tiles, either side of the decision tree:
+#                            overlay - inserting UKSeaMap (Section 1.2.), erasing the land (if given), removing the NE
+#                                      Evidence Base (Section 2.) and intersecting the new maps (Section 3.2.)
+#                            update  - erasing the losing areas, overwriting the combined map (Sections 3.8. - 3.9.)
+#                                      and reinserting the NE Evidence Base (Section 4.)
+#                        Every layer is clipped to the tile it is read for. The intersection attributes of all tiles
+#                        are combined (by feature) before the decision tree is run once for the whole map (Sections
+#                        3.3. - 3.7.), and the features split across tiles are dissolved back together along the seams
+#                        when the tiles of the update phase are merged. The overlays are those of Overlay.py.
+#
+#                        The vertices which clipping adds along the seams are removed again once the pieces are
+#                        dissolved, as they change the area of a feature on the ellipsoid (Measures.py), so the tiled
+#                        update gives the same features and areas as the update run as one job. Slivers without any
+#                        width (e.g. 1e-17 square degrees) left by the erases are kept, as within the update run as one
+#                        job, but they depend on the order features are overlaid, so either update can hold a few more
+#                        of them than the other - compare_updates() compares both updates without them.
+#
+#                        Tiles are handed out through a job folder (TileQueue), which may be on a shared drive. Each
+#                        tile is a small file claimed by renaming it, so no two workers can claim the same tile:
+#                          - tiles are split into shards of neighbouring tiles, and each worker takes tiles from the
+#                            front of its own shard; a worker whose shard is empty steals from the back of the
+#                            largest remaining shard;
+#                          - a worker renews the lease on its tile while working on it; tiles whose lease expires (a
+#                            worker which stopped or hung) are taken over by another worker;
+#                          - a tile which fails is returned to its shard and retried, up to max_attempts times.
+#
+#                        Run the update with four local worker processes:
+#                            updated = tiled_update(layers, tables, job_folder, tile_size=1.0, workers=4)
+#                        and add workers on other machines with access to the job folder with:
+#                            python -m combined_map.Tiled_Update worker \\server\share\tiled_job --shard 1
+
+########################################################################################################################
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import threading
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .GeoParquet import read_geoparquet, write_geoparquet
+from .Geometry_Buffers import polygonal
+from .Instrumentation import trace
+from .Measures import add_area_field, measure_layer
+from .Overlay import append_layer, clip_layer, dissolve_layer, erase_layer, intersect_layers
+
+#   Source values of the NE Evidence Base, removed before and reinserted after the new maps (Section 2.)
+NE_SOURCES = ['NE_Ev_2', 'NE_Evid']
+
+#   Field identifying the feature each tile piece was clipped from, used to dissolve the pieces along the tile seams
+KEY_FIELD = 'Feature_Key'
+
+#   Phases of the tiled update, in the order they are run
+PHASES = ['overlay', 'update']
+
+#   Distance (as a fraction of the tile size) within which a vertex lies on a tile seam
+SEAM_TOLERANCE = 1e-9
+
+#   Delay (s) before the first poll of the job folder while waiting - doubled at each poll up to poll_seconds
+FIRST_POLL_SECONDS = 0.01
+
+
+########################################################################################################################
+
+#                                                   TILE QUEUE                                                         #
+
+########################################################################################################################
+
+class TileQueue(object):
+    """
+    Class Title: TileQueue
+    A queue of tiles held as files within a folder, shared by any number of worker processes (on any machine which can
+    see the folder). Tiles move between the pending (one folder per shard), running, done and failed folders by
+    renaming, which is atomic, so a tile is only ever claimed by one worker at a time.
+    """
+
+    def __init__(self, folder, lease_seconds=600, max_attempts=3):
+        self.folder = folder
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _path(self, *names):
+        return os.path.join(self.folder, *names)
+
+    @classmethod
+    def create(cls, folder, tiles, shards=1, lease_seconds=600, max_attempts=3):
+        """Create the queue of tiles (dictionaries holding at least a 'tile' name), split into shards of
+        neighbouring tiles"""
+        queue = cls(folder, lease_seconds, max_attempts)
+        staging = folder + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        shards = max(1, min(shards, len(tiles) or 1))
+        for shard, block in enumerate(np.array_split(np.arange(len(tiles)), shards)):
+            os.makedirs(os.path.join(staging, 'pending', '%03d' % shard))
+            for position, index in enumerate(block):
+                task = dict(tiles[index], shard=shard, attempts=0, errors=[])
+                _write_json(os.path.join(staging, 'pending', '%03d' % shard,
+                                         '%06d_%s.json' % (position, task['tile'])), task)
+        for name in ['running', 'done', 'failed']:
+            os.makedirs(os.path.join(staging, name))
+        _write_json(os.path.join(staging, 'queue.json'), {'tiles': len(tiles), 'shards': shards,
+                                                           'lease_seconds': lease_seconds,
+                                                           'max_attempts': max_attempts})
+        # The queue only appears to the workers once it is complete
+        os.rename(staging, folder)
+        return queue
+
+    @classmethod
+    def open(cls, folder):
+        """Open a queue created by TileQueue.create()"""
+        with open(os.path.join(folder, 'queue.json')) as f:
+            settings = json.load(f)
+        return cls(folder, settings['lease_seconds'], settings['max_attempts'])
+
+    def _list(self, *names):
+        """List the tile files within a folder of the queue, in order"""
+        return sorted(x for x in os.listdir(self._path(*names)) if x.endswith('.json'))
+
+    def _pending(self):
+        """Return the pending tile files of every shard, each in order"""
+        pending = {}
+        for shard in sorted(os.listdir(self._path('pending'))):
+            pending[int(shard)] = self._list('pending', shard)
+        return pending
+
+    def claim(self, worker, shard=0):
+        """Claim the next tile for worker from the front of its shard, stealing from the back of the largest other
+        shard, or taking over a tile whose lease has expired. Returns the claimed task, or None if there is none."""
+        pending = self._pending()
+        home = shard % len(pending) if pending else 0
+        candidates = [(home, x) for x in pending.get(home, [])]
+        for other in sorted(pending, key=lambda x: -len(pending[x])):
+            if other != home:
+                candidates += [(other, x) for x in reversed(pending[other])]
+        for shard_of_tile, name in candidates:
+            source = self._path('pending', '%03d' % shard_of_tile, name)
+            task = self._take(source, name.split('_', 1)[1][:-len('.json')], worker, stolen=shard_of_tile != home)
+            if task is not None:
+                return task
+        return self._take_expired(worker)
+
+    def _running_path(self, tile, worker):
+        return self._path('running', '%s@%s.json' % (tile, worker))
+
+    def _take(self, source, tile, worker, stolen=False):
+        """Rename a tile file into the running folder, returning its task if this worker won the rename"""
+        target = self._running_path(tile, worker)
+        try:
+            # A rename keeps the modification time, so the lease starts when the tile is claimed rather than when
+            # the tile file was written (a pending file could otherwise be taken over as soon as it was claimed)
+            os.utime(source, None)
+            os.rename(source, target)
+        except OSError:
+            return None
+        with open(target) as f:
+            task = json.load(f)
+        task.update(attempts=task['attempts'] + 1, worker=worker, stolen=stolen, claimed=time.time())
+        _write_json(target, task)
+        return task
+
+    def _take_expired(self, worker):
+        """Take over the first running tile whose lease has not been renewed within lease_seconds"""
+        now = time.time()
+        for name in self._list('running'):
+            source = self._path('running', name)
+            try:
+                expired = now - os.path.getmtime(source) > self.lease_seconds
+            except OSError:
+                continue
+            if not expired:
+                continue
+            task = self._take(source, name.split('@')[0], worker)
+            if task is None:
+                continue
+            task['errors'].append('Lease of %s expired' % name.split('@')[1][:-len('.json')])
+            if task['attempts'] > self.max_attempts:
+                self._finish(task, 'failed')
+                continue
+            return task
+        return None
+
+    def renew(self, task):
+        """Renew the lease of a claimed tile. Returns False if the tile has been taken over by another worker."""
+        try:
+            os.utime(self._running_path(task['tile'], task['worker']), None)
+            return True
+        except OSError:
+            return False
+
+    def _move(self, task, target):
+        """Move a claimed tile out of the running folder to target, holding task. Returns False if the tile has been
+        taken over by another worker, which will finish it instead."""
+        source = self._running_path(task['tile'], task['worker'])
+        # The running file is renamed before it is written, as writing it in place would recreate it after another
+        # worker had taken it over. The new name is still a running tile (taken over if this worker stops), but one
+        # which no other worker holds.
+        moving = self._running_path(task['tile'], '%s.moving' % task['worker'])
+        try:
+            os.rename(source, moving)
+        except OSError:
+            return False
+        _write_json(moving, task)
+        os.rename(moving, target)
+        return True
+
+    def _finish(self, task, state):
+        return self._move(task, self._path(state, '%s.json' % task['tile']))
+
+    def complete(self, task, summary=None):
+        """Mark a claimed tile as done, recording a summary of its results"""
+        task['summary'] = summary
+        task['completed'] = time.time()
+        self._finish(task, 'done')
+
+    def retry(self, task, error):
+        """Return a failed tile to the front of its shard to be retried, or mark it as failed once it has been
+        attempted max_attempts times"""
+        task['errors'].append(error)
+        if task['attempts'] >= self.max_attempts:
+            self._finish(task, 'failed')
+            return False
+        self._move(task, self._path('pending', '%03d' % task['shard'], '000000_%s.json' % task['tile']))
+        return True
+
+    def status(self):
+        """Return the number of tiles pending, running, done and failed"""
+        return {'pending': sum(len(x) for x in self._pending().values()),
+                'running': len(self._list('running')),
+                'done': len(self._list('done')),
+                'failed': len(self._list('failed'))}
+
+    def finished(self):
+        status = self.status()
+        return status['pending'] == 0 and status['running'] == 0
+
+    def failures(self):
+        """Return the errors of every failed tile, by tile name"""
+        failures = {}
+        for name in self._list('failed'):
+            with open(self._path('failed', name)) as f:
+                task = json.load(f)
+            failures[task['tile']] = task['errors']
+        return failures
+
+
+def _poll_delays(poll_seconds):
+    """Yield the delays between the polls of the job folder, doubling from FIRST_POLL_SECONDS up to poll_seconds"""
+    delay = min(FIRST_POLL_SECONDS, poll_seconds)
+    while True:
+        yield delay
+        delay = min(delay * 2, poll_seconds)
+
+
+def _write_json(path, value):
+    """Write a JSON file through a temporary file, so a partly written file is never read"""
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'w') as f:
+        json.dump(value, f, indent=2)
+    os.replace(temporary, path)
+
+
+########################################################################################################################
+
+#                                                     TILES                                                            #
+
+########################################################################################################################
+
+def make_tiles(layers, tile_size):
+    """
+    Function Title: make_tiles()
+    Define function to create a grid of square tiles of tile_size (in the units of the layers, e.g. degrees) over the
+    extent of the layers, keeping only tiles which hold part of a feature. Tiles are named by row and column and listed
+    row by row, so neighbouring tiles are listed together.
+    """
+    bounds = np.vstack([shapely.bounds(shapely.from_wkb(x['WKB'].values)) for x in layers if len(x)])
+    bounds = bounds[~np.isnan(bounds).any(axis=1)]
+    xmin, ymin = bounds[:, 0].min(), bounds[:, 1].min()
+    columns = max(1, int(np.ceil((bounds[:, 2].max() - xmin) / tile_size)))
+    rows = max(1, int(np.ceil((bounds[:, 3].max() - ymin) / tile_size)))
+    tree = shapely.STRtree(shapely.box(bounds[:, 0], bounds[:, 1], bounds[:, 2], bounds[:, 3]))
+
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            tile = [xmin + column * tile_size, ymin + row * tile_size, xmin + (column + 1) * tile_size,
+                    ymin + (row + 1) * tile_size]
+            if len(tree.query(shapely.box(*tile))):
+                tiles.append({'tile': 'r%03d_c%03d' % (row, column), 'bounds': tile})
+    return tiles
+
+
+def _read_tile(path, bounds, grid_size=None):
+    """Read the features of a GeoParquet layer within a tile, clipped to the tile"""
+    return clip_layer(read_geoparquet(path, bbox=bounds), bounds, grid_size)
+
+
+def _tile_folder(job_folder, phase, tile):
+    return os.path.join(job_folder, 'tiles', phase, tile)
+
+
+def _write_tile(job_folder, phase, tile, layers, worker):
+    """Write the output layers of a tile through a temporary folder. If the tile has already been written (by a worker
+    whose lease expired but which finished anyway) the first output is kept."""
+    target = _tile_folder(job_folder, phase, tile)
+    temporary = '%s.%s.tmp' % (target, worker)
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    for name, layer in layers.items():
+        write_geoparquet(layer, os.path.join(temporary, '%s.parquet' % name))
+    try:
+        os.rename(temporary, target)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+    return dict((name, len(layer)) for name, layer in layers.items())
+
+
+def _read_tile_output(job_folder, phase, tile, name):
+    return read_geoparquet(os.path.join(_tile_folder(job_folder, phase, tile), '%s.parquet' % name))
+
+
+def overlay_tile(job, tile):
+    """
+    Function Title: overlay_tile()
+    Sections 1.2. - 3.2. for one tile - insert UKSeaMap into the combined map, erase the land, remove the NE Evidence
+    Base and intersect the remaining survey maps with the new maps
+    """
+    bounds, grid_size, inputs = tile['bounds'], job['grid_size'], job['inputs']
+    combined_map = _read_tile(inputs['combined_map'], bounds, grid_size)
+    uksm = _read_tile(inputs['uksm'], bounds, grid_size)
+    new_maps = _read_tile(inputs['new_maps'], bounds, grid_size)
+
+    # Section 1.2. - Replace the old UKSeaMap with the new UKSeaMap, wherever there are no survey maps
+    combined_extract = combined_map.loc[combined_map['GUI'] != 'UKSM16']
+    uksm_erased = erase_layer(uksm, combined_extract, grid_size=grid_size)
+    if inputs.get('land'):
+        uksm_erased = erase_layer(uksm_erased, _read_tile(inputs['land'], bounds, grid_size), grid_size=grid_size)
+    combined_insert = append_layer(uksm_erased, combined_extract)
+
+    # Section 2. - Remove the NE Evidence Base
+    ne_evidence = combined_insert.loc[combined_insert['Source'].isin(NE_SOURCES)]
+    no_ne = combined_insert.loc[~combined_insert['Source'].isin(NE_SOURCES)]
+    no_evidbase = no_ne.loc[no_ne['Source'] != 'UKSM18']
+
+    # Section 3.2. - Intersect the combined map with the new maps, dissolved by GUI
+    intersect = intersect_layers(no_evidbase, dissolve_layer(new_maps, 'GUI', grid_size=grid_size),
+                                 grid_size=grid_size)
+    intersect['Overlap_Area_km2'] = measure_layer(intersect)[0]
+    return {'no_ne': no_ne, 'ne_evidence': ne_evidence, 'new_maps': new_maps, 'intersect': intersect}
+
+
+def update_tile(job, tile):
+    """
+    Function Title: update_tile()
+    Sections 3.8. - 4. for one tile - erase the areas of the new maps which lost to the existing maps, overwrite the
+    combined map with the new maps and reinsert the NE Evidence Base
+    """
+    grid_size, folder = job['grid_size'], job['folder']
+    no_ne, ne_evidence, new_maps, intersect = [_read_tile_output(folder, 'overlay', tile['tile'], x)
+                                               for x in ['no_ne', 'ne_evidence', 'new_maps', 'intersect']]
+    Join_Results = pd.read_csv(os.path.join(folder, 'Join_Results.csv'))
+    results = dict(((x.NewGUI, x.ExistingGUI), x.Comparison_Result) for x in Join_Results.itertuples())
+    won = np.array([results.get((new, existing)) == new for new, existing in zip(intersect['GUI_1'],
+                                                                                  intersect['GUI'])], dtype=bool)
+
+    new_maps_win = erase_layer(new_maps, intersect.loc[~won], grid_size=grid_size)
+    placeholder = erase_layer(no_ne, new_maps_win, grid_size=grid_size)
+    updated = append_layer(new_maps_win, placeholder)
+    updated = append_layer(ne_evidence, erase_layer(updated, ne_evidence, grid_size=grid_size))
+    return {'updated': updated}
+
+
+#   Function run on every tile of each phase
+TILE_FUNCTIONS = {'overlay': overlay_tile, 'update': update_tile}
+
+
+########################################################################################################################
+
+#                                                    WORKERS                                                           #
+
+########################################################################################################################
+
+def _keep_lease(queue, task, stop):
+    """Renew the lease of a tile until stop is set (run on a background thread while the tile is worked on)"""
+    while not stop.wait(queue.lease_seconds / 4.0):
+        if not queue.renew(task):
+            return
+
+
+def _work_on(job, queue, phase, name, shard):
+    """Work on the tiles of one phase until none are left. Returns the number of tiles completed."""
+    completed = 0
+    delays = _poll_delays(job['poll_seconds'])
+    while True:
+        task = queue.claim(name, shard)
+        if task is None:
+            if queue.finished():
+                return completed
+            time.sleep(next(delays))
+            continue
+        delays = _poll_delays(job['poll_seconds'])
+        stop = threading.Event()
+        lease = threading.Thread(target=_keep_lease, args=(queue, task, stop))
+        lease.daemon = True
+        lease.start()
+        try:
+            start = time.perf_counter()
+            layers = TILE_FUNCTIONS[phase](job, task)
+            summary = _write_tile(job['folder'], phase, task['tile'], layers, name)
+            summary['seconds'] = time.perf_counter() - start
+            queue.complete(task, summary)
+            completed += 1
+        except Exception:
+            queue.retry(task, traceback.format_exc())
+        finally:
+            stop.set()
+            lease.join()
+
+
+def run_worker(job_folder, name=None, shard=0, phases=None, wait_seconds=None):
+    """
+    Function Title: run_worker()
+    Define function to work on the tiles of a tiled update within a job folder (created by prepare_job()), phase by
+    phase, until every tile has been completed. Each worker takes tiles from the front of its shard first. Workers
+    wait up to wait_seconds (forever by default) for the tiles of the next phase to be queued.
+    Returns the number of tiles completed within each phase.
+    """
+    with open(os.path.join(job_folder, 'job.json')) as f:
+        job = json.load(f)
+    name = name or '%s-%d' % (platform.node(), os.getpid())
+    completed = {}
+    for phase in phases or PHASES:
+        queue_folder = os.path.join(job_folder, 'queue', phase)
+        start = time.time()
+        delays = _poll_delays(job['poll_seconds'])
+        while not os.path.isdir(queue_folder):
+            if wait_seconds is not None and time.time() - start > wait_seconds:
+                return completed
+            time.sleep(next(delays))
+        completed[phase] = _work_on(job, TileQueue.open(queue_folder), phase, name, shard)
+    return completed
+
+
+########################################################################################################################
+
+#                                                  COORDINATOR                                                         #
+
+########################################################################################################################
+
+def prepare_job(job_folder, layers, tables, tile_size, grid_size=None, lease_seconds=600, max_attempts=3,
+                poll_seconds=1.0):
+    """
+    Function Title: prepare_job()
+    Define function to create the job folder of a tiled update. layers is a dictionary of the 'combined_map', 'uksm',
+    'new_maps' and (optionally) 'land' layers (DataFrames with a 'WKB' column), which are written to GeoParquet with a
+    field identifying every feature. tables holds the paths of the 'merged_attributes', 'confidence' and
+    'gui_tracking' tables used by the decision tree. Returns the job settings.
+    """
+    inputs_folder = os.path.join(job_folder, 'inputs')
+    os.makedirs(inputs_folder)
+    inputs, offset = {}, 0
+    for name in ['combined_map', 'uksm', 'new_maps', 'land']:
+        if layers.get(name) is None:
+            continue
+        Layer = layers[name].copy()
+        Layer[KEY_FIELD] = np.arange(offset, offset + len(Layer), dtype=np.int64)
+        offset += len(Layer)
+        inputs[name] = os.path.abspath(os.path.join(inputs_folder, '%s.parquet' % name))
+        write_geoparquet(Layer, inputs[name])
+    job = {'folder': os.path.abspath(job_folder), 'inputs': inputs,
+           'tables': dict((name, os.path.abspath(path)) for name, path in tables.items()),
+           'tiles': make_tiles([x for x in layers.values() if x is not None], tile_size), 'tile_size': tile_size,
+           'grid_size': grid_size, 'lease_seconds': lease_seconds, 'max_attempts': max_attempts,
+           'poll_seconds': poll_seconds}
+    _write_json(os.path.join(job_folder, 'job.json'), job)
+    return job
+
+
+def _wait(job, queue, processes):
+    """Wait until every tile of a queue is done, working on the queue within this process if there are no local
+    worker processes. Raises an IOError naming the tiles which failed every attempt."""
+    delays = _poll_delays(job['poll_seconds'])
+    while not queue.finished():
+        if processes is not None and not any(x.is_alive() for x in processes):
+            raise IOError('Every local worker stopped before the tiles of %s were finished' % queue.folder)
+        time.sleep(next(delays))
+    failures = queue.failures()
+    if failures:
+        raise IOError('%d tile(s) failed within %s: %s' % (len(failures), queue.folder, ', '.join(sorted(failures))))
+
+
+def combine_intersections(job):
+    """
+    Function Title: combine_intersections()
+    Define function to combine the intersection attributes of every tile, totalling the area of each intersection
+    between an existing feature and a new map which was split across tiles
+    """
+    pieces = [read_geoparquet(os.path.join(_tile_folder(job['folder'], 'overlay', x['tile']), 'intersect.parquet'))
+              for x in job['tiles']]
+    Pieces = pd.concat(pieces, ignore_index=True).drop(columns=['WKB'])
+    Pieces = Pieces.sort_values([KEY_FIELD, 'GUI_1'], kind='stable')
+    first = dict((x, 'first') for x in Pieces.columns if x not in [KEY_FIELD, 'GUI_1'])
+    first.update(Shape_Area='sum', Overlap_Area_km2='sum')
+    return Pieces.groupby([KEY_FIELD, 'GUI_1'], as_index=False, sort=False, dropna=False).agg(first)
+
+
+def decide_intersections(Intersection_Attributes, tables):
+    """
+    Function Title: decide_intersections()
+    Sections 3.3. - 3.7. - Run the decision tree on the combined intersection attributes of every tile. Returns the
+    comparison results, the intersections which require expert judgement and the join results.
+    """
+    from .Combined_Map_Stages import read_table, build_control_frames, load_confidence_metadata, \
+        build_new_decision_attributes, build_existing_decision_attributes, build_comparison, attach_overlap_areas, \
+        run_decision_tree
+    Intersected_Maps, Control_DF = build_control_frames(Intersection_Attributes)
+    ThreeStep_GUI_Confidence, GUI_Tracking = load_confidence_metadata(tables['confidence'], tables['gui_tracking'])
+    New_Decision_Attributes = build_new_decision_attributes(read_table(tables['merged_attributes']),
+                                                            ThreeStep_GUI_Confidence)
+    Combined_Decision_Attributes = build_existing_decision_attributes(Intersection_Attributes, Intersected_Maps,
+                                                                      ThreeStep_GUI_Confidence)
+    Comparison_DF = build_comparison(Control_DF, New_Decision_Attributes, Combined_Decision_Attributes)
+    return run_decision_tree(attach_overlap_areas(Comparison_DF, Intersection_Attributes))
+
+
+def _seam_lines(job):
+    """Return the x and y coordinates of the tile seams"""
+    bounds = np.array([x['bounds'] for x in job['tiles']])
+    return np.unique(bounds[:, [0, 2]]), np.unique(bounds[:, [1, 3]])
+
+
+def _remove_seam_ring_vertices(ring, seams, tolerance):
+    """Remove the vertices of a ring which lie on a tile seam and on the edge between their neighbours"""
+    coords = shapely.get_coordinates(ring)[:-1]
+    on_seam = ((np.abs(coords[:, :1] - seams[0]).min(axis=1) <= tolerance) |
+               (np.abs(coords[:, 1:] - seams[1]).min(axis=1) <= tolerance))
+    before, after = np.roll(coords, 1, axis=0), np.roll(coords, -1, axis=0)
+    edge = after - before
+    offset = np.abs(edge[:, 0] * (coords[:, 1] - before[:, 1]) - edge[:, 1] * (coords[:, 0] - before[:, 0]))
+    keep = ~(on_seam & (offset <= tolerance * np.hypot(edge[:, 0], edge[:, 1])))
+    if keep.sum() < 3:
+        return ring
+    return np.vstack([coords[keep], coords[keep][:1]])
+
+
+def _remove_seam_vertices(geometries, seams, tolerance):
+    """Remove the vertices added along the tile seams when the features were clipped to the tiles"""
+    cleaned = np.empty(len(geometries), dtype=object)
+    for i, geometry in enumerate(geometries):
+        parts = [shapely.Polygon(_remove_seam_ring_vertices(part.exterior, seams, tolerance),
+                                 [_remove_seam_ring_vertices(x, seams, tolerance) for x in part.interiors])
+                 for part in shapely.get_parts(geometry)]
+        cleaned[i] = parts[0] if len(parts) == 1 else shapely.MultiPolygon(parts)
+    return polygonal(shapely.make_valid(cleaned))
+
+
+def merge_tiles(job, workers=None, area_field='AreaKm2'):
+    """
+    Function Title: merge_tiles()
+    Define function to merge the updated combined map of every tile into one layer, dissolving the pieces of features
+    which were split across tiles back into one feature along the tile seams (without the vertices clipping added
+    along the seams), and calculate the area (km2) of every feature within area_field
+    """
+    Pieces = pd.concat([_read_tile_output(job['folder'], 'update', x['tile'], 'updated') for x in job['tiles']],
+                       ignore_index=True)
+    split = Pieces[KEY_FIELD].duplicated(keep=False).values
+    Whole = Pieces.loc[~split]
+    Split = Pieces.loc[split].drop_duplicates(KEY_FIELD).drop(columns=['WKB'])
+    Seams = dissolve_layer(Pieces.loc[split], KEY_FIELD, workers=workers, grid_size=job['grid_size'])
+    tolerance = max(job['tile_size'] * SEAM_TOLERANCE, job['grid_size'] or 0)
+    if len(Seams):
+        Seams['WKB'] = shapely.to_wkb(_remove_seam_vertices(shapely.from_wkb(Seams['WKB'].values),
+                                                            _seam_lines(job), tolerance))
+    Merged = pd.concat([Whole, pd.merge(Split, Seams, on=KEY_FIELD, how='left')], ignore_index=True)
+    Merged = Merged.sort_values(KEY_FIELD, kind='stable').drop(columns=[KEY_FIELD]).reset_index(drop=True)
+    return add_area_field(Merged, area_field, workers)
+
+
+def _totals_by_gui(layer, area_field, sliver_width):
+    """Return the number of features, planar area, perimeter and area_field total of each GUI, leaving out slivers"""
+    geometries = shapely.from_wkb(layer['WKB'].values)
+    area, length = shapely.area(geometries), shapely.length(geometries)
+    Totals = pd.DataFrame({'GUI': layer['GUI'].values, 'Shape_Area': area, 'Shape_Length': length,
+                           'Area': layer[area_field].values}).loc[2 * area > sliver_width * length]
+    return Totals.groupby('GUI').agg(Features=('GUI', 'size'), Shape_Area=('Shape_Area', 'sum'),
+                                     Shape_Length=('Shape_Length', 'sum'), Area=('Area', 'sum'))
+
+
+def compare_updates(Untiled, Tiled, area_field='AreaKm2', grid_size=None, rtol=1e-9, area_rtol=1e-3):
+    """
+    Function Title: compare_updates()
+    Define function to compare the updated combined map of a tiled update with that of the same update run as one
+    job, by GUI - the number of features, their total area in the units of the layers (within rtol, plus grid_size
+    along every boundary for a fixed-precision update) and their total area_field (km2, within area_rtol). Returns the
+    totals of both for every GUI which differs - an empty DataFrame if the updates are equivalent.
+
+    Slivers narrower than 1e-9 (or grid_size), such as those of 1e-17 square degrees left by an erase, are left out,
+    as the overlays leave them in either update depending on the order features are overlaid. Areas on the ellipsoid
+    are compared more loosely, as the overlays of a tile can node a boundary with different collinear vertices, and
+    Measures.py takes each edge as straight within the equal-area projection.
+    """
+    sliver_width = max(1e-9, grid_size or 0)
+    Compared = _totals_by_gui(Untiled, area_field, sliver_width).join(
+        _totals_by_gui(Tiled, area_field, sliver_width), how='outer', lsuffix='_Untiled', rsuffix='_Tiled').fillna(0)
+    tolerance = rtol * Compared['Shape_Area_Untiled'] + (grid_size or 0) * Compared['Shape_Length_Untiled']
+    same = ((Compared['Features_Untiled'] == Compared['Features_Tiled']) &
+            ((Compared['Shape_Area_Tiled'] - Compared['Shape_Area_Untiled']).abs() <= tolerance) &
+            np.isclose(Compared['Area_Tiled'], Compared['Area_Untiled'], rtol=area_rtol, atol=0))
+    return Compared.loc[~same, ['Features_Untiled', 'Features_Tiled', 'Shape_Area_Untiled', 'Shape_Area_Tiled',
+                                'Area_Untiled', 'Area_Tiled']]
+
+
+def run_tiled_update(job_folder, workers=None, shards=None):
+    """
+    Function Title: run_tiled_update()
+    Define function to run a tiled update prepared by prepare_job(), with workers local worker processes (and any
+    workers started on other machines with run_worker()). With workers=None the tiles are worked on within this
+    process, unless workers=0, when only the workers on other machines are used. Returns the updated combined map, the
+    intersections which require expert judgement and the status of both phases.
+    """
+    with open(os.path.join(job_folder, 'job.json')) as f:
+        job = json.load(f)
+    shards = shards or max(workers or 1, 1)
+    processes = None
+    if workers:
+        processes = [multiprocessing.Process(target=run_worker, args=(job['folder'], 'local-%d' % i, i))
+                     for i in range(workers)]
+        for process in processes:
+            process.daemon = True
+            process.start()
+
+    status = {}
+    try:
+        for phase in PHASES:
+            if phase == 'update':
+                with trace('decision_tree_tiles') as record:
+                    Intersection_Attributes = combine_intersections(job)
+                    _, Requires_Judgement, Join_Results = decide_intersections(Intersection_Attributes,
+                                                                               job['tables'])
+                    Join_Results.to_csv(os.path.join(job['folder'], 'Join_Results.csv'), index=False)
+                    record.rows_in, record.rows_out = len(Intersection_Attributes), len(Join_Results)
+            with trace('%s_tiles' % phase, rows_in=len(job['tiles'])) as record:
+                queue = TileQueue.create(os.path.join(job['folder'], 'queue', phase), job['tiles'], shards,
+                                         job['lease_seconds'], job['max_attempts'])
+                if workers is None:
+                    run_worker(job['folder'], shard=0, phases=[phase])
+                _wait(job, queue, processes if workers else None)
+                status[phase] = queue.status()
+                record.rows_out = status[phase]['done']
+        with trace('merge_tiles', rows_in=len(job['tiles'])) as record:
+            Updated = merge_tiles(job, workers)
+            record.rows_out = len(Updated)
+    finally:
+        for process in processes or []:
+            process.join(job['poll_seconds'] * 5)
+            if process.is_alive():
+                process.terminate()
+    return Updated, Requires_Judgement, status
+
+
+def tiled_update(layers, tables, job_folder, tile_size, workers=None, grid_size=None, shards=None, **settings):
+    """
+    Function Title: tiled_update()
+    Define function to prepare and run a tiled update (see prepare_job() and run_tiled_update()) in one call
+    """
+    prepare_job(job_folder, layers, tables, tile_size, grid_size, **settings)
+    return run_tiled_update(job_folder, workers, shards)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Work on the tiles of a tiled combined map update')
+    subparsers = parser.add_subparsers(dest='command')
+    worker_parser = subparsers.add_parser('worker', help='Work on the tiles of a job folder until all are done')
+    worker_parser.add_argument('job_folder')
+    worker_parser.add_argument('--name', help='Name of the worker (the machine name and process id by default)')
+    worker_parser.add_argument('--shard', type=int, default=0, help='Shard of tiles to work on first')
+    run_parser = subparsers.add_parser('run', help='Run a job folder created by prepare_job()')
+    run_parser.add_argument('job_folder')
+    run_parser.add_argument('out_path', help='GeoParquet file to write the updated combined map to')
+    run_parser.add_argument('--workers', type=int, default=None, help='Local worker processes (0 for none)')
+    run_parser.add_argument('--shards', type=int, default=None)
+    status_parser = subparsers.add_parser('status', help='List the tiles pending, running, done and failed')
+    status_parser.add_argument('job_folder')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        print(json.dumps(run_worker(args.job_folder, args.name, args.shard)))
+    elif args.command == 'run':
+        updated_map, _, run_status = run_tiled_update(args.job_folder, args.workers, args.shards)
+        write_geoparquet(updated_map, args.out_path)
+        print(json.dumps(run_status, indent=2))
+    elif args.command == 'status':
+        for phase_name in PHASES:
+            phase_folder = os.path.join(args.job_folder, 'queue', phase_name)
+            if os.path.isdir(phase_folder):
+                print('%-8s %s' % (phase_name, json.dumps(TileQueue.open(phase_folder).status())))
+    else:
+        parser.print_help()
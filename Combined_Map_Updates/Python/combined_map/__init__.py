@@ -0,0 +1,60 @@
+########################################################################################################################
+
+# Title: Combined Map
+
+# Script description:    The functions and pipeline stages of the combined map update (Combined_Map_Updates.py) as an
+#                        importable package. Add the Combined_Map_Updates\Python folder to the Python path, then e.g.
+#                            from combined_map import decision_tree, build_pipeline
+#                        or import a module directly (e.g. from combined_map.Overlay import erase_layer).
+#
+#                        Nothing is imported until it is first used, so importing the package does not import ArcPy,
+#                        Pandas, Shapely or Polars - each is only loaded by the modules and stages which need it. Run
+#                        the update, or any one of its stages, from the command line with:
+#                            python -m combined_map update_config.json [stage ...]
+#                        (see __main__.py).
+
+########################################################################################################################
+
+import importlib
+
+#   Public names of the package and the modules they are loaded from when first used
+EXPORTS = {
+    'Combined_Map_Functions': ['add_fields', 'eunisToAllLevel3', 'listUniqueValues', 'remove_my_nan', 'list_set',
+                               'confidence_check', 'MESH_confidence_check', 'habitat_classifier', 'decision_tree',
+                               'DECISION_TREE_VERSION'],
+    'Combined_Map_Stages': ['read_table', 'build_control_frames', 'load_confidence_metadata', 'run_metadata_checks',
+                            'build_new_decision_attributes', 'build_existing_decision_attributes', 'build_comparison',
+                            'run_decision_tree', 'split_decisions', 'build_pipeline', 'DEFAULT_PARAMETERS'],
+    'Pipeline': ['Pipeline', 'Stage', 'StageOutput'],
+    'Instrumentation': ['Tracer', 'trace', 'set_tracer'],
+    'Decision_Store': ['DecisionStore', 'judgement_fingerprint'],
+    'Geometry_QA': ['read_layer_geometries', 'write_repaired_geometries', 'check_geometries', 'find_overlaps'],
+    'Overlay': ['select_by_location', 'merge_layers', 'append_layer', 'dissolve_layer', 'erase_layer',
+                'intersect_layers', 'clip_layer'],
+    'Reference_Reader': ['list_feature_classes', 'read_feature_classes', 'concat_feature_classes',
+                         'copy_feature_classes'],
+    'Measures': ['measure_layer', 'measure_geometries', 'add_area_field', 'calculate_area_field'],
+    'GeoParquet': ['write_geoparquet', 'read_geoparquet', 'export_feature_class'],
+    'Change_Detection': ['detect_changes', 'write_changes'],
+    'Tiled_Update': ['TileQueue', 'make_tiles', 'prepare_job', 'run_worker', 'run_tiled_update', 'merge_tiles',
+                     'tiled_update', 'compare_updates'],
+    'Raster_Preview': ['PreviewGrids', 'rasterise', 'area_statistics', 'write_quicklook', 'preview_update'],
+    'EUNIS_Registry': ['EunisRegistry', 'get_registry'],
+    'Output_Writer': ['OutputWriter', 'write_table', 'publish', 'set_writer']}
+
+_MODULES = dict((name, module) for module, names in EXPORTS.items() for name in names)
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    """Import the module holding a public name the first time the name is used"""
+    if name not in _MODULES:
+        raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULES))
@@ -0,0 +1,60 @@
+########################################################################################################################
+
+# Title: Combined Map Command Line
+
+# Script description:    Command line for the combined map update pipeline (see Combined_Map_Stages.py). Run from the
+#                        Combined_Map_Updates\Python folder:
+#                            python -m combined_map update_config.json                  - the full update
+#                            python -m combined_map update_config.json decision_tree    - one stage (and any stage it
+#                                                                                         needs without a checkpoint)
+#                            python -m combined_map update_config.json decision_tree --only
+#                                                                                       - one stage from the checkpoints
+#                                                                                         of the stages before it
+#                            python -m combined_map update_config.json --list           - the stages of the update
+#
+#                        Only the modules of the stages which run are imported, so the Pandas stages (Sections 3.3. -
+#                        3.8.) can be re-run from a plain Python 3 console without ArcPy, Shapely or Polars.
+
+########################################################################################################################
+
+import argparse
+import json
+import sys
+
+
+def main(argv=None):
+    """
+    Function Title: main()
+    Define function to run the combined map update, or the named stages of it, from the command line
+    """
+    parser = argparse.ArgumentParser(prog='python -m combined_map', description='Run the combined map update pipeline')
+    parser.add_argument('config', help='JSON file holding the inputs and parameters of the update')
+    parser.add_argument('stages', nargs='*', help='Only run these stages (and the stages they need)')
+    parser.add_argument('--only', action='store_true',
+                        help='Fail rather than run any stage before the named stages which has no checkpoint')
+    parser.add_argument('--force', nargs='*', default=[], help='Re-run these stages (and all downstream stages)')
+    parser.add_argument('--list', action='store_true', help='List the stages of the update and exit')
+    args = parser.parse_args(argv)
+
+    from .Combined_Map_Stages import build_pipeline
+    with open(args.config) as f:
+        update_config = json.load(f)
+    pipeline = build_pipeline(update_config)
+
+    if args.list:
+        for name, stage in pipeline.stages.items():
+            print('%-26s %s' % (name, ', '.join(stage.upstream()) or '-'))
+        return 0
+    unknown = [x for x in args.stages + args.force if x not in pipeline.stages]
+    if unknown:
+        parser.error('unknown stage(s) %s - see --list' % ', '.join(unknown))
+    if args.only and not args.stages:
+        parser.error('--only requires the stages to run')
+
+    results = pipeline.run(targets=args.stages or None, force=args.force, only=args.only)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
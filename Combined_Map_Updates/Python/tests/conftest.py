@@ -0,0 +1,14 @@
+########################################################################################################################
+
+# Title: Test configuration
+
+# Script description:    Adds the Combined_Map_Updates\Python folder to the Python path, so the tests import the
+#                        combined_map package from this copy of the repository. Run the tests from that folder with:
+#                            python -m pytest tests
+
+########################################################################################################################
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,38 @@
+########################################################################################################################
+
+# Title: Benchmark tests
+
+# Script description:    Checks that the synthetic inputs (Synthetic_Data.py) are reproducible and that a small
+#                        benchmark run (Benchmarks.py) records the rows read and written by each stage.
+
+########################################################################################################################
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('shapely')
+pytest.importorskip('pyarrow')
+
+from combined_map.Benchmarks import run_benchmarks, throughput
+from combined_map.Synthetic_Data import generate_update_inputs
+
+
+def test_generated_inputs_are_reproducible():
+    first, second = generate_update_inputs(scale=0.25, seed=5), generate_update_inputs(scale=0.25, seed=5)
+    assert sorted(first) == sorted(second)
+    for name in first:
+        pd.testing.assert_frame_equal(first[name], second[name], obj=name)
+    assert not generate_update_inputs(scale=0.25, seed=6)['combined_map'].equals(first['combined_map'])
+
+
+def test_benchmark_records_rows(capsys):
+    results = run_benchmarks(scales=[0.25], seed=1)
+    scale = results['scales']['0.25']
+    stages = dict((x['name'], x) for x in scale['stages'] if x.get('parent') is None)
+    updated = scale['updated_map']['features']
+    data = generate_update_inputs(scale=0.25, seed=1)
+    assert stages['read_feature_classes']['rows_out'] == len(data['new_maps'])
+    assert stages['write_geoparquet']['rows_in'] == stages['write_geoparquet']['rows_out'] == updated
+    assert 0 < stages['read_geoparquet']['rows_out'] <= updated
+    totals = throughput(scale['stages'])
+    assert all(x['rows_per_second'] > 0 for x in totals.values() if x['rows_per_second'] is not None)
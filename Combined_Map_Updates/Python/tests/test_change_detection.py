@@ -0,0 +1,62 @@
+########################################################################################################################
+
+# Title: Change Detection tests
+
+# Script description:    Checks that detect_changes() (Change_Detection.py) skips unchanged GUIs and reports the areas
+#                        reassigned, lost and gained between two versions of a small combined map, with their habitat
+#                        zones.
+
+########################################################################################################################
+
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+from combined_map.Change_Detection import L3_FIELD, area_km2, detect_changes, habitat_zone
+
+
+def _layer(features):
+    return pd.DataFrame({'GUI': [x[0] for x in features], L3_FIELD: [x[1] for x in features],
+                         'WKB': shapely.to_wkb([shapely.box(*x[2]) for x in features])})
+
+
+OLD = _layer([('GB1', 'A5.2', (0, 50, 1, 51)), ('GB2', 'A5.3', (1, 50, 2, 51)), ('GB3', 'A2.2', (2, 50, 3, 51))])
+#   GB1 is unchanged, half of GB2 is reassigned to GB4, GB3 is no longer mapped and GB5 is newly mapped
+NEW = _layer([('GB1', 'A5.2', (0, 50, 1, 51)), ('GB2', 'A5.3', (1, 50, 1.5, 51)), ('GB4', 'A5.2', (1.5, 50, 2, 51)),
+              ('GB5', 'A2.2', (3, 50, 4, 51))])
+
+
+def test_habitat_zone():
+    zones = habitat_zone(['A2.2', 'A5.3', 'A2.2+A5.3', 'C1.1', None])
+    assert zones.tolist() == ['Intertidal', 'Sub-tidal', 'Mixed habitat', 'Other', 'Other']
+
+
+def test_detect_changes():
+    result = detect_changes(OLD, NEW)
+    statistics = result['statistics']
+    assert statistics['changed_guis'] == 4
+    assert statistics['removed_features'] == 2
+    assert statistics['added_features'] == 3
+
+    changes = result['changes'].set_index('Change')
+    assert sorted(changes.index) == ['Gained', 'Lost', 'Reassigned']
+    assert changes.loc['Reassigned', ['From_GUI', 'To_GUI', 'From_L3', 'To_L3']].tolist() == ['GB2', 'GB4', 'A5.3',
+                                                                                             'A5.2']
+    assert changes.loc['Reassigned', 'Area_km2'] == pytest.approx(area_km2([shapely.box(1.5, 50, 2, 51)])[0])
+    assert changes.loc['Lost', ['From_GUI', 'From_Zone']].tolist() == ['GB3', 'Intertidal']
+    assert changes.loc['Gained', ['To_GUI', 'To_Zone']].tolist() == ['GB5', 'Intertidal']
+
+    summary = result['summary'].set_index(['Summary', 'Value'])
+    assert ('GUI', 'GB1') not in summary.index
+    box_area = area_km2([shapely.box(2, 50, 3, 51)])[0]
+    assert summary.loc[('Zone', 'Intertidal'), 'Lost_km2'] == pytest.approx(box_area)
+    assert summary.loc[('Zone', 'Intertidal'), 'Gained_km2'] == pytest.approx(area_km2([shapely.box(3, 50, 4, 51)])[0])
+    assert summary.loc[('EUNIS_L3', 'A5.3'), 'Lost_km2'] == pytest.approx(changes.loc['Reassigned', 'Area_km2'])
+
+
+def test_identical_versions_have_no_changes():
+    result = detect_changes(OLD, OLD.iloc[::-1])
+    assert result['statistics']['changed_guis'] == 0
+    assert len(result['changes']) == 0
+    assert len(result['summary']) == 0
@@ -0,0 +1,81 @@
+########################################################################################################################
+
+# Title: Habitat classification tests
+
+# Script description:    Checks the classification of EUNIS codes into zones (habitat_classifier()) and level 3
+#                        habitats (eunisToAllLevel3()), including codes which share a prefix with a shorter code (A10
+#                        is not A1), codes deeper than level 4 and codes which are not within the EUNIS code list.
+
+########################################################################################################################
+
+import pytest
+
+from combined_map.Combined_Map_Functions import eunisToAllLevel3, habitat_classifier
+from combined_map.EUNIS_Registry import EunisRegistry, get_registry
+
+
+@pytest.mark.parametrize('codes, zone', [
+    (['A1'], 'Intertidal'),
+    (['A1.1'], 'Intertidal'),
+    (['A5.2511'], 'Sub-tidal'),
+    (['A1.1', 'A5.1'], 'Mixed habitat'),
+    (['A10'], 'Error'),
+    (['A10.1'], 'Error'),
+    (['A7'], 'Error'),
+    (['A9.9'], 'Error')])
+def test_habitat_classifier(codes, zone):
+    assert habitat_classifier({'HAB_TYPE': codes}) == zone
+
+
+def test_prefix_is_not_the_parent_code():
+    assert habitat_classifier({'HAB_TYPE': ['A10']}) != 'Intertidal'
+    assert eunisToAllLevel3('A10.11') == 'Void'
+
+
+@pytest.mark.parametrize('code, level3', [
+    ('A5.25', 'A5.2'),
+    ('A5.251', 'A5.2'),
+    ('A5.2511', 'A5.2'),
+    ('A1.1131/A5.2511', 'A1.1+A5.2'),
+    ('A5.2511+A3.1123', 'A3.1+A5.2')])
+def test_level3_of_deep_codes(code, level3):
+    assert eunisToAllLevel3(code) == level3
+
+
+@pytest.mark.parametrize('code', ['A7', 'A8.1', 'A9.9', 'C8.4', 'J7', 'A5.9', 'A5.91'])
+def test_unknown_codes_are_rejected(code):
+    registry = get_registry()
+    assert registry.lookup(code) is None
+    assert registry.level(code) is None
+    assert registry.tokenise('A5.1/%s' % code) == ('A5.1',)
+    assert eunisToAllLevel3(code) == 'Void'
+
+
+@pytest.mark.parametrize('code, entry', [
+    ('A', [1, None, None, None]),
+    ('B3', [2, 'B3', None, 'Intertidal']),
+    ('C1', [2, 'C1', None, None]),
+    ('A5.2', [3, 'A5', 'A5.2', 'Sub-tidal']),
+    ('A5.2511', [3, 'A5', 'A5.2', 'Sub-tidal'])])
+def test_registry_lookup(code, entry):
+    assert get_registry().lookup(code) == entry
+
+
+@pytest.mark.parametrize('code, level', [('A', 1), ('A5', 2), ('A5.2', 3), ('A5.25', 4), ('A5.2511', 6)])
+def test_level_of_a_code(code, level):
+    assert get_registry().level(code) == level
+
+
+def test_registry_is_saved_and_loaded(tmp_path):
+    registry = EunisRegistry.build()
+    loaded = EunisRegistry.load(registry.save(str(tmp_path / 'registry.json')))
+    assert loaded.codes == registry.codes
+    assert loaded.lookup('A9.9') is None
+
+
+def test_code_list_is_checked(tmp_path):
+    path = str(tmp_path / 'codes.json')
+    with open(path, 'w') as f:
+        f.write('{"habitats": {"A5": ["A5.1", "A6.1"]}}')
+    with pytest.raises(ValueError):
+        EunisRegistry.build(path)
@@ -0,0 +1,129 @@
+########################################################################################################################
+
+# Title: Decision store tests
+
+# Script description:    Checks that the decision store (Decision_Store.py) reuses recorded decisions and expert
+#                        judgements, reports the decisions it cannot record, and that its fingerprint changes only when
+#                        judgements are imported - without the store being created just to read the fingerprint.
+
+########################################################################################################################
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from combined_map.__main__ import main
+from combined_map.Combined_Map_Functions import decision_tree
+from combined_map.Decision_Store import DecisionStore, judgement_fingerprint
+
+
+def _comparison():
+    return pd.DataFrame({
+        'NewGUI': ['GB500001', 'GB500002', 'GB500003', 'GB500004'],
+        'ExistingGUI': ['GB000001', 'GB000002', 'GB000003', 'GB000004'],
+        'New_Habitat_Classification': ['Intertidal', 'Sub-tidal', 'Mixed habitat', 'Sub-tidal'],
+        'Existing_Habitat_Classification': ['Sub-tidal', 'Intertidal', 'Sub-tidal', 'Mixed habitat'],
+        'New_3_Step_Confidence_Score': [1, 2, 3, 2],
+        'Existing_3_Step_Confidence_Score': [1, 1, 3, 2],
+        'New_MESH_Score': [50, 60, 70, 40],
+        'Existing_MESH_Score': [50, 60, 70, 40]}, index=[10, 11, 12, 13])
+
+
+class Counter(object):
+    """Decision tree function which counts the rows it decides"""
+
+    def __init__(self):
+        self.rows = 0
+
+    def __call__(self, new):
+        self.rows += len(new)
+        return new.apply(lambda df: decision_tree(df), axis=1)
+
+
+def test_decide_reuses_recorded_decisions(tmp_path):
+    path = str(tmp_path / 'Decisions.sqlite')
+    Comparison_DF = _comparison()
+    decide = Counter()
+    with DecisionStore(path) as store:
+        first = store.decide(Comparison_DF, decide)
+    assert decide.rows == 4
+    assert first['Decision_Source'].tolist() == ['decision_tree'] * 4
+    assert first['Comparison_Result'].tolist() == ['GB500001', 'GB000002', 'Requires expert judgement',
+                                                   'Requires expert judgement']
+    assert first.index.tolist() == Comparison_DF.index.tolist()
+
+    # A changed confidence score makes a new intersection record
+    Comparison_DF.loc[13, 'New_3_Step_Confidence_Score'] = 3
+    with DecisionStore(path) as store:
+        second = store.decide(Comparison_DF, decide)
+    assert decide.rows == 5
+    assert second['Decision_Source'].tolist() == ['stored', 'stored', 'stored', 'decision_tree']
+    assert second.loc[13, 'Comparison_Result'] == 'GB500004'
+
+
+def test_expert_judgements_round_trip(tmp_path, capsys):
+    path = str(tmp_path / 'Decisions.sqlite')
+    with DecisionStore(path) as store:
+        decided = store.decide(_comparison(), Counter())
+        before = store.fingerprint()
+        Reviewed = decided.loc[decided['Comparison_Result'] == 'Requires expert judgement'].copy()
+        Reviewed['Expert_Judgement'] = [Reviewed.loc[12, 'ExistingGUI'], None]
+        assert store.record_judgements(Reviewed, judged_by='Reviewer') == 1
+        assert '1 of 2 reviewed rows have no Expert_Judgement' in capsys.readouterr().out
+        after = store.fingerprint()
+
+        Reviewed['Expert_Judgement'] = ['GB999999', None]
+        with pytest.raises(ValueError):
+            store.record_judgements(Reviewed)
+
+        decide = Counter()
+        reused = store.decide(_comparison(), decide)
+        summary = store.summary()
+    assert decide.rows == 0
+    assert reused.loc[12, ['Comparison_Result', 'Decision_Source']].tolist() == ['GB000003', 'expert']
+    assert reused.loc[13, ['Comparison_Result', 'Decision_Source']].tolist() == ['Requires expert judgement',
+                                                                                 'stored']
+    assert before != after
+    assert summary.set_index('Decision_Source').loc['expert', 'Decisions'] == 1
+
+    # Recording the decision tree results again keeps the expert judgement
+    with DecisionStore(path) as store:
+        assert store.record(decided) == 0
+        assert store.fingerprint() == after
+    assert '4 of 4 decisions were not recorded' in capsys.readouterr().out
+
+
+def test_record_reports_rows_missing_a_key(tmp_path, capsys):
+    Comparison_DF = _comparison()
+    Comparison_DF['Comparison_Result'] = [decision_tree(x) for _, x in Comparison_DF.iterrows()]
+    Comparison_DF.loc[11, 'Existing_MESH_Score'] = np.nan
+    with DecisionStore(str(tmp_path / 'Decisions.sqlite')) as store:
+        assert store.record(Comparison_DF) == 3
+    assert '1 of 4 decisions were not recorded within %s (1 missing a key column, 0 already recorded)' % store.path \
+        in capsys.readouterr().out
+
+
+def test_fingerprint_does_not_create_the_store(tmp_path):
+    path = str(tmp_path / 'Decisions.sqlite')
+    empty = judgement_fingerprint(path)
+    assert not os.path.exists(path)
+    with DecisionStore(path) as store:
+        assert store.fingerprint() == empty
+        store.decide(_comparison(), Counter())
+    assert judgement_fingerprint(path) == empty
+
+
+def test_listing_the_pipeline_does_not_create_the_store(tmp_path, capsys):
+    path = str(tmp_path / 'Decisions.sqlite')
+    config = dict((x, str(tmp_path / x)) for x in ['checkpoint_dir', 'combined_map', 'uksm', 'mhw_land',
+                                                    'reference_gdb', 'confidence_metadata', 'gui_tracking'])
+    config['decision_store'] = path
+    config_path = str(tmp_path / 'update_config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+    assert main([config_path, '--list']) == 0
+    assert 'decision_tree' in capsys.readouterr().out
+    assert not os.path.exists(path)
@@ -0,0 +1,66 @@
+########################################################################################################################
+
+# Title: Generalised Layer tests
+
+# Script description:    Checks that the predicates settled on the generalised layer of Generalised_Layer.py match
+#                        those tested on full detail geometry, that the outer and inner approximations bound every
+#                        feature, and that a saved generalised layer loads unchanged.
+
+########################################################################################################################
+
+import numpy as np
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+from combined_map.Generalised_Layer import GeneralisedLayer
+from combined_map.Synthetic_Data import generate_update_inputs
+
+
+@pytest.fixture(scope='module')
+def layers():
+    data = generate_update_inputs(scale=0.25, seed=5)
+    return data['uksm'], shapely.from_wkb(data['combined_map']['WKB'].values)
+
+
+@pytest.fixture(scope='module')
+def generalised(layers):
+    uksm, _ = layers
+    return GeneralisedLayer.build(uksm, tolerances=(0.1, 0.01))
+
+
+def test_approximations_bound_every_feature(generalised):
+    for outer, inner in zip(generalised.outer, generalised.inner):
+        assert shapely.covers(outer, generalised.geometries).all()
+        assert shapely.covers(generalised.geometries, inner).all()
+
+
+@pytest.mark.parametrize('predicate', ['intersects', 'contains'])
+def test_query_matches_full_detail(layers, generalised, predicate):
+    _, geometries = layers
+    left, right = generalised.query(geometries, predicate)
+    expected_left, expected_right = shapely.STRtree(geometries).query(generalised.geometries, predicate)
+    order = np.lexsort((expected_right, expected_left))
+    assert np.array_equal(left, expected_left[order])
+    assert np.array_equal(right, expected_right[order])
+    statistics = generalised.statistics
+    assert statistics['candidates'] == sum(v for k, v in statistics.items() if k != 'candidates')
+    # Most candidate pairs are settled without testing full detail geometry
+    assert statistics['full'] < statistics['candidates']
+
+
+def test_select_and_unknown_predicate(layers, generalised):
+    _, geometries = layers
+    selected = generalised.select(geometries)
+    assert np.array_equal(selected, shapely.intersects(generalised.geometries[:, None], geometries[None, :]).any(1))
+    with pytest.raises(ValueError):
+        generalised.query(geometries, 'touches')
+
+
+def test_save_and_load(generalised, tmp_path):
+    generalised.save(str(tmp_path / 'generalised.pkl'))
+    loaded = GeneralisedLayer.load(str(tmp_path / 'generalised.pkl'))
+    assert loaded.tolerances == generalised.tolerances
+    assert np.array_equal(loaded.oids, generalised.oids)
+    assert loaded.vertex_counts() == generalised.vertex_counts()
+    assert shapely.equals_exact(loaded.geometries, generalised.geometries, tolerance=0).all()
@@ -0,0 +1,59 @@
+########################################################################################################################
+
+# Title: Geometry QA tests
+
+# Script description:    Checks the validation and repair of geometries (check_geometries()) and the overlap report
+#                        (find_overlaps()), including layers holding polygons which GEOS cannot intersect until they
+#                        have been repaired.
+
+########################################################################################################################
+
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+from combined_map.Geometry_QA import check_geometries, find_overlaps
+
+#   Self-intersecting ring - GEOS raises a TopologyException when it is intersected without being repaired
+BOWTIE = shapely.Polygon([(0, 0), (2, 0), (2, 2), (1, -1), (0, 2)])
+
+
+def _layer(geometries, guis):
+    return pd.DataFrame({'OID': range(1, len(guis) + 1), 'GUI': guis, 'WKB': shapely.to_wkb(geometries)})
+
+
+def test_check_geometries_repairs_invalid_polygons():
+    checked = check_geometries(_layer([shapely.box(0, 0, 1, 1), BOWTIE], ['GB1', 'GB2']), workers=1)
+    assert checked['Valid'].tolist() == [True, False]
+    assert checked['Repaired'].tolist() == [False, True]
+    assert shapely.is_valid(shapely.from_wkb(checked['WKB'].values)).all()
+
+
+def test_find_overlaps():
+    layer = _layer([shapely.box(0, 0, 2, 2), shapely.box(1, 1, 3, 3), shapely.box(2, 0, 3, 1),
+                    shapely.box(0, 1.99, 3, 2.01)], ['GB1', 'GB2', 'GB3', 'GB4'])
+    Overlap_Pairs, Overlap_Report = find_overlaps(layer)
+    pairs = dict(((x.GUI_1, x.GUI_2), x) for x in Overlap_Pairs.itertuples())
+    # Boxes which only share an edge do not overlap
+    assert sorted(pairs) == [('GB1', 'GB2'), ('GB1', 'GB4'), ('GB2', 'GB4')]
+    assert pairs[('GB1', 'GB2')].Overlap_Area == pytest.approx(1.0)
+    assert not pairs[('GB1', 'GB2')].Sliver
+    assert pairs[('GB1', 'GB4')].Sliver
+    report = Overlap_Report.set_index('GUI')
+    assert report.loc['GB1', 'Overlap_Count'] == 2
+    assert report.loc['GB4', 'Sliver_Count'] == 2
+
+
+def test_find_overlaps_with_an_unrepaired_polygon():
+    layer = _layer([BOWTIE, shapely.box(0.5, 0, 1.5, 1), shapely.box(5, 5, 6, 6), shapely.box(5.5, 5.5, 7, 7)],
+                   ['GB1', 'GB2', 'GB3', 'GB4'])
+    with pytest.raises(shapely.errors.GEOSException):
+        shapely.intersection(BOWTIE, shapely.box(0.5, 0, 1.5, 1))
+    Overlap_Pairs, _ = find_overlaps(layer)
+    pairs = dict(((x.GUI_1, x.GUI_2), x.Overlap_Area) for x in Overlap_Pairs.itertuples())
+    assert sorted(pairs) == [('GB1', 'GB2'), ('GB3', 'GB4')]
+    assert pairs[('GB3', 'GB4')] == pytest.approx(0.25)
+    repaired = shapely.make_valid(BOWTIE)
+    assert pairs[('GB1', 'GB2')] == pytest.approx(shapely.area(shapely.intersection(repaired,
+                                                                                   shapely.box(0.5, 0, 1.5, 1))))
@@ -0,0 +1,100 @@
+########################################################################################################################
+
+# Title: GeoParquet tests
+
+# Script description:    Checks that layers written to GeoParquet (GeoParquet.py) are read back unchanged, and that
+#                        reads by bounding box, GUI and Source only read the row groups which may hold matching
+#                        features while returning every matching feature.
+
+########################################################################################################################
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from combined_map.GeoParquet import (hilbert_distance, read_geoparquet, row_group_statistics, select_row_groups,
+                                     write_geoparquet)
+from combined_map.Synthetic_Data import generate_update_inputs
+
+
+@pytest.fixture(scope='module')
+def layer():
+    return generate_update_inputs(scale=0.5, seed=2)['combined_map']
+
+
+@pytest.fixture(scope='module')
+def parquet_path(layer, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('geoparquet') / 'Combined_Map.parquet')
+    assert write_geoparquet(layer, path, row_group_size=25) == (len(layer) + 24) // 25
+    return path
+
+
+def _sorted(df):
+    """Sort features, reading the missing values of text columns as None (as they are read back from Parquet)"""
+    Sorted = df.sort_values(['GUI', 'POLYGON']).reset_index(drop=True)
+    text = Sorted.select_dtypes(exclude='number').columns
+    Sorted[text] = Sorted[text].astype(object).where(Sorted[text].notna(), None)
+    return Sorted
+
+
+def test_hilbert_distance_visits_every_cell_once():
+    x, y = np.meshgrid(np.arange(4), np.arange(4))
+    distance = hilbert_distance(x.ravel(), y.ravel(), (0, 0, 3, 3), order=2)
+    assert sorted(distance) == list(range(16))
+    # Consecutive cells along the curve are neighbours
+    order = np.argsort(distance)
+    steps = np.abs(np.diff(x.ravel()[order])) + np.abs(np.diff(y.ravel()[order]))
+    assert (steps == 1).all()
+
+
+def test_round_trip(layer, parquet_path):
+    Read = read_geoparquet(parquet_path)
+    pd.testing.assert_frame_equal(_sorted(Read)[list(layer.columns)], _sorted(layer))
+    metadata = json.loads(pq.ParquetFile(parquet_path).schema_arrow.metadata[b'geo'])
+    assert metadata['primary_column'] == 'geometry'
+    assert metadata['columns']['geometry']['geometry_types']
+
+
+def test_bbox_reads_prune_row_groups(layer, parquet_path):
+    statistics = row_group_statistics(parquet_path)
+    assert statistics['rows'].sum() == len(layer)
+    bounds = shapely.bounds(shapely.from_wkb(layer['WKB'].values))
+    xmin, ymin = bounds[:, 0].min(), bounds[:, 1].min()
+    xmax, ymax = bounds[:, 2].max(), bounds[:, 3].max()
+    bbox = (xmin, ymin, xmin + (xmax - xmin) / 5, ymin + (ymax - ymin) / 5)
+
+    selected = select_row_groups(statistics, bbox=bbox)
+    assert 0 < len(selected) < len(statistics)
+    Read = read_geoparquet(parquet_path, bbox=bbox)
+    expected = (bounds[:, 0] <= bbox[2]) & (bounds[:, 2] >= bbox[0]) & (bounds[:, 1] <= bbox[3]) & \
+        (bounds[:, 3] >= bbox[1])
+    pd.testing.assert_frame_equal(_sorted(Read)[list(layer.columns)], _sorted(layer.loc[expected]))
+
+
+def test_attribute_reads(layer, parquet_path):
+    guis = sorted(layer['GUI'].unique())[:2]
+    Read = read_geoparquet(parquet_path, gui=guis, columns=['GUI', 'POLYGON'])
+    assert sorted(Read.columns) == ['GUI', 'POLYGON', 'WKB']
+    assert len(Read) == layer['GUI'].isin(guis).sum()
+    assert set(Read['GUI']) == set(guis)
+
+    assert read_geoparquet(parquet_path, source=['No such source']).empty
+    statistics = row_group_statistics(parquet_path)
+    assert len(select_row_groups(statistics, gui=['ZZ999999'])) == 0
+
+
+def test_null_geometries(tmp_path):
+    Layer = pd.DataFrame({'GUI': ['GB1', 'GB2', 'GB3'], 'Source': ['A', 'B', 'C'],
+                          'WKB': [shapely.to_wkb(shapely.box(0, 0, 1, 1)), None,
+                                  shapely.to_wkb(shapely.box(5, 5, 6, 6))]})
+    path = str(tmp_path / 'Nulls.parquet')
+    write_geoparquet(Layer, path, row_group_size=2)
+    Read = read_geoparquet(path)
+    assert Read['GUI'].tolist()[-1] == 'GB2'
+    assert Read['WKB'].isna().tolist() == [False, False, True]
+    assert read_geoparquet(path, bbox=(-1, -1, 2, 2))['GUI'].tolist() == ['GB1']
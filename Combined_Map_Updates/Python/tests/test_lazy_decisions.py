@@ -0,0 +1,89 @@
+########################################################################################################################
+
+# Title: Lazy decision tree tests
+
+# Script description:    Checks that the Polars version of Sections 3.3. - 3.8. (Lazy_Decisions.py) returns the same
+#                        metadata check outputs, comparison results, intersections requiring expert judgement and join
+#                        results as the Pandas version (Combined_Map_Stages.py), on generated decision tables (including
+#                        HAB_TYPE values which a prefix search would misread), and reaches the same result as
+#                        decision_tree() for every combination of habitat classifications and confidence scores.
+
+########################################################################################################################
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pl = pytest.importorskip('polars')
+
+from combined_map import Lazy_Decisions
+from combined_map.Combined_Map_Functions import decision_tree
+from combined_map.Combined_Map_Stages import (build_comparison, build_control_frames,
+                                              build_existing_decision_attributes, build_new_decision_attributes,
+                                              load_confidence_metadata, run_decision_tree, run_metadata_checks)
+from combined_map.Lazy_Decisions import SCORE_COLUMNS, _decision, build_decision_plan, run_lazy_decisions
+from combined_map.Synthetic_Data import generate_decision_tables, write_update_inputs
+
+
+def _pandas_decisions(data, paths):
+    """Run Sections 3.3. - 3.8. with Pandas, as within the decision tree stages"""
+    Intersection_Attributes = pd.read_csv(paths['intersection_attributes'], sep=',')
+    Merged_Attributes = pd.read_csv(paths['merged_attributes'], sep=',')
+    Intersected_Maps, Control_DF = build_control_frames(Intersection_Attributes)
+    ThreeStep_GUI_Confidence, GUI_Tracking = load_confidence_metadata(paths['confidence'], paths['gui_tracking'])
+    outputs = run_metadata_checks(Control_DF, ThreeStep_GUI_Confidence, GUI_Tracking)
+    New_Decision_Attributes = build_new_decision_attributes(Merged_Attributes, ThreeStep_GUI_Confidence)
+    Combined_Decision_Attributes = build_existing_decision_attributes(Intersection_Attributes, Intersected_Maps,
+                                                                      ThreeStep_GUI_Confidence)
+    Comparison_DF = build_comparison(Control_DF, New_Decision_Attributes, Combined_Decision_Attributes)
+    outputs['Comparison_DF'], outputs['Requires_Judgement'], outputs['Join_Results'] = run_decision_tree(Comparison_DF)
+    return outputs
+
+
+#   HAB_TYPE values which a substring or prefix search would misread, and codes deeper than level 4
+AWKWARD_HABITATS = ['A10', 'A10.1/A5.2', 'A5.2511', 'A1.1131/A5.2511', 'A2.611 + A3.1123', 'B3.11', 'C1.1', None]
+
+
+@pytest.mark.parametrize('seed, awkward', [(0, False), (1, False), (2, True)])
+def test_lazy_decisions_match_pandas(tmp_path, seed, awkward):
+    data = generate_decision_tables(existing_maps=200, seed=seed)
+    if awkward:
+        rng = np.random.default_rng(seed)
+        for name in ['merged_attributes', 'intersection_attributes']:
+            data[name]['HAB_TYPE'] = data[name]['HAB_TYPE'].astype(object)
+            replace = rng.random(len(data[name])) < 0.3
+            data[name].loc[replace, 'HAB_TYPE'] = rng.choice(np.array(AWKWARD_HABITATS, dtype=object), replace.sum())
+    paths = write_update_inputs(data, str(tmp_path))
+    expected = _pandas_decisions(data, paths)
+    lazy = run_lazy_decisions(paths['intersection_attributes'], paths['merged_attributes'], paths['confidence'],
+                              paths['gui_tracking'])
+
+    assert sorted(lazy) == sorted(expected)
+    # Every output holds rows for these seeds, so each comparison below checks real data
+    assert all(len(x) for x in expected.values())
+    for name, Expected in expected.items():
+        pd.testing.assert_frame_equal(lazy[name], Expected, check_dtype=False, check_index_type=False, obj=name)
+
+
+def test_lazy_decision_covers_every_rule():
+    classifications = ['Intertidal', 'Mixed habitat', 'Sub-tidal', 'Error']
+    rows = [dict(zip(['New_Habitat_Classification', 'Existing_Habitat_Classification'] + SCORE_COLUMNS, x))
+            for x in itertools.product(classifications, classifications, [0, 1, 2], [0, 1, 2], [0, 1], [0, 1])]
+    Comparison_DF = pd.DataFrame(rows)
+    Comparison_DF['NewGUI'] = ['GB%06d' % (500001 + i) for i in range(len(Comparison_DF))]
+    Comparison_DF['ExistingGUI'] = ['GB%06d' % (i + 1) for i in range(len(Comparison_DF))]
+
+    expected = [decision_tree(x) for _, x in Comparison_DF.iterrows()]
+    lazy = pl.from_pandas(Comparison_DF).select(_decision())['Comparison_Result'].to_list()
+    assert lazy == expected
+    # Every outcome of the decision tree is reached - the new GUI, the existing GUI, expert judgement and no result
+    assert set(x if x is None or x == 'Requires expert judgement' else x[:3] for x in expected) == \
+        {'GB5', 'GB0', 'Requires expert judgement', None}
+
+
+def test_lazy_plan_requires_the_same_decision_tree_version(monkeypatch):
+    monkeypatch.setattr(Lazy_Decisions, 'LAZY_DECISION_TREE_VERSION', Lazy_Decisions.DECISION_TREE_VERSION + 1)
+    with pytest.raises(ValueError):
+        build_decision_plan('intersection.csv', 'merged.csv', 'confidence.csv', 'tracking.csv')
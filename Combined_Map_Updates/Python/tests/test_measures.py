@@ -0,0 +1,79 @@
+########################################################################################################################
+
+# Title: Measures tests
+
+# Script description:    Checks the areas and perimeters of Measures.py against known values on the WGS 1984
+#                        ellipsoid - the area of the whole ellipsoid, the area between two parallels (integrated
+#                        numerically from the radii of curvature, independently of the authalic latitude used by
+#                        Measures.py) and the lengths of the equator and of meridians - and that layers measured within
+#                        several worker processes, including null and empty geometries, give the same results.
+
+########################################################################################################################
+
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+from combined_map.Measures import add_area_field, measure_geometries, measure_layer
+
+#   Surface area (km2) of the WGS 1984 ellipsoid
+ELLIPSOID_AREA_KM2 = 510065621.7184
+#   Length (km) of one degree of longitude along the equator
+EQUATOR_DEGREE_KM = 6378.137 * np.pi / 180
+#   Length (km) of the meridian between the equator and 1 degree north
+MERIDIAN_DEGREE_KM = 110.574389
+
+
+def _cell_area_km2(south, north, width):
+    """Integrate the area (km2) of a cell width degrees wide between two parallels over the ellipsoid, using the
+    meridian (M) and prime vertical (N) radii of curvature - dA = M N cos(latitude) dlatitude dlongitude"""
+    a = 6378.137
+    e2 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+    latitude = np.radians(np.linspace(south, north, 100001))
+    w = 1 - e2 * np.sin(latitude) ** 2
+    integrand = a * (1 - e2) / w ** 1.5 * a / np.sqrt(w) * np.cos(latitude)
+    return np.trapezoid(integrand, latitude) * np.radians(width)
+
+
+@pytest.mark.parametrize('south, north, width', [(0, 1, 1), (50, 51, 1), (55.5, 56, 0.25), (-60, -30, 10)])
+def test_cell_areas(south, north, width):
+    area, _ = measure_geometries([shapely.box(0, south, width, north)])
+    assert area[0] == pytest.approx(_cell_area_km2(south, north, width), rel=1e-9)
+
+
+def test_known_areas():
+    area, _ = measure_geometries([shapely.box(0, 0, 1, 1), shapely.box(-180, 0, 180, 90),
+                                  shapely.box(-180, -90, 180, 90)])
+    assert area[1] == pytest.approx(ELLIPSOID_AREA_KM2 / 2, rel=1e-9)
+    assert area[2] == pytest.approx(ELLIPSOID_AREA_KM2, rel=1e-9)
+
+
+def test_holes_and_multi_polygons():
+    cell = shapely.box(0, 50, 1, 51)
+    hole = shapely.box(0.25, 50.25, 0.75, 50.75)
+    area, perimeter = measure_geometries([cell, hole, cell.difference(hole),
+                                          shapely.MultiPolygon([cell, shapely.box(2, 50, 3, 51)])])
+    assert area[2] == pytest.approx(area[0] - area[1], rel=1e-12)
+    assert perimeter[2] == pytest.approx(perimeter[0] + perimeter[1], rel=1e-12)
+    assert area[3] == pytest.approx(2 * area[0], rel=1e-12)
+
+
+def test_perimeters():
+    _, perimeter = measure_geometries([shapely.box(0, -1e-6, 1, 0), shapely.box(0, 0, 1e-6, 1)])
+    assert perimeter[0] == pytest.approx(2 * EQUATOR_DEGREE_KM, rel=1e-5)
+    assert perimeter[1] == pytest.approx(2 * MERIDIAN_DEGREE_KM, rel=1e-5)
+
+
+def test_layers_measured_within_workers():
+    geometries = [shapely.box(x, 50, x + 0.5, 50.5) for x in range(10)] + [None, shapely.Polygon()]
+    layer = pd.DataFrame({'GUI': ['GB%d' % x for x in range(12)], 'WKB': shapely.to_wkb(geometries)})
+    area, perimeter = measure_layer(layer)
+    parallel_area, parallel_perimeter = measure_layer(layer, workers=2, chunk_size=3)
+    assert np.array_equal(area, parallel_area, equal_nan=True)
+    assert np.array_equal(perimeter, parallel_perimeter, equal_nan=True)
+    assert area[:10] == pytest.approx(measure_geometries(geometries[:10])[0], rel=1e-12)
+    # Null geometries have no area, and empty geometries an area of 0
+    assert np.isnan(area[10]) and area[11] == 0
+    assert np.array_equal(add_area_field(layer)['AreaKm2'].values, area, equal_nan=True)
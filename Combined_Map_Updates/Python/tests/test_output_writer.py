@@ -0,0 +1,98 @@
+########################################################################################################################
+
+# Title: Output writer tests
+
+# Script description:    Checks that tables are written through temporary files in each format (Output_Writer.py),
+#                        that mixed object columns are written to Parquet as text without changing the queued table,
+#                        and that failed writes are retried, then reported when the writer is waited on.
+
+########################################################################################################################
+
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from combined_map import Output_Writer
+from combined_map.Output_Writer import OutputWriter, get_writer, publish, set_writer, write_table
+
+
+def _table():
+    return pd.DataFrame({'GUI': ['GB000001', 'GB000002', None],
+                         'Value': [1, 'two', None],
+                         'GUIs': [['GB000001', 'GB000002'], [], None]}, index=[5, 6, 7])
+
+
+def test_write_table_formats(tmp_path):
+    df = _table()
+    parquet = write_table(df, str(tmp_path / 'out' / 'table.parquet'))
+    read = pd.read_parquet(parquet)
+    assert list(read.index) == [5, 6, 7]
+    assert list(read['Value'].fillna('')) == ['1', 'two', '']
+    assert list(read['GUIs'].fillna('')) == ["['GB000001', 'GB000002']", '[]', '']
+    # The queued table is left as it was
+    assert df['Value'].iloc[0] == 1 and isinstance(df['GUIs'].iloc[0], list)
+
+    csv = write_table(df, str(tmp_path / 'out' / 'table.txt'), 'csv', index=False)
+    assert list(pd.read_csv(csv)['GUI'].fillna('')) == ['GB000001', 'GB000002', '']
+    assert sorted(os.listdir(str(tmp_path / 'out'))) == ['table.parquet', 'table.txt']
+
+    with pytest.raises(ValueError):
+        write_table(df, str(tmp_path / 'table.xlsx'))
+
+
+def test_writer_writes_every_format(tmp_path):
+    folder = str(tmp_path / 'outputs')
+    with OutputWriter(folder, formats=('parquet', 'csv')) as writer:
+        futures = writer.write('Join_Results', _table())
+        assert [x.result() for x in futures] == writer.paths('Join_Results')
+    assert sorted(os.listdir(folder)) == ['Join_Results.csv', 'Join_Results.parquet']
+    assert sorted((x['name'], x['rows'], x['attempts']) for x in writer.written) == [('Join_Results', 3, 1)] * 2
+    assert writer.pending() == 0
+
+    with pytest.raises(ValueError):
+        OutputWriter(folder, formats=('xlsx',))
+
+
+def test_failed_writes_are_retried(tmp_path, monkeypatch):
+    failures = []
+
+    def flaky_write(df, path, file_format=None, index=True):
+        if not failures:
+            failures.append(path)
+            raise IOError('network drive unavailable')
+        return write_table(df, path, file_format, index)
+
+    monkeypatch.setattr(Output_Writer, 'write_table', flaky_write)
+    writer = OutputWriter(str(tmp_path), attempts=2, retry_seconds=0)
+    writer.write('Requires_Judgement', _table())
+    assert writer.close() == 1
+    assert [x['attempts'] for x in writer.written] == [2]
+    assert os.path.isfile(str(tmp_path / 'Requires_Judgement.parquet'))
+
+
+def test_failed_writes_are_reported(tmp_path):
+    # The output folder cannot be created where a file already exists
+    folder = str(tmp_path / 'not_a_folder')
+    with open(folder, 'w') as f:
+        f.write('')
+    writer = OutputWriter(folder, attempts=2, retry_seconds=0)
+    writer.write('GUI_Zero_Confidence', _table())
+    with pytest.raises(IOError) as error:
+        writer.close()
+    assert 'GUI_Zero_Confidence.parquet' in str(error.value)
+    assert writer.written == []
+
+
+def test_publish_uses_the_active_writer(tmp_path):
+    assert get_writer() is None
+    assert publish('Zero_MESH_Confidence', _table()) == []
+    writer = set_writer(OutputWriter(str(tmp_path)))
+    try:
+        assert len(publish('Zero_MESH_Confidence', _table())) == 1
+        assert writer.close() == 1
+    finally:
+        set_writer(None)
+    assert os.listdir(str(tmp_path)) == ['Zero_MESH_Confidence.parquet']
@@ -0,0 +1,93 @@
+########################################################################################################################
+
+# Title: Overlay tests
+
+# Script description:    Checks that the overlays of Overlay.py return the same features, attributes and geometries
+#                        when run within one process and across several worker processes (small chunks, so that
+#                        every worker handles several chunks), with and without rounding the input coordinates or a
+#                        fixed-precision grid, and that only the pairs GEOS cannot node are re-run on ROBUST_GRID_SIZE.
+
+########################################################################################################################
+
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+from combined_map.Geometry_Buffers import GeometryBuffers
+from combined_map.Overlay import ROBUST_GRID_SIZE, _pairwise, dissolve_layer, erase_layer, intersect_layers
+from combined_map.Synthetic_Data import generate_update_inputs
+
+
+@pytest.fixture(scope='module')
+def layers():
+    data = generate_update_inputs(scale=0.25, seed=3)
+    return data['combined_map'], data['new_maps'], data['uksm']
+
+
+def _area(layer):
+    return shapely.area(shapely.from_wkb(layer['WKB'].values)).sum()
+
+
+def _assert_same_layer(single, parallel):
+    assert len(single) > 0
+    pd.testing.assert_frame_equal(single.drop(columns=['WKB']), parallel.drop(columns=['WKB']))
+    expected, actual = shapely.from_wkb(single['WKB'].values), shapely.from_wkb(parallel['WKB'].values)
+    assert np.all(shapely.equals_exact(expected, actual, tolerance=1e-9))
+
+
+@pytest.mark.parametrize('grid_size', [None, 1e-7])
+@pytest.mark.parametrize('precision', [None, 1e-3])
+def test_erase_single_and_multiple_workers(layers, precision, grid_size):
+    combined_map, new_maps, _ = layers
+    single = erase_layer(combined_map, new_maps, precision=precision, grid_size=grid_size)
+    parallel = erase_layer(combined_map, new_maps, workers=2, chunk_size=20, precision=precision, grid_size=grid_size)
+    assert _area(single) < _area(combined_map)
+    _assert_same_layer(single, parallel)
+
+
+@pytest.mark.parametrize('grid_size', [None, 1e-7])
+@pytest.mark.parametrize('precision', [None, 1e-3])
+def test_intersect_single_and_multiple_workers(layers, precision, grid_size):
+    combined_map, new_maps, _ = layers
+    single = intersect_layers(combined_map, new_maps, precision=precision, grid_size=grid_size)
+    parallel = intersect_layers(combined_map, new_maps, workers=2, chunk_size=20, precision=precision,
+                                grid_size=grid_size)
+    _assert_same_layer(single, parallel)
+
+
+@pytest.mark.parametrize('grid_size', [None, 1e-7])
+@pytest.mark.parametrize('precision', [None, 1e-3])
+def test_dissolve_single_and_multiple_workers(layers, precision, grid_size):
+    _, _, uksm = layers
+    single = dissolve_layer(uksm, 'HAB_TYPE', precision=precision, grid_size=grid_size)
+    parallel = dissolve_layer(uksm, 'HAB_TYPE', workers=2, chunk_size=3, precision=precision, grid_size=grid_size)
+    assert len(single) < len(uksm)
+    _assert_same_layer(single, parallel)
+
+
+def test_precision_buffers_hold_rounded_bounds(layers):
+    combined_map, _, _ = layers
+    buffers = GeometryBuffers.from_wkb(combined_map['WKB'].values, 1e-3)
+    geometries = buffers.take(np.arange(len(buffers)))
+    vertices = shapely.get_coordinates(geometries)
+    assert np.allclose(vertices / 1e-3, np.round(vertices / 1e-3), atol=1e-6)
+    assert np.array_equal(buffers.bounds, shapely.bounds(geometries), equal_nan=True)
+
+
+def test_pairwise_reruns_only_failing_pairs():
+    failing = shapely.box(0.5, 0.5, 1.5, 1.5)
+
+    def difference(a, b, grid_size=None):
+        if grid_size != ROBUST_GRID_SIZE and np.any(shapely.equals(b, failing)):
+            raise shapely.errors.GEOSException('TopologyException: Ring edge missing')
+        return shapely.difference(a, b, grid_size=grid_size)
+
+    left = np.array([shapely.box(0, 0, 1, 1), shapely.box(0, 0, 1, 1)])
+    right = np.array([shapely.box(0.5, 0, 1, 1), failing])
+    result = _pairwise(difference, left, right)
+    assert shapely.equals_exact(result[0], shapely.difference(left[0], right[0]), tolerance=0)
+    assert shapely.equals(result[1], shapely.difference(left[1], right[1], grid_size=ROBUST_GRID_SIZE))
+    with pytest.raises(shapely.errors.GEOSException):
+        _pairwise(difference, left, right, grid_size=1e-7)
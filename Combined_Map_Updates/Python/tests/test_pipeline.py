@@ -0,0 +1,151 @@
+########################################################################################################################
+
+# Title: Pipeline checkpoint tests
+
+# Script description:    Checks that the pipeline (Pipeline.py) reuses the checkpoint of a stage when nothing it
+#                        depends on has changed, and re-runs it (and the stages after it) when its inputs, parameters or
+#                        helper code change.
+
+########################################################################################################################
+
+import pytest
+
+from combined_map.Pipeline import Pipeline, Stage, StageOutput
+
+
+def _double(value):
+    return value * 2
+
+
+def _triple(value):
+    return value * 3
+
+
+class Recorder(object):
+    """Stage functions which record every run"""
+
+    def __init__(self):
+        self.runs = []
+        self.helper = _double
+
+    def scale(self, inputs, outputs, params):
+        self.runs.append('scale')
+        with open(inputs['source']) as f:
+            value = int(f.read())
+        with open(outputs['scaled'], 'w') as f:
+            f.write(str(self.helper(value) + params['offset']))
+
+    def report(self, inputs, outputs, params):
+        self.runs.append('report')
+        with open(inputs['scaled']) as f, open(outputs['report'], 'w') as out:
+            out.write('Scaled value: %s' % f.read())
+
+
+def _build(checkpoint_dir, recorder, source, offset=0, code=None):
+    pipeline = Pipeline(checkpoint_dir, max_workers=1)
+    pipeline.add(Stage('scale', recorder.scale, inputs={'source': source}, outputs={'scaled': 'scaled.txt'},
+                       params={'offset': offset}, code=code or [recorder.helper]))
+    pipeline.add(Stage('report', recorder.report, inputs={'scaled': StageOutput('scale', 'scaled')},
+                       outputs={'report': 'report.txt'}))
+    return pipeline
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'source.txt')
+    with open(path, 'w') as f:
+        f.write('21')
+    return path
+
+
+def test_runs_then_reuses_checkpoints(tmp_path, source):
+    recorder = Recorder()
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    first = _build(checkpoint_dir, recorder, source).run()
+    assert recorder.runs == ['scale', 'report']
+    assert _read(first['report']['report']) == 'Scaled value: 42'
+
+    second = _build(checkpoint_dir, recorder, source).run()
+    assert recorder.runs == ['scale', 'report']
+    assert second == first
+
+
+def test_resumes_after_a_failed_stage(tmp_path, source):
+    recorder = Recorder()
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    report = recorder.report
+
+    def fail(inputs, outputs, params):
+        raise ValueError('Report failed')
+
+    recorder.report = fail
+    with pytest.raises(RuntimeError):
+        _build(checkpoint_dir, recorder, source).run()
+    assert recorder.runs == ['scale']
+
+    recorder.report = report
+    outputs = _build(checkpoint_dir, recorder, source).run()
+    assert recorder.runs == ['scale', 'report']
+    assert _read(outputs['report']['report']) == 'Scaled value: 42'
+
+
+def test_reruns_when_the_input_changes(tmp_path, source):
+    recorder = Recorder()
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    _build(checkpoint_dir, recorder, source).run()
+    with open(source, 'w') as f:
+        f.write('5')
+    outputs = _build(checkpoint_dir, recorder, source).run()
+    assert recorder.runs == ['scale', 'report'] * 2
+    assert _read(outputs['report']['report']) == 'Scaled value: 10'
+
+
+def test_reruns_when_the_parameters_change(tmp_path, source):
+    recorder = Recorder()
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    _build(checkpoint_dir, recorder, source).run()
+    outputs = _build(checkpoint_dir, recorder, source, offset=1).run()
+    assert recorder.runs == ['scale', 'report'] * 2
+    assert _read(outputs['report']['report']) == 'Scaled value: 43'
+
+
+def test_reruns_when_the_helper_code_changes(tmp_path, source):
+    recorder = Recorder()
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    _build(checkpoint_dir, recorder, source).run()
+    recorder.helper = _triple
+    outputs = _build(checkpoint_dir, recorder, source).run()
+    assert recorder.runs == ['scale', 'report'] * 2
+    assert _read(outputs['report']['report']) == 'Scaled value: 63'
+
+    # A version constant listed as code of the stage
+    _build(checkpoint_dir, recorder, source, code=[_triple, {'VERSION': 2}]).run()
+    assert recorder.runs == ['scale', 'report'] * 3
+
+    # A data file read by the stage (e.g. the EUNIS code list)
+    codes_path = str(tmp_path / 'codes.json')
+    with open(codes_path, 'w') as f:
+        f.write('["A5.1"]')
+    _build(checkpoint_dir, recorder, source, code=[_triple, {'VERSION': 2}, codes_path]).run()
+    _build(checkpoint_dir, recorder, source, code=[_triple, {'VERSION': 2}, codes_path]).run()
+    assert recorder.runs == ['scale', 'report'] * 4
+    with open(codes_path, 'w') as f:
+        f.write('["A5.1", "A5.2"]')
+    _build(checkpoint_dir, recorder, source, code=[_triple, {'VERSION': 2}, codes_path]).run()
+    assert recorder.runs == ['scale', 'report'] * 5
+
+
+def test_forced_stage_reruns(tmp_path, source):
+    recorder = Recorder()
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    _build(checkpoint_dir, recorder, source).run()
+    _build(checkpoint_dir, recorder, source).run(force=['report'])
+    assert recorder.runs == ['scale', 'report', 'report']
+    # Stages after a forced stage are forced too
+    _build(checkpoint_dir, recorder, source).run(force=['scale'])
+    assert recorder.runs == ['scale', 'report', 'report', 'scale', 'report']
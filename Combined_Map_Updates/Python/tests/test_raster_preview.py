@@ -0,0 +1,98 @@
+########################################################################################################################
+
+# Title: Raster Preview tests
+
+# Script description:    Checks the grids of Raster_Preview.py on a small combined map and set of new maps - the cells
+#                        each feature is burnt into, the cell areas on the ellipsoid, the intersections and outcome of
+#                        every cell, the area statistics and the quick-look image.
+
+########################################################################################################################
+
+import os
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+
+from combined_map.Measures import measure_geometries
+from combined_map.Raster_Preview import OUTCOMES, OUTCOME_COLOURS, PreviewGrids, preview_update, rasterise
+
+#   Survey map GB1 (half won by GB9, half kept against GB8), NE Evidence Base and UKSeaMap features, and an unmapped
+#   area covered by GB7, each one degree wide
+COMBINED_MAP = pd.DataFrame({'GUI': ['GB1', 'GB2', 'UKSM18'], 'Source': ['Survey', 'NE_Evid', 'UKSM18'],
+                             'WKB': shapely.to_wkb([shapely.box(0, 50, 2, 51), shapely.box(2, 50, 3, 51),
+                                                    shapely.box(3, 50, 4, 51)])})
+NEW_MAPS = pd.DataFrame({'GUI': ['GB9', 'GB8', 'GB7'],
+                         'WKB': shapely.to_wkb([shapely.box(0, 50, 1, 51), shapely.box(1, 50, 2, 51),
+                                                shapely.box(2, 50, 5, 51)])})
+JOIN_RESULTS = pd.DataFrame({'NewGUI': ['GB9', 'GB8'], 'ExistingGUI': ['GB1', 'GB1'],
+                             'Comparison_Result': ['GB9', 'GB1']})
+
+
+@pytest.fixture(scope='module')
+def grids():
+    return PreviewGrids.build(COMBINED_MAP, NEW_MAPS, 0.25)
+
+
+def test_rasterise_cell_centres():
+    layer = pd.DataFrame({'WKB': shapely.to_wkb([shapely.box(0, 0, 2, 2), shapely.box(1, 0, 1.4, 1)])})
+    grid = rasterise(layer, np.array([1, 2]), (0, 0, 2, 2), 0.5)
+    # Row 0 is the northern edge, and the last feature covering a cell centre wins
+    assert grid.tolist() == [[1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 2, 1], [1, 1, 2, 1]]
+
+
+def test_cell_areas(grids):
+    assert grids.shape == (4, 20)
+    total = (np.broadcast_to(grids.cell_areas(), grids.shape)).sum()
+    assert total == pytest.approx(measure_geometries([shapely.box(0, 50, 5, 51)])[0][0], rel=1e-9)
+
+
+def test_intersection_attributes(grids):
+    Intersections = grids.intersection_attributes()
+    assert list(zip(Intersections['GUI'], Intersections['GUI_1'])) == [('GB1', 'GB9'), ('GB1', 'GB8')]
+    assert Intersections['Shape_Area'].tolist() == [1.0, 1.0]
+    areas = measure_geometries([shapely.box(0, 50, 1, 51)])[0]
+    assert Intersections['Overlap_Area_km2'].tolist() == pytest.approx([areas[0], areas[0]], rel=1e-9)
+
+
+def test_apply_decisions(grids):
+    updated, outcome = grids.apply_decisions(JOIN_RESULTS)
+    expected = [OUTCOMES.index(x) for x in ['New map wins', 'Existing map kept', 'NE Evidence Base kept',
+                                            'New map over UKSeaMap', 'New map over unmapped area']]
+    assert (outcome == np.repeat(expected, 4)[np.newaxis, :]).all()
+    assert list(grids.guis[updated[0, ::4] - 1]) == ['GB9', 'GB1', 'GB2', 'GB7', 'GB7']
+
+    # Intersections without a result keep the existing map
+    _, undecided = grids.apply_decisions(JOIN_RESULTS.iloc[:0])
+    assert (undecided[:, :8] == OUTCOMES.index('Existing map kept')).all()
+
+
+def test_preview_update(grids, tmp_path):
+    results = preview_update(COMBINED_MAP, NEW_MAPS, 0.25, Join_Results=JOIN_RESULTS, out_folder=str(tmp_path),
+                             grids=grids)
+    Outcome_Areas = results['Outcome_Areas'].set_index('Outcome')
+    assert Outcome_Areas['Cells'].sum() == 80 and Outcome_Areas.loc['Not mapped', 'Cells'] == 0
+    assert Outcome_Areas['Area_km2'].sum() == pytest.approx(grids.cell_areas().sum() * 20)
+    New_Map_Areas = results['New_Map_Areas'].set_index('NewGUI')
+    assert New_Map_Areas.loc['GB7', 'New map over unmapped area'] == pytest.approx(
+        Outcome_Areas.loc['New map over unmapped area', 'Area_km2'])
+    assert sorted(results['Updated_Areas']['GUI']) == ['GB1', 'GB2', 'GB7', 'GB9']
+    assert sorted(os.listdir(str(tmp_path))) == ['Preview_Grids.npz', 'Preview_Join_Results.csv',
+                                                 'Preview_New_Map_Areas.csv', 'Preview_Outcome.png',
+                                                 'Preview_Outcome_Areas.csv', 'Preview_Updated_Areas.csv']
+
+    # The quick-look image holds the colour of the outcome of every cell
+    with open(os.path.join(str(tmp_path), 'Preview_Outcome.png'), 'rb') as f:
+        png = f.read()
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    width, height = struct.unpack('>II', png[16:24])
+    assert (width, height) == (20, 4)
+    start = png.index(b'IDAT') + 4
+    rows = np.frombuffer(zlib.decompress(png[start:start + struct.unpack('>I', png[start - 8:start - 4])[0]]),
+                         dtype=np.uint8).reshape(height, 1 + width * 3)
+    assert (rows[:, 0] == 0).all()
+    assert (rows[:, 1:].reshape(height, width, 3) == np.asarray(OUTCOME_COLOURS)[results['outcome']]).all()
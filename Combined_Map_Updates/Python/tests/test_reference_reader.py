@@ -0,0 +1,68 @@
+########################################################################################################################
+
+# Title: Reference Reader tests
+
+# Script description:    Checks that read_feature_classes() (Reference_Reader.py) reads a folder of GeoParquet survey
+#                        maps into DataFrames keyed by name, whatever the number of workers, and reports its
+#                        throughput, and that duplicate names and unreadable files are reported. Copies are made with
+#                        ArcPy, so copy_feature_classes() is not tested here.
+
+########################################################################################################################
+
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+shapely = pytest.importorskip('shapely')
+
+from combined_map.GeoParquet import write_geoparquet
+from combined_map.Reference_Reader import concat_feature_classes, format_statistics, list_feature_classes, \
+    read_feature_classes
+from combined_map.Synthetic_Data import generate_update_inputs
+
+
+@pytest.fixture(scope='module')
+def survey_folder(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('surveys')
+    new_maps = generate_update_inputs(scale=0.25, seed=1)['new_maps']
+    for gui, Survey in new_maps.groupby('GUI'):
+        write_geoparquet(Survey.reset_index(drop=True), str(folder / ('%s.parquet' % gui)))
+    (folder / 'README.txt').write_text('Not a survey map')
+    return str(folder), new_maps
+
+
+def test_list_feature_classes(survey_folder):
+    folder, new_maps = survey_folder
+    paths = list_feature_classes(folder)
+    assert [os.path.basename(x) for x in paths] == ['%s.parquet' % x for x in sorted(new_maps['GUI'].unique())]
+
+
+@pytest.mark.parametrize('workers, max_pending', [(1, None), (3, 1)])
+def test_read_feature_classes(survey_folder, workers, max_pending):
+    folder, new_maps = survey_folder
+    layers, statistics = read_feature_classes(list_feature_classes(folder), fields=['GUI', 'HAB_TYPE'],
+                                              workers=workers, max_pending=max_pending)
+    assert sorted(layers) == sorted(new_maps['GUI'].unique())
+    assert statistics['feature_classes'] == len(layers)
+    assert statistics['features'] == len(new_maps)
+    assert statistics['bytes'] > 0 and statistics['failed'] == {}
+    assert 'feature classes' in format_statistics(statistics)
+
+    Merged = concat_feature_classes(layers)
+    assert Merged['Feature_Class'].is_monotonic_increasing
+    assert (Merged['Feature_Class'] == Merged['GUI']).all()
+    expected = shapely.area(shapely.from_wkb(new_maps['WKB'].values)).sum()
+    assert shapely.area(shapely.from_wkb(Merged['WKB'].values)).sum() == pytest.approx(expected)
+
+
+def test_duplicate_names_and_unreadable_files(survey_folder, tmp_path):
+    folder, _ = survey_folder
+    path = list_feature_classes(folder)[0]
+    with pytest.raises(ValueError):
+        read_feature_classes([path, os.path.join(str(tmp_path), os.path.basename(path))])
+    broken = tmp_path / 'Broken.parquet'
+    broken.write_bytes(b'Not a parquet file')
+    with pytest.raises(IOError) as error:
+        read_feature_classes([path, str(broken)])
+    assert 'Broken' in str(error.value)
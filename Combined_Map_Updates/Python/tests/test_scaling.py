@@ -0,0 +1,76 @@
+########################################################################################################################
+
+# Title: Scaling tests
+
+# Script description:    Checks the power law fits of the scaling benchmark (Scaling.py), that exponents are only
+#                        reported as worse than the baseline beyond the tolerance with 95% confidence, and runs a small
+#                        sweep over synthetic decision tables.
+
+########################################################################################################################
+
+import numpy as np
+import pytest
+
+from combined_map.Scaling import FUNCTIONS, compare_scaling, decision_inputs, fit_power_law, run_sweep, \
+    scaling_table, _report
+from combined_map.Synthetic_Data import generate_decision_tables
+
+
+def test_fit_power_law_recovers_the_exponent():
+    values = [10, 20, 40, 80]
+    exponent, coefficient, error = fit_power_law(values, [3.0 * x ** 2 for x in values])
+    assert exponent == pytest.approx(2.0)
+    assert coefficient == pytest.approx(3.0)
+    assert error == pytest.approx(0.0, abs=1e-6)
+
+    # Repeats at each value are fitted together, and spread between them gives a standard error
+    exponent, _, error = fit_power_law(values, [[x * 0.9, x * 1.1] for x in values])
+    assert exponent == pytest.approx(1.0)
+    assert 0 < error < 0.1
+
+    # Two points cannot give a standard error
+    assert fit_power_law([1, 2], [1, 2])[2] == np.inf
+
+
+def _results(exponent, error=0.02, against='rows'):
+    fit = {'against': against, 'time_exponent': exponent, 'time_exponent_error': error,
+           'memory_exponent': 1.0, 'memory_exponent_error': error}
+    return {'sweeps': {'rows_per_gui': {'fits': {'decision_tree': fit}}}}
+
+
+@pytest.mark.parametrize('exponent, error, against, regressed', [
+    (1.0, 0.02, 'rows', False),
+    (1.2, 0.02, 'rows', False),
+    (1.5, 0.02, 'rows', True),
+    # Within the tolerance once the standard errors are allowed for
+    (1.5, 0.2, 'rows', False),
+    # Fits against different sizes are not compared
+    (2.0, 0.02, 'rows_per_gui', False)])
+def test_compare_scaling(exponent, error, against, regressed):
+    regressions = compare_scaling(_results(1.0, error), _results(exponent, error, against), tolerance=0.25)
+    assert regressions == ([('rows_per_gui', 'decision_tree', 'time', 1.0, exponent)] if regressed else [])
+    assert _report(regressions) == (1 if regressed else 0)
+
+
+def test_decision_inputs_run():
+    inputs = decision_inputs(generate_decision_tables(existing_maps=20, seed=1))
+    assert sorted(inputs) == sorted(FUNCTIONS)
+    for name in FUNCTIONS:
+        func, rows = inputs[name]
+        assert rows > 0
+        func()
+
+
+def test_small_sweep():
+    sweep = run_sweep('new_per_existing', [1, 4], existing_maps=20, repeats=2)
+    assert [x['value'] for x in sweep['points']] == [1, 4]
+    assert sweep['held'] == {'rows_per_gui': 10}
+    assert sorted(sweep['fits']) == sorted(FUNCTIONS)
+    # The comparison data set grows with the new maps of every existing map
+    rows = [x['functions']['decision_tree']['rows'] for x in sweep['points']]
+    assert rows[1] > rows[0]
+    assert sweep['fits']['decision_tree']['against'] == 'rows'
+
+    table = scaling_table({'sweeps': {'new_per_existing': sweep}})
+    assert all(x in table for x in FUNCTIONS)
+    assert compare_scaling({'sweeps': {'new_per_existing': sweep}}, {'sweeps': {'new_per_existing': sweep}}) == []
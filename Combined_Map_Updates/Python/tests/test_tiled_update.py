@@ -0,0 +1,111 @@
+########################################################################################################################
+
+# Title: Tiled Update tests
+
+# Script description:    Checks the tile queue of Tiled_Update.py (claiming, stealing, retrying and taking over tiles,
+#                        including a worker finishing a tile after it was taken over), compare_updates(), and that a
+#                        small update run tile by tile gives the same features and areas as the update run as one job.
+
+########################################################################################################################
+
+import os
+
+import pandas as pd
+import pytest
+
+shapely = pytest.importorskip('shapely')
+pytest.importorskip('pyarrow')
+
+from combined_map.Benchmarks import run_update
+from combined_map.Synthetic_Data import generate_update_inputs, write_update_inputs
+from combined_map.Tiled_Update import TileQueue, compare_updates
+
+TILES = [{'tile': 'r000_c%03d' % x, 'bounds': [x, 0, x + 1, 1]} for x in range(4)]
+
+
+def _expire(queue, task):
+    """Set the lease of a claimed tile back past lease_seconds"""
+    path = queue._running_path(task['tile'], task['worker'])
+    os.utime(path, (os.path.getmtime(path) - 2 * queue.lease_seconds,) * 2)
+
+
+def test_claim_and_steal(tmp_path):
+    queue = TileQueue.create(str(tmp_path / 'queue'), TILES, shards=2)
+    first = queue.claim('a', shard=0)
+    assert (first['tile'], first['stolen'], first['attempts']) == ('r000_c000', False, 1)
+    assert queue.claim('b', shard=1)['tile'] == 'r000_c002'
+    assert queue.claim('a', shard=0)['tile'] == 'r000_c001'
+    # Shard 0 is empty, so the last tile of shard 1 is stolen
+    stolen = queue.claim('a', shard=0)
+    assert (stolen['tile'], stolen['stolen']) == ('r000_c003', True)
+    assert queue.claim('c') is None
+    assert queue.status() == {'pending': 0, 'running': 4, 'done': 0, 'failed': 0}
+
+
+def test_retry_until_failed(tmp_path):
+    queue = TileQueue.create(str(tmp_path / 'queue'), TILES[:1], max_attempts=2)
+    assert queue.retry(queue.claim('a'), 'first error')
+    task = queue.claim('b')
+    assert task['attempts'] == 2 and task['errors'] == ['first error']
+    assert not queue.retry(task, 'second error')
+    assert queue.finished()
+    assert queue.failures() == {'r000_c000': ['first error', 'second error']}
+
+
+@pytest.mark.parametrize('finish', ['complete', 'retry'])
+def test_finishing_a_tile_taken_over(tmp_path, finish):
+    queue = TileQueue.create(str(tmp_path / 'queue'), TILES[:1], lease_seconds=60)
+    stalled = queue.claim('a')
+    _expire(queue, stalled)
+    task = queue.claim('b')
+    assert task['tile'] == stalled['tile'] and task['errors'] == ['Lease of a expired']
+    assert not queue.renew(stalled)
+
+    # The stalled worker finishes after all - the tile must stay with the worker which took it over
+    if finish == 'complete':
+        queue.complete(stalled, {'features': 1})
+    else:
+        queue.retry(stalled, 'error')
+    assert queue.status() == {'pending': 0, 'running': 1, 'done': 0, 'failed': 0}
+    assert os.listdir(os.path.join(queue.folder, 'running')) == ['r000_c000@b.json']
+    assert queue.renew(task)
+    queue.complete(task, {'features': 2})
+    assert queue.finished() and queue.status()['done'] == 1
+
+
+def test_claimed_pending_tile_is_not_expired(tmp_path):
+    queue = TileQueue.create(str(tmp_path / 'queue'), TILES[:1], lease_seconds=60)
+    pending = os.path.join(queue.folder, 'pending', '000', os.listdir(os.path.join(queue.folder, 'pending', '000'))[0])
+    os.utime(pending, (os.path.getmtime(pending) - 120,) * 2)
+    task = queue.claim('a')
+    # The tile file was written before the lease, but the lease starts when it is claimed
+    assert queue.claim('b') is None
+    queue.complete(task)
+    assert queue.finished()
+
+
+def _layer(guis, geometries):
+    geometries = shapely.from_wkt(geometries)
+    return pd.DataFrame({'GUI': guis, 'WKB': shapely.to_wkb(geometries), 'AreaKm2': shapely.area(geometries) * 1e4})
+
+
+def test_compare_updates():
+    untiled = _layer(['GB1', 'GB2'], ['POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))', 'POLYGON ((1 0, 2 0, 2 1, 1 1, 1 0))'])
+    sliver = 'POLYGON ((1 0, 1 1, 1.0000000000000002 0.5, 1 0))'
+    assert compare_updates(untiled, untiled).empty
+    # Slivers without any width are left out of both updates
+    assert compare_updates(untiled, pd.concat([untiled, _layer(['GB2'], [sliver])], ignore_index=True)).empty
+    split = _layer(['GB1', 'GB1', 'GB2'], ['POLYGON ((0 0, 0.5 0, 0.5 1, 0 1, 0 0))',
+                                           'POLYGON ((0.5 0, 1 0, 1 1, 0.5 1, 0.5 0))',
+                                           'POLYGON ((1 0, 2 0, 2 0.5, 1 0.5, 1 0))'])
+    differences = compare_updates(untiled, split)
+    assert differences['Features_Untiled'].to_dict() == {'GB1': 1, 'GB2': 1}
+    assert differences['Features_Tiled'].to_dict() == {'GB1': 2, 'GB2': 1}
+    assert differences.loc['GB2', 'Shape_Area_Tiled'] == pytest.approx(0.5)
+
+
+def test_tiled_update_matches_untiled_update(tmp_path):
+    data = generate_update_inputs(scale=0.25, seed=2)
+    # Raises a ValueError if the tiled update differs (see compare_updates())
+    updated = run_update(data, write_update_inputs(data, str(tmp_path)), tile_size=4.0)
+    assert len(updated) > 0